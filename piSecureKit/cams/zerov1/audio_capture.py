@@ -0,0 +1,451 @@
+"""
+Continuous audio capture with level-triggered clips.
+
+One long-running reader owns the microphone (a single `arecord` process writing raw PCM to a
+pipe, or a WAV file for tests and replays) and keeps the last few seconds in a preallocated ring
+buffer. RMS and peak levels are computed per block with numpy. A block above the trigger level
+starts an event whose clip begins `pre_roll_sec` earlier, straight out of the ring; it ends once the
+sound has stayed below the release level for `post_roll_sec`. Manual requests (`trigger`) join the
+same state machine, so two requests at once extend one clip instead of fighting over the device.
+Finished clips are compressed (FLAC or Opus through ffmpeg, else plain WAV) on a writer thread.
+
+    python3 audio_capture.py --wav doorbell.wav -o /tmp/clips --trigger-dbfs -30
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import logging
+import wave
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+LOG = logging.getLogger("PiSecureKit.audio")
+
+_STOP = object()
+SILENCE_DBFS = -120.0  # reported for digital silence instead of -inf
+_CODECS = {"flac": ("flac", "flac", ".flac"), "opus": ("libopus", "ogg", ".opus")}  # codec, muxer, suffix
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class AudioConfig:
+    directory: Path = Path("/var/lib/pisecurekit/sound")
+    device: str = "dmic_sv"            # ALSA capture device
+    rate: int = 48000
+    channels: int = 2
+    block_sec: float = 0.05            # level measurement granularity
+    trigger_dbfs: float = -30.0        # block RMS at or above this starts (or extends) an event
+    release_dbfs: float = -40.0        # below this counts as quiet again
+    pre_roll_sec: float = 5.0          # audio kept from before the trigger
+    post_roll_sec: float = 5.0         # quiet time that ends an event
+    max_clip_sec: float = 60.0         # longer events are cut into several clips
+    codec: str = "flac"                # "flac", "opus" (both need ffmpeg) or "wav"
+    queue_max_clips: int = 4           # finished clips waiting for the writer; beyond this dropped
+    restart_sec: float = 1.0           # first wait before restarting a live source that stopped
+    restart_max_sec: float = 30.0      # the wait doubles per failed restart up to this
+
+
+class Levels(NamedTuple):
+    rms_dbfs: float
+    peak_dbfs: float
+
+
+class AudioEvent(NamedTuple):
+    start: float                # wall time of the first sample in the clip (pre-roll included)
+    duration: float
+    peak_dbfs: float
+    reason: str                 # "level" or whatever `trigger` was given
+    path: Optional[Path]        # None if the clip was dropped
+
+
+def dbfs(value: float) -> float:
+    return 20 * math.log10(value / 32768.0) if value > 0 else SILENCE_DBFS
+
+
+def _frames(seconds: float, rate: int) -> int:
+    return round(seconds * rate)
+
+
+def levels(block: np.ndarray) -> Levels:
+    """RMS and peak of an int16 block, all channels together, in dBFS."""
+    if not block.size:
+        return Levels(SILENCE_DBFS, SILENCE_DBFS)
+    x = block.astype(np.float32).ravel()
+    return Levels(dbfs(math.sqrt(float(np.dot(x, x)) / x.size)), dbfs(float(np.abs(x).max())))
+
+
+# ---------- Ring buffer ----------
+class AudioRing:
+    """
+    The last `capacity` frames as int16 (frames, channels). Positions are absolute frame counts
+    since the start of capture, so an event can refer to its start while newer audio keeps coming.
+    """
+
+    def __init__(self, capacity: int, channels: int) -> None:
+        self._buf = np.zeros((capacity, channels), dtype=np.int16)
+        self.capacity = capacity
+        self.end = 0  # absolute position one past the newest frame
+
+    @property
+    def start(self) -> int:
+        return max(0, self.end - self.capacity)
+
+    def write(self, block: np.ndarray) -> None:
+        n = len(block)
+        if n > self.capacity:
+            block, self.end = block[-self.capacity:], self.end + n - self.capacity
+            n = self.capacity
+        i = self.end % self.capacity
+        first = min(n, self.capacity - i)
+        self._buf[i:i + first] = block[:first]
+        self._buf[:n - first] = block[first:]
+        self.end += n
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """Copy of frames [start, end); raises ValueError if any of it was already overwritten."""
+        if start < self.start or end > self.end or start > end:
+            raise ValueError(f"frames {start}-{end} not in ring ({self.start}-{self.end})")
+        i, n = start % self.capacity, end - start
+        if i + n <= self.capacity:
+            return self._buf[i:i + n].copy()
+        return np.concatenate((self._buf[i:], self._buf[:i + n - self.capacity]))
+
+
+# ---------- Sources ----------
+def _to_int16(raw: bytes, sample_width: int, channels: int) -> np.ndarray:
+    if sample_width == 2:
+        samples = np.frombuffer(raw, dtype="<i2")
+    elif sample_width == 4:
+        samples = (np.frombuffer(raw, dtype="<i4") >> 16).astype(np.int16)  # MEMS mics: top 16 bits carry it
+    else:
+        raise ValueError(f"unsupported sample width {sample_width}")
+    return samples.reshape(-1, channels)
+
+
+class WavSource:
+    """Blocks of a 16- or 32-bit WAV file; `realtime` paces them like a live device."""
+
+    live = False  # the end of the file is the end of the capture
+
+    def __init__(self, path: Path, realtime: bool = False) -> None:
+        self.path = Path(path)
+        self.realtime = realtime
+        with wave.open(str(self.path), "rb") as w:
+            self.rate, self.channels, self.sample_width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        _to_int16(b"", self.sample_width, self.channels)  # unsupported widths fail here, not on the thread
+
+    def blocks(self, block_frames: int) -> Iterator[np.ndarray]:
+        t0, sent = time.monotonic(), 0
+        with wave.open(str(self.path), "rb") as w:
+            while True:
+                raw = w.readframes(block_frames)
+                if not raw:
+                    return
+                block = _to_int16(raw, self.sample_width, self.channels)
+                if self.realtime:
+                    time.sleep(max(0.0, t0 + sent / self.rate - time.monotonic()))
+                sent += len(block)
+                yield block
+
+    def close(self) -> None:
+        pass
+
+
+class ArecordSource:
+    """Raw S32_LE PCM from one long-running `arecord`; the only process holding the device."""
+
+    sample_width = 4
+    live = True  # arecord exiting (device unplugged, xrun it gave up on) is restarted
+
+    def __init__(self, device: str, rate: int, channels: int) -> None:
+        self.rate, self.channels = rate, channels
+        self._cmd = [shutil.which("arecord") or "arecord", "-q", "-D", device, "-r", str(rate),
+                     "-c", str(channels), "-f", "S32_LE", "-t", "raw"]
+        self._proc: Optional[subprocess.Popen] = None
+
+    def blocks(self, block_frames: int) -> Iterator[np.ndarray]:
+        self._proc = subprocess.Popen(self._cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+        LOG.info("Audio capture: %s", " ".join(self._cmd))
+        buf = bytearray(block_frames * self.channels * self.sample_width)
+        view = memoryview(buf)
+        stdout = self._proc.stdout
+        try:
+            while True:
+                filled = 0
+                while filled < len(buf):
+                    n = stdout.readinto(view[filled:])
+                    if not n:
+                        err = self._proc.stderr.read().decode(errors="replace").strip()
+                        if err:
+                            LOG.warning("arecord exited: %s", err)
+                        return
+                    filled += n
+                yield _to_int16(buf, self.sample_width, self.channels)  # converted copy; buf is reused
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+
+
+# ---------- Clip writer ----------
+def clip_suffix(codec: str) -> str:
+    return _CODECS[codec][2] if codec in _CODECS else ".wav"
+
+
+def write_clip(path: Path, samples: np.ndarray, rate: int, codec: str) -> int:
+    """Write int16 (frames, channels) samples to `path` atomically; returns the file size."""
+    part = path.with_name(path.name + ".part")
+    if codec in _CODECS:
+        encoder, muxer, _ = _CODECS[codec]
+        subprocess.run([shutil.which("ffmpeg") or "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+                        "-y", "-f", "s16le", "-ar", str(rate), "-ac", str(samples.shape[1]), "-i", "pipe:0",
+                        "-c:a", encoder, "-f", muxer, str(part)],
+                       input=samples.astype("<i2").tobytes(), check=True, capture_output=True)
+    else:
+        with wave.open(str(part), "wb") as w:
+            w.setnchannels(samples.shape[1])
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(samples.astype("<i2").tobytes())
+    os.replace(part, path)
+    return path.stat().st_size
+
+
+# ---------- Capture ----------
+class AudioCapture:
+    """
+    Reads `source` on a background thread into the ring and runs the event state machine;
+    finished clips go to a second thread that compresses and writes them. `on_event` is called
+    from the writer thread once a clip is on disk (or dropped).
+    """
+
+    def __init__(self, cfg: AudioConfig, source, on_event: Optional[Callable[[AudioEvent], None]] = None) -> None:
+        codec = cfg.codec
+        if codec in _CODECS and shutil.which("ffmpeg") is None:
+            LOG.warning("ffmpeg not found: audio clips will be written as WAV, not %s", codec)
+            codec = "wav"
+        self._cfg = cfg
+        self._codec = codec
+        self._source = source
+        self._rate = source.rate
+        self._on_event = on_event
+        self._block = max(1, _frames(cfg.block_sec, self._rate))
+        capacity = _frames(cfg.pre_roll_sec + cfg.max_clip_sec, self._rate) + self._block
+        self._ring = AudioRing(capacity, source.channels)
+        self._lock = threading.Lock()
+        self._t0 = 0.0  # wall time of frame 0
+        self._event: Optional[Dict[str, object]] = None
+        self._manual_until = 0  # absolute frame position a `trigger` keeps the event open to
+        self._pending_reason: Optional[str] = None
+        self._levels = Levels(SILENCE_DBFS, SILENCE_DBFS)
+        self._clips: "queue.Queue[object]" = queue.Queue(maxsize=cfg.queue_max_clips)
+        self._events: List[AudioEvent] = []
+        self._stats: Dict[str, float] = {"blocks": 0, "frames": 0, "events": 0, "clips_written": 0,
+                                         "clips_dropped": 0, "bytes_written": 0, "level_cpu_sec": 0.0,
+                                         "source_restarts": 0}
+        self._reader: Optional[threading.Thread] = None
+        self._writer: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    # -- control --
+    def start(self) -> None:
+        if self._reader is not None:
+            return
+        self._cfg.directory.mkdir(parents=True, exist_ok=True)
+        self._t0 = time.time()
+        self._writer = threading.Thread(target=self._write_loop, name="audio-writer", daemon=True)
+        self._writer.start()
+        self._reader = threading.Thread(target=self._read_loop, name="audio-capture", daemon=True)
+        self._reader.start()
+
+    def stop(self) -> None:
+        """Stop capturing; an event in progress is cut and written."""
+        self._stopping.set()
+        self._source.close()
+        self.wait()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Until the source runs out (a WAV file) or `stop`, and every clip is written."""
+        if self._reader is not None:
+            self._reader.join(timeout)
+        if self._writer is not None:
+            self._writer.join(timeout)
+
+    def trigger(self, duration: float, reason: str = "manual") -> None:
+        """Record at least `duration` seconds from now (plus pre-roll), joining any current event."""
+        with self._lock:
+            self._manual_until = max(self._manual_until, self._ring.end + _frames(duration, self._rate))
+            self._pending_reason = reason
+
+    # -- reporting --
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._stats)
+            out["rms_dbfs"], out["peak_dbfs"] = round(self._levels.rms_dbfs, 1), round(self._levels.peak_dbfs, 1)
+            out["recording"] = self._event is not None
+        out["queued_clips"] = self._clips.qsize()
+        return out
+
+    def events(self) -> List[AudioEvent]:
+        with self._lock:
+            return list(self._events)
+
+    # -- capture thread --
+    def _read_loop(self) -> None:
+        delay = 0.0
+        try:
+            while True:
+                try:
+                    got = self._read_source()
+                except Exception:
+                    LOG.exception("Audio capture failed")
+                    got = 0
+                if self._stopping.is_set() or not getattr(self._source, "live", False):
+                    break
+                # A live source ended on its own: restart it, backing off while it keeps failing
+                delay = self._cfg.restart_sec if got or not delay else min(delay * 2, self._cfg.restart_max_sec)
+                if self._event is not None:
+                    self._finish(self._ring.end)  # no clip spans the gap
+                LOG.warning("Audio source stopped; restarting in %.0fs", delay)
+                if self._stopping.wait(delay):
+                    break
+                with self._lock:
+                    self._stats["source_restarts"] += 1
+                self._t0 = time.time() - self._ring.end / self._rate  # keep clip timestamps on wall time
+        finally:
+            if self._event is not None:
+                self._finish(self._ring.end)
+            self._clips.put(_STOP)
+
+    def _read_source(self) -> int:
+        """Read `source` until it ends or `stop`; returns the number of blocks read."""
+        got = 0
+        for block in self._source.blocks(self._block):
+            got += 1
+            self._ring.write(block)
+            t = time.process_time()
+            lv = levels(block)
+            with self._lock:
+                self._levels = lv
+                self._stats["blocks"] += 1
+                self._stats["frames"] += len(block)
+                self._stats["level_cpu_sec"] += time.process_time() - t
+            self._step(lv, len(block))
+            if self._stopping.is_set():
+                break
+        return got
+
+    def _step(self, lv: Levels, n: int) -> None:
+        cfg, pos = self._cfg, self._ring.end
+        with self._lock:
+            manual_until, reason = self._manual_until, self._pending_reason
+            self._pending_reason = None
+        loud = lv.rms_dbfs >= cfg.trigger_dbfs
+        ev = self._event
+        if ev is None:
+            if not loud and reason is None:
+                return
+            # Pre-roll counts back from the start of the block that triggered
+            start = pos - n - _frames(cfg.pre_roll_sec, self._rate)
+            ev = self._event = {"start": max(self._ring.start, start),
+                                "last_loud": pos, "peak": lv.peak_dbfs, "reason": reason or "level"}
+            with self._lock:
+                self._stats["events"] += 1
+            LOG.info("Audio event (%s) at %.1f dBFS", ev["reason"], lv.rms_dbfs)
+        if lv.rms_dbfs >= cfg.release_dbfs:
+            ev["last_loud"] = pos
+        ev["peak"] = max(ev["peak"], lv.peak_dbfs)
+        quiet_since = pos - max(ev["last_loud"], manual_until)
+        if quiet_since >= _frames(cfg.post_roll_sec, self._rate):
+            self._finish(pos)
+        elif pos - ev["start"] >= _frames(cfg.pre_roll_sec + cfg.max_clip_sec, self._rate):
+            # Over-long event: close this clip and carry on in a new one, without pre-roll
+            self._finish(pos)
+            self._event = {"start": pos, "last_loud": pos, "peak": SILENCE_DBFS, "reason": ev["reason"]}
+
+    def _finish(self, end: int) -> None:
+        ev, self._event = self._event, None
+        samples = self._ring.read(ev["start"], end)
+        item = (self._t0 + ev["start"] / self._rate, samples, ev["peak"], ev["reason"])
+        try:
+            self._clips.put_nowait(item)
+        except queue.Full:
+            LOG.warning("Audio writer behind: dropped a %.1fs clip", len(samples) / self._rate)
+            self._record(AudioEvent(item[0], len(samples) / self._rate, ev["peak"], ev["reason"], None))
+
+    # -- writer thread --
+    def _write_loop(self) -> None:
+        while True:
+            item = self._clips.get()
+            if item is _STOP:
+                return
+            start, samples, peak, reason = item  # type: ignore[misc]
+            name = datetime.fromtimestamp(start).strftime("audio_%Y%m%d_%H%M%S_%f")[:-3] + clip_suffix(self._codec)
+            path: Optional[Path] = self._cfg.directory / name
+            try:
+                size = write_clip(path, samples, self._rate, self._codec)
+            except (OSError, subprocess.CalledProcessError) as e:
+                LOG.warning("Writing %s failed: %s", name, e)
+                path, size = None, 0
+            else:
+                with self._lock:
+                    self._stats["bytes_written"] += size
+                LOG.info("Audio clip %s: %.1fs, %d bytes", name, len(samples) / self._rate, size)
+            self._record(AudioEvent(start, len(samples) / self._rate, peak, reason, path))
+
+    def _record(self, event: AudioEvent) -> None:
+        with self._lock:
+            self._stats["clips_written" if event.path else "clips_dropped"] += 1
+            self._events.append(event)
+            del self._events[:-100]
+        if self._on_event is not None:
+            try:
+                self._on_event(event)
+            except Exception:
+                LOG.exception("Audio event callback failed")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Capture audio and write level-triggered clips.")
+    ap.add_argument("--wav", type=Path, help="read this file instead of the ALSA device")
+    ap.add_argument("--device", default=AudioConfig.device)
+    ap.add_argument("-o", "--output", type=Path, default=AudioConfig.directory)
+    ap.add_argument("--trigger-dbfs", type=float, default=AudioConfig.trigger_dbfs)
+    ap.add_argument("--release-dbfs", type=float, default=AudioConfig.release_dbfs)
+    ap.add_argument("--codec", choices=["flac", "opus", "wav"], default=AudioConfig.codec)
+    args = ap.parse_args()
+    cfg = AudioConfig(directory=args.output, device=args.device, trigger_dbfs=args.trigger_dbfs,
+                      release_dbfs=args.release_dbfs, codec=args.codec)
+    source = WavSource(args.wav) if args.wav else ArecordSource(cfg.device, cfg.rate, cfg.channels)
+    capture = AudioCapture(cfg, source, on_event=lambda e: print(e.path or "dropped", f"{e.duration:.1f}s",
+                                                                 f"peak {e.peak_dbfs:.1f} dBFS"))
+    capture.start()
+    try:
+        capture.wait()
+    except KeyboardInterrupt:
+        capture.stop()
+    print(json.dumps(capture.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
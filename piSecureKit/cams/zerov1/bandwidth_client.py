@@ -0,0 +1,145 @@
+"""
+Camera side of the hub's bandwidth allocator (piSecureKit/hub/bandwidth_allocator.py).
+
+Every `interval_sec` the camera heartbeats its demand (priority, min/max bitrate) and whether its
+uplink looked congested since the last beat; the reply carries its budget, which is applied to
+the encoder. The hub also pushes budget changes to POST /budget on the control API, so changes
+land without waiting for the next beat. If the hub is unreachable the last budget stays in force.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import socket
+import threading
+import urllib.request
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+LOG = logging.getLogger("PiSecureKit.bandwidth")
+
+
+@dataclass(frozen=True)
+class BandwidthConfig:
+    hub_url: str                     # allocator API, e.g. http://192.168.6.76:8090
+    name: str = ""                   # defaults to the hostname
+    priority: float = 1.0            # share of spare uplink relative to other cameras
+    min_bps: int = 300_000
+    interval_sec: float = 5.0
+    timeout_sec: float = 3.0
+    queue_congested_sec: float = 0.5  # send queue deeper than this much of the budget counts as congestion
+
+
+class CongestionProbe:
+    """
+    Turns publisher stats into "congested since the last check": outages, drops or a deep send queue.
+    An on-demand publisher that is idle (off, or only sending keepalives) is never congested.
+    """
+
+    def __init__(self, stats: Callable[[], Dict[str, Any]], queue_congested_sec: float = 0.5) -> None:
+        self._stats = stats
+        self._queue_sec = queue_congested_sec
+        self._last: Dict[str, int] = {}
+
+    @staticmethod
+    def _idle(stats: Dict[str, Any]) -> bool:
+        return stats.get("state") == "idle" or stats.get("mode", "live") != "live"
+
+    def idle(self) -> bool:
+        return self._idle(self._stats() or {})
+
+    def check(self, bitrate: int) -> bool:
+        stats = self._stats() or {}
+        if self._idle(stats):
+            self._last = {}  # the next live sink starts its counters afresh
+            return False
+        sink = stats.get("sink") or {}
+        now = {"outages": int(stats.get("outages", 0)), "frames_dropped": int(sink.get("frames_dropped", 0))}
+        # A new sink restarts its counters; only increases count
+        grew = any(now[k] > self._last.get(k, now[k]) for k in now)
+        self._last = now
+        deep = int(sink.get("queue_bytes", 0)) * 8 > bitrate * self._queue_sec
+        return grew or deep or stats.get("state") == "outage"
+
+
+class BandwidthClient:
+
+    def __init__(self, cfg: BandwidthConfig, demand: Callable[[], int], apply: Callable[[int], None],
+                 publisher_stats: Callable[[], Dict[str, Any]], control_port: Optional[int] = None) -> None:
+        self._cfg = cfg
+        self.name = cfg.name or socket.gethostname()
+        self._demand = demand
+        self._apply = apply
+        self._probe = CongestionProbe(publisher_stats, cfg.queue_congested_sec)
+        self._control_port = control_port
+        self._lock = threading.Lock()
+        self._budget: Optional[int] = None
+        self._reported_demand: Optional[int] = None  # kept while idle, so a new session is not starved
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, int] = {"heartbeats": 0, "failures": 0, "budget_changes": 0, "congested": 0}
+
+    def start(self) -> "BandwidthClient":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bandwidth-client", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._cfg.timeout_sec + 1)
+            self._thread = None
+        try:
+            self._post("/cameras/leave", {"name": self.name})
+        except OSError as e:
+            LOG.debug("Leave notification failed: %s", e)
+
+    def on_budget(self, bitrate: int) -> None:
+        """Budget pushed by the hub (or returned by a heartbeat)."""
+        with self._lock:
+            if bitrate == self._budget:
+                return
+            self._budget = bitrate
+            self._stats["budget_changes"] += 1
+        LOG.info("Hub budget for %s: %d bps", self.name, bitrate)
+        self._apply(bitrate)
+
+    def heartbeat(self) -> Optional[int]:
+        if self._probe.idle() and self._reported_demand is not None:
+            demand = self._reported_demand  # nothing streams: keep the last live demand
+        else:
+            demand = self._reported_demand = self._demand()
+        congested = self._probe.check(self._budget or demand)
+        body = {"name": self.name, "priority": self._cfg.priority, "min_bps": self._cfg.min_bps,
+                "max_bps": demand, "congested": congested, "control_port": self._control_port}
+        try:
+            reply = self._post("/cameras/heartbeat", body)
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._stats["failures"] += 1
+            LOG.debug("Heartbeat to %s failed: %s", self._cfg.hub_url, e)
+            return None
+        with self._lock:
+            self._stats["heartbeats"] += 1
+            self._stats["congested"] += congested
+        self.on_budget(int(reply["bitrate"]))
+        return self._budget
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hub": self._cfg.hub_url, "name": self.name, "budget": self._budget, **self._stats}
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.heartbeat()
+            except Exception as e:
+                LOG.warning("Bandwidth heartbeat failed: %s", e)
+            self._stop.wait(self._cfg.interval_sec)
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        req = urllib.request.Request(f"{self._cfg.hub_url.rstrip('/')}{path}", method="POST",
+                                     data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self._cfg.timeout_sec) as resp:
+            return json.load(resp)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Offline encoder tuning on any Linux box with ffmpeg: re-encode recorded clips over a grid of
+bitrate, GOP (iperiod) and picamera2 Quality presets, score each encode against its source
+(PSNR/SSIM) and recommend a VideoConfig per scene type.
+
+Clips are grouped by scene type by their directory, e.g. clips/day/*.h264, clips/night/*.h264:
+
+    python3 bench_encoder.py clips/day clips/night --iperiods 15,30,60 --jobs 4
+    python3 bench_encoder.py clips/*/ --encoder h264_v4l2m2m    # on a Pi: the hardware encoder
+
+libx264 (the default) is configured like the bcm2835 encoder (no B-frames, fixed GOP, CBR-ish
+rate control) so size and quality are comparable; its CPU time is not, it only ranks settings.
+The source clip is the reference, so scores are relative to what the camera already recorded.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import re
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+LOG = logging.getLogger("PiSecureKit.bench_encoder")
+
+CLIP_SUFFIXES = (".h264", ".mp4", ".mkv", ".y4m")
+# picamera2's H264Encoder: Mbps at 1080p30 per Quality, scaled by pixel rate (encoders/h264_encoder.py)
+QUALITY_MBPS = {"very_low": 2, "low": 4, "medium": 6, "high": 9, "very_high": 15}
+
+
+@dataclass(frozen=True)
+class Setting:
+    bitrate: int
+    iperiod: int
+    quality: Optional[str] = None  # the preset the bitrate came from, if any
+
+    @property
+    def label(self) -> str:
+        rate = f"{self.bitrate / 1e6:.2f}M" + (f" ({self.quality})" if self.quality else "")
+        return f"{rate} g{self.iperiod}"
+
+
+@dataclass(frozen=True)
+class Clip:
+    path: Path
+    scene: str
+    fps: float
+
+
+def quality_bitrate(quality: str, width: int, height: int, fps: float) -> int:
+    """The bitrate picamera2 substitutes for a Quality preset at this size and frame rate."""
+    return int(QUALITY_MBPS[quality] * 1_000_000 * width * height * fps / (1920 * 1080 * 30))
+
+
+def grid(bitrates: Sequence[int], qualities: Sequence[str], iperiods: Sequence[int],
+         width: int, height: int, fps: float) -> List[Setting]:
+    rates = [(b, None) for b in bitrates] + [(quality_bitrate(q, width, height, fps), q) for q in qualities]
+    return [Setting(b, g, q) for b, q in rates for g in iperiods]
+
+
+def find_clips(paths: Iterable[Path], fps: float) -> List[Clip]:
+    """Clips under each path (or the path itself); the scene type is the clip's directory name."""
+    clips: List[Clip] = []
+    for path in paths:
+        files = sorted(p for p in path.rglob("*") if p.suffix in CLIP_SUFFIXES) if path.is_dir() else [path]
+        clips += [Clip(f, f.parent.name, fps) for f in files]
+    return clips
+
+
+# ---------- ffmpeg ----------
+def _input_args(clip: Clip) -> List[str]:
+    # Raw Annex-B (what SegmentedRecorder writes) carries no timing
+    return ["-f", "h264", "-framerate", str(clip.fps), "-i", str(clip.path)] if clip.path.suffix == ".h264" \
+        else ["-i", str(clip.path)]
+
+
+def encode_args(encoder: str, setting: Setting) -> List[str]:
+    args = ["-c:v", encoder, "-b:v", str(setting.bitrate), "-g", str(setting.iperiod), "-bf", "0"]
+    if encoder == "libx264":
+        args += ["-preset", "veryfast", "-tune", "zerolatency", "-keyint_min", str(setting.iperiod),
+                 "-sc_threshold", "0", "-maxrate", str(setting.bitrate), "-bufsize", str(setting.bitrate)]
+    return args + ["-an", "-f", "h264"]
+
+
+def parse_scores(stderr: str) -> Dict[str, float]:
+    """Averages from ffmpeg's ssim and psnr filter summaries."""
+    ssim = re.search(r"SSIM .*All:([\d.]+)", stderr)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", stderr)
+    if ssim is None or psnr is None:
+        raise ValueError("ffmpeg reported no SSIM/PSNR summary")
+    return {"ssim": float(ssim.group(1)), "psnr": float(psnr.group(1))}
+
+
+def _frames(stderr: str) -> int:
+    counts = re.findall(r"frame=\s*(\d+)", stderr)
+    return int(counts[-1]) if counts else 0
+
+
+def _child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_one(clip: Clip, setting: Setting, encoder: str = "libx264", ffmpeg: str = "ffmpeg") -> Dict[str, Any]:
+    """Encode `clip` with `setting` and score it; runs in a pool worker, one ffmpeg at a time."""
+    row: Dict[str, Any] = {"clip": str(clip.path), "scene": clip.scene, "setting": setting.label,
+                           "bitrate": setting.bitrate, "iperiod": setting.iperiod, "quality": setting.quality}
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp, "encoded.h264")
+        cpu0, t0 = _child_cpu(), time.monotonic()
+        enc = subprocess.run([ffmpeg, "-nostdin", "-hide_banner", "-y", *_input_args(clip),
+                              *encode_args(encoder, setting), str(out)],
+                             capture_output=True, text=True)
+        encode_sec, cpu_sec = time.monotonic() - t0, _child_cpu() - cpu0
+        if enc.returncode != 0:
+            return {**row, "ok": False, "error": enc.stderr.strip().splitlines()[-1:]}
+        frames = _frames(enc.stderr)
+        cmp = subprocess.run([ffmpeg, "-nostdin", "-hide_banner", "-f", "h264", "-framerate", str(clip.fps),
+                              "-i", str(out), *_input_args(clip), "-filter_complex",
+                              "[0:v]split[a][b];[1:v]split[c][d];[a][c]ssim;[b][d]psnr", "-f", "null", "-"],
+                             capture_output=True, text=True)
+        if cmp.returncode != 0:
+            return {**row, "ok": False, "error": cmp.stderr.strip().splitlines()[-1:]}
+        size = out.stat().st_size
+    duration = frames / clip.fps if frames else 0.0
+    return {**row, "ok": True, **parse_scores(cmp.stderr), "frames": frames, "bytes": size,
+            "actual_bitrate": round(size * 8 / duration) if duration else 0,
+            "encode_fps": round(frames / encode_sec, 1) if encode_sec else 0.0,
+            "cpu_sec_per_frame": round(cpu_sec / frames, 5) if frames else 0.0}
+
+
+def run_grid(clips: Sequence[Clip], settings: Sequence[Setting], encoder: str = "libx264",
+             jobs: Optional[int] = None, ffmpeg: str = "ffmpeg") -> List[Dict[str, Any]]:
+    """Every clip x setting, spread over `jobs` worker processes (default: one per CPU)."""
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(run_one, clip, s, encoder, ffmpeg) for clip in clips for s in settings]
+        rows = []
+        for future in futures:
+            row = future.result()
+            LOG.info("%s %s: %s", row["clip"], row["setting"],
+                     f"ssim {row['ssim']:.4f} psnr {row['psnr']:.2f}" if row["ok"] else row["error"])
+            rows.append(row)
+    return rows
+
+
+# ---------- Recommendation ----------
+def summarize(rows: Sequence[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Per scene, per setting: scores averaged over the scene's clips (failed encodes excluded)."""
+    groups: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for row in rows:
+        if row["ok"]:
+            groups.setdefault(row["scene"], {}).setdefault(row["setting"], []).append(row)
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for scene, by_setting in groups.items():
+        out[scene] = []
+        for label, runs in by_setting.items():
+            def mean(key: str) -> float:
+                return sum(r[key] for r in runs) / len(runs)
+            out[scene].append({"setting": label, "bitrate": runs[0]["bitrate"], "iperiod": runs[0]["iperiod"],
+                               "quality": runs[0]["quality"], "clips": len(runs),
+                               "ssim": round(mean("ssim"), 4), "psnr": round(mean("psnr"), 2),
+                               "actual_bitrate": round(mean("actual_bitrate")),
+                               "cpu_sec_per_frame": round(mean("cpu_sec_per_frame"), 5)})
+        out[scene].sort(key=lambda s: (s["actual_bitrate"], s["cpu_sec_per_frame"]))
+    return out
+
+
+def recommend(summary: Sequence[Dict[str, Any]], min_ssim: float = 0.95) -> Dict[str, Any]:
+    """
+    The smallest stream that reaches `min_ssim`, cheapest to encode on ties; if nothing reaches
+    it, the best-scoring setting.
+    """
+    passing = [s for s in summary if s["ssim"] >= min_ssim]
+    if passing:
+        return min(passing, key=lambda s: (s["actual_bitrate"], s["cpu_sec_per_frame"]))
+    return max(summary, key=lambda s: (s["ssim"], -s["actual_bitrate"]))
+
+
+def video_config(base: Any, choice: Dict[str, Any]) -> Any:
+    """`base` (a VideoConfig) with the chosen rate and GOP; quality=None so the bitrate is used as is."""
+    return replace(base, bitrate=choice["bitrate"], iperiod=choice["iperiod"], quality=None)
+
+
+def _print(summary: Dict[str, List[Dict[str, Any]]], picks: Dict[str, Dict[str, Any]], min_ssim: float) -> None:
+    for scene, rows in summary.items():
+        print(f"\n[{scene}] (target SSIM {min_ssim})")
+        print(f"  {'setting':<24}{'kbps':>8}{'ssim':>8}{'psnr':>8}{'ms/frame':>10}")
+        for s in rows:
+            mark = " <" if s is picks[scene] else ""
+            print(f"  {s['setting']:<24}{s['actual_bitrate'] / 1e3:>8.0f}{s['ssim']:>8.4f}{s['psnr']:>8.2f}"
+                  f"{s['cpu_sec_per_frame'] * 1e3:>10.2f}{mark}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("clips", nargs="+", type=Path, help="clip files or scene directories")
+    parser.add_argument("--width", type=int, default=1640, help="encoded size (for the Quality presets)")
+    parser.add_argument("--height", type=int, default=1232)
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate of raw .h264 clips")
+    parser.add_argument("--bitrates", default="1000000,2000000,3000000,4000000,6000000")
+    parser.add_argument("--qualities", default="low,medium", help=f"picamera2 presets: {','.join(QUALITY_MBPS)}")
+    parser.add_argument("--iperiods", default="15,30,60")
+    parser.add_argument("--encoder", default="libx264", help="ffmpeg encoder, e.g. h264_v4l2m2m on a Pi")
+    parser.add_argument("--min-ssim", type=float, default=0.95)
+    parser.add_argument("--jobs", type=int, help="parallel encodes (default: one per CPU)")
+    parser.add_argument("--json", type=Path, help="also write every run and the picks to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Loaded by path: the service module's file name is not importable
+    spec = importlib.util.spec_from_file_location("main_new_shutsdown", Path(__file__).with_name("main-new-shutsdown.py"))
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+
+    clips = find_clips(args.clips, args.fps)
+    if not clips:
+        parser.error("no clips found")
+    qualities = [q for q in args.qualities.split(",") if q]
+    settings = grid([int(b) for b in args.bitrates.split(",") if b], qualities,
+                    [int(g) for g in args.iperiods.split(",")], args.width, args.height, args.fps)
+    LOG.info("%d clips x %d settings", len(clips), len(settings))
+    rows = run_grid(clips, settings, args.encoder, args.jobs)
+    summary = summarize(rows)
+    picks = {scene: recommend(s, args.min_ssim) for scene, s in summary.items()}
+    _print(summary, picks, args.min_ssim)
+    base = service.VideoConfig(width=args.width, height=args.height, frame_rate=int(args.fps))
+    print()
+    for scene, pick in picks.items():
+        print(f"{scene}: {video_config(base, pick)}")
+    if args.json:
+        args.json.write_text(json.dumps({"runs": rows, "summary": summary, "picks": picks}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
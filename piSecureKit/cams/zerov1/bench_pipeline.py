@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmarks on any Linux box: a SyntheticCamera drives the real outputs.
+
+    python3 bench_pipeline.py publish --seconds 20               # native RTSP into a local receiver
+    python3 bench_pipeline.py publish --hub 192.168.6.76:8554    # ... or into a real hub
+    python3 bench_pipeline.py record --dir /tmp/bench-video
+    python3 bench_pipeline.py snapshots --interval 0.2
+    python3 bench_pipeline.py burst --count 10 --interval 2      # burst stills while streaming
+    python3 bench_pipeline.py mjpeg --viewers 20                 # MJPEG broadcaster fan-out
+
+Reports throughput, drops, CPU time, per-stage latency (latency_trace) and, with the local
+receiver, end-to-end latency percentiles up to the receiver's depacketizer.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import logging
+import resource
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from http_server import HttpServer
+from latency_trace import LatencyTracer, traced_outputs
+from mjpeg_broadcast import MjpegBroadcaster
+from recorder import RecorderConfig, SegmentedRecorder
+from rtsp_publisher import RtspOutput
+from rtsp_test_server import RtspTestServer
+from snapshots import BurstSaver, SnapshotConfig, SnapshotPipeline
+from synthetic_camera import FakeH264Encoder, SyntheticCamera, SyntheticConfig
+
+
+def percentiles(values: List[float], points=(50, 95, 99)) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in points}
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(camera: SyntheticCamera, seconds: float) -> Dict[str, Any]:
+    cpu0, t0 = _cpu_seconds(), time.monotonic()
+    camera.start()
+    time.sleep(seconds)
+    camera.stop()
+    wall = time.monotonic() - t0
+    status = camera.status()
+    return {"seconds": round(wall, 2), "cpu_percent": round(100 * (_cpu_seconds() - cpu0) / wall, 1),
+            "frames": status["frames"], "late_frames": status["late_frames"],
+            "mbps": round(status["bytes"] * 8 / wall / 1e6, 2)}
+
+
+def bench_publish(cfg: SyntheticConfig, seconds: float, hub: Optional[str],
+                  sample_every: int = 1) -> Dict[str, Any]:
+    server = None
+    if hub:
+        host, _, port = hub.partition(":")
+        port = int(port or 8554)
+    else:
+        server = RtspTestServer().start()
+        host, port = server.host, server.port
+    tracer = LatencyTracer(sample_every)
+    out = RtspOutput(host, port, "bench", tracer=tracer)
+    camera = SyntheticCamera(cfg, traced_outputs([out], tracer))
+    tracer.time_base = camera.time_base_us
+    try:
+        result = _run(camera, seconds)
+        result.update(out.stats())
+        result["stages"] = tracer.summary()
+        if server is not None:
+            server.wait_for("bench", result["frames_sent"], timeout=5)
+            sent = dict(camera.emitted)
+            latencies = []
+            for _, au, received in server.stream("bench").access_units:
+                index = FakeH264Encoder.frame_index(au)
+                if index in sent:
+                    latencies.append((received - sent[index]) * 1000)
+            result["received"] = len(server.stream("bench").access_units)
+            result["latency_ms"] = {k: round(v, 2) for k, v in percentiles(latencies).items()}
+    finally:
+        if server is not None:
+            server.stop()
+    return result
+
+
+def bench_record(cfg: SyntheticConfig, seconds: float, directory: Optional[Path]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        rec = SegmentedRecorder(RecorderConfig(directory=directory or Path(tmp), segment_sec=10))
+        result = _run(SyntheticCamera(cfg, [rec]), seconds)
+        result.update(rec.stats())
+    return result
+
+
+def bench_snapshots(cfg: SyntheticConfig, seconds: float, interval: float) -> Dict[str, Any]:
+    camera = SyntheticCamera(cfg, [])
+    grab_ms: List[float] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        pipe = SnapshotPipeline(SnapshotConfig(), Path(tmp, "preview.jpg"))
+        camera.start()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            pipe.submit(camera.grab_frame())
+            grab_ms.append((time.perf_counter() - t0) * 1000)
+            time.sleep(interval)
+        camera.stop()
+        pipe.close()
+        result = {"frames": camera.status()["frames"], "late_frames": camera.status()["late_frames"],
+                  **pipe.stats(), "grab_ms": {k: round(v, 2) for k, v in percentiles(grab_ms).items()}}
+    return result
+
+
+def bench_burst(cfg: SyntheticConfig, seconds: float, count: int, interval: float) -> Dict[str, Any]:
+    """Bursts of `count` consecutive frames saved on workers while the stream keeps its frame rate."""
+    camera = SyntheticCamera(cfg, [])
+    grab_fps: List[float] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = BurstSaver(Path(tmp), max_pending=4 * count)
+        cpu0, t0 = _cpu_seconds(), time.monotonic()
+        camera.start()
+        n = 0
+        while time.monotonic() - t0 < seconds:
+            try:
+                saver.reserve(count)
+            except RuntimeError:
+                pass  # counted as rejected; nothing is grabbed
+            else:
+                g0 = time.monotonic()
+                grabs = camera.grab_burst(count)
+                grab_fps.append(len(grabs) / (time.monotonic() - g0))
+                saver.release(count - len(grabs))
+                saver.save(grabs, f"burst{n}")
+            n += 1
+            time.sleep(interval)
+        saver.wait(timeout=60)
+        wall = time.monotonic() - t0
+        camera.stop()
+        saver.close()
+        stats = saver.stats()
+    status = camera.status()
+    return {"seconds": round(wall, 2), "cpu_percent": round(100 * (_cpu_seconds() - cpu0) / wall, 1),
+            "frames": status["frames"], "late_frames": status["late_frames"],
+            "grab_fps": {k: round(v, 1) for k, v in percentiles(grab_fps).items()},
+            "saved_per_sec": round(stats["saved"] / wall, 1),
+            "encode_ms": round(1000 * stats["encode_sec"] / max(stats["saved"] + stats["failed"], 1), 1), **stats}
+
+
+def bench_mjpeg(seconds: float, viewers: int, fps: float, frame_bytes: int) -> Dict[str, Any]:
+    """Broadcast JPEG-sized frames to local viewers; pool allocations/copies and GC runs per frame."""
+    broadcaster = MjpegBroadcaster()
+    server = HttpServer("127.0.0.1", 0)
+    server.route("GET", "/video_feed", broadcaster.handle)
+    server.start()
+    received = [0] * viewers
+
+    def viewer(i: int) -> None:
+        with socket.create_connection(("127.0.0.1", server.port)) as sock:
+            sock.sendall(b"GET /video_feed HTTP/1.1\r\n\r\n")
+            while True:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    return
+                received[i] += len(chunk)
+
+    for i in range(viewers):
+        threading.Thread(target=viewer, args=(i,), daemon=True).start()
+    while broadcaster.stats()["clients"] < viewers:
+        time.sleep(0.01)
+    frame = bytes(frame_bytes)
+    gc0 = sum(s["collections"] for s in gc.get_stats())
+    cpu0, t0 = _cpu_seconds(), time.monotonic()
+    n = 0
+    while time.monotonic() - t0 < seconds:
+        broadcaster.publish(frame)
+        n += 1
+        time.sleep(max(0.0, t0 + n / fps - time.monotonic()))
+    wall = time.monotonic() - t0
+    stats = broadcaster.stats()
+    server.stop()
+    return {"seconds": round(wall, 2), "viewers": viewers, "frames": n,
+            "cpu_percent": round(100 * (_cpu_seconds() - cpu0) / wall, 1),
+            "gc_collections": sum(s["collections"] for s in gc.get_stats()) - gc0,
+            "mbytes_received": round(sum(received) / 1e6, 1), **stats}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", choices=["publish", "record", "snapshots", "burst", "mjpeg"])
+    parser.add_argument("--source", default="pattern", help="'pattern' or a .y4m/.h264 file")
+    parser.add_argument("--width", type=int, default=1640)
+    parser.add_argument("--height", type=int, default=1232)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--bitrate", type=int, default=4_000_000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--hub", help="publish to host[:port] instead of a local receiver")
+    parser.add_argument("--dir", type=Path, help="recording directory (default: a temp dir)")
+    parser.add_argument("--interval", type=float, default=1.0, help="snapshot (or burst) interval")
+    parser.add_argument("--count", type=int, default=10, help="frames per burst")
+    parser.add_argument("--sample-every", type=int, default=1, help="latency-trace one frame in N")
+    parser.add_argument("--viewers", type=int, default=20, help="MJPEG viewers")
+    parser.add_argument("--frame-bytes", type=int, default=60_000, help="MJPEG frame size")
+    parser.add_argument("--json", type=Path, help="also write the result to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    cfg = SyntheticConfig(source=args.source, width=args.width, height=args.height,
+                          fps=args.fps, bitrate=args.bitrate)
+    if args.bench == "publish":
+        result = bench_publish(cfg, args.seconds, args.hub, args.sample_every)
+    elif args.bench == "mjpeg":
+        result = bench_mjpeg(args.seconds, args.viewers, args.fps, args.frame_bytes)
+    elif args.bench == "burst":
+        result = bench_burst(cfg, args.seconds, args.count, args.interval)
+    elif args.bench == "record":
+        result = bench_record(cfg, args.seconds, args.dir)
+    else:
+        result = bench_snapshots(cfg, args.seconds, args.interval)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
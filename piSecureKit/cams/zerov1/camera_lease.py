@@ -0,0 +1,250 @@
+"""
+Exclusive, crash-safe lease on a camera, taken before Picamera2 opens it.
+
+The lease is an flock on `<lock_dir>/camera<N>.lock`, so the kernel drops it the moment the
+holder dies; a restarted service never waits on a dead process. A holder that is still alive is
+stale if it belongs to our own cgroup (i.e. a previous run of this systemd unit still shutting
+down): it gets SIGTERM, then SIGKILL after a grace period. Anything else (another unit, a shell,
+rpicam-hello) is waited for, up to `wait_sec`. Processes in our cgroup that hold the camera
+devices without any lease (pre-lease versions of the service) are reaped the same way.
+
+Under the camera supervisor all workers share the unit's cgroup, so the supervisor (our parent,
+when it is in our cgroup) and its other children are never treated as stale: a sibling may have
+the devices open for its own camera before its lease file shows it.
+
+Nothing is reaped unless we run as a systemd service (our cgroup is a `.service` unit, or
+systemd set INVOCATION_ID): in a login session, a container or a flat cgroup layout the
+"same cgroup" holds unrelated processes, so there we only wait.
+"""
+from __future__ import annotations
+
+import errno
+import fcntl
+import logging
+import os
+import signal
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Set
+
+LOG = logging.getLogger("PiSecureKit.lease")
+
+DEFAULT_LOCK_DIR = Path("/run/lock/pisecurekit")
+# Nodes a libcamera client keeps open: unicam/CFE (media, video) and the ISP.
+DEVICE_PREFIXES = ("/dev/media", "/dev/video")
+
+
+class CameraBusyError(TimeoutError):
+    pass
+
+
+@dataclass(frozen=True)
+class LeaseConfig:
+    lock_dir: Path = DEFAULT_LOCK_DIR
+    wait_sec: float = 10.0      # bound on waiting for another holder to let go
+    grace_sec: float = 3.0      # SIGTERM -> SIGKILL for a stale holder of ours
+    poll_sec: float = 0.1
+    reap: bool = True           # False: never signal anyone, only wait
+
+
+# ---------- /proc helpers ----------
+def _cmdline(pid: int) -> str:
+    try:
+        return Path(f"/proc/{pid}/cmdline").read_bytes().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def _cgroup(pid: int) -> str:
+    try:
+        return Path(f"/proc/{pid}/cgroup").read_text()
+    except OSError:
+        return ""
+
+
+def _unit_path(pid: int) -> str:
+    """The cgroup path systemd placed `pid` in: cgroup v2, else the v1 name=systemd hierarchy."""
+    paths = {}
+    for line in _cgroup(pid).splitlines():
+        _, controllers, path = line.split(":", 2)
+        paths[controllers] = path
+    v2 = paths.get("", "")
+    return v2 if v2 not in ("", "/") else paths.get("name=systemd", "")
+
+
+def in_service() -> bool:
+    """Running as a systemd service, so our cgroup holds only that unit's processes."""
+    return _unit_path(os.getpid()).rstrip("/").endswith(".service") or bool(os.environ.get("INVOCATION_ID"))
+
+
+def _ppid(pid: int) -> Optional[int]:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        return int(stat[stat.rfind(")") + 2:].split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _alive(pid: int) -> bool:
+    """Running (not gone, not a zombie waiting to be reaped by its parent)."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return False
+    return stat[stat.rfind(")") + 2:][:1] != "Z"
+
+
+def device_holders(prefixes: Sequence[str] = DEVICE_PREFIXES) -> Set[int]:
+    """PIDs (other than ours) with a camera device node open; only processes we may inspect."""
+    me = os.getpid()
+    pids: Set[int] = set()
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit() or int(entry.name) == me:
+            continue
+        try:
+            for fd in (entry / "fd").iterdir():
+                if os.readlink(fd).startswith(tuple(prefixes)):
+                    pids.add(int(entry.name))
+                    break
+        except OSError:
+            continue
+    return pids
+
+
+class CameraLease:
+
+    def __init__(self, camera_num: int = 0, cfg: LeaseConfig = LeaseConfig()) -> None:
+        self._cfg = cfg
+        self.camera_num = camera_num
+        self.path = cfg.lock_dir / f"camera{camera_num}.lock"
+        self._fd: Optional[int] = None
+        self._refused: Set[int] = set()  # holders of our cgroup left alone outside a service; logged once
+
+    def __enter__(self) -> "CameraLease":
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> "CameraLease":
+        if self._fd is not None:
+            return self
+        t0 = time.monotonic()
+        deadline = t0 + self._cfg.wait_sec
+        fd = self._open()
+        try:
+            self._lock(fd, deadline)
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+            self._fd = fd
+        except BaseException:
+            os.close(fd)
+            raise
+        if self._cfg.reap:
+            self._reap_unleased(deadline)
+        LOG.info("Acquired camera %d lease in %.2fs", self.camera_num, time.monotonic() - t0)
+        return self
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            os.ftruncate(self._fd, 0)
+        except OSError:
+            pass
+        os.close(self._fd)  # closing drops the flock
+        self._fd = None
+
+    # -- internals --
+    def _open(self) -> int:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        except PermissionError:
+            pass
+        return os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o664)
+
+    def _lock(self, fd: int, deadline: float) -> None:
+        reaped: Set[int] = set()
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            holder = self._holder(fd)
+            if self._cfg.reap and holder and holder not in reaped and self._stale(holder):
+                reaped.add(holder)
+                self._terminate(holder, deadline)
+                continue
+            if time.monotonic() >= deadline:
+                who = f"pid {holder} ({_cmdline(holder) or '?'})" if holder else "unknown process"
+                raise CameraBusyError(f"camera {self.camera_num} still leased by {who} after {self._cfg.wait_sec:.0f}s")
+            time.sleep(self._cfg.poll_sec)
+
+    @staticmethod
+    def _holder(fd: int) -> Optional[int]:
+        try:
+            text = os.pread(fd, 32, 0).decode().strip()
+            return int(text) if text else None
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _same_unit(pid: int) -> bool:
+        mine = _cgroup(os.getpid())
+        return bool(mine) and _cgroup(pid) == mine
+
+    def _stale(self, pid: int) -> bool:
+        """Ours to reap: same unit, but neither our supervisor nor one of its live workers."""
+        if not self._same_unit(pid):
+            return False
+        if not in_service():
+            if pid not in self._refused:
+                self._refused.add(pid)
+                LOG.warning("Not reaping camera holder pid %d (%s): not running as a systemd service",
+                            pid, _cmdline(pid))
+            return False
+        parent = os.getppid()
+        if self._same_unit(parent) and (pid == parent or _ppid(pid) == parent):
+            return False
+        return True
+
+    def _terminate(self, pid: int, deadline: float) -> None:
+        LOG.warning("Reaping stale camera holder pid %d (%s)", pid, _cmdline(pid))
+        try:
+            os.kill(pid, signal.SIGTERM)
+            kill_at = min(time.monotonic() + self._cfg.grace_sec, deadline)
+            while _alive(pid) and time.monotonic() < kill_at:
+                time.sleep(self._cfg.poll_sec)
+            if _alive(pid):
+                LOG.warning("pid %d ignored SIGTERM; killing", pid)
+                os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        except PermissionError as e:
+            LOG.warning("Cannot signal pid %d: %s", pid, e)
+
+    def _leased_pids(self) -> Set[int]:
+        """PIDs holding any camera lease in the lock directory (ours included)."""
+        pids: Set[int] = set()
+        for path in self.path.parent.glob("camera*.lock"):
+            try:
+                text = path.read_text().strip()
+            except OSError:
+                continue
+            if text.isdigit() and _alive(int(text)):
+                pids.add(int(text))
+        return pids
+
+    def _reap_unleased(self, deadline: float) -> None:
+        """Processes of our unit holding camera devices without any lease cannot be live siblings."""
+        leased = self._leased_pids()
+        stale: List[int] = [pid for pid in device_holders() if pid not in leased and self._stale(pid)]
+        for pid in stale:
+            self._terminate(pid, deadline)
@@ -0,0 +1,208 @@
+"""
+Runs one camera pipeline per worker process and keeps them alive.
+
+Each camera gets its own process (libcamera/Picamera2 state, GIL and crash domain), optionally
+pinned to CPUs. A worker that dies is restarted with its own backoff while the others keep
+streaming. Logging, the HTTP endpoint and periodic timers stay in the supervisor: workers send
+log records and status reports over queues instead of each running their own.
+
+    [supervisor]
+    http_port = 8080
+    hub = 192.168.6.76
+
+    [camera:front]
+    camera_num = 0
+    path = front
+    cpus = 2
+"""
+from __future__ import annotations
+
+import configparser
+import logging
+import logging.handlers
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LOG = logging.getLogger("PiSecureKit.supervisor")
+
+# target(cfg, report) runs one camera until SIGTERM and calls report(status, metrics_text) now and then.
+WorkerTarget = Callable[[Any, Callable[[Dict[str, Any], str], None]], None]
+
+
+@dataclass(frozen=True)
+class CameraSpec:
+    name: str
+    cfg: Any                      # the camera's AppConfig (must be picklable)
+    cpus: Tuple[int, ...] = ()    # CPU affinity; empty = inherit
+
+
+@dataclass
+class _Worker:
+    spec: CameraSpec
+    process: Optional[mp.process.BaseProcess] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    backoff: float = 0.0
+    next_start: float = 0.0
+    last_exit: Optional[int] = None
+    status: Dict[str, Any] = field(default_factory=dict)
+    metrics: str = ""
+    reported_at: float = 0.0
+
+
+# ---------- Config ----------
+def parse_cpus(value: str) -> Tuple[int, ...]:
+    """'2', '2,3' or '0-3' -> CPU ids."""
+    cpus: List[int] = []
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        lo, _, hi = part.partition("-")
+        cpus.extend(range(int(lo), int(hi or lo) + 1))
+    return tuple(cpus)
+
+
+def read_cameras_ini(path: Path) -> Tuple[Dict[str, str], List[Tuple[str, Dict[str, str]]]]:
+    """([supervisor] options, [(name, options) for each [camera:<name>] section])."""
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise FileNotFoundError(path)
+    settings = dict(parser["supervisor"]) if parser.has_section("supervisor") else {}
+    cameras = [(s.split(":", 1)[1], dict(parser[s])) for s in parser.sections() if s.startswith("camera:")]
+    if not cameras:
+        raise ValueError(f"{path}: no [camera:<name>] sections")
+    return settings, cameras
+
+
+# ---------- Worker side ----------
+def _worker_main(target: WorkerTarget, spec: CameraSpec, log_queue, status_queue) -> None:
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    if spec.cpus:
+        try:
+            os.sched_setaffinity(0, spec.cpus)
+        except (AttributeError, OSError) as e:
+            LOG.warning("[%s] cannot pin to CPUs %s: %s", spec.name, spec.cpus, e)
+
+    def report(status: Dict[str, Any], metrics: str = "") -> None:
+        try:
+            status_queue.put_nowait((spec.name, status, metrics))
+        except queue.Full:
+            pass
+
+    target(spec.cfg, report)
+
+
+# ---------- Supervisor ----------
+class CameraSupervisor:
+
+    def __init__(self, specs: List[CameraSpec], target: WorkerTarget,
+                 min_backoff_sec: float = 1.0, max_backoff_sec: float = 30.0,
+                 stable_after_sec: float = 60.0) -> None:
+        names = [s.name for s in specs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"duplicate camera names: {names}")
+        self._ctx = mp.get_context("spawn")  # never fork a process that may hold camera state
+        self._target = target
+        self._workers = {s.name: _Worker(s) for s in specs}
+        self._min_backoff = min_backoff_sec
+        self._max_backoff = max_backoff_sec
+        self._stable_after = stable_after_sec
+        self._log_queue = self._ctx.Queue()
+        self._status_queue = self._ctx.Queue(maxsize=256)
+        self._listener = logging.handlers.QueueListener(
+            self._log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._status_thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._listener.start()
+        self._status_thread = threading.Thread(target=self._collect, name="supervisor-status", daemon=True)
+        self._status_thread.start()
+        for w in self._workers.values():
+            self._spawn(w)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        procs = [w.process for w in self._workers.values() if w.process is not None and w.process.is_alive()]
+        for p in procs:
+            p.terminate()  # SIGTERM: the worker stops its StreamService cleanly
+        deadline = time.monotonic() + timeout
+        for p in procs:
+            p.join(max(deadline - time.monotonic(), 0.1))
+            if p.is_alive():
+                LOG.warning("Worker pid %d ignored SIGTERM; killing", p.pid)
+                p.kill()
+                p.join(1)
+        self._listener.stop()
+
+    def poll(self) -> None:
+        """Restart dead workers whose backoff has elapsed; call periodically."""
+        now = time.monotonic()
+        for w in self._workers.values():
+            p = w.process
+            if p is not None and not p.is_alive():
+                w.last_exit = p.exitcode
+                w.process = None
+                # A worker that ran for a while starts over with the shortest backoff.
+                if now - w.started_at >= self._stable_after:
+                    w.backoff = 0.0
+                w.backoff = min(max(w.backoff * 2, self._min_backoff), self._max_backoff)
+                w.next_start = now + w.backoff
+                LOG.error("Camera %s exited with %s; restarting in %.1fs", w.spec.name, p.exitcode, w.backoff)
+            if w.process is None and not self._stop.is_set() and now >= w.next_start:
+                w.restarts += 1
+                self._spawn(w)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {name: {"pid": w.process.pid if w.process is not None else None,
+                           "alive": w.process is not None and w.process.is_alive(),
+                           "cpus": list(w.spec.cpus), "restarts": w.restarts, "last_exit": w.last_exit,
+                           "report_age_sec": round(now - w.reported_at, 1) if w.reported_at else None,
+                           "status": w.status}
+                    for name, w in self._workers.items()}
+
+    def metrics(self) -> str:
+        """Workers' Prometheus text with a camera label added to every sample."""
+        out: List[str] = []
+        with self._lock:
+            for name, w in self._workers.items():
+                for line in w.metrics.splitlines():
+                    if line.startswith("#"):
+                        if line not in out:
+                            out.append(line)
+                    elif "{" in line:
+                        out.append(line.replace("{", f'{{camera="{name}",', 1))
+                    elif line:
+                        metric, _, value = line.partition(" ")
+                        out.append(f'{metric}{{camera="{name}"}} {value}')
+        return "\n".join(out) + "\n" if out else ""
+
+    def _spawn(self, w: _Worker) -> None:
+        p = self._ctx.Process(target=_worker_main, name=f"camera-{w.spec.name}",
+                              args=(self._target, w.spec, self._log_queue, self._status_queue), daemon=False)
+        p.start()
+        w.process = p
+        w.started_at = time.monotonic()
+        LOG.info("Started camera %s (pid %d, cpus=%s)", w.spec.name, p.pid, list(w.spec.cpus) or "any")
+
+    def _collect(self) -> None:
+        while not self._stop.is_set():
+            try:
+                name, status, metrics = self._status_queue.get(timeout=0.5)
+            except (queue.Empty, EOFError, OSError):
+                continue
+            with self._lock:
+                w = self._workers.get(name)
+                if w is not None:
+                    w.status, w.metrics, w.reported_at = status, metrics, time.monotonic()
@@ -0,0 +1,39 @@
+"""
+Shared base for outputs that are fed encoded frames straight from a picamera2 encoder.
+"""
+from __future__ import annotations
+
+import logging
+
+LOG = logging.getLogger("PiSecureKit.output")
+
+# ---------- Optional picamera2 import ----------
+# Encoders only accept subclasses of picamera2's Output, so use it when present.
+# On dev machines fall back to a plain class with the same start/stop/recording contract.
+try:
+    from picamera2.outputs import Output as _OutputBase
+except Exception:  # pragma: no cover (dev machines)
+    class _OutputBase:  # type: ignore[no-redef]
+        def __init__(self, pts=None) -> None:
+            self.recording = False
+
+        def start(self) -> None:
+            self.recording = True
+
+        def stop(self) -> None:
+            self.recording = False
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+            pass
+
+
+class EncodedOutput(_OutputBase):
+    """
+    Base class for our own encoder outputs.
+
+    Subclasses implement `outputframe(frame, keyframe, timestamp, packet, audio)`; it is called
+    on the encoder thread, so implementations must hand work off rather than block.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
@@ -0,0 +1,88 @@
+"""
+Minimal H.264 Annex-B helpers: NAL splitting and access-unit grouping.
+
+Only what the camera-side tooling needs; no slice parsing beyond first_mb_in_slice.
+"""
+from __future__ import annotations
+
+from typing import BinaryIO, Iterator, List, Tuple
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+START_CODE = b"\x00\x00\x00\x01"
+
+
+def iter_nal_units(data: bytes) -> Iterator[memoryview]:
+    """Yield NAL unit payloads (without start codes) from an Annex-B byte string."""
+    view = memoryview(data)
+    i = data.find(b"\x00\x00\x01")
+    while i != -1:
+        start = i + 3
+        nxt = data.find(b"\x00\x00\x01", start)
+        end = len(data) if nxt == -1 else nxt
+        # A 4-byte start code leaves a trailing zero on the previous NAL.
+        if nxt != -1 and data[end - 1] == 0:
+            end -= 1
+        if end > start:
+            yield view[start:end]
+        i = nxt
+
+
+def nal_type(nal: bytes) -> int:
+    return nal[0] & 0x1F
+
+
+def is_keyframe(frame: bytes) -> bool:
+    """True if an access unit contains an IDR slice."""
+    return any(nal_type(n) == NAL_IDR for n in iter_nal_units(frame))
+
+
+def iter_access_units(stream: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[Tuple[bytes, bool]]:
+    """
+    Read an Annex-B elementary stream and yield (access_unit, keyframe) pairs.
+
+    A new access unit starts at an AUD/SPS/PPS/SEI following a slice, or at a slice whose
+    first_mb_in_slice is 0 (leading bit of ue(v) set) following a slice.
+    """
+    pending = b""
+    current: List[bytes] = []
+    has_slice = False
+    keyframe = False
+
+    def flush() -> Tuple[bytes, bool]:
+        return b"".join(START_CODE + n for n in current), keyframe
+
+    eof = False
+    while not eof:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        pending += chunk
+        nals = list(iter_nal_units(pending))
+        if not eof:
+            # The final NAL may be cut off mid-chunk; keep it for the next round.
+            last = pending.rfind(b"\x00\x00\x01")
+            if last <= 0:
+                continue
+            if pending[last - 1] == 0:
+                last -= 1
+            pending = pending[last:]
+            nals = nals[:-1]
+        for nal in nals:
+            kind = nal_type(nal)
+            is_slice = kind in (NAL_SLICE, NAL_IDR)
+            starts_au = has_slice and (
+                kind in (NAL_AUD, NAL_SPS, NAL_PPS, NAL_SEI) or (is_slice and len(nal) > 1 and nal[1] & 0x80)
+            )
+            if starts_au:
+                yield flush()
+                current, has_slice, keyframe = [], False, False
+            current.append(bytes(nal))
+            has_slice = has_slice or is_slice
+            keyframe = keyframe or kind == NAL_IDR
+    if current:
+        yield flush()
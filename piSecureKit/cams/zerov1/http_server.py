@@ -0,0 +1,192 @@
+"""
+Small asyncio HTTP/1.1 server for the camera's status and control endpoints.
+
+One event loop on one background thread; no framework and no per-request threads, so it costs
+a few hundred kB instead of the Flask stack `old_main.py` carried.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+LOG = logging.getLogger("PiSecureKit.http")
+
+_REASONS = {200: "OK", 204: "No Content", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error", 503: "Service Unavailable"}
+_MAX_HEADER_BYTES = 16 * 1024
+_MAX_BODY_BYTES = 64 * 1024
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes = b""
+
+    def json(self) -> dict:
+        return json.loads(self.body or b"{}")
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Open-ended body (e.g. MJPEG) written by the handler after the headers; the connection
+    # closes when it returns
+    stream: Optional[Callable[[asyncio.StreamWriter], Awaitable[None]]] = None
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+def json_response(obj, status: int = 200) -> Response:
+    return Response(status, json.dumps(obj, default=str).encode(), "application/json")
+
+
+def error_response(status: int, message: str) -> Response:
+    return json_response({"error": message}, status)
+
+
+class HttpServer:
+    """Route table plus an asyncio server running on its own daemon thread."""
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080) -> None:
+        self.host = host
+        self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._error: Optional[OSError] = None
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    # -- lifecycle --
+    def start(self) -> "HttpServer":
+        """Bind and serve; raises the bind error (e.g. port in use) instead of running without an API."""
+        self._error = None
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="http-server", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=5)
+        if self._error is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+            raise self._error
+        return self
+
+    def stop(self) -> None:
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def call_soon(self, callback, *args) -> None:
+        """Schedule `callback` on the server loop from any thread (no-op if not running)."""
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        self.loop = loop
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, reuse_address=True))
+            self.port = self._server.sockets[0].getsockname()[1]
+            LOG.info("HTTP endpoint on %s:%d", self.host, self.port)
+            self._ready.set()
+            loop.run_forever()
+        except OSError as e:
+            LOG.error("HTTP endpoint failed to start on port %d: %s", self.port, e)
+            self._error = e
+            self._ready.set()
+        finally:
+            if self._server is not None:
+                self._server.close()
+            for task in asyncio.all_tasks(loop):
+                task.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            loop.close()
+            self.loop = None
+
+    # -- protocol --
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                req = await self._read_request(reader)
+                if req is None:
+                    break
+                resp = await self._dispatch(req)
+                if resp.stream is not None:
+                    self._write_response(writer, req, resp, False)
+                    await resp.stream(writer)
+                    break
+                keep_alive = req.headers.get("connection", "").lower() != "close"
+                self._write_response(writer, req, resp, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass  # server shutting down with the connection open (keep-alive, streams)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        head = await reader.readuntil(b"\r\n\r\n")
+        if len(head) > _MAX_HEADER_BYTES:
+            raise ValueError("headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                k, _, v = line.partition(":")
+                headers[k.strip().lower()] = v.strip()
+        length = int(headers.get("content-length", "0") or 0)
+        if length > _MAX_BODY_BYTES:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _dispatch(self, req: Request) -> Response:
+        handler = self._routes.get((req.method, req.path))
+        if handler is None:
+            if any(path == req.path for _, path in self._routes):
+                return error_response(405, f"{req.method} not allowed on {req.path}")
+            return error_response(404, f"no route for {req.path}")
+        try:
+            return await handler(req)
+        except (ValueError, KeyError, TypeError) as e:
+            return error_response(400, str(e))
+        except Exception as e:
+            LOG.exception("Handler for %s %s failed", req.method, req.path)
+            return error_response(500, str(e))
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, req: Request, resp: Response, keep_alive: bool) -> None:
+        lines = [f"HTTP/1.1 {resp.status} {_REASONS.get(resp.status, '')}",
+                 f"Content-Type: {resp.content_type}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if resp.stream is None:
+            lines.append(f"Content-Length: {len(resp.body)}")
+        lines += [f"{k}: {v}" for k, v in resp.headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if req.method != "HEAD" and resp.body:
+            writer.write(resp.body)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Sampled per-frame latency tracing, from sensor timestamp to network send.
+
+Every `sample_every`-th frame is tagged by its encoder timestamp when it leaves the encoder;
+each pipeline stage that sees the frame again records (now - sensor time) into that stage's
+histogram. Histograms are fixed log-spaced buckets, each written by a single thread (the one
+running that stage), so recording takes no locks.
+
+Stages recorded by the camera service:
+    encoded     encoder output callback (sensor -> ISP -> H.264 done)
+    handed_off  after every output accepted the frame (ffmpeg pipe write, recorder queue, ...)
+    send_start  native RTSP sender picked the frame off its queue
+    sent        native RTSP sendmsg returned
+
+Dump a running service's numbers with:
+
+    python3 latency_trace.py --url http://camera:8080
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional
+
+from encoded_output import EncodedOutput
+
+# Upper bucket bounds in microseconds: 50us .. ~10s, 25% apart.
+BUCKETS_US: List[float] = []
+_b = 50.0
+while _b < 10_000_000:
+    BUCKETS_US.append(round(_b, 1))
+    _b *= 1.25
+del _b
+
+_MAX_INFLIGHT = 512
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; safe with one writer and any number of readers."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_US) + 1)  # last bucket is overflow
+        self.total_us = 0.0
+        self.max_us = 0.0
+
+    def record(self, value_us: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_US, value_us)] += 1
+        self.total_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile, in microseconds."""
+        counts = list(self.counts)
+        rank = sum(counts) * p / 100.0
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if c and seen >= rank:
+                return min(BUCKETS_US[i], self.max_us) if i < len(BUCKETS_US) else self.max_us
+        return 0.0
+
+    def summary(self) -> Dict[str, float]:
+        n = self.count
+        return {"count": n,
+                "mean_ms": round(self.total_us / n / 1000, 3) if n else 0.0,
+                "p50_ms": round(self.percentile(50) / 1000, 3),
+                "p90_ms": round(self.percentile(90) / 1000, 3),
+                "p99_ms": round(self.percentile(99) / 1000, 3),
+                "max_ms": round(self.max_us / 1000, 3)}
+
+
+class LatencyTracer:
+    """
+    `time_base` returns the sensor time (monotonic, microseconds) of encoder timestamp zero, or
+    None until the first frame is out; for Picamera2 that is `encoder.firsttimestamp`. The camera
+    driver sets it once it owns the encoder.
+    """
+
+    def __init__(self, sample_every: int = 30,
+                 time_base: Optional[Callable[[], Optional[int]]] = None) -> None:
+        self.time_base = time_base
+        self.sample_every = sample_every
+        self._seen = 0
+        self._inflight: Dict[int, int] = {}  # encoder timestamp -> absolute sensor time (us)
+        self.stages: Dict[str, Histogram] = {}
+
+    def begin(self, timestamp: Optional[int]) -> bool:
+        """Called once per frame by the first stage; decides whether the frame is sampled."""
+        if timestamp is None or self.sample_every <= 0:
+            return False
+        self._seen += 1
+        if self._seen % self.sample_every:
+            return False
+        base = self.time_base() if self.time_base is not None else None
+        if base is None:
+            return False
+        self._inflight[timestamp] = base + timestamp
+        if len(self._inflight) > _MAX_INFLIGHT:  # frames some stage never saw (dropped)
+            self._inflight.pop(next(iter(self._inflight)), None)
+        return True
+
+    def mark(self, stage: str, timestamp: Optional[int]) -> None:
+        sensor_us = self._inflight.get(timestamp) if timestamp is not None else None
+        if sensor_us is None:
+            return
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages.setdefault(stage, Histogram())
+        hist.record(time.monotonic_ns() / 1000 - sensor_us)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {name: hist.summary() for name, hist in list(self.stages.items())}
+
+    def prometheus(self, prefix: str = "pisecurekit_frame_latency_seconds") -> str:
+        """Histograms in Prometheus text exposition format."""
+        lines = [f"# TYPE {prefix} histogram"]
+        for name, hist in list(self.stages.items()):
+            counts = list(hist.counts)
+            cumulative = 0
+            for bound, c in zip(BUCKETS_US, counts):
+                cumulative += c
+                lines.append(f'{prefix}_bucket{{stage="{name}",le="{bound / 1e6:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{prefix}_bucket{{stage="{name}",le="+Inf"}} {cumulative}')
+            lines.append(f'{prefix}_sum{{stage="{name}"}} {hist.total_us / 1e6:.6f}')
+            lines.append(f'{prefix}_count{{stage="{name}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+class TraceTap(EncodedOutput):
+    """
+    Zero-copy pass-through Output that marks a stage. Put one `first=True` tap at the head of the
+    encoder's output list and one at the end: picamera2 calls outputs in list order.
+    """
+
+    def __init__(self, tracer: LatencyTracer, stage: str, first: bool = False) -> None:
+        super().__init__()
+        self._tracer = tracer
+        self._stage = stage
+        self._first = first
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+        if audio:
+            return
+        if self._first and not self._tracer.begin(timestamp):
+            return
+        self._tracer.mark(self._stage, timestamp)
+
+
+def traced_outputs(outputs: List, tracer: LatencyTracer) -> List:
+    """`outputs` bracketed by the encoded/handed_off taps."""
+    return [TraceTap(tracer, "encoded", first=True), *outputs, TraceTap(tracer, "handed_off")]
+
+
+def _print_table(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'stage':<12}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, s in summary.items():
+        print(f"{name:<12}{s['count']:>8}{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}"
+              f"{s['p90_ms']:>9.2f}{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Dump per-stage frame latency from a camera service")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="camera status endpoint base URL")
+    parser.add_argument("--json", action="store_true", help="print raw JSON instead of a table")
+    args = parser.parse_args()
+    with urllib.request.urlopen(f"{args.url.rstrip('/')}/latency", timeout=5) as resp:
+        summary = json.load(resp)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        _print_table(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,12 +5,32 @@ PiSecureKit - Raspberry Pi Camera Security System (OOP + type-safe refactor)
 from __future__ import annotations
 
 import os
+import json
+import fcntl
+import asyncio
 import time
 import signal
 import logging
-from dataclasses import dataclass
+import argparse
+import threading
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Protocol, Optional, runtime_checkable
+from typing import Any, Dict, List, NamedTuple, Protocol, Optional, Tuple, runtime_checkable
+
+import camera_supervisor
+from bandwidth_client import BandwidthClient, BandwidthConfig
+from camera_lease import CameraLease, LeaseConfig
+import memory_budget
+import snapshots
+from http_server import HttpServer, Response, error_response, json_response
+from latency_trace import LatencyTracer, traced_outputs
+from recorder import RecorderConfig, SegmentedRecorder
+from resilient_publisher import LIVE, OFF, OnDemandConfig, ReconnectConfig, ResilientPublisher
+from rtsp_publisher import RtspOutput
+from snapshots import BurstSaver, SnapshotConfig, SnapshotPipeline, SnapshotStore
+from synthetic_camera import SyntheticCamera, SyntheticConfig
+from systemd_notify import Notifier
+from timelapse import TimelapseConfig, TimelapseReader, TimelapseWriter
 
 # ---------- Logging ----------
 logging.basicConfig(
@@ -24,19 +44,38 @@ CAMERA_AVAILABLE = True
 try:
     from picamera2 import Picamera2
     from picamera2.encoders import H264Encoder, Quality
-    from picamera2.outputs import FfmpegOutput
+    from picamera2.outputs import FfmpegOutput, Output
 except Exception as _exc:  # pragma: no cover (dev machines)
     LOG.warning("Camera modules not available: %s", _exc)
     CAMERA_AVAILABLE = False
 
+# V4L2 controls for live bitrate changes; older picamera2 releases ship them as `v4l2`
+V4L2_CONTROLS = True
+try:
+    from videodev2 import V4L2_CID_MPEG_VIDEO_BITRATE, VIDIOC_S_CTRL, v4l2_control
+except Exception:  # pragma: no cover
+    try:
+        from v4l2 import V4L2_CID_MPEG_VIDEO_BITRATE, VIDIOC_S_CTRL, v4l2_control
+    except Exception as _exc:
+        if CAMERA_AVAILABLE:
+            LOG.warning("No V4L2 control bindings (%s); live bitrate changes are unavailable", _exc)
+        V4L2_CONTROLS = False
+
 
 # ---------- Configuration ----------
+# (x, y, width, height), each a share (0..1] of the full sensor field of view
+Roi = Tuple[float, float, float, float]
+
+
 @dataclass(frozen=True)
 class RtspConfig:
     host: str                # e.g., "192.168.6.76"
     port: int = 8554
     path: str = "hqstream"
     tcp: bool = True
+    # "ffmpeg" (remux subprocess) or "native" (in-process RTP over TCP); the default for every
+    # entry point (PISECUREKIT_PUBLISHER, the supervisor's `publisher` key)
+    publisher: str = "ffmpeg"
 
     def url(self) -> str:
         # rtsp://HOST:PORT/PATH
@@ -60,17 +99,218 @@ class VideoConfig:
     frame_rate: int = 30
     bitrate: int = 4_000_000
     iperiod: int = 30  # keyframe interval
+    # picamera2 Quality preset ("very_low" .. "very_high"); it replaces `bitrate` with one scaled
+    # to size and frame rate. None encodes at `bitrate` (see bench_encoder.py for picking one).
+    quality: Optional[str] = "low"
     lores_enabled: bool = False
     lores_width: int = 640
     lores_height: int = 480
+    # Region of interest (x, y, width, height) as shares of the sensor field of view, e.g. a
+    # doorway. Cropped in the ISP (ScalerCrop); the encoded size and bitrate shrink with it.
+    roi: Optional[Roi] = None
+
+
+@dataclass(frozen=True)
+class SimulcastConfig:
+    # Second, low-quality H.264 stream encoded from the lores output (VideoConfig.lores_*)
+    enabled: bool = True
+    path: str = "lqstream"
+    bitrate: int = 500_000
+    iperiod: int = 60  # keyframe interval; longer GOPs pay off at low bitrates
+    cma_headroom_bytes: int = 24 << 20  # CMA left free for the ISP, stills and other clients
 
 
 @dataclass(frozen=True)
 class AppConfig:
     rtsp: RtspConfig
     video: VideoConfig = VideoConfig()
+    simulcast: SimulcastConfig = SimulcastConfig()  # lqstream alongside hqstream, when CMA allows
     preview_jpeg_path: Path = Path("/dev/shm/camera-tmp.jpg")
-    preview_interval_sec: float = 5.0
+    preview_interval_sec: float = 1.0
+    snapshots: SnapshotConfig = SnapshotConfig()  # sizes written next to preview_jpeg_path
+    stills_dir: Path = Path("/var/lib/pisecurekit/stills")  # POST /burst
+    recording: Optional[RecorderConfig] = None  # local segmented recording; None disables
+    timelapse: Optional[TimelapseConfig] = None  # append preview stills to daily MJPEG files; None disables
+    reconnect: ReconnectConfig = ReconnectConfig()  # hub-outage buffering and backfill
+    on_demand: Optional[OnDemandConfig] = None  # publish only while the hub asks (POST /publish); None: always
+    synthetic: Optional[SyntheticConfig] = None  # hardware-free frame source instead of the camera
+    trace_sample_every: int = 30  # latency-trace one frame in N; 0 disables
+    http_port: Optional[int] = 8080  # status endpoint; None disables
+    memory_log_interval_sec: float = 60.0  # 0 disables
+    camera_num: int = 0  # Picamera2 camera index on multi-camera boards
+    lease: LeaseConfig = LeaseConfig()  # exclusive camera ownership across restarts
+    bandwidth: Optional[BandwidthConfig] = None  # hub-assigned bitrate budget; None: fixed bitrate
+
+
+# Accepted range for live bitrate changes (the bcm2835 H.264 encoder tops out at 25 Mbps)
+MIN_BITRATE = 100_000
+MAX_BITRATE = 25_000_000
+# Upper bound on GET /snapshot.jpg?wait=N long-polls
+MAX_LONG_POLL_SEC = 30.0
+# Start-up time asked of systemd (EXTEND_TIMEOUT_USEC) per lease wait or configure attempt
+CONFIGURE_STEP_SEC = 30.0
+
+# (width, height, pixel_format, buffer_count, use_lores)
+Attempt = Tuple[int, int, str, int, bool]
+
+
+def configuration_ladder(video: VideoConfig, simulcast: bool = False) -> List[Attempt]:
+    """Increasingly lighter configurations to fall back through on DMA/CMA OOM."""
+    ladder: List[Attempt] = []
+    if simulcast:
+        # Full-size main plus lores first; everything below drops the LQ stream
+        ladder += [(video.width, video.height, video.format, 3, True),
+                   (video.width, video.height, video.format, 2, True)]
+    fallbacks: List[Attempt] = [
+        (1280, 720,       "YUV420", 3, False),
+        (1280, 720,       "YUV420", 2, False),
+        (1024, 576,       "YUV420", 2, False),
+        (640,  480,       "YUV420", 2, False),
+    ]
+    # Only sizes below the first rung are lighter (a ROI can make the first rung the smallest);
+    # failing that, the first size with fewer buffers
+    area = video.width * video.height
+    fallbacks = [rung for rung in fallbacks if rung[0] * rung[1] < area] or [
+        (video.width, video.height, video.format, 2, False)]
+    ladder += [(video.width, video.height, video.format, 3, video.lores_enabled)] + fallbacks
+    return list(dict.fromkeys(ladder))
+
+
+def attempt_cma_bytes(cfg: AppConfig, attempt: Attempt) -> int:
+    """Estimated CMA footprint of a rung: camera buffers plus the encoder(s) it will run."""
+    w, h, fmt, buffers, use_lores = attempt
+    lores = (cfg.video.lores_width, cfg.video.lores_height) if use_lores else None
+    total = memory_budget.estimate_buffer_bytes(w, h, fmt, buffers, lores) + memory_budget.encoder_buffer_bytes(w, h)
+    if lores is not None and cfg.simulcast.enabled:
+        total += memory_budget.encoder_buffer_bytes(*lores)
+    return total
+
+
+def burst_frame_limit(cfg: AppConfig, mem: memory_budget.MemorySnapshot) -> int:
+    """
+    Burst frames that may wait to be saved: snapshots.burst_max_frames, or fewer if their YUV
+    copies would take more than snapshots.burst_memory_share of the available memory.
+    """
+    limit = cfg.snapshots.burst_max_frames
+    if not mem.mem_available:
+        return limit  # MemAvailable not reported
+    if cfg.synthetic is not None:
+        w, h = cfg.synthetic.width, cfg.synthetic.height
+    else:
+        video = roi_video(cfg.video)
+        w, h = video.width, video.height
+    fits = int(mem.mem_available * cfg.snapshots.burst_memory_share) // memory_budget.frame_bytes(w, h, "YUV420")
+    return max(1, min(limit, fits))
+
+
+def fitting_ladder(cfg: AppConfig, mem: memory_budget.MemorySnapshot) -> List[Attempt]:
+    """
+    configuration_ladder without the lores (simulcast) rungs that would not fit the free CMA.
+    Main-only rungs are left to configure() to reject, as before.
+    """
+    ladder = configuration_ladder(cfg.video, cfg.simulcast.enabled)
+    if not mem.cma_total:
+        return ladder  # CMA not reported (not a Pi): let configure() decide
+    budget = mem.cma_free - cfg.simulcast.cma_headroom_bytes
+    fits: List[Attempt] = []
+    for attempt in ladder:
+        need = attempt_cma_bytes(cfg, attempt)
+        if attempt[4] and need > budget:
+            LOG.info("Skipping %dx%d (buffers=%d) with lores: needs ~%.1fMB CMA, %.1fMB available",
+                     attempt[0], attempt[1], attempt[3], need / 1e6, budget / 1e6)
+            continue
+        fits.append(attempt)
+    return fits
+
+
+# ---------- Region of interest ----------
+def parse_roi(value: Any) -> Optional[Roi]:
+    """ROI from "x,y,w,h" or a 4-sequence of field-of-view shares; None or "" is the full view."""
+    if value is None or value == "":
+        return None
+    parts = value.split(",") if isinstance(value, str) else list(value)
+    if len(parts) != 4:
+        raise ValueError("roi needs four values: x, y, width, height")
+    x, y, w, h = (float(p) for p in parts)
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 and 0 < h <= 1) or x + w > 1.000001 or y + h > 1.000001:
+        raise ValueError(f"roi {value!r} is not inside the field of view")
+    return (x, y, w, h)
+
+
+def roi_video(video: VideoConfig) -> VideoConfig:
+    """
+    What is actually encoded for `video.roi`: size and bitrate scaled down with the region, so
+    the pixel density stays as configured and only the region's pixels are processed and sent.
+    """
+    if video.roi is None:
+        return video
+    _, _, rw, rh = video.roi
+    width = max(int(video.width * rw) // 32 * 32, 64)
+    height = max(int(video.height * rh) // 2 * 2, 64)
+    share = width * height / (video.width * video.height)
+    return replace(video, width=width, height=height,
+                   bitrate=max(MIN_BITRATE, int(video.bitrate * share)),
+                   lores_width=min(video.lores_width, width), lores_height=min(video.lores_height, height))
+
+
+def scaler_crop(roi: Optional[Roi], full: Tuple[int, int, int, int], aspect: float) -> Tuple[int, int, int, int]:
+    """
+    ScalerCrop rectangle (x, y, width, height in sensor pixels) for `roi` of the `full` crop:
+    widened about its centre to the output aspect ratio, which the ISP would otherwise stretch
+    to, and shifted to stay on the sensor.
+    """
+    fx, fy, fw, fh = full
+    x, y, w, h = roi if roi is not None else (0.0, 0.0, 1.0, 1.0)
+    cx, cy = fx + (x + w / 2) * fw, fy + (y + h / 2) * fh
+    cw, ch = w * fw, h * fh
+    if cw / ch < aspect:
+        cw = ch * aspect
+    else:
+        ch = cw / aspect
+    if cw > fw:
+        cw, ch = fw, fw / aspect
+    if ch > fh:
+        cw, ch = fh * aspect, fh
+    left = min(max(cx - cw / 2, fx), fx + fw - cw)
+    top = min(max(cy - ch / 2, fy), fy + fh - ch)
+    return (round(left), round(top), round(cw), round(ch))
+
+
+# ---------- Encoder outputs ----------
+def rtsp_sink(cfg: RtspConfig, path: str, tracer: Optional[LatencyTracer] = None):
+    rtsp = replace(cfg, path=path)
+    if rtsp.publisher == "native" or not CAMERA_AVAILABLE:
+        # Always TCP-interleaved; saves the ffmpeg process and its pipe copies
+        return RtspOutput(rtsp.host, rtsp.port, rtsp.path, tracer=tracer)
+    return FfmpegOutput(f"{rtsp.ffmpeg_flags()} {rtsp.url()}", audio=False)
+
+
+def build_outputs(cfg: AppConfig, tracer: Optional[LatencyTracer] = None
+                  ) -> Tuple[ResilientPublisher, Optional[SegmentedRecorder], List[Any]]:
+    """
+    Publisher (rebuilding its RTSP sink whenever the hub drops us), optional local recorder, and
+    the encoder output list holding them (bracketed by latency taps when tracing).
+    """
+    def sink(path: str):
+        # Backfill uploads carry old timestamps; only the live stream is traced
+        return rtsp_sink(cfg.rtsp, path, tracer if path == cfg.rtsp.path else None)
+
+    publisher = ResilientPublisher(sink, cfg.rtsp.path, cfg.reconnect, cfg.on_demand)
+    recorder = SegmentedRecorder(cfg.recording) if cfg.recording is not None else None
+    outputs: List[Any] = [o for o in (publisher, recorder) if o is not None]
+    if tracer is not None:
+        outputs = traced_outputs(outputs, tracer)
+    return publisher, recorder, outputs
+
+
+def build_lq_publisher(cfg: AppConfig) -> ResilientPublisher:
+    """Publisher for the simulcast LQ stream; untraced and never recorded locally."""
+    reconnect = cfg.reconnect
+    if reconnect.spill_dir is not None:
+        reconnect = replace(reconnect, spill_dir=reconnect.spill_dir / cfg.simulcast.path)
+    # The HQ keepalive already tells the hub the camera is up; LQ has nothing to add while idle
+    on_demand = replace(cfg.on_demand, idle=OFF) if cfg.on_demand is not None else None
+    return ResilientPublisher(lambda path: rtsp_sink(cfg.rtsp, path), cfg.simulcast.path, reconnect, on_demand)
 
 
 # ---------- Camera Abstraction ----------
@@ -81,6 +321,16 @@ class CameraDriver(Protocol):
     def start(self) -> None: ...
     def stop(self) -> None: ...
     def capture_still(self, destination: Path) -> None: ...
+    def grab_frame(self) -> Optional[snapshots.Grab]: ...
+    def grab_burst(self, count: int) -> List[snapshots.Grab]: ...  # consecutive frames; [] if unsupported
+    def status(self) -> Dict[str, Any]: ...
+    # Live controls; NotImplementedError where a driver cannot do it
+    def set_bitrate(self, bitrate: int) -> None: ...
+    def request_keyframe(self) -> None: ...
+    def set_lores(self, enabled: bool) -> None: ...
+    def set_roi(self, roi: Optional[Roi]) -> None: ...
+    # resilient_publisher.LIVE / KEEPALIVE / OFF, of the HQ publisher or the simulcast one
+    def set_publishing(self, mode: str, simulcast: bool = False) -> None: ...
 
 
 class NullCamera(CameraDriver):
@@ -104,44 +354,93 @@ class NullCamera(CameraDriver):
         destination.write_bytes(b"\xFF\xD8\xFF\xD9")  # minimal JPEG SOI/EOI
         LOG.debug("[NullCamera] wrote placeholder still to %s", destination)
 
+    def grab_frame(self) -> Optional[snapshots.Grab]:
+        return None  # nothing to encode; the service falls back to capture_still
+
+    def grab_burst(self, count: int) -> List[snapshots.Grab]:
+        return []
+
+    def set_bitrate(self, bitrate: int) -> None:
+        LOG.info("[NullCamera] bitrate -> %d", bitrate)
+
+    def request_keyframe(self) -> None:
+        LOG.info("[NullCamera] keyframe requested")
+
+    def set_lores(self, enabled: bool) -> None:
+        LOG.info("[NullCamera] lores -> %s", enabled)
+
+    def set_roi(self, roi: Optional[Roi]) -> None:
+        LOG.info("[NullCamera] roi -> %s", roi)
+
+    def set_publishing(self, mode: str, simulcast: bool = False) -> None:
+        LOG.info("[NullCamera] %s publishing -> %s", "simulcast" if simulcast else "main", mode)
+
+    def status(self) -> Dict[str, Any]:
+        return {"driver": "null", "running": self._running, "fps": self._fps}
+
 
 class Picamera2Driver(CameraDriver):
     """Real Picamera2-backed implementation."""
-    def __init__(self, cfg: AppConfig) -> None:
+    def __init__(self, cfg: AppConfig, tracer: Optional[LatencyTracer] = None,
+                 notifier: Optional[Notifier] = None) -> None:
         if not CAMERA_AVAILABLE:
             raise RuntimeError("Picamera2 not available on this system.")
-        self._cfg = cfg
-        self._picam2 = Picamera2()
+        # With a ROI the ladder starts at the region's size (see roi_video), not the full frame
+        self._cfg = replace(cfg, video=roi_video(cfg.video))
+        # Lease waits and ladder fallbacks can outlast WatchdogSec/TimeoutStartSec under systemd
+        self._notifier = notifier or Notifier()
+        self._notifier.extend_timeout(CONFIGURE_STEP_SEC)
+        # Take the camera from any lingering previous instance before libcamera tries to open it
+        self._lease = CameraLease(cfg.camera_num, cfg.lease).acquire()
+        baseline = memory_budget.snapshot()
+        self._picam2 = Picamera2(cfg.camera_num)
         self._encoder = H264Encoder(
             bitrate=self._cfg.video.bitrate,
             repeat=True,
             iperiod=self._cfg.video.iperiod
         )
-        self._output = FfmpegOutput(
-            f"{self._cfg.rtsp.ffmpeg_flags()} {self._cfg.rtsp.url()}",
-            audio=False
-        )
+        self._output, self._recorder, self._outputs = build_outputs(self._cfg, tracer)
+        if tracer is not None:
+            tracer.time_base = lambda: self._encoder.firsttimestamp
+        # Simulcast: a second hardware encoder on the lores stream, with its own bitrate and GOP
+        self._lq_encoder = H264Encoder(bitrate=cfg.simulcast.bitrate, repeat=True, iperiod=cfg.simulcast.iperiod)
+        self._lq_output = build_lq_publisher(cfg) if cfg.simulcast.enabled else None
+        # A (re)connected publisher asks for an IDR instead of waiting out the GOP
+        self._output.keyframe_requester = self.request_keyframe
+        if self._lq_output is not None:
+            self._lq_output.keyframe_requester = self._lq_encoder.force_key_frame
+        self._lq_error: Optional[str] = None
         self._started = False
+        self._active: Optional[Attempt] = None
+        self._bitrate_override: Optional[int] = None
+        self._roi = cfg.video.roi
+        self._crop: Optional[Tuple[int, int, int, int]] = None  # ScalerCrop in sensor pixels
 
         # Attempt a series of increasingly lighter configurations to avoid DMA/CMA OOM
-        attempts = [
-            # (width, height, pixel_format, buffer_count, use_lores)
-            (self._cfg.video.width, self._cfg.video.height, self._cfg.video.format, 3, self._cfg.video.lores_enabled),
-            (1280, 720,       "YUV420", 3, False),
-            (1280, 720,       "YUV420", 2, False),
-            (1024, 576,       "YUV420", 2, False),
-            (640,  480,       "YUV420", 2, False),
-        ]
-
-        configured = False
-        for (w, h, fmt, buffers, use_lores) in attempts:
+        for (w, h, fmt, buffers, use_lores) in fitting_ladder(self._cfg, baseline):
+            self._notifier.extend_timeout(CONFIGURE_STEP_SEC)
             if self._try_configure(w, h, fmt, buffers, use_lores):
-                LOG.info("Configured camera: %dx%d %s (buffers=%d, lores=%s)", w, h, fmt, buffers, use_lores)
-                configured = True
+                self._active = (w, h, fmt, buffers, use_lores)
+                cost = memory_budget.delta(baseline, memory_budget.snapshot())
+                LOG.info("Configured camera: %dx%d %s (buffers=%d, lores=%s); est. buffers %.1fMB, "
+                         "CMA +%.1fMB, RSS +%.1fMB", w, h, fmt, buffers, use_lores,
+                         self._buffer_estimate() / 1e6, cost["cma_used"] / 1e6, cost["rss"] / 1e6)
                 break
 
-        if not configured:
+        if self._active is None:
             raise RuntimeError("Failed to configure Picamera2 after multiple attempts; likely CMA/DMA memory is insufficient.")
+        if cfg.simulcast.enabled and not self._simulcast:
+            LOG.warning("Simulcast disabled: no configuration with a lores stream fits; publishing %s only",
+                        cfg.rtsp.path)
+
+    @property
+    def _simulcast(self) -> bool:
+        return self._lq_output is not None and self._active[4] and self._lq_error is None
+
+    def _buffer_estimate(self) -> int:
+        w, h, fmt, buffers, use_lores = self._active
+        lores = (self._cfg.video.lores_width, self._cfg.video.lores_height) if use_lores else None
+        return memory_budget.estimate_buffer_bytes(w, h, fmt, buffers, lores)
 
     def _try_configure(self, main_w: int, main_h: int, main_fmt: str, buffer_count: int, use_lores: bool) -> bool:
         try:
@@ -155,6 +454,7 @@ class Picamera2Driver(CameraDriver):
             video_conf["buffer_count"] = buffer_count
             self._picam2.align_configuration(video_conf)
             self._picam2.configure(video_conf)
+            self._set_crop(self._roi, main_w / main_h)
             return True
         except Exception as e:
             LOG.warning("Configure attempt failed for %dx%d %s (buffers=%d, lores=%s): %s", main_w, main_h, main_fmt, buffer_count, use_lores, e)
@@ -164,8 +464,26 @@ class Picamera2Driver(CameraDriver):
         if self._started:
             return
         LOG.info("Starting Picamera2 RTSP to %s", self._cfg.rtsp.url())
-        # Quality.LOW here reduces encoder load for stability; adjust if desired
-        self._picam2.start_recording(self._encoder, self._output, quality=Quality.LOW)
+        # A quality preset overrides the encoder bitrate, so skip it once one was set over the API
+        quality = None
+        if self._cfg.video.quality is not None and self._bitrate_override is None:
+            quality = Quality[self._cfg.video.quality.upper()]
+        self._lq_error = None  # retry the LQ encoder on every start
+        if not self._simulcast:
+            self._picam2.start_recording(self._encoder, self._outputs, quality=quality)
+            self._started = True
+            return
+        self._picam2.start_encoder(self._encoder, self._outputs, quality=quality, name="main")
+        try:
+            # No quality preset: it would override the LQ bitrate
+            self._picam2.start_encoder(self._lq_encoder, [self._lq_output], name="lores")
+        except Exception as e:
+            # Typically ENOMEM allocating encoder buffers: keep HQ rather than fail the service
+            self._lq_error = str(e)
+            LOG.warning("LQ encoder failed to start (%s); continuing with %s only", e, self._cfg.rtsp.path)
+            if self._lq_encoder in self._picam2.encoders:
+                self._picam2.stop_encoder(self._lq_encoder)
+        self._picam2.start()
         self._started = True
 
     def stop(self) -> None:
@@ -184,17 +502,164 @@ class Picamera2Driver(CameraDriver):
         finally:
             req.release()
 
+    def grab_frame(self) -> Optional[snapshots.Grab]:
+        """Copy the YUV planes out of one request and release it; encoding happens elsewhere."""
+        w, h, fmt, _, use_lores = self._active
+        if fmt != "YUV420":
+            return None
+        req = self._picam2.capture_request()
+        try:
+            ts = time.time()
+            grab = [snapshots.yuv420_planes(req.make_array("main"), w, h, ts)]
+            if use_lores:
+                lw, lh = self._cfg.video.lores_width, self._cfg.video.lores_height
+                grab.append(snapshots.yuv420_planes(req.make_array("lores"), lw, lh, ts))
+        finally:
+            req.release()
+        return grab
+
+    def grab_burst(self, count: int) -> List[snapshots.Grab]:
+        """
+        Every capture_request is the next completed frame of the running video configuration, so
+        this runs at the sensor frame rate with no mode switch; the encoders never miss a frame.
+        """
+        grabs: List[snapshots.Grab] = []
+        for _ in range(count):
+            grab = self.grab_frame()
+            if grab is None:
+                break
+            grabs.append(grab)
+        return grabs
+
+    def set_bitrate(self, bitrate: int) -> None:
+        """Takes effect on the running encoder (V4L2 control, no restart) and on later starts."""
+        vd = getattr(self._encoder, "vd", None)
+        running = self._started and vd is not None and not vd.closed
+        if running and not V4L2_CONTROLS:
+            raise NotImplementedError("live bitrate changes need the videodev2 (or v4l2) module")
+        self._bitrate_override = bitrate
+        self._encoder.bitrate = bitrate
+        if running:
+            ctrl = v4l2_control()
+            ctrl.id = V4L2_CID_MPEG_VIDEO_BITRATE
+            ctrl.value = bitrate
+            fcntl.ioctl(vd, VIDIOC_S_CTRL, ctrl)
+        LOG.info("Encoder bitrate -> %d", bitrate)
+
+    def request_keyframe(self) -> None:
+        self._encoder.force_key_frame()
+
+    def set_lores(self, enabled: bool) -> None:
+        """Adding/removing a stream needs a reconfigure: the encoder restarts (~1s gap)."""
+        w, h, fmt, buffers, use_lores = self._active
+        if enabled == use_lores:
+            return
+        was_started = self._started
+        self.stop()
+        try:
+            if self._try_configure(w, h, fmt, buffers, enabled):
+                self._active = (w, h, fmt, buffers, enabled)
+            elif not self._try_configure(w, h, fmt, buffers, use_lores):
+                raise RuntimeError("Reconfigure failed and the previous configuration could not be restored")
+            else:
+                raise RuntimeError(f"Camera cannot run with lores={enabled} at {w}x{h} (buffers={buffers})")
+        finally:
+            if was_started:
+                self.start()
+
+    def set_roi(self, roi: Optional[Roi]) -> None:
+        """Pan/zoom the running stream (ScalerCrop, no restart); the encoded size stays as configured."""
+        w, h = self._active[:2]
+        self._set_crop(roi, w / h)
+        self._roi = roi
+        LOG.info("ROI -> %s (sensor crop %s)", roi, self._crop)
+
+    def set_publishing(self, mode: str, simulcast: bool = False) -> None:
+        """Only the publisher switches; the encoders and the local recorder keep running."""
+        if not simulcast:
+            self._output.set_mode(mode)
+        elif self._simulcast:
+            self._lq_output.set_mode(mode)
+        else:
+            raise NotImplementedError(f"simulcast is not active: {self._lq_error or 'disabled'}")
+
+    def _set_crop(self, roi: Optional[Roi], aspect: float) -> None:
+        # Largest crop of the configured sensor mode; camera_controls holds (min, max, default)
+        full = self._picam2.camera_controls["ScalerCrop"][1]
+        crop = scaler_crop(roi, full, aspect)
+        self._picam2.set_controls({"ScalerCrop": crop})
+        self._crop = crop
+
+    def status(self) -> Dict[str, Any]:
+        w, h, fmt, buffers, use_lores = self._active
+        publisher = self._output.stats()
+        out: Dict[str, Any] = {
+            "driver": "picamera2",
+            "running": self._started,
+            "bitrate": self._encoder.bitrate,
+            "config": {"width": w, "height": h, "format": fmt, "buffer_count": buffers, "lores": use_lores},
+            "buffer_bytes_estimate": self._buffer_estimate(),
+            "roi": {"region": self._roi, "crop": self._crop},
+            "publisher": publisher,
+            "bytes": publisher["bytes_in"],
+            "simulcast": {"active": self._simulcast, "error": self._lq_error},
+        }
+        if self._simulcast:
+            out["simulcast"]["bitrate"] = self._lq_encoder.bitrate
+            out["simulcast"]["publisher"] = self._lq_output.stats()
+        if self._recorder is not None:
+            out["recorder"] = self._recorder.stats()
+        return out
+
 
 # ---------- Orchestration ----------
+class Usage(NamedTuple):
+    monotonic: float
+    cpu_sec: float      # process CPU time, all threads (publisher, snapshots, encoder I/O)
+    encoded_bytes: int  # H.264 bytes out of the encoder so far
+
+
+def _usage_rates(start: Usage, end: Usage) -> Dict[str, float]:
+    """Encoded bitrate and CPU load between two usage samples."""
+    elapsed = end.monotonic - start.monotonic
+    if elapsed <= 0:
+        return {"seconds": 0.0, "bitrate": 0.0, "cpu_percent": 0.0}
+    return {"seconds": round(elapsed, 1),
+            "bitrate": round(max(end.encoded_bytes - start.encoded_bytes, 0) * 8 / elapsed),
+            "cpu_percent": round(100 * (end.cpu_sec - start.cpu_sec) / elapsed, 1)}
+
+
 class StreamService:
     """
     Owns a CameraDriver lifecycle and optional periodic preview capture.
     Use as a context manager for guaranteed cleanup.
     """
-    def __init__(self, camera: CameraDriver, cfg: AppConfig) -> None:
+    def __init__(self, camera: CameraDriver, cfg: AppConfig, tracer: Optional[LatencyTracer] = None,
+                 notifier: Optional[Notifier] = None) -> None:
         self._camera = camera
         self._cfg = cfg
+        self.tracer = tracer
+        self._notifier = notifier or Notifier()
         self._running = False
+        self._streaming = False
+        self._control = threading.Lock()  # serialises camera start/stop/reconfigure
+        self._snapshots: Optional[SnapshotPipeline] = None
+        self._bursts: Optional[BurstSaver] = None
+        self.burst_limit = cfg.snapshots.burst_max_frames  # frames per burst and waiting; set by start()
+        self.store = SnapshotStore()  # latest JPEG per size, served by GET /snapshot.jpg
+        self._timelapse: Optional[TimelapseWriter] = None
+        self._timelapse_seq = 0
+        self._video = roi_video(cfg.video)  # what is encoded: the bitrate ceiling for budgets
+        self._roi = cfg.video.roi
+        self._roi_change: Optional[Dict[str, Any]] = None
+        self._usage_mark = self._usage()
+        # Publishing mode per mediamtx path: hqstream, and the simulcast path if there is one
+        self._publishing = {cfg.rtsp.path: LIVE if cfg.on_demand is None else cfg.on_demand.idle}
+        if cfg.simulcast.enabled:
+            self._publishing[cfg.simulcast.path] = LIVE if cfg.on_demand is None else OFF
+        # POST /publish: holder -> lease end (None: until released). The hub's holders are path names
+        self._publish_holders: Dict[str, Optional[float]] = {}
+        self._publish_timer: Optional[threading.Timer] = None  # fires when the first lease ends
 
     def __enter__(self) -> "StreamService":
         self.start()
@@ -207,14 +672,238 @@ class StreamService:
         if self._running:
             return
         self._camera.start()
+        self._streaming = True
+        if snapshots.JPEG_AVAILABLE:
+            self._snapshots = SnapshotPipeline(self._cfg.snapshots, self._cfg.preview_jpeg_path,
+                                               store=self.store)
+            self.burst_limit = burst_frame_limit(self._cfg, memory_budget.snapshot())
+            if self.burst_limit < self._cfg.snapshots.burst_max_frames:
+                LOG.info("Bursts limited to %d frames by available memory", self.burst_limit)
+            self._bursts = BurstSaver(self._cfg.stills_dir, self._cfg.snapshots.burst_quality,
+                                      self._cfg.snapshots.workers, self.burst_limit)
+        else:
+            LOG.warning("No JPEG encoder (simplejpeg/Pillow); previews are captured inline")
+        if self._cfg.timelapse is not None:
+            self._timelapse = TimelapseWriter(self._cfg.timelapse)
+        self._usage_mark = self._usage()
         self._running = True
 
     def stop(self) -> None:
         if not self._running:
             return
-        self._camera.stop()
+        with self._control:
+            if self._publish_timer is not None:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+            if self._streaming:
+                self._camera.stop()
+                self._streaming = False
+        if self._snapshots is not None:
+            self._snapshots.close()
+            self._snapshots = None
+        if self._bursts is not None:
+            self._bursts.close()
+            self._bursts = None
+        if self._timelapse is not None:
+            self._timelapse.close()
+            self._timelapse = None
         self._running = False
 
+    # -- live control (called from the HTTP API thread pool) --
+    def start_stream(self) -> None:
+        with self._control:
+            if self._running and not self._streaming:
+                self._camera.start()
+                self._streaming = True
+
+    def stop_stream(self) -> None:
+        """Stop the camera and encoder but keep the service (and its API) up."""
+        with self._control:
+            if self._streaming:
+                self._camera.stop()
+                self._streaming = False
+
+    def snapshot(self) -> Dict[str, str]:
+        with self._control:
+            if not self._streaming:
+                raise RuntimeError("stream is stopped")
+            self._preview()
+        paths = self._snapshots.paths if self._snapshots is not None else {"full": self._cfg.preview_jpeg_path}
+        return {name: str(path) for name, path in paths.items()}
+
+    def burst(self, count: int) -> Dict[str, Any]:
+        """
+        `count` consecutive frames of the running stream as full-size stills. Only the grabs hold
+        the control lock; encoding and writing happen on the burst workers, and the streams never stop.
+        The frames' slots are reserved before grabbing, so a burst that would not fit is refused
+        without copying anything.
+        """
+        stem = time.strftime("burst_%Y%m%d_%H%M%S") + f"_{int(time.time() * 1000) % 1000:03d}"
+        with self._control:
+            if not self._streaming:
+                raise RuntimeError("stream is stopped")
+            t0 = time.monotonic()
+            grabs: List[snapshots.Grab] = []
+            if self._bursts is not None:
+                self._bursts.reserve(count)
+                try:
+                    grabs = self._camera.grab_burst(count)
+                finally:
+                    self._bursts.release(count - len(grabs))
+            grab_sec = time.monotonic() - t0
+            if grabs:
+                paths = self._bursts.save(grabs, stem)
+            else:
+                # No YUV frames or no JPEG encoder: the driver's stills, one at a time
+                self._cfg.stills_dir.mkdir(parents=True, exist_ok=True)
+                paths = [self._cfg.stills_dir / f"{stem}-{i:02d}.jpg" for i in range(count)]
+                for path in paths:
+                    self._camera.capture_still(path)
+                grab_sec = time.monotonic() - t0
+        return {"paths": [str(p) for p in paths], "grab_sec": round(grab_sec, 3)}
+
+    def set_bitrate(self, bitrate: int) -> None:
+        with self._control:
+            self._camera.set_bitrate(bitrate)
+
+    def request_keyframe(self) -> None:
+        self._camera.request_keyframe()
+
+    def set_lores(self, enabled: bool) -> None:
+        with self._control:
+            self._camera.set_lores(enabled)
+
+    def set_roi(self, roi: Optional[Roi]) -> None:
+        """Move the crop; status()["roi"] then compares bitrate and CPU before and after."""
+        with self._control:
+            now = self._usage()
+            self._camera.set_roi(roi)
+            self._roi_change = {"from": self._roi, "to": roi, "at": time.time(),
+                                "before": _usage_rates(self._usage_mark, now)}
+            self._roi, self._usage_mark = roi, now
+
+    # -- on-demand publishing (driven by the hub's runOnDemand hooks) --
+    def set_publishing(self, enabled: bool, lease_sec: Optional[float] = None,
+                       holder: str = "hub") -> Dict[str, Any]:
+        """
+        Publish a stream while any holder wants it, otherwise fall back to the idle mode: keepalive
+        or local recording only (the simulcast stream is simply off). The hub holds one lease per
+        on-demand path, named after it; the simulcast path's holder switches only the LQ stream,
+        any other holder the HQ one. A lease ends on its own unless renewed, so a hub that dies
+        mid-session cannot leave the camera publishing forever.
+        """
+        with self._control:
+            holders = dict(self._publish_holders)
+            if enabled:
+                self._publish_holders[holder] = time.time() + lease_sec if lease_sec is not None else None
+            else:
+                self._publish_holders.pop(holder, None)
+            try:
+                self._update_publishing()
+            except RuntimeError:
+                self._publish_holders = holders
+                raise
+        return self.publishing_status()
+
+    def _idle_mode(self, path: str) -> str:
+        if self._cfg.on_demand is None:
+            return LIVE  # always-on: leases cannot take a stream off the air
+        return self._cfg.on_demand.idle if path == self._cfg.rtsp.path else OFF
+
+    def _holder_path(self, holder: str) -> str:
+        return holder if holder in self._publishing else self._cfg.rtsp.path
+
+    def _update_publishing(self) -> None:
+        """Under the control lock: drop ended leases, switch the paths' modes, re-arm the expiry timer."""
+        now = time.time()
+        self._publish_holders = {h: end for h, end in self._publish_holders.items() if end is None or end > now}
+        wanted = {self._holder_path(h) for h in self._publish_holders}
+        for path, current in self._publishing.items():
+            mode = LIVE if path in wanted else self._idle_mode(path)
+            if mode != current:
+                self._camera.set_publishing(mode, simulcast=path != self._cfg.rtsp.path)
+                self._publishing[path] = mode
+        if self._publish_timer is not None:
+            self._publish_timer.cancel()
+            self._publish_timer = None
+        ends = [end for end in self._publish_holders.values() if end is not None]
+        if ends:
+            self._publish_timer = threading.Timer(min(ends) - now, self._publish_lease_expired)
+            self._publish_timer.daemon = True
+            self._publish_timer.start()
+
+    def _publish_lease_expired(self) -> None:
+        with self._control:
+            try:
+                self._update_publishing()
+            except RuntimeError as e:
+                LOG.warning("Cannot switch publishing after a lease ended: %s", e)
+
+    def publishing_status(self) -> Dict[str, Any]:
+        now = time.time()
+        holders = dict(self._publish_holders)
+        return {"mode": self._publishing[self._cfg.rtsp.path], "paths": dict(self._publishing),
+                "on_demand": self._cfg.on_demand is not None,
+                "holders": {h: round(max(end - now, 0.0), 1) if end is not None else None
+                            for h, end in holders.items()}}
+
+    def _usage(self) -> Usage:
+        return Usage(time.monotonic(), time.process_time(), int(self._camera.status().get("bytes", 0)))
+
+    def roi_status(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"region": self._roi}
+        if self._roi_change is not None:
+            out["change"] = {**self._roi_change, "after": _usage_rates(self._usage_mark, self._usage())}
+        return out
+
+    # -- hub bandwidth budget --
+    def _lq_bitrate(self) -> int:
+        simulcast = self._camera.status().get("simulcast") or {}
+        return int(simulcast.get("bitrate", 0)) if simulcast.get("active") else 0
+
+    def bitrate_demand(self) -> int:
+        """What this camera would send unconstrained: configured HQ plus the LQ stream if running."""
+        return self._video.bitrate + self._lq_bitrate()
+
+    def apply_budget(self, budget: int) -> None:
+        """Fit HQ into the hub's budget after the LQ stream; never above the configured bitrate."""
+        hq = max(MIN_BITRATE, min(self._video.bitrate, budget - self._lq_bitrate()))
+        try:
+            self.set_bitrate(hq)
+        except NotImplementedError as e:
+            LOG.warning("Cannot apply bandwidth budget: %s", e)
+
+    def publisher_stats(self) -> Dict[str, Any]:
+        camera = self._camera.status()
+        return camera.get("publisher") or {}
+
+    def _timelapse_tick(self) -> None:
+        """Hand the newest already-encoded still to the time-lapse writer (no extra encode)."""
+        jpeg = self.store.get(self._cfg.timelapse.size)
+        if jpeg is not None and jpeg.seq != self._timelapse_seq:
+            self._timelapse_seq = jpeg.seq
+            self._timelapse.offer(jpeg.data, jpeg.timestamp or time.time())
+
+    def _preview(self) -> None:
+        grab = self._camera.grab_frame() if self._snapshots is not None else None
+        if grab is None:
+            self._camera.capture_still(self._cfg.preview_jpeg_path)
+        else:
+            self._snapshots.submit(grab)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "streaming": self._streaming,
+            "camera": self._camera.status(),
+            "roi": self.roi_status(),
+            "publishing": self.publishing_status(),
+            "snapshots": self._snapshots.stats() if self._snapshots is not None else None,
+            "bursts": self._bursts.stats() if self._bursts is not None else None,
+            "timelapse": self._timelapse.stats() if self._timelapse is not None else None,
+            "memory": memory_budget.snapshot().as_dict(),
+        }
+
     def run_forever(self) -> None:
         """
         Blocks; periodically captures a still for preview.
@@ -224,28 +913,391 @@ class StreamService:
                  self._cfg.preview_interval_sec, self._cfg.preview_jpeg_path)
 
         next_tick = time.monotonic()
+        next_memory_log = next_tick
+        next_watchdog = next_tick
+        next_timelapse = next_tick
+        watchdog_every = self._notifier.watchdog_interval_sec
         try:
             while self._running:
                 now = time.monotonic()
-                if now >= next_tick:
+                if now >= next_tick and self._streaming:
                     try:
-                        self._camera.capture_still(self._cfg.preview_jpeg_path)
+                        with self._control:
+                            self._preview()
                     except Exception as e:
                         LOG.exception("Still capture failed: %s", e)
                     next_tick = now + self._cfg.preview_interval_sec
+                if self._timelapse is not None and now >= next_timelapse:
+                    self._timelapse_tick()
+                    next_timelapse = now + self._cfg.timelapse.interval_sec
+                if self._cfg.memory_log_interval_sec > 0 and now >= next_memory_log:
+                    LOG.info("Memory: %s", memory_budget.snapshot().describe())
+                    next_memory_log = now + self._cfg.memory_log_interval_sec
+                if watchdog_every and now >= next_watchdog:
+                    # Pinged from this loop so a wedged loop lets systemd restart us
+                    self._notifier.watchdog()
+                    next_watchdog = now + watchdog_every
                 time.sleep(0.05)  # small sleep to avoid tight loop
         finally:
             LOG.info("StreamService loop exiting")
 
 
 # ---------- Wiring / Bootstrap ----------
-def build_camera(cfg: AppConfig) -> CameraDriver:
+def build_camera(cfg: AppConfig, tracer: Optional[LatencyTracer] = None,
+                 mem: Optional[memory_budget.MemorySnapshot] = None,
+                 notifier: Optional[Notifier] = None) -> CameraDriver:
+    if cfg.synthetic is not None:
+        publisher, recorder, outputs = build_outputs(cfg, tracer)
+        # Same CMA decision as the real driver, minus configure(): simulcast if the first rung has lores
+        simulcast = cfg.simulcast.enabled and fitting_ladder(cfg, mem or memory_budget.snapshot())[0][4]
+        lq_publisher = build_lq_publisher(cfg) if simulcast else None
+        camera = SyntheticCamera(cfg.synthetic, outputs,
+                                 lq_outputs=[lq_publisher] if lq_publisher is not None else None,
+                                 lq_bitrate=cfg.simulcast.bitrate, lq_iperiod=cfg.simulcast.iperiod,
+                                 publisher=publisher, lq_publisher=lq_publisher, recorder=recorder)
+        if tracer is not None:
+            tracer.time_base = camera.time_base_us
+        return camera
     if CAMERA_AVAILABLE:
-        return Picamera2Driver(cfg)
+        return Picamera2Driver(cfg, tracer, notifier)
     LOG.warning("Using NullCamera (no hardware).")
     return NullCamera(fps=cfg.video.frame_rate)
 
 
+def benchmark_memory(cfg: AppConfig, settle_sec: float = 3.0) -> List[Dict[str, Any]]:
+    """
+    Step through the configuration ladder on real hardware and measure each rung:
+    CMA/RSS after configure and after the encoder has run for `settle_sec`. With a ROI the
+    ladder is the one Picamera2Driver configures: sized to the region (see roi_video).
+    """
+    if not CAMERA_AVAILABLE:
+        raise RuntimeError("Memory benchmark needs Picamera2 and a camera.")
+    video = roi_video(cfg.video)
+    results: List[Dict[str, Any]] = []
+    lease = CameraLease(cfg.camera_num, cfg.lease).acquire()
+    picam2 = Picamera2(cfg.camera_num)
+    try:
+        for (w, h, fmt, buffers, use_lores) in configuration_ladder(video):
+            lores = (video.lores_width, video.lores_height) if use_lores else None
+            row: Dict[str, Any] = {
+                "width": w, "height": h, "format": fmt, "buffer_count": buffers, "lores": use_lores,
+                "estimate_bytes": memory_budget.estimate_buffer_bytes(w, h, fmt, buffers, lores),
+            }
+            before = memory_budget.snapshot()
+            try:
+                kwargs = {"main": {"size": (w, h), "format": fmt},
+                          "controls": {"FrameRate": video.frame_rate}}
+                if lores is not None:
+                    kwargs["lores"] = {"size": lores, "format": "YUV420"}
+                conf = picam2.create_video_configuration(**kwargs)
+                conf["buffer_count"] = buffers
+                picam2.align_configuration(conf)
+                picam2.configure(conf)
+                configured = memory_budget.snapshot()
+                picam2.start_recording(H264Encoder(bitrate=video.bitrate, iperiod=video.iperiod), Output())
+                time.sleep(settle_sec)
+                running = memory_budget.snapshot()
+                picam2.stop_recording()
+                row.update(ok=True,
+                           cma_configure=memory_budget.delta(before, configured)["cma_used"],
+                           cma_running=memory_budget.delta(before, running)["cma_used"],
+                           rss_running=running.rss)
+            except Exception as e:
+                row.update(ok=False, error=str(e))
+            LOG.info("Benchmark %s", row)
+            results.append(row)
+    finally:
+        picam2.close()
+        lease.release()
+    return results
+
+
+def _print_benchmark(rows: List[Dict[str, Any]]) -> None:
+    print(f"{'config':<28}{'estimate':>10}{'cma cfg':>10}{'cma run':>10}{'rss':>10}")
+    for r in rows:
+        name = f"{r['width']}x{r['height']} {r['format']} b={r['buffer_count']}{' +lores' if r['lores'] else ''}"
+        if not r["ok"]:
+            print(f"{name:<28}{r['estimate_bytes'] / 1e6:>9.1f}M  FAILED: {r['error']}")
+            continue
+        print(f"{name:<28}{r['estimate_bytes'] / 1e6:>9.1f}M{r['cma_configure'] / 1e6:>9.1f}M"
+              f"{r['cma_running'] / 1e6:>9.1f}M{r['rss_running'] / 1e6:>9.1f}M")
+
+
+def start_http(service: StreamService, cfg: AppConfig) -> Optional[HttpServer]:
+    if cfg.http_port is None:
+        return None
+    server = HttpServer(port=cfg.http_port)
+
+    async def status(_req):
+        return json_response(service.status())
+
+    async def latency(_req):
+        return json_response(service.tracer.summary() if service.tracer is not None else {})
+
+    async def metrics(_req):
+        text = service.tracer.prometheus() if service.tracer is not None else ""
+        return Response(body=text.encode(), content_type="text/plain; version=0.0.4")
+
+    # Camera calls block (start/stop take a while), so they run in the loop's thread pool
+    async def blocking(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def start(_req):
+        await blocking(service.start_stream)
+        return json_response({"streaming": True})
+
+    async def stop(_req):
+        await blocking(service.stop_stream)
+        return json_response({"streaming": False})
+
+    async def snapshot(_req):
+        try:
+            return json_response(await blocking(service.snapshot))
+        except RuntimeError as e:
+            return error_response(409, str(e))
+
+    async def burst(req):
+        count = int(req.json().get("count", 1))
+        limit = service.burst_limit
+        if not 1 <= count <= limit:
+            raise ValueError(f"count must be within 1..{limit}")
+        try:
+            return json_response(await blocking(service.burst, count))
+        except RuntimeError as e:  # stopped, or the previous bursts are still being saved
+            return error_response(409, str(e))
+
+    async def bitrate(req):
+        value = int(req.json()["bitrate"])
+        if not MIN_BITRATE <= value <= MAX_BITRATE:
+            raise ValueError(f"bitrate must be within {MIN_BITRATE}..{MAX_BITRATE}")
+        return await control({"bitrate": value}, service.set_bitrate, value)
+
+    async def keyframe(_req):
+        return await control({"keyframe": "requested"}, service.request_keyframe)
+
+    async def lores(req):
+        enabled = bool(req.json()["enabled"])
+        return await control({"lores": enabled}, service.set_lores, enabled)
+
+    async def roi(req):
+        # {"roi": [x, y, w, h]} in shares of the field of view; null for the full view
+        region = parse_roi(req.json()["roi"])
+        return await control({"roi": region}, service.set_roi, region)
+
+    async def publish(req):
+        # {"enabled": true, "lease_sec": 30, "holder": "cam1"}: the hub renews it while anyone watches.
+        # The holder is the mediamtx path; without lease_sec the lease is the longest allowed.
+        body = req.json()
+        enabled = bool(body["enabled"])
+        holder = str(body.get("holder", "hub"))
+        limit = (cfg.on_demand or OnDemandConfig()).max_lease_sec
+        lease_sec = body.get("lease_sec")
+        lease_sec = limit if lease_sec is None else float(lease_sec)
+        if not 0 < lease_sec <= limit:
+            raise ValueError(f"lease_sec must be within 0..{limit:g}")
+        try:
+            return json_response(await blocking(service.set_publishing, enabled, lease_sec, holder))
+        except RuntimeError as e:  # includes NotImplementedError from drivers without publishers
+            return error_response(409, str(e) or "not supported by this camera driver")
+
+    sizes = [size.name for size in cfg.snapshots.sizes]
+
+    async def snapshot_jpeg(req):
+        # Served from memory: no encoding and no file I/O per request
+        name = req.query.get("size", sizes[0])
+        if name not in sizes:
+            raise ValueError(f"size must be one of {', '.join(sizes)}")
+        seen = {tag.strip() for tag in req.headers.get("if-none-match", "").split(",") if tag.strip()}
+        wait = min(float(req.query.get("wait", 0)), MAX_LONG_POLL_SEC)
+        jpeg = service.store.get(name)
+        if wait > 0:
+            # Long-poll: answer as soon as a frame the client has not seen exists
+            jpeg = await service.store.wait_newer(name, seen, wait) or jpeg
+        if jpeg is None:
+            return error_response(503, "no snapshot yet")
+        headers = {"ETag": jpeg.etag, "Cache-Control": "no-cache"}
+        if jpeg.etag in seen or "*" in seen:
+            return Response(304, headers=headers)
+        return Response(200, jpeg.data, "image/jpeg", headers)
+
+    async def timelapse_jpeg(req):
+        if cfg.timelapse is None:
+            return error_response(404, "time-lapse is not enabled")
+        reader = TimelapseReader(cfg.timelapse.directory)
+        found = await asyncio.get_running_loop().run_in_executor(
+            None, reader.seek, float(req.query.get("at", time.time())))
+        if found is None:
+            return error_response(503, "no time-lapse frames yet")
+        day, entry = found
+        data = await asyncio.get_running_loop().run_in_executor(None, reader.read, day, entry)
+        return Response(200, data, "image/jpeg", {"X-Timestamp": f"{entry.timestamp:.3f}",
+                                                  "Cache-Control": "max-age=86400"})
+
+    async def control(result, fn, *args):
+        try:
+            await blocking(fn, *args)
+        except RuntimeError as e:  # includes NotImplementedError from drivers lacking the control
+            return error_response(409, str(e) or "not supported by this camera driver")
+        return json_response(result)
+
+    server.route("GET", "/status", status)
+    server.route("GET", "/latency", latency)
+    server.route("GET", "/metrics", metrics)
+    server.route("POST", "/start", start)
+    server.route("POST", "/stop", stop)
+    server.route("POST", "/snapshot", snapshot)
+    server.route("POST", "/burst", burst)
+    server.route("GET", "/snapshot.jpg", snapshot_jpeg)
+    server.route("GET", "/timelapse.jpg", timelapse_jpeg)
+    server.route("POST", "/bitrate", bitrate)
+    server.route("POST", "/keyframe", keyframe)
+    server.route("POST", "/lores", lores)
+    server.route("POST", "/roi", roi)
+    server.route("POST", "/publish", publish)
+    return server.start()
+
+
+def start_bandwidth_client(service: StreamService, cfg: AppConfig,
+                           http: Optional[HttpServer] = None) -> Optional[BandwidthClient]:
+    """Join the hub's allocator; with an HTTP endpoint the hub can also push budgets to /budget."""
+    if cfg.bandwidth is None:
+        return None
+    client = BandwidthClient(cfg.bandwidth, service.bitrate_demand, service.apply_budget,
+                             service.publisher_stats, http.port if http is not None else None)
+    if http is not None:
+        async def budget(req):
+            value = int(req.json()["bitrate"])
+            if value <= 0:
+                raise ValueError("bitrate must be positive")
+            await asyncio.get_running_loop().run_in_executor(None, client.on_budget, value)
+            return json_response({"budget": value})
+
+        async def bandwidth(_req):
+            return json_response(client.status())
+
+        http.route("POST", "/budget", budget)
+        http.route("GET", "/bandwidth", bandwidth)
+    return client.start()
+
+
+# ---------- Multi-camera ----------
+def app_config_from_section(name: str, options: Dict[str, str], defaults: Dict[str, str]) -> AppConfig:
+    """AppConfig for one [camera:<name>] section; keys missing there fall back to [supervisor]."""
+    opt = {**defaults, **options}
+    video = VideoConfig(
+        width=int(opt.get("width", 1640)), height=int(opt.get("height", 1232)),
+        format=opt.get("format", "YUV420"), frame_rate=int(opt.get("frame_rate", 30)),
+        bitrate=int(opt.get("bitrate", 4_000_000)), iperiod=int(opt.get("iperiod", 30)),
+        lores_enabled=opt.get("lores", "no").lower() in ("1", "yes", "true", "on"),
+        quality=None if opt.get("quality", "low").lower() in ("", "none") else opt.get("quality", "low").lower(),
+        roi=parse_roi(opt.get("roi")),
+    )
+    video_dir = opt.get("video_dir")
+    return AppConfig(
+        rtsp=RtspConfig(host=opt.get("hub", "192.168.6.76"), port=int(opt.get("hub_port", 8554)),
+                        path=opt.get("path", name), publisher=opt.get("publisher", RtspConfig.publisher)),
+        video=video,
+        # One LQ path per camera; they would all publish to "lqstream" otherwise
+        simulcast=SimulcastConfig(enabled=opt.get("simulcast", "yes").lower() in ("1", "yes", "true", "on"),
+                                  path=opt.get("lq_path", f"{name}_lq"),
+                                  bitrate=int(opt.get("lq_bitrate", SimulcastConfig.bitrate))),
+        preview_jpeg_path=Path(opt.get("preview", f"/dev/shm/camera-{name}.jpg")),
+        preview_interval_sec=float(opt.get("preview_interval_sec", 1.0)),
+        recording=RecorderConfig(directory=Path(video_dir) / name, prefix=name) if video_dir else None,
+        timelapse=TimelapseConfig(directory=Path(opt["timelapse_dir"]) / name,
+                                  interval_sec=float(opt.get("timelapse_interval_sec", 10.0)))
+        if opt.get("timelapse_dir") else None,
+        synthetic=SyntheticConfig(source=opt["synthetic"], width=video.width, height=video.height,
+                                  fps=video.frame_rate, bitrate=video.bitrate) if opt.get("synthetic") else None,
+        bandwidth=BandwidthConfig(hub_url=opt["allocator"], name=name, priority=float(opt.get("priority", 1.0)))
+        if opt.get("allocator") else None,
+        trace_sample_every=int(opt.get("trace_sample_every", 30)),
+        # The supervisor owns the HTTP endpoint and the memory log
+        http_port=None,
+        memory_log_interval_sec=0,
+        camera_num=int(opt.get("camera_num", 0)),
+    )
+
+
+def run_camera_worker(cfg: AppConfig, report, report_interval_sec: float = 2.0) -> None:
+    """One camera's pipeline inside a supervisor worker process."""
+    tracer = LatencyTracer(cfg.trace_sample_every) if cfg.trace_sample_every > 0 else None
+    camera = build_camera(cfg, tracer)
+    service = StreamService(camera, cfg, tracer)
+    install_signal_handlers(service.stop)
+    done = threading.Event()
+    # No HTTP endpoint in a worker: budgets arrive with the heartbeat replies
+    bandwidth = start_bandwidth_client(service, cfg)
+
+    def reporter() -> None:
+        while not done.wait(report_interval_sec):
+            try:
+                report(service.status(), tracer.prometheus() if tracer is not None else "")
+            except Exception as e:
+                LOG.debug("Status report failed: %s", e)
+
+    threading.Thread(target=reporter, name="status-report", daemon=True).start()
+    try:
+        with service:
+            service.run_forever()
+    finally:
+        done.set()
+        if bandwidth is not None:
+            bandwidth.stop()
+
+
+def run_supervisor(path: Path) -> int:
+    settings, cameras = camera_supervisor.read_cameras_ini(path)
+    specs = [camera_supervisor.CameraSpec(name, app_config_from_section(name, options, settings),
+                                          camera_supervisor.parse_cpus(options.get("cpus", "")))
+             for name, options in cameras]
+    supervisor = camera_supervisor.CameraSupervisor(specs, run_camera_worker)
+
+    http = None
+    port = settings.get("http_port", "8080")
+    if port:
+        http = HttpServer(port=int(port))
+
+        async def status(_req):
+            return json_response({"cameras": supervisor.status(), "memory": memory_budget.snapshot().as_dict()})
+
+        async def metrics(_req):
+            return Response(body=supervisor.metrics().encode(), content_type="text/plain; version=0.0.4")
+
+        http.route("GET", "/status", status)
+        http.route("GET", "/metrics", metrics)
+        http.start()
+
+    memory_every = float(settings.get("memory_log_interval_sec", 60))
+    next_memory_log = [0.0]
+
+    def tick() -> None:
+        now = time.monotonic()
+        if memory_every > 0 and now >= next_memory_log[0]:
+            LOG.info("Memory: %s", memory_budget.snapshot().describe())
+            next_memory_log[0] = now + memory_every
+
+    notifier = Notifier.from_env()
+    stopping = threading.Event()
+    install_signal_handlers(stopping.set)
+    supervisor.start()
+    LOG.info("Supervising %d camera(s): %s", len(specs), ", ".join(s.name for s in specs))
+    notifier.ready(f"supervising {len(specs)} camera(s)")
+    try:
+        while not stopping.wait(0.5):
+            supervisor.poll()
+            tick()
+            if notifier.watchdog_interval_sec:
+                notifier.watchdog()
+    finally:
+        notifier.stopping()
+        supervisor.stop()
+        if http is not None:
+            http.stop()
+    LOG.info("Supervisor stopped.")
+    return 0
+
+
 def install_signal_handlers(stop_cb) -> None:
     def _handler(signum, _frame):
         LOG.info("Received signal %s, shutting down...", signum)
@@ -260,32 +1312,85 @@ def install_signal_handlers(stop_cb) -> None:
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description="PiSecureKit camera service")
+    parser.add_argument("--benchmark-memory", action="store_true",
+                        help="measure the CMA/RSS cost of each fallback configuration and exit")
+    parser.add_argument("--json", type=Path, help="also write benchmark results to this file")
+    parser.add_argument("--cameras", type=Path,
+                        help="run every camera in this ini file under one supervisor (see camera_supervisor.py)")
+    args = parser.parse_args()
+
+    if args.cameras:
+        return run_supervisor(args.cameras)
+
     # Read host from env or default to your original
     hub_host = os.getenv("PISECUREKIT_HUB", "192.168.6.76")
+    # Local recording is opt-in; point this at the SD card (or USB disk) directory to enable it
+    video_dir = os.getenv("PISECUREKIT_VIDEO_DIR")
+    # "pattern" or a .y4m/.h264 file: run the whole pipeline without a camera
+    synthetic = os.getenv("PISECUREKIT_SYNTHETIC")
+    # Hub bandwidth allocator, e.g. http://192.168.6.76:8090; unset keeps the fixed bitrate
+    allocator = os.getenv("PISECUREKIT_ALLOCATOR")
+    # Time-lapse of the preview stills (one frame per 10 s by default)
+    timelapse_dir = os.getenv("PISECUREKIT_TIMELAPSE_DIR")
+    # Region of interest "x,y,w,h" as shares of the field of view, e.g. "0.5,0.2,0.3,0.6"
+    roi = os.getenv("PISECUREKIT_ROI")
+    # Where POST /burst writes its stills
+    stills_dir = os.getenv("PISECUREKIT_STILLS_DIR", str(AppConfig.stills_dir))
+    # "keepalive" or "off": publish hqstream only while the hub asks (hub/on_demand_config.py)
+    on_demand = os.getenv("PISECUREKIT_ON_DEMAND")
 
     cfg = AppConfig(
-        rtsp=RtspConfig(host=hub_host, port=8554, path="hqstream"),
+        rtsp=RtspConfig(host=hub_host, port=8554, path="hqstream",
+                        publisher=os.getenv("PISECUREKIT_PUBLISHER", RtspConfig.publisher)),
         video=VideoConfig(
             width=1640, height=1232, format="YUV420",
             frame_rate=30, bitrate=4_000_000, iperiod=30,
             lores_enabled=False,
             lores_width=640,
             lores_height=480,
+            roi=parse_roi(roi),
         ),
         preview_jpeg_path=Path("/dev/shm/camera-tmp.jpg"),
-        preview_interval_sec=5.0
+        preview_interval_sec=1.0,
+        stills_dir=Path(stills_dir),
+        recording=RecorderConfig(directory=Path(video_dir)) if video_dir else None,
+        timelapse=TimelapseConfig(directory=Path(timelapse_dir)) if timelapse_dir else None,
+        synthetic=SyntheticConfig(source=synthetic) if synthetic else None,
+        on_demand=OnDemandConfig(idle=on_demand) if on_demand else None,
+        bandwidth=BandwidthConfig(hub_url=allocator,
+                                  priority=float(os.getenv("PISECUREKIT_PRIORITY", "1.0"))) if allocator else None,
     )
 
-    camera = build_camera(cfg)
-    service = StreamService(camera, cfg)
+    if args.benchmark_memory:
+        rows = benchmark_memory(cfg)
+        _print_benchmark(rows)
+        if args.json:
+            args.json.write_text(json.dumps(rows, indent=2))
+        return 0
+
+    notifier = Notifier.from_env()
+    tracer = LatencyTracer(cfg.trace_sample_every) if cfg.trace_sample_every > 0 else None
+    camera = build_camera(cfg, tracer, notifier=notifier)
+    service = StreamService(camera, cfg, tracer, notifier)
+    http = start_http(service, cfg)
+    bandwidth = start_bandwidth_client(service, cfg, http)
 
     # graceful shutdown
     install_signal_handlers(service.stop)
 
     LOG.info("Starting camera streams…")
-    with service:
-        # block here until signal or exception
-        service.run_forever()
+    try:
+        with service:
+            notifier.ready(f"streaming to {cfg.rtsp.url()}")
+            # block here until signal or exception
+            service.run_forever()
+    finally:
+        notifier.stopping()
+        if bandwidth is not None:
+            bandwidth.stop()
+        if http is not None:
+            http.stop()
     LOG.info("Camera streams stopped.")
     return 0
 
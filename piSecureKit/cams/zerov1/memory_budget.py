@@ -0,0 +1,106 @@
+"""
+Process and CMA memory accounting for camera configurations.
+
+CMA (contiguous memory) is what the ISP, the camera buffers and the H.264 encoder allocate from;
+on a Pi Zero it is the budget that decides whether a configuration can run at all.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+LOG = logging.getLogger("PiSecureKit.memory")
+
+MEMINFO = Path("/proc/meminfo")
+PROC_STATUS = Path("/proc/self/status")
+
+# Bytes per pixel of the formats we configure (YUV420 is planar 4:2:0).
+_BYTES_PER_PIXEL = {
+    "YUV420": 1.5, "YVU420": 1.5, "NV12": 1.5, "NV21": 1.5,
+    "YUYV": 2.0, "RGB888": 3.0, "BGR888": 3.0, "XBGR8888": 4.0, "XRGB8888": 4.0,
+}
+
+
+def read_meminfo(path: Path = MEMINFO) -> Dict[str, int]:
+    """/proc/meminfo as bytes, keyed by field name (e.g. CmaTotal, CmaFree, MemAvailable)."""
+    out: Dict[str, int] = {}
+    try:
+        with path.open() as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                parts = rest.split()
+                if parts and parts[0].isdigit():  # /proc/*/status also has text fields
+                    out[key] = int(parts[0]) * (1024 if len(parts) > 1 and parts[1] == "kB" else 1)
+    except OSError as e:
+        LOG.debug("Cannot read %s: %s", path, e)
+    return out
+
+
+def read_process_memory(path: Path = PROC_STATUS) -> Tuple[int, int]:
+    """(VmRSS, VmHWM) of this process in bytes; zeros where unavailable."""
+    fields = read_meminfo(path)
+    return fields.get("VmRSS", 0), fields.get("VmHWM", 0)
+
+
+@dataclass(frozen=True)
+class MemorySnapshot:
+    rss: int
+    rss_peak: int
+    cma_total: int
+    cma_free: int
+    mem_available: int
+
+    @property
+    def cma_used(self) -> int:
+        return self.cma_total - self.cma_free
+
+    def as_dict(self) -> Dict[str, int]:
+        d = asdict(self)
+        d["cma_used"] = self.cma_used
+        return d
+
+    def describe(self) -> str:
+        return (f"rss={self.rss / 1e6:.1f}MB (peak {self.rss_peak / 1e6:.1f}MB), "
+                f"cma used={self.cma_used / 1e6:.1f}/{self.cma_total / 1e6:.1f}MB, "
+                f"available={self.mem_available / 1e6:.1f}MB")
+
+
+def snapshot(meminfo: Path = MEMINFO, status: Path = PROC_STATUS) -> MemorySnapshot:
+    info = read_meminfo(meminfo)
+    rss, peak = read_process_memory(status)
+    return MemorySnapshot(
+        rss=rss, rss_peak=peak,
+        cma_total=info.get("CmaTotal", 0), cma_free=info.get("CmaFree", 0),
+        mem_available=info.get("MemAvailable", 0),
+    )
+
+
+def frame_bytes(width: int, height: int, fmt: str) -> int:
+    """Approximate size of one frame buffer, with the 64-byte stride alignment libcamera uses."""
+    stride = -(-width // 64) * 64
+    return int(stride * height * _BYTES_PER_PIXEL.get(fmt, 4.0))
+
+
+def estimate_buffer_bytes(width: int, height: int, fmt: str, buffer_count: int,
+                          lores: Optional[Tuple[int, int]] = None) -> int:
+    """Camera buffer footprint of a video configuration (main plus optional YUV420 lores)."""
+    per_request = frame_bytes(width, height, fmt)
+    if lores is not None:
+        per_request += frame_bytes(lores[0], lores[1], "YUV420")
+    return per_request * buffer_count
+
+
+# picamera2's V4L2 encoder maps 16 compressed buffers; bcm2835-codec sizes them by resolution.
+ENCODER_CAPTURE_BUFFERS = 16
+
+
+def encoder_buffer_bytes(width: int, height: int) -> int:
+    """CMA held by one running H.264 encoder for its output (compressed) buffers."""
+    per_buffer = (768 << 10) if width * height > 1280 * 720 else (512 << 10)
+    return ENCODER_CAPTURE_BUFFERS * per_buffer
+
+
+def delta(before: MemorySnapshot, after: MemorySnapshot) -> Dict[str, int]:
+    return {"rss": after.rss - before.rss, "cma_used": after.cma_used - before.cma_used}
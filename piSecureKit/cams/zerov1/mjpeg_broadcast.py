@@ -0,0 +1,185 @@
+"""
+MJPEG fan-out for browser viewers (multipart/x-mixed-replace), on the http_server event loop.
+
+Each frame is framed as a multipart part once, whatever the number of viewers, in a buffer
+reused from a small pool; viewers write memoryviews of it, so steady-state streaming neither
+allocates nor copies per viewer. Viewers are coroutines, not threads: each one sends the newest
+part, waits for its socket to drain and then jumps to whatever is newest, so a slow viewer skips
+frames instead of queueing them or holding anyone else up. An idle viewer costs a parked future.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    from .http_server import Request, Response, error_response
+except ImportError:  # run from cams/zerov1, as the camera service and its tests are
+    from http_server import Request, Response, error_response
+
+LOG = logging.getLogger("PiSecureKit.mjpeg")
+
+BOUNDARY = "frame"
+
+
+class Part(NamedTuple):
+    data: memoryview  # the whole multipart part, as written to viewers
+    jpeg: memoryview  # the JPEG inside it
+
+
+def _in_use(buf: bytearray) -> bool:
+    """True while any memoryview of `buf` is alive (viewers, transport buffers): bytearray refuses to resize then."""
+    try:
+        buf.append(0)
+    except BufferError:
+        return True
+    buf.pop()
+    return False
+
+
+class PartPool:
+    """
+    Builds multipart parts into reused bytearrays: one copy of the JPEG per frame, out of the
+    encoder's buffer. A buffer goes back into service only once nothing references it any more.
+    Content-Length lets clients read the JPEG without scanning for the boundary.
+    """
+
+    def __init__(self, boundary: str = BOUNDARY, max_buffers: int = 8) -> None:
+        self._prefix = f"--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: ".encode("ascii")
+        self._max_buffers = max_buffers
+        self._buffers: List[bytearray] = []
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"parts": 0, "reuses": 0, "allocations": 0, "bytes_allocated": 0,
+                                       "copies": 0, "bytes_copied": 0}
+
+    def build(self, jpeg) -> Part:
+        head = b"%s%d\r\n\r\n" % (self._prefix, len(jpeg))
+        start, end = len(head), len(head) + len(jpeg)
+        with self._lock:
+            buf = self._take(end + 2)
+            self._stats["parts"] += 1
+            self._stats["copies"] += 1
+            self._stats["bytes_copied"] += len(jpeg)
+        # Same-length slice assignments: never a resize, so safe on a buffer we own
+        buf[:start] = head
+        buf[start:end] = jpeg
+        buf[end:end + 2] = b"\r\n"
+        view = memoryview(buf)
+        return Part(view[:end + 2], view[start:end])
+
+    def _take(self, size: int) -> bytearray:
+        free = [b for b in self._buffers if not _in_use(b)]
+        fits = [b for b in free if len(b) >= size]
+        if fits:
+            self._stats["reuses"] += 1
+            return fits[0]
+        capacity = size + size // 4  # headroom so slightly bigger frames do not regrow it
+        self._stats["allocations"] += 1
+        self._stats["bytes_allocated"] += capacity
+        if free:
+            buf = free[0]  # too small: grow it (allowed, nothing references it)
+            buf.extend(bytes(capacity - len(buf)))
+            return buf
+        buf = bytearray(capacity)
+        if len(self._buffers) < self._max_buffers:
+            self._buffers.append(buf)  # otherwise a one-off: every pooled buffer is still in flight
+        return buf
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "buffers": len(self._buffers)}
+
+
+class MjpegBroadcaster:
+    """
+    Newest-frame broadcaster. `publish` may be called from any thread (the encoder's); `handle`
+    is an HttpServer route handler. Viewers beyond `max_clients` get a 503.
+    """
+
+    def __init__(self, max_clients: int = 500, write_buffer_bytes: int = 256 << 10) -> None:
+        self._max_clients = max_clients
+        # Per viewer, in asyncio and again in the kernel: about one frame in flight. Autotuned
+        # kernel buffers would let a stalled viewer pin megabytes and hide that it is stalled.
+        self._write_buffer = write_buffer_bytes
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool = PartPool()
+        self._part: Optional[memoryview] = None
+        self._seq = 0
+        self._new_frame: Optional[asyncio.Future] = None
+        self._clients = 0
+        self._stats: Dict[str, int] = {"frames": 0, "parts_sent": 0, "frames_skipped": 0, "clients_total": 0,
+                                       "clients_rejected": 0}
+
+    # -- producer side (any thread) --
+    def publish(self, jpeg) -> Part:
+        """Frame `jpeg` (from a pooled buffer) and send it to every viewer."""
+        part = self._pool.build(jpeg)
+        self.publish_part(part)
+        return part
+
+    def publish_part(self, part: Part) -> None:
+        """Send a part already built by the producer's own PartPool."""
+        with self._lock:
+            self._part = part.data
+            self._seq += 1
+            self._stats["frames"] += 1
+            loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass  # server loop closed
+
+    def _wake(self) -> None:
+        # One shared future per frame: every parked viewer resumes from the same result
+        fut, self._new_frame = self._new_frame, None
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    # -- viewer side (event loop) --
+    async def handle(self, _req: Request) -> Response:
+        if self._clients >= self._max_clients:
+            self._stats["clients_rejected"] += 1
+            return error_response(503, "too many viewers")
+        return Response(200, content_type=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+                        headers={"Cache-Control": "no-cache, private", "Pragma": "no-cache"},
+                        stream=self._stream)
+
+    async def _stream(self, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._loop = loop
+        writer.transport.set_write_buffer_limits(high=self._write_buffer)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._write_buffer)
+        self._clients += 1
+        self._stats["clients_total"] += 1
+        sent = 0
+        try:
+            while True:
+                with self._lock:
+                    seq, part = self._seq, self._part
+                if seq == sent or part is None:
+                    if self._new_frame is None:
+                        self._new_frame = loop.create_future()
+                    # Shielded: cancelling one viewer must not cancel the future the others wait on
+                    await asyncio.shield(self._new_frame)
+                    continue
+                if sent:
+                    self._stats["frames_skipped"] += seq - sent - 1
+                sent = seq
+                writer.write(part)
+                self._stats["parts_sent"] += 1
+                # Only this viewer waits here; frames published meanwhile are skipped, not queued
+                await writer.drain()
+        finally:
+            # A viewer that went away while parked is noticed on its next write
+            self._clients -= 1
+
+    def stats(self) -> Dict[str, object]:
+        return {**self._stats, "clients": self._clients, "pool": self._pool.stats()}
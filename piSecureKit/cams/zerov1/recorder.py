@@ -0,0 +1,272 @@
+"""
+SD-card friendly segmented recorder for the encoded H.264 stream.
+
+The encoder thread only ever enqueues frames; a write-behind thread batches them into large,
+block-aligned writes against preallocated segment files and enforces the retention policy.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from encoded_output import EncodedOutput
+
+LOG = logging.getLogger("PiSecureKit.recorder")
+
+_STOP = object()
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class RecorderConfig:
+    directory: Path = Path("/var/lib/pisecurekit/video")
+    prefix: str = "cam"
+    segment_sec: float = 60.0               # new segment on the first keyframe after this
+    write_block_bytes: int = 1 << 20        # every write() is this size, except the final tail
+    preallocate_bytes: int = 32 << 20       # initial guess; later segments use the largest seen
+    queue_max_bytes: int = 16 << 20         # beyond this frames are dropped, never blocked on
+    sync_every_bytes: int = 8 << 20         # fdatasync + drop page cache so dirty pages stay small
+    retain_bytes: Optional[int] = 8 << 30
+    retain_age_sec: Optional[float] = 7 * 24 * 3600.0
+
+
+# ---------- Segment file ----------
+class _SegmentFile:
+    """One preallocated segment, written in whole blocks through a staging buffer."""
+
+    def __init__(self, path: Path, block: int, preallocate: int) -> None:
+        self.path = path
+        self._part = path.with_name(path.name + ".part")
+        self._fd = os.open(self._part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        if preallocate > 0:
+            try:
+                os.posix_fallocate(self._fd, 0, preallocate)
+            except (AttributeError, OSError) as e:
+                # Not every filesystem supports it; recording still works, just less contiguous.
+                LOG.debug("posix_fallocate unavailable for %s: %s", self._part, e)
+        self._buf = bytearray(block)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+        self._synced = 0
+        self.size = 0
+
+    def append(self, data: bytes) -> Tuple[int, float]:
+        """Copy into the staging buffer; returns (bytes written to disk, seconds spent writing)."""
+        written, spent = 0, 0.0
+        src = memoryview(data)
+        block = len(self._buf)
+        while src:
+            n = min(block - self._fill, len(src))
+            self._view[self._fill:self._fill + n] = src[:n]
+            self._fill += n
+            src = src[n:]
+            if self._fill == block:
+                spent += self._flush()
+                written += block
+        return written, spent
+
+    def maybe_sync(self, every: int) -> None:
+        if every and self.size - self._synced >= every:
+            os.fdatasync(self._fd)
+            self._drop_cache(self._synced, self.size - self._synced)
+            self._synced = self.size
+
+    def close(self) -> Tuple[int, float]:
+        tail = self._fill
+        spent = self._flush() if tail else 0.0
+        try:
+            os.ftruncate(self._fd, self.size)  # give back the unused preallocation
+            os.fdatasync(self._fd)
+            self._drop_cache(0, self.size)
+        finally:
+            os.close(self._fd)
+        os.replace(self._part, self.path)
+        return tail, spent
+
+    def _flush(self) -> float:
+        t0 = time.perf_counter()
+        view = self._view[:self._fill]
+        while view:
+            n = os.write(self._fd, view)
+            view = view[n:]
+        self.size += self._fill
+        self._fill = 0
+        return time.perf_counter() - t0
+
+    def _drop_cache(self, offset: int, length: int) -> None:
+        try:
+            os.posix_fadvise(self._fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except (AttributeError, OSError):
+            pass
+
+
+# ---------- Recorder ----------
+class SegmentedRecorder(EncodedOutput):
+    """
+    Encoder output that records fixed-duration `.h264` segments with write-behind.
+
+    `outputframe` never touches the disk: it enqueues the frame (or drops it when the queue is
+    over budget, resuming on the next keyframe) and returns.
+    """
+
+    def __init__(self, cfg: RecorderConfig) -> None:
+        super().__init__()
+        self._cfg = cfg
+        self._queue: "queue.SimpleQueue[object]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._queued_bytes = 0
+        self._queued_frames = 0
+        self._dropping = False
+        self._thread: Optional[threading.Thread] = None
+        self._preallocate = cfg.preallocate_bytes
+        # stats (written by the writer thread, read under the lock)
+        self._dropped_frames = 0
+        self._bytes_written = 0
+        self._write_seconds = 0.0
+        self._segments_closed = 0
+        self._segments_deleted = 0
+
+    # -- Output interface (encoder thread) --
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._cfg.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._writer_loop, name="recorder-writer", daemon=True)
+        self._thread.start()
+        super().start()
+        LOG.info("Recorder writing %.0fs segments to %s", self._cfg.segment_sec, self._cfg.directory)
+
+    def stop(self) -> None:
+        super().stop()
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+        if audio or not self.recording:
+            return
+        size = len(frame)
+        with self._lock:
+            if self._dropping and not keyframe:
+                self._dropped_frames += 1
+                return
+            if self._queued_bytes + size > self._cfg.queue_max_bytes:
+                # Drop until the next keyframe so segments never contain undecodable P-frames.
+                self._dropping = True
+                self._dropped_frames += 1
+                return
+            self._dropping = False
+            self._queued_bytes += size
+            self._queued_frames += 1
+        ts = timestamp / 1_000_000 if timestamp is not None else time.monotonic()
+        self._queue.put((bytes(frame), keyframe, ts))
+
+    # -- Reporting --
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            secs = self._write_seconds
+            return {
+                "queue_frames": self._queued_frames,
+                "queue_bytes": self._queued_bytes,
+                "dropped_frames": self._dropped_frames,
+                "bytes_written": self._bytes_written,
+                "write_mbps": (self._bytes_written / secs / 1e6) if secs > 0 else 0.0,
+                "segments_closed": self._segments_closed,
+                "segments_deleted": self._segments_deleted,
+            }
+
+    # -- Write-behind thread --
+    def _writer_loop(self) -> None:
+        seg: Optional[_SegmentFile] = None
+        seg_start = 0.0
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                frame, keyframe, ts = item  # type: ignore[misc]
+                with self._lock:
+                    self._queued_bytes -= len(frame)
+                    self._queued_frames -= 1
+                if keyframe and (seg is None or ts - seg_start >= self._cfg.segment_sec):
+                    if seg is not None:
+                        self._close_segment(seg)
+                    seg, seg_start = self._open_segment(), ts
+                if seg is None:
+                    continue  # wait for the first keyframe
+                written, spent = seg.append(frame)
+                if written:
+                    self._account(written, spent)
+                    seg.maybe_sync(self._cfg.sync_every_bytes)
+        except Exception:
+            LOG.exception("Recorder writer failed; recording stopped")
+            self.recording = False
+        finally:
+            if seg is not None:
+                self._close_segment(seg)
+
+    def _open_segment(self) -> _SegmentFile:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        path = self._cfg.directory / f"{self._cfg.prefix}_{stamp}.h264"
+        n = 0
+        while path.exists():  # rotations within the same millisecond; suffix still sorts after
+            n += 1
+            path = self._cfg.directory / f"{self._cfg.prefix}_{stamp}_{n:02d}.h264"
+        return _SegmentFile(path, self._cfg.write_block_bytes, self._preallocate)
+
+    def _close_segment(self, seg: _SegmentFile) -> None:
+        try:
+            written, spent = seg.close()
+        except OSError as e:
+            LOG.error("Failed to close segment %s: %s", seg.path, e)
+            return
+        self._account(written, spent)
+        # Size the next preallocation from what segments actually need, rounded to whole blocks.
+        block = self._cfg.write_block_bytes
+        self._preallocate = max(self._preallocate, -(-int(seg.size * 1.1) // block) * block)
+        with self._lock:
+            self._segments_closed += 1
+        self._enforce_retention()
+        s = self.stats()
+        LOG.info("Recorded %s (%.1f MB); write %.1f MB/s, queue %d frames/%d KB, dropped %d",
+                 seg.path.name, seg.size / 1e6, s["write_mbps"], s["queue_frames"],
+                 s["queue_bytes"] // 1024, s["dropped_frames"])
+
+    def _account(self, written: int, spent: float) -> None:
+        with self._lock:
+            self._bytes_written += written
+            self._write_seconds += spent
+
+    def _enforce_retention(self) -> None:
+        segments: List[Tuple[Path, os.stat_result]] = []
+        for path in sorted(self._cfg.directory.glob(f"{self._cfg.prefix}_*.h264")):
+            try:
+                segments.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        total = sum(st.st_size for _, st in segments)
+        now = time.time()
+        # Oldest first (names sort chronologically); always keep the newest segment.
+        for path, st in segments[:-1]:
+            too_big = self._cfg.retain_bytes is not None and total > self._cfg.retain_bytes
+            too_old = self._cfg.retain_age_sec is not None and now - st.st_mtime > self._cfg.retain_age_sec
+            if not (too_big or too_old):
+                break
+            try:
+                path.unlink()
+            except OSError as e:
+                LOG.warning("Retention could not delete %s: %s", path, e)
+                continue
+            total -= st.st_size
+            with self._lock:
+                self._segments_deleted += 1
+            LOG.debug("Retention deleted %s", path.name)
@@ -0,0 +1,497 @@
+"""
+Hub-outage tolerant publisher.
+
+Wraps the real RTSP output (built by a factory, e.g. FfmpegOutput) and keeps the camera running
+when the hub goes away: frames produced during the outage go to a bounded backlog (memory or
+disk), the sink is rebuilt with exponential backoff, and once the live stream is healthy again
+the backlog is uploaded to a separate `<path>_backfill` publication at a paced rate.
+
+With an OnDemandConfig the hub decides when the stream is worth its airtime: `set_mode("live")`
+publishes to `<path>` (which mediamtx only asks for while someone watches, see
+hub/on_demand_config.py), and the idle mode either sends a keyframe every few seconds to
+`<path>_idle` or nothing at all, leaving local recording as the only consumer of the encoder.
+"""
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import h264
+from encoded_output import EncodedOutput
+from recorder import RecorderConfig, SegmentedRecorder
+
+LOG = logging.getLogger("PiSecureKit.publisher")
+
+Frame = Tuple[bytes, bool, Optional[int]]  # (access unit, keyframe, timestamp in us)
+
+_OUTAGE = "outage"
+_CONNECTING = "connecting"
+_LIVE = "live"
+_IDLE = "idle"  # OFF mode: no connection wanted, so none missing either
+
+# Publishing modes (set_mode)
+LIVE = "live"            # full stream to <path>
+KEEPALIVE = "keepalive"  # one keyframe per interval to <path><keepalive_suffix>
+OFF = "off"              # nothing leaves the camera
+MODES = (LIVE, KEEPALIVE, OFF)
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class ReconnectConfig:
+    initial_backoff_sec: float = 0.5
+    max_backoff_sec: float = 30.0
+    settle_sec: float = 2.0              # error-free time after a (re)connect before it counts as live
+    buffer_max_bytes: int = 8 << 20      # outage backlog cap; ~16 s at 4 Mbps in memory
+    spill_dir: Optional[Path] = None     # keep the backlog on disk here instead of in memory
+    backfill_suffix: str = "_backfill"
+    backfill_speed: float = 2.0          # x real time, so catch-up never floods the uplink
+    backfill_fps: int = 30               # pacing for disk backlogs, which carry no timestamps
+    backfill_attempts: int = 3
+
+
+@dataclass(frozen=True)
+class OnDemandConfig:
+    idle: str = KEEPALIVE                # mode while nobody watches: KEEPALIVE or OFF
+    keepalive_suffix: str = "_idle"      # keeps <path> itself free for mediamtx's runOnDemand
+    keepalive_interval_sec: float = 5.0  # one keyframe per interval; ~1-2% of the live bitrate
+    max_lease_sec: float = 60.0          # longest lease the hub may hold on POST /publish
+
+
+# ---------- Outage backlogs ----------
+class _Backlog(ABC):
+    """A finished outage recording waiting to be backfilled."""
+
+    nbytes: int = 0
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[Frame]:
+        ...
+
+    def discard(self) -> None:
+        pass
+
+
+class _ListBacklog(_Backlog):
+    def __init__(self, frames: List[Frame]) -> None:
+        self._frames = frames
+        self.nbytes = sum(len(f[0]) for f in frames)
+
+    def __iter__(self) -> Iterator[Frame]:
+        return iter(self._frames)
+
+
+class _FileBacklog(_Backlog):
+    def __init__(self, files: List[Path]) -> None:
+        self._files = files
+        self.nbytes = sum(p.stat().st_size for p in files if p.exists())
+
+    def __iter__(self) -> Iterator[Frame]:
+        for path in self._files:
+            if not path.exists():
+                continue  # pruned by the spill retention
+            with path.open("rb") as f:
+                for au, key in h264.iter_access_units(f):
+                    yield au, key, None
+
+    def discard(self) -> None:
+        for path in self._files:
+            path.unlink(missing_ok=True)
+
+
+class _MemoryBuffer:
+    """GOP-granular ring: evicts the oldest whole GOP so the backlog always starts on a keyframe."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max = max_bytes
+        self._gops: Deque[List[Frame]] = deque()
+        self.nbytes = 0
+
+    def append(self, frame: bytes, keyframe: bool, timestamp: Optional[int]) -> None:
+        if keyframe:
+            self._gops.append([])
+        elif not self._gops:
+            return  # undecodable without its keyframe
+        self._gops[-1].append((bytes(frame), keyframe, timestamp))
+        self.nbytes += len(frame)
+        while self.nbytes > self._max and len(self._gops) > 1:
+            self.nbytes -= sum(len(f[0]) for f in self._gops.popleft())
+
+    def take(self) -> Optional[_Backlog]:
+        if not self._gops:
+            return None
+        frames = [f for gop in self._gops for f in gop]
+        self._gops.clear()
+        self.nbytes = 0
+        return _ListBacklog(frames)
+
+
+class _DiskBuffer:
+    """Spills the backlog through a SegmentedRecorder, whose retention bounds it by bytes."""
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self._cfg = RecorderConfig(
+            directory=directory, prefix="outage", segment_sec=10.0,
+            write_block_bytes=256 << 10, preallocate_bytes=4 << 20, queue_max_bytes=4 << 20,
+            retain_bytes=max_bytes, retain_age_sec=None,
+        )
+        self._recorder: Optional[SegmentedRecorder] = None
+        self._outages = 0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._recorder.stats()["bytes_written"]) if self._recorder else 0
+
+    def append(self, frame: bytes, keyframe: bool, timestamp: Optional[int]) -> None:
+        if self._recorder is None:
+            # One prefix per outage so a backlog never picks up files still queued for backfill.
+            self._outages += 1
+            self._recorder = SegmentedRecorder(replace(self._cfg, prefix=f"outage{self._outages:04d}"))
+            self._recorder.start()
+        self._recorder.outputframe(frame, keyframe, timestamp)
+
+    def take(self) -> Optional[_Backlog]:
+        if self._recorder is None:
+            return None
+        self._recorder.stop()
+        self._recorder = None
+        files = sorted(self._cfg.directory.glob(f"outage{self._outages:04d}_*.h264"))
+        return _FileBacklog(files) if files else None
+
+
+# ---------- Publisher ----------
+class ResilientPublisher(EncodedOutput):
+    """
+    Encoder output that survives hub restarts.
+
+    `sink_factory(path)` must return a started-on-demand Output with an `error_callback`
+    attribute (FfmpegOutput and RtspOutput qualify). A supervisor thread owns all reconnects, so the
+    encoder thread never waits on the network beyond what the sink itself does.
+
+    Without `on_demand` the publisher is always live; with it, it starts in the idle mode and
+    `set_mode()` switches paths with an immediate reconnect. Set `keyframe_requester` to the
+    encoder's force-keyframe call so a new connection does not wait out the rest of the GOP.
+    """
+
+    def __init__(self, sink_factory: Callable[[str], EncodedOutput], path: str,
+                 cfg: ReconnectConfig = ReconnectConfig(), on_demand: Optional[OnDemandConfig] = None) -> None:
+        super().__init__()
+        self.needs_pacing = True
+        self._factory = sink_factory
+        self._path = path
+        self._cfg = cfg
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._state = _OUTAGE
+        self._sink: Optional[EncodedOutput] = None
+        self._keyed = False          # current sink has been fed its first keyframe
+        self._had_live = False       # only buffer real outages, not the initial connect
+        self._gop: List[Frame] = []  # GOP in flight while live; seeds the backlog if the hub drops
+        self._on_demand = on_demand or OnDemandConfig()
+        self._mode = LIVE if on_demand is None else on_demand.idle
+        if self._mode not in MODES:
+            raise ValueError(f"unknown publishing mode {self._mode!r}")
+        self._reconnect_now = False  # a mode switch skips the backoff
+        self._switching = False      # reconnecting for a mode switch: not an outage, nothing to buffer
+        self._last_keepalive = float("-inf")
+        self.keyframe_requester: Optional[Callable[[], None]] = None
+        if cfg.spill_dir is not None:
+            self._buffer = _DiskBuffer(cfg.spill_dir, cfg.buffer_max_bytes)
+        else:
+            self._buffer = _MemoryBuffer(cfg.buffer_max_bytes)
+        self._backfills: Deque[Tuple[_Backlog, int]] = deque()
+        self._supervisor: Optional[threading.Thread] = None
+        self._backfiller: Optional[threading.Thread] = None
+        self._stats: Dict[str, int] = {"outages": 0, "reconnects": 0, "backfills_done": 0, "backfills_failed": 0,
+                                       "frames_in": 0, "bytes_in": 0,  # from the encoder, whatever the state
+                                       "mode_changes": 0, "keepalive_frames": 0}
+
+    # -- Output interface --
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._state = _OUTAGE
+        self._supervisor = threading.Thread(target=self._supervise, name="publisher-supervisor", daemon=True)
+        self._supervisor.start()
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        for t in (self._supervisor, self._backfiller):
+            if t is not None:
+                t.join(timeout=10)
+        self._supervisor = self._backfiller = None
+        self._stop_sink(self._sink)
+        self._sink = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+        if audio or not self.recording:
+            return
+        with self._lock:
+            self._stats["frames_in"] += 1
+            self._stats["bytes_in"] += len(frame)
+            state, sink = self._state, self._sink
+            if self._mode != LIVE:
+                if not self._keepalive_due(keyframe, state):
+                    return
+            elif state == _LIVE:
+                if keyframe:
+                    self._gop = []
+                self._gop.append((frame, keyframe, timestamp))
+            elif self._had_live and not self._switching:
+                self._buffer.append(frame, keyframe, timestamp)
+            if state == _CONNECTING and not self._keyed:
+                if not keyframe:
+                    return
+                self._keyed = True
+        if sink is not None and state != _OUTAGE:
+            sink.outputframe(frame, keyframe, timestamp)
+
+    def _keepalive_due(self, keyframe: bool, state: str) -> bool:
+        """Called under the lock: one keyframe per interval, and nothing in OFF mode."""
+        if self._mode != KEEPALIVE or not keyframe or state == _OUTAGE:
+            return False
+        now = time.monotonic()
+        if now - self._last_keepalive < self._on_demand.keepalive_interval_sec:
+            return False
+        self._last_keepalive = now
+        self._stats["keepalive_frames"] += 1
+        return True
+
+    # -- On-demand publishing --
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def set_mode(self, mode: str) -> None:
+        """
+        Switch between LIVE, KEEPALIVE and OFF; the new path is connected right away. The reconnect
+        is not an outage, so nothing is buffered for it, but a backlog from an outage before the
+        switch (the hub died, then its lease ran out) is kept and backfilled once connected again.
+        """
+        if mode not in MODES:
+            raise ValueError(f"unknown publishing mode {mode!r}")
+        with self._lock:
+            if mode == self._mode:
+                return
+            LOG.info("Publishing %s: %s -> %s", self._path, self._mode, mode)
+            self._mode = mode
+            self._state = _IDLE if mode == OFF else _OUTAGE
+            self._switching = True
+            self._gop = []
+            self._last_keepalive = float("-inf")
+            self._reconnect_now = True
+            self._stats["mode_changes"] += 1
+        self._wake.set()
+
+    def _target_path(self) -> str:
+        return self._path if self._mode == LIVE else self._path + self._on_demand.keepalive_suffix
+
+    # -- Reporting --
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._stats)
+            out.update(state=self._state, mode=self._mode, backlog_bytes=self._buffer.nbytes, backfills_pending=len(self._backfills))
+            sink = self._sink
+        if sink is not None and hasattr(sink, "stats"):
+            out["sink"] = sink.stats()  # live connection (send queue, drops); restarts with each sink
+        return out
+
+    # -- Supervisor --
+    def _on_sink_error(self, sink: EncodedOutput, exc: Exception) -> None:
+        with self._lock:
+            if sink is not self._sink or self._state in (_OUTAGE, _IDLE):
+                return
+            LOG.warning("RTSP publish to %s failed (%s); buffering until the hub is back", self._target_path(), exc)
+            self._switching = False
+            if self._state == _LIVE:
+                self._stats["outages"] += 1
+                # Whatever of this GOP was still in flight is lost with the connection.
+                for f in self._gop:
+                    self._buffer.append(*f)
+                self._gop = []
+            self._state = _OUTAGE
+        self._wake.set()
+
+    def _supervise(self) -> None:
+        backoff = 0.0  # first attempt is immediate
+        while self._running:
+            with self._lock:
+                state, sink, mode = self._state, self._sink, self._mode
+                reconnect_now, self._reconnect_now = self._reconnect_now, False
+            if reconnect_now:
+                backoff = 0.0
+            if state in (_OUTAGE, _IDLE):
+                if sink is not None:
+                    with self._lock:
+                        self._sink = None
+                    self._stop_sink(sink)
+                if mode == OFF:
+                    with self._lock:
+                        if self._mode == OFF:
+                            self._state = _IDLE
+                    self._wake.wait()
+                    self._wake.clear()
+                    continue
+                if backoff and self._sleep(backoff):
+                    return
+                backoff = min(max(backoff * 2, self._cfg.initial_backoff_sec), self._cfg.max_backoff_sec)
+                self._connect()
+            elif state == _CONNECTING:
+                connected_at = time.monotonic()
+                self._sleep(self._cfg.settle_sec)
+                with self._lock:
+                    healthy = self._state == _CONNECTING and self._keyed
+                if healthy and time.monotonic() - connected_at >= self._cfg.settle_sec:
+                    backoff = 0.0
+                    self._go_live()
+            elif self._wake.wait(self._keepalive_check()):
+                self._wake.clear()
+
+    def _keepalive_check(self) -> Optional[float]:
+        """Asks for a keyframe once a keepalive is due (GOPs may be longer than the interval); next check in seconds."""
+        with self._lock:
+            if self._mode != KEEPALIVE or self.keyframe_requester is None:
+                return None
+            remaining = self._last_keepalive + self._on_demand.keepalive_interval_sec - time.monotonic()
+        if remaining > 0:
+            return remaining
+        self._request_keyframe()
+        return self._on_demand.keepalive_interval_sec / 4
+
+    def _request_keyframe(self) -> None:
+        requester = self.keyframe_requester
+        if requester is not None:
+            try:
+                requester()
+            except Exception as e:
+                LOG.debug("Keyframe request failed: %s", e)
+
+    def _connect(self) -> None:
+        with self._lock:
+            path, mode = self._target_path(), self._mode
+        try:
+            sink = self._factory(path)
+            sink.error_callback = lambda e, s=sink: self._on_sink_error(s, e)
+            sink.start()
+        except Exception as e:
+            LOG.warning("Reconnect to hub failed: %s", e)
+            with self._lock:
+                self._switching = False  # the hub is gone, whatever the reconnect was for
+            return
+        with self._lock:
+            if self._mode != mode:
+                stale, sink = sink, None  # switched while connecting; the supervisor goes again
+            else:
+                self._sink = sink
+                self._keyed = False
+                self._state = _CONNECTING
+                self._stats["reconnects"] += 1
+        if sink is None:
+            self._stop_sink(stale)
+            return
+        self._request_keyframe()  # first frame in ~one frame time instead of up to a GOP
+
+    def _go_live(self) -> None:
+        with self._lock:
+            # Frames sent during the settle window are in both the live stream and the backlog;
+            # a little overlap beats a gap.
+            self._state = _LIVE
+            self._switching = False
+            had_live, self._had_live = self._had_live, True
+        # Nothing appends once we are live, so the (possibly disk-flushing) take runs unlocked.
+        backlog = self._buffer.take() if had_live else None
+        if backlog is not None:
+            with self._lock:
+                self._backfills.append((backlog, 0))
+        LOG.info("RTSP publish to %s is live%s", self._target_path(),
+                 f"; backfilling {backlog.nbytes / 1e6:.1f} MB" if backlog is not None else "")
+        if self._backfills and (self._backfiller is None or not self._backfiller.is_alive()):
+            self._backfiller = threading.Thread(target=self._backfill_loop, name="publisher-backfill", daemon=True)
+            self._backfiller.start()
+
+    def _sleep(self, seconds: float) -> bool:
+        """Interruptible sleep; returns True if the publisher is stopping."""
+        deadline = time.monotonic() + seconds
+        while self._running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._wake.wait(remaining):
+                self._wake.clear()
+                with self._lock:
+                    if self._state in (_OUTAGE, _IDLE):
+                        return not self._running
+        return True
+
+    @staticmethod
+    def _stop_sink(sink: Optional[EncodedOutput]) -> None:
+        if sink is None:
+            return
+        try:
+            sink.stop()
+        except Exception as e:
+            LOG.debug("Ignoring error stopping RTSP sink: %s", e)
+
+    # -- Backfill --
+    def _backfill_loop(self) -> None:
+        while self._running:
+            with self._lock:
+                if not self._backfills or self._state != _LIVE:
+                    return
+                backlog, attempts = self._backfills.popleft()
+            if self._upload(backlog):
+                backlog.discard()
+                with self._lock:
+                    self._stats["backfills_done"] += 1
+            elif attempts + 1 < self._cfg.backfill_attempts:
+                with self._lock:
+                    self._backfills.appendleft((backlog, attempts + 1))
+                return  # retried after the next successful reconnect
+            else:
+                LOG.error("Giving up on %.1f MB backfill for %s", backlog.nbytes / 1e6, self._path)
+                backlog.discard()
+                with self._lock:
+                    self._stats["backfills_failed"] += 1
+
+    def _upload(self, backlog: _Backlog) -> bool:
+        failed = threading.Event()
+        path = self._path + self._cfg.backfill_suffix
+        try:
+            sink = self._factory(path)
+            sink.error_callback = lambda _e: failed.set()
+            sink.start()
+        except Exception as e:
+            LOG.warning("Backfill connect to %s failed: %s", path, e)
+            return False
+        started = time.monotonic()
+        first_ts: Optional[int] = None
+        frame_period = 1.0 / (self._cfg.backfill_fps * self._cfg.backfill_speed)
+        try:
+            for i, (frame, keyframe, ts) in enumerate(backlog):
+                if not self._running or failed.is_set():
+                    return False
+                if ts is not None:
+                    first_ts = ts if first_ts is None else first_ts
+                    due = (ts - first_ts) / 1e6 / self._cfg.backfill_speed
+                else:
+                    due = i * frame_period
+                delay = started + due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                sink.outputframe(frame, keyframe, ts)
+            return not failed.is_set()
+        finally:
+            self._stop_sink(sink)
@@ -0,0 +1,313 @@
+"""
+In-process RTSP publisher: ANNOUNCE/SETUP/RECORD over TCP-interleaved RTP (RFC 2326/6184).
+
+Replaces the `ffmpeg -c:v copy -f rtsp` remux process. Access units from the encoder are queued
+as-is; a sender thread packetizes them (single NAL or FU-A) and pushes each access unit to the
+socket with one scatter-gather `sendmsg`, so NAL payloads are never copied in Python.
+"""
+from __future__ import annotations
+
+import base64
+import logging
+import os
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import h264
+from encoded_output import EncodedOutput
+
+LOG = logging.getLogger("PiSecureKit.rtsp")
+
+_STOP = object()
+_PT = 96
+_CLOCK = 90_000
+_IOV_MAX = 1024
+
+
+class RtspError(RuntimeError):
+    pass
+
+
+# ---------- RTP packetization ----------
+class H264Packetizer:
+    """Turns Annex-B access units into interleaved RTP packets as lists of buffers."""
+
+    def __init__(self, max_payload: int = 1400, channel: int = 0) -> None:
+        self.max_payload = max_payload
+        self._channel = channel
+        self._seq = int.from_bytes(os.urandom(2), "big")
+        self._ssrc = int.from_bytes(os.urandom(4), "big")
+        self._ts_base = int.from_bytes(os.urandom(4), "big")
+
+    def rtp_timestamp(self, timestamp_us: int) -> int:
+        return (self._ts_base + timestamp_us * _CLOCK // 1_000_000) & 0xFFFFFFFF
+
+    def packetize(self, frame: bytes, timestamp_us: int) -> List[memoryview]:
+        """Return [prefix, payload, prefix, payload, ...] for one access unit."""
+        nals = [n for n in h264.iter_nal_units(frame) if h264.nal_type(n) != h264.NAL_AUD]
+        ts = self.rtp_timestamp(timestamp_us)
+        bufs: List[memoryview] = []
+        for i, nal in enumerate(nals):
+            last_nal = i == len(nals) - 1
+            if len(nal) <= self.max_payload:
+                bufs += (self._prefix(len(nal), ts, last_nal, b""), nal)
+                continue
+            # FU-A: indicator keeps F/NRI with type 28, header carries S/E and the real type.
+            indicator = (nal[0] & 0xE0) | 28
+            kind = nal[0] & 0x1F
+            body = nal[1:]
+            chunk = self.max_payload - 2
+            for off in range(0, len(body), chunk):
+                start, end = off == 0, off + chunk >= len(body)
+                fu = bytes((indicator, (0x80 if start else 0) | (0x40 if end else 0) | kind))
+                piece = body[off:off + chunk]
+                bufs += (self._prefix(len(piece) + 2, ts, last_nal and end, fu), piece)
+        return bufs
+
+    def _prefix(self, payload_len: int, ts: int, marker: bool, extra: bytes) -> memoryview:
+        self._seq = (self._seq + 1) & 0xFFFF
+        rtp_len = 12 + payload_len
+        hdr = struct.pack("!cBHBBHII", b"$", self._channel, rtp_len,
+                          0x80, (0x80 if marker else 0) | _PT, self._seq, ts, self._ssrc)
+        return memoryview(hdr + extra)
+
+
+# ---------- RTSP client ----------
+class RtspClient:
+    """Blocking RTSP RECORD session on one TCP connection."""
+
+    def __init__(self, host: str, port: int, path: str, timeout: float = 5.0) -> None:
+        self.url = f"rtsp://{host}:{port}/{path}"
+        self._addr = (host, port)
+        self._timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._cseq = 0
+        self._session: Optional[str] = None
+
+    def connect(self) -> None:
+        # The timeout also bounds payload writes, so a wedged hub surfaces as an error.
+        sock = socket.create_connection(self._addr, timeout=self._timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._session = None
+        self.request("OPTIONS", self.url)
+
+    def announce(self, sdp: str) -> None:
+        self.request("ANNOUNCE", self.url, {"Content-Type": "application/sdp"}, sdp.encode())
+        _, headers = self.request("SETUP", f"{self.url}/trackID=0",
+                                  {"Transport": "RTP/AVP/TCP;unicast;interleaved=0-1;mode=record"})
+        self._session = headers.get("session", "").split(";")[0] or None
+        self.request("RECORD", self.url, {"Range": "npt=0.000-"})
+
+    def send(self, bufs: List[memoryview]) -> int:
+        sent = 0
+        for i in range(0, len(bufs), _IOV_MAX):
+            batch = bufs[i:i + _IOV_MAX]
+            total = sum(len(b) for b in batch)
+            n = self._sock.sendmsg(batch)
+            while n < total:  # partial write: fall back to sendall for the remainder
+                joined = b"".join(bytes(b) for b in batch)
+                self._sock.sendall(joined[n:])
+                n = total
+            sent += total
+        return sent
+
+    def drain(self) -> None:
+        """Discard whatever the server sent us (RTCP receiver reports)."""
+        # Poll first: with a socket timeout set, recv() would wait for data even with MSG_DONTWAIT.
+        while select.select([self._sock], [], [], 0)[0]:
+            if not self._sock.recv(4096):
+                return
+
+    def close(self) -> None:
+        if self._sock is None:
+            return
+        try:
+            if self._session:
+                self._send_request("TEARDOWN", self.url, {})
+        except OSError:
+            pass
+        try:
+            self._sock.close()
+        finally:
+            self._sock = None
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                body: bytes = b"") -> Tuple[int, Dict[str, str]]:
+        self._send_request(method, url, headers or {}, body)
+        status, resp = self._read_response()
+        if status == 401:
+            raise RtspError(f"{method} {url}: hub requires authentication, which is not supported")
+        if status != 200:
+            raise RtspError(f"{method} {url} failed with status {status}")
+        return status, resp
+
+    def _send_request(self, method: str, url: str, headers: Dict[str, str], body: bytes = b"") -> None:
+        self._cseq += 1
+        lines = [f"{method} {url} RTSP/1.0", f"CSeq: {self._cseq}", "User-Agent: PiSecureKit"]
+        if self._session:
+            lines.append(f"Session: {self._session}")
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        self._sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+    def _read_response(self) -> Tuple[int, Dict[str, str]]:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("RTSP server closed the connection")
+            data += chunk
+            if data.startswith(b"$"):  # interleaved packet ahead of the reply; skip it
+                size = struct.unpack("!H", data[2:4])[0] if len(data) >= 4 else 0
+                if len(data) >= 4 + size:
+                    data = data[4 + size:]
+        head, _, rest = data.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {}
+        for line in lines[1:]:
+            k, _, v = line.partition(":")
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get("content-length", "0") or 0)
+        while len(rest) < length:
+            chunk = self._sock.recv(length - len(rest))
+            if not chunk:
+                raise ConnectionError("RTSP server closed the connection mid-reply")
+            rest += chunk
+        return status, headers
+
+
+def build_sdp(host: str, sps: Optional[bytes], pps: Optional[bytes]) -> str:
+    fmtp = "packetization-mode=1"
+    if sps:
+        fmtp += f";profile-level-id={sps[1:4].hex().upper()}"
+        if pps:
+            sets = ",".join(base64.b64encode(p).decode() for p in (sps, pps))
+            fmtp += f";sprop-parameter-sets={sets}"
+    return "\r\n".join([
+        "v=0",
+        f"o=- 0 0 IN IP4 {host}",
+        "s=PiSecureKit",
+        f"c=IN IP4 {host}",
+        "t=0 0",
+        f"m=video 0 RTP/AVP {_PT}",
+        f"a=rtpmap:{_PT} H264/{_CLOCK}",
+        f"a=fmtp:{_PT} {fmtp}",
+        "a=control:trackID=0",
+        "",
+    ])
+
+
+# ---------- Encoder output ----------
+class RtspOutput(EncodedOutput):
+    """
+    Drop-in for `FfmpegOutput(... -f rtsp url)` without the ffmpeg process.
+
+    `start()` opens the connection (raising if the hub is unreachable); the session is announced
+    on the first keyframe so the SDP can carry SPS/PPS. Network failures are reported through
+    `error_callback`, like FfmpegOutput. An optional `tracer` (latency_trace.LatencyTracer)
+    gets the send_start/sent stages.
+    """
+
+    def __init__(self, host: str, port: int, path: str, max_payload: int = 1400,
+                 queue_max_bytes: int = 4 << 20, tracer=None) -> None:
+        super().__init__()
+        self.error_callback = None
+        self._host = host
+        self._client = RtspClient(host, port, path)
+        self._packetizer = H264Packetizer(max_payload)
+        self._queue: "queue.SimpleQueue[object]" = queue.SimpleQueue()
+        self._queue_max = queue_max_bytes
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._dropping = False
+        self._broken = False
+        self._thread: Optional[threading.Thread] = None
+        self._tracer = tracer
+        self._stats: Dict[str, int] = {"frames_sent": 0, "packets_sent": 0, "bytes_sent": 0, "frames_dropped": 0}
+
+    def start(self) -> None:
+        self._client.connect()
+        self._broken = False
+        self._thread = threading.Thread(target=self._sender, name="rtsp-sender", daemon=True)
+        self._thread.start()
+        super().start()
+        LOG.info("Publishing to %s (native RTSP)", self._client.url)
+
+    def stop(self) -> None:
+        super().stop()
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._client.close()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+        if audio or not self.recording or self._broken:
+            return
+        with self._lock:
+            if (self._dropping and not keyframe) or self._queued + len(frame) > self._queue_max:
+                self._dropping = True
+                self._stats["frames_dropped"] += 1
+                return
+            self._dropping = False
+            self._queued += len(frame)
+        if timestamp is None:
+            timestamp = time.monotonic_ns() // 1000
+        self._queue.put((frame, keyframe, timestamp))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._stats)
+            out["queue_bytes"] = self._queued
+            return out
+
+    def _sender(self) -> None:
+        announced = False
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    return
+                frame, keyframe, ts = item  # type: ignore[misc]
+                with self._lock:
+                    self._queued -= len(frame)
+                if not announced:
+                    if not keyframe:
+                        continue
+                    self._client.announce(build_sdp(self._host, *_parameter_sets(frame)))
+                    announced = True
+                if self._tracer is not None:
+                    self._tracer.mark("send_start", ts)
+                bufs = self._packetizer.packetize(frame, ts)
+                sent = self._client.send(bufs)
+                if self._tracer is not None:
+                    self._tracer.mark("sent", ts)
+                self._client.drain()
+                with self._lock:
+                    self._stats["frames_sent"] += 1
+                    self._stats["packets_sent"] += len(bufs) // 2
+                    self._stats["bytes_sent"] += sent
+        except (OSError, RtspError) as e:
+            self._broken = True
+            LOG.warning("RTSP publish to %s failed: %s", self._client.url, e)
+            if self.error_callback:
+                self.error_callback(e)
+
+
+def _parameter_sets(frame: bytes) -> Tuple[Optional[bytes], Optional[bytes]]:
+    sps = pps = None
+    for nal in h264.iter_nal_units(frame):
+        kind = h264.nal_type(nal)
+        if kind == h264.NAL_SPS:
+            sps = bytes(nal)
+        elif kind == h264.NAL_PPS:
+            pps = bytes(nal)
+    return sps, pps
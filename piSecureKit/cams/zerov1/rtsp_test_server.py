@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Stand-in RTSP receiver for tests and benchmarks (a tiny subset of what mediamtx does).
+
+Accepts publishers doing OPTIONS/ANNOUNCE/SETUP/RECORD with TCP-interleaved RTP, depacketizes
+H.264 (single NAL, STAP-A, FU-A) and keeps the received access units per path. `stop()` drops
+every connection abruptly, like a hub restart; `start()` brings it back on the same port.
+
+    python3 rtsp_test_server.py --port 8554
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+LOG = logging.getLogger("PiSecureKit.rtsp_test_server")
+
+
+@dataclass
+class ReceivedStream:
+    path: str
+    sdp: str = ""
+    packets: int = 0
+    bytes: int = 0
+    # (rtp_timestamp, annex-b access unit, monotonic receive time)
+    access_units: List[Tuple[int, bytes, float]] = field(default_factory=list)
+    sessions: int = 0
+
+
+class _Depacketizer:
+    """RFC 6184 packetization modes 0/1 -> Annex-B access units, split on the marker bit."""
+
+    def __init__(self) -> None:
+        self._nals: List[bytes] = []
+        self._fu = bytearray()
+
+    def push(self, payload: bytes) -> Optional[Tuple[int, bytes]]:
+        if len(payload) < 12:
+            return None
+        cc = payload[0] & 0x0F
+        ext = payload[0] & 0x10
+        marker = payload[1] & 0x80
+        ts = struct.unpack_from("!I", payload, 4)[0]
+        off = 12 + 4 * cc
+        if ext:
+            ext_len = struct.unpack_from("!H", payload, off + 2)[0]
+            off += 4 + 4 * ext_len
+        body = payload[off:]
+        if not body:
+            return None
+        kind = body[0] & 0x1F
+        if kind == 24:  # STAP-A
+            i = 1
+            while i + 2 <= len(body):
+                n = struct.unpack_from("!H", body, i)[0]
+                self._nals.append(bytes(body[i + 2:i + 2 + n]))
+                i += 2 + n
+        elif kind == 28:  # FU-A
+            start, end = body[1] & 0x80, body[1] & 0x40
+            if start:
+                self._fu = bytearray([(body[0] & 0xE0) | (body[1] & 0x1F)])
+            self._fu += body[2:]
+            if end:
+                self._nals.append(bytes(self._fu))
+                self._fu = bytearray()
+        else:
+            self._nals.append(bytes(body))
+        if marker and self._nals:
+            au = b"".join(b"\x00\x00\x00\x01" + n for n in self._nals)
+            self._nals = []
+            return ts, au
+        return None
+
+
+class RtspTestServer:
+    """Threaded RTSP RECORD receiver; see module docstring."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, keep_access_units: int = 10_000) -> None:
+        self.host = host
+        self.port = port
+        self.keep_access_units = keep_access_units
+        self.streams: Dict[str, ReceivedStream] = {}
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._conns: List[socket.socket] = []
+        self._thread: Optional[threading.Thread] = None
+        self._session_ids = 0
+
+    # -- lifecycle --
+    def start(self) -> "RtspTestServer":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(16)
+        self.port = sock.getsockname()[1]
+        self._sock = sock
+        self._thread = threading.Thread(target=self._accept_loop, args=(sock,), name="rtsp-test-accept", daemon=True)
+        self._thread.start()
+        LOG.info("RTSP test server listening on %s:%d", self.host, self.port)
+        return self
+
+    def stop(self) -> None:
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for c in conns:
+            try:
+                c.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            c.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def __enter__(self) -> "RtspTestServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def url(self, path: str) -> str:
+        return f"rtsp://{self.host}:{self.port}/{path}"
+
+    def stream(self, path: str) -> ReceivedStream:
+        with self._lock:
+            return self.streams.setdefault(path, ReceivedStream(path))
+
+    def wait_for(self, path: str, access_units: int, timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if len(self.stream(path).access_units) >= access_units:
+                return True
+            time.sleep(0.01)
+        return False
+
+    # -- connection handling --
+    def _accept_loop(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), name="rtsp-test-conn", daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        reader = conn.makefile("rb")
+        stream: Optional[ReceivedStream] = None
+        depack = _Depacketizer()
+        try:
+            while True:
+                first = reader.read(1)
+                if not first:
+                    return
+                if first == b"$":
+                    hdr = reader.read(3)
+                    if len(hdr) < 3:
+                        return
+                    channel, size = hdr[0], struct.unpack("!H", hdr[1:])[0]
+                    payload = reader.read(size)
+                    if stream is None or channel != 0:
+                        continue  # RTCP or data before SETUP
+                    stream.packets += 1
+                    stream.bytes += len(payload)
+                    au = depack.push(payload)
+                    if au is not None:
+                        stream.access_units.append((au[0], au[1], time.monotonic()))
+                        if len(stream.access_units) > self.keep_access_units:
+                            del stream.access_units[:len(stream.access_units) // 2]
+                    continue
+                stream = self._handle_request(conn, reader, first, stream)
+        except (OSError, ValueError):
+            return
+        finally:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _handle_request(self, conn: socket.socket, reader, first: bytes,
+                        stream: Optional[ReceivedStream]) -> Optional[ReceivedStream]:
+        line = (first + reader.readline()).decode("latin-1").strip()
+        method, uri, _ = line.split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            h = reader.readline().decode("latin-1").strip()
+            if not h:
+                break
+            k, _, v = h.partition(":")
+            headers[k.strip().lower()] = v.strip()
+        body = reader.read(int(headers.get("content-length", "0") or 0))
+        path = uri.split("://", 1)[-1].split("/", 1)[-1].split("?")[0]
+        path = path.split("/trackID")[0].split("/streamid")[0].rstrip("/")
+        extra = ""
+        if method == "OPTIONS":
+            extra = "Public: OPTIONS, ANNOUNCE, SETUP, RECORD, TEARDOWN\r\n"
+        elif method == "ANNOUNCE":
+            stream = self.stream(path)
+            stream.sdp = body.decode("latin-1")
+        elif method == "SETUP":
+            stream = stream or self.stream(path)
+            with self._lock:
+                self._session_ids += 1
+                sid = self._session_ids
+            transport = headers.get("transport", "RTP/AVP/TCP;unicast;interleaved=0-1")
+            extra = f"Transport: {transport}\r\nSession: {sid:08d};timeout=60\r\n"
+        elif method == "RECORD":
+            if stream is not None:
+                stream.sessions += 1
+        elif method == "TEARDOWN":
+            pass
+        else:
+            conn.sendall(f"RTSP/1.0 501 Not Implemented\r\nCSeq: {headers.get('cseq', '0')}\r\n\r\n".encode())
+            return stream
+        conn.sendall(f"RTSP/1.0 200 OK\r\nCSeq: {headers.get('cseq', '0')}\r\n{extra}\r\n".encode())
+        return stream
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Stand-in RTSP receiver (prints per-path stats).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8554)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    with RtspTestServer(args.host, args.port) as server:
+        try:
+            while True:
+                time.sleep(5)
+                for s in list(server.streams.values()):
+                    LOG.info("%s: %d AUs, %d packets, %.1f kB", s.path, len(s.access_units), s.packets, s.bytes / 1e3)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,430 @@
+"""
+Snapshot pipeline: grab a YUV420 frame on the service loop, JPEG-encode it on worker threads.
+
+Grabbing is a buffer copy; everything expensive (downscaling, encoding, writing) happens off the
+loop. Workers only ever pick up the newest grab, so a slow encode drops stale snapshots instead of
+queueing them. Every size (full, medium, thumbnail, ...) is produced from one grab in one pass.
+The encoded JPEGs are also kept in a SnapshotStore, so HTTP clients are served from memory.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+
+LOG = logging.getLogger("PiSecureKit.snapshots")
+
+try:
+    import simplejpeg
+    SIMPLEJPEG_AVAILABLE = True
+except ImportError:
+    SIMPLEJPEG_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+JPEG_AVAILABLE = SIMPLEJPEG_AVAILABLE or PIL_AVAILABLE
+
+
+# ---------- Config ----------
+@dataclass(frozen=True)
+class SnapshotSize:
+    name: str
+    width: int = 0   # 0 keeps the source size
+    height: int = 0
+    quality: int = 85
+
+
+@dataclass(frozen=True)
+class SnapshotConfig:
+    sizes: Tuple[SnapshotSize, ...] = (
+        SnapshotSize("full", quality=85),
+        SnapshotSize("medium", 640, 480, quality=80),
+        SnapshotSize("thumb", 160, 120, quality=70),
+    )
+    workers: int = 2
+    write_files: bool = True  # also write JPEGs next to the destination (for file-reading dashboards)
+    burst_quality: int = 90
+    burst_max_frames: int = 30  # per burst, and burst frames waiting to be saved (each a YUV copy)
+    burst_memory_share: float = 0.25  # of MemAvailable those waiting copies may take; lowers the above
+
+
+# ---------- Frames ----------
+@dataclass
+class YuvFrame:
+    """Planar 4:2:0 image; planes may be views into a larger (copied) buffer."""
+    y: np.ndarray
+    u: np.ndarray
+    v: np.ndarray
+    timestamp: float = 0.0
+
+    @property
+    def width(self) -> int:
+        return self.y.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.y.shape[0]
+
+
+def yuv420_planes(array: np.ndarray, width: int, height: int, timestamp: float = 0.0) -> YuvFrame:
+    """Split Picamera2's YUV420 `make_array` layout, shape (height * 3/2, stride), into planes."""
+    stride = array.shape[1]
+    y = array[:height, :width]
+    # Chroma rows are half the stride, two of them packed per array row.
+    chroma = array[height:].reshape(-1, stride // 2)
+    u = chroma[:height // 2, :width // 2]
+    v = chroma[height // 2:height, :width // 2]
+    return YuvFrame(y, u, v, timestamp)
+
+
+def downscale_plane(plane: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Resize one 8-bit plane: box-average by the integer part of the ratio, then nearest-sample the
+    remainder. Vectorised; good enough for previews and much cheaper than a full resampler.
+    """
+    src_h, src_w = plane.shape
+    fy, fx = max(src_h // height, 1), max(src_w // width, 1)
+    if fy > 1 or fx > 1:
+        h, w = src_h // fy * fy, src_w // fx * fx
+        boxes = plane[:h, :w].reshape(h // fy, fy, w // fx, fx)
+        plane = boxes.mean(axis=(1, 3), dtype=np.float32).astype(np.uint8)
+    if plane.shape != (height, width):
+        rows = np.arange(height) * plane.shape[0] // height
+        cols = np.arange(width) * plane.shape[1] // width
+        plane = plane[rows[:, None], cols]
+    return plane
+
+
+def downscale(frame: YuvFrame, width: int, height: int) -> YuvFrame:
+    width, height = width & ~1, height & ~1  # 4:2:0 needs even dimensions
+    if (width, height) == (frame.width, frame.height):
+        return frame
+    return YuvFrame(downscale_plane(frame.y, width, height),
+                    downscale_plane(frame.u, width // 2, height // 2),
+                    downscale_plane(frame.v, width // 2, height // 2),
+                    frame.timestamp)
+
+
+def crop(frame: YuvFrame, x: int, y: int, width: int, height: int) -> YuvFrame:
+    """Views of a region of `frame` (no copy); the rectangle is snapped to even pixels for 4:2:0."""
+    x, y, width, height = x & ~1, y & ~1, max(width & ~1, 2), max(height & ~1, 2)
+    return YuvFrame(frame.y[y:y + height, x:x + width],
+                    frame.u[y // 2:(y + height) // 2, x // 2:(x + width) // 2],
+                    frame.v[y // 2:(y + height) // 2, x // 2:(x + width) // 2],
+                    frame.timestamp)
+
+
+# ---------- JPEG ----------
+def encode_jpeg(frame: YuvFrame, quality: int) -> bytes:
+    """YUV420 planes to JPEG; simplejpeg encodes the planes directly, Pillow needs RGB first."""
+    if SIMPLEJPEG_AVAILABLE:
+        return simplejpeg.encode_jpeg_yuv_planes(
+            np.ascontiguousarray(frame.y), np.ascontiguousarray(frame.u), np.ascontiguousarray(frame.v),
+            quality)
+    if PIL_AVAILABLE:
+        buf = io.BytesIO()
+        Image.fromarray(yuv420_to_rgb(frame)).save(buf, "JPEG", quality=quality)
+        return buf.getvalue()
+    raise RuntimeError("No JPEG encoder available (install simplejpeg or Pillow).")
+
+
+def yuv420_to_rgb(frame: YuvFrame) -> np.ndarray:
+    """BT.601 full-range conversion with chroma upsampled by repetition."""
+    h, w = frame.height, frame.width
+    y = frame.y.astype(np.float32)
+    u = frame.u.repeat(2, axis=0).repeat(2, axis=1)[:h, :w].astype(np.float32) - 128.0
+    v = frame.v.repeat(2, axis=0).repeat(2, axis=1)[:h, :w].astype(np.float32) - 128.0
+    rgb = np.empty((h, w, 3), dtype=np.float32)
+    rgb[..., 0] = y + 1.402 * v
+    rgb[..., 1] = y - 0.344136 * u - 0.714136 * v
+    rgb[..., 2] = y + 1.772 * u
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Readers of `path` see either the previous snapshot or the new one, never a partial file."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def snapshot_paths(destination: Path, cfg: SnapshotConfig) -> Dict[str, Path]:
+    """The first size is written to `destination`; others get `-<name>` before the suffix."""
+    paths = {}
+    for i, size in enumerate(cfg.sizes):
+        paths[size.name] = destination if i == 0 else destination.with_name(
+            f"{destination.stem}-{size.name}{destination.suffix}")
+    return paths
+
+
+# ---------- In-memory store ----------
+@dataclass(frozen=True)
+class Jpeg:
+    seq: int
+    data: bytes
+    etag: str
+    timestamp: float = 0.0
+
+
+class SnapshotStore:
+    """
+    Newest JPEG per size, shared with the HTTP server. Encoder threads `put`; long-polling
+    handlers `await wait_newer` and are woken on their own event loop, so idle clients cost a
+    parked future each.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Jpeg] = {}
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        # ETags outlive a restart in client caches; the epoch keeps a new run's seq 1 distinct
+        self._epoch = f"{time.time_ns() // 1_000_000:x}"
+
+    def put(self, name: str, seq: int, data: bytes, timestamp: float = 0.0) -> None:
+        jpeg = Jpeg(seq, data, f'"{self._epoch}-{seq}"', timestamp)
+        with self._lock:
+            current = self._latest.get(name)
+            if current is not None and current.seq > seq:
+                return
+            self._latest[name] = jpeg
+            waiters, self._waiters = self._waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def get(self, name: str) -> Optional[Jpeg]:
+        with self._lock:
+            return self._latest.get(name)
+
+    async def wait_newer(self, name: str, seen: Collection[str], timeout: float) -> Optional[Jpeg]:
+        """First JPEG for `name` whose ETag is not in `seen`; None if none arrives within `timeout`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            fut = loop.create_future()
+            with self._lock:
+                current = self._latest.get(name)
+                if current is not None and current.etag not in seen:
+                    return current
+                self._waiters.append((loop, fut))
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(fut, remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+# ---------- Pipeline ----------
+# One grab: the main stream and, when configured, the lores stream (a cheaper downscale source).
+Grab = List[YuvFrame]
+
+
+class SnapshotPipeline:
+    """Worker pool encoding the newest grab into every configured size."""
+
+    def __init__(self, cfg: SnapshotConfig, destination: Path,
+                 encode: Callable[[YuvFrame, int], bytes] = encode_jpeg,
+                 store: Optional[SnapshotStore] = None) -> None:
+        self._cfg = cfg
+        self._paths = snapshot_paths(destination, cfg)
+        self._encode = encode
+        self._store = store
+        self._cond = threading.Condition()
+        self._pending: Optional[Tuple[int, Grab]] = None
+        self._seq = 0
+        self._written_seq: Dict[str, int] = {}
+        # One per size: orders the writers of one file without holding up submit()
+        self._write_locks = {size.name: threading.Lock() for size in cfg.sizes}
+        self._closed = False
+        self._stats: Dict[str, float] = {"submitted": 0, "encoded": 0, "dropped": 0, "failed": 0,
+                                         "last_encode_ms": 0.0}
+        if cfg.write_files:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+        self._threads = [threading.Thread(target=self._worker, name=f"snapshot-{i}", daemon=True)
+                         for i in range(max(cfg.workers, 1))]
+        for t in self._threads:
+            t.start()
+
+    @property
+    def paths(self) -> Dict[str, Path]:
+        return dict(self._paths)
+
+    def submit(self, grab: Grab) -> None:
+        """Hand over a grab; replaces (drops) one no worker has picked up yet. Never blocks."""
+        with self._cond:
+            if self._pending is not None:
+                self._stats["dropped"] += 1
+            self._seq += 1
+            self._stats["submitted"] += 1
+            self._pending = (self._seq, grab)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            out = dict(self._stats)
+            out["pending"] = int(self._pending is not None)
+            return out
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                seq, grab = self._pending
+                self._pending = None
+            t0 = time.perf_counter()
+            try:
+                self._render(seq, grab)
+            except Exception as e:
+                LOG.warning("Snapshot encode failed: %s", e)
+                with self._cond:
+                    self._stats["failed"] += 1
+                continue
+            with self._cond:
+                self._stats["encoded"] += 1
+                self._stats["last_encode_ms"] = (time.perf_counter() - t0) * 1000
+
+    def _render(self, seq: int, grab: Grab) -> None:
+        for size in self._cfg.sizes:
+            source = _pick_source(grab, size)
+            w, h = (size.width, size.height) if size.width else (source.width, source.height)
+            data = self._encode(downscale(source, w, h), size.quality)
+            with self._write_locks[size.name]:
+                with self._cond:
+                    # Another worker may already have written a newer grab; never go backwards.
+                    if self._written_seq.get(size.name, 0) > seq:
+                        continue
+                    self._written_seq[size.name] = seq
+                if self._store is not None:
+                    self._store.put(size.name, seq, data, source.timestamp)
+                if self._cfg.write_files:
+                    write_atomic(self._paths[size.name], data)
+
+
+def _pick_source(grab: Grab, size: SnapshotSize) -> YuvFrame:
+    """Smallest frame in the grab that is still at least as large as the requested size."""
+    if not size.width:
+        return grab[0]
+    fits = [f for f in grab if f.width >= size.width and f.height >= size.height]
+    return min(fits, key=lambda f: f.width * f.height) if fits else grab[0]
+
+
+# ---------- Bursts ----------
+class BurstSaver:
+    """
+    Encodes burst stills at full size on a worker pool and writes them to `directory`. Unlike the
+    preview pipeline nothing accepted is dropped; instead `reserve` refuses a burst that would leave
+    more than `max_pending` frames waiting. It is called before the frames are grabbed, so the
+    YUV copies held in memory are bounded even while a refused burst would have been copying.
+    """
+
+    def __init__(self, directory: Path, quality: int = 90, workers: int = 2, max_pending: int = 30,
+                 encode: Callable[[YuvFrame, int], bytes] = encode_jpeg) -> None:
+        self._directory = directory
+        self._quality = quality
+        self._max_pending = max_pending
+        self._encode = encode
+        self._cond = threading.Condition()
+        self._pending = 0   # frames reserved or being saved
+        self._reserved = 0  # of those, reserved but not handed to `save` yet
+        self._stats: Dict[str, float] = {"bursts": 0, "saved": 0, "failed": 0, "rejected": 0, "bytes": 0,
+                                         "encode_sec": 0.0}
+        directory.mkdir(parents=True, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="burst")
+
+    def reserve(self, count: int) -> None:
+        """Claim `count` pending slots before grabbing; `save` fills them, `release` returns the unused."""
+        with self._cond:
+            if self._pending + count > self._max_pending:
+                self._stats["rejected"] += 1
+                raise RuntimeError(f"{self._pending} burst frames are still being saved")
+            self._pending += count
+            self._reserved += count
+
+    def release(self, count: int) -> None:
+        """Give back reserved slots no grab was saved into (a short or failed grab)."""
+        if count <= 0:
+            return
+        with self._cond:
+            if count > self._reserved:
+                raise RuntimeError(f"releasing {count} burst slots, {self._reserved} reserved")
+            self._reserved -= count
+            self._pending -= count
+            self._cond.notify_all()
+
+    def save(self, grabs: List[Grab], stem: str) -> List[Path]:
+        """
+        Queue one still per grab as `<stem>-NN.jpg`, into slots taken with `reserve`; returns the
+        paths they will be written to.
+        """
+        with self._cond:
+            if len(grabs) > self._reserved:
+                raise RuntimeError(f"saving {len(grabs)} burst frames, {self._reserved} slots reserved")
+            self._reserved -= len(grabs)
+            self._stats["bursts"] += 1
+        paths = [self._directory / f"{stem}-{i:02d}.jpg" for i in range(len(grabs))]
+        for grab, path in zip(grabs, paths):
+            self._pool.submit(self._write, grab[0], path)
+        return paths
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Until every queued frame is written; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {**self._stats, "pending": self._pending}
+
+    def _write(self, frame: YuvFrame, path: Path) -> None:
+        t0 = time.perf_counter()
+        try:
+            data = self._encode(frame, self._quality)
+            write_atomic(path, data)
+        except Exception as e:
+            LOG.warning("Burst still %s failed: %s", path.name, e)
+            data = None
+        with self._cond:
+            self._stats["encode_sec"] += time.perf_counter() - t0
+            if data is None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["saved"] += 1
+                self._stats["bytes"] += len(data)
+            self._pending -= 1
+            self._cond.notify_all()
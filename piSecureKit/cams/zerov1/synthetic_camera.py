@@ -0,0 +1,388 @@
+"""
+Hardware-free camera driver: paced frame streams from a synthetic pattern, a Y4M file or a
+recorded H.264 file, fed to the same encoder outputs (publisher, recorder) as Picamera2Driver.
+
+Raw sources (pattern, Y4M) go through `FakeH264Encoder`, which emits well-formed Annex-B access
+units sized from the configured bitrate and GOP; H.264 files are replayed as-is. Either way the
+downstream pipeline sees realistic frame sizes, keyframe cadence and timestamps.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import h264
+import snapshots
+from snapshots import YuvFrame
+
+LOG = logging.getLogger("PiSecureKit.synthetic")
+
+# Baseline-profile SPS/PPS; consumers only look at profile/level and pass them through.
+SPS = bytes.fromhex("6742c01e8c8d40501e900f08846a")
+PPS = bytes.fromhex("68ce3c80")
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    source: str = "pattern"  # "pattern", or a path to a .y4m / .h264 file
+    width: int = 1640
+    height: int = 1232
+    fps: float = 30.0
+    bitrate: int = 4_000_000  # fake encoder target; ignored when replaying H.264
+    iperiod: int = 30
+    keyframe_weight: float = 4.0  # IDR size relative to a P frame
+
+
+# ---------- Raw sources ----------
+class PatternSource:
+    """Moving diagonal gradient with a sweeping bar; frames are only rendered when grabbed."""
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width, self.height = width & ~1, height & ~1
+        self._yy, self._xx = np.ogrid[:self.height, :self.width]
+        self._index = 0
+
+    def advance(self) -> None:
+        self._index += 1
+
+    def frame(self) -> YuvFrame:
+        i = self._index
+        y = ((self._xx + self._yy + 4 * i) & 0xFF).astype(np.uint8)
+        bar = (i * 8) % self.width
+        y[:, bar:bar + 16] = 235
+        u = np.full((self.height // 2, self.width // 2), (64 + i) & 0xFF, dtype=np.uint8)
+        v = np.full((self.height // 2, self.width // 2), (192 - i) & 0xFF, dtype=np.uint8)
+        return YuvFrame(y, u, v, time.time())
+
+
+class Y4mSource:
+    """Reads 4:2:0 YUV4MPEG2 frames, looping at end of file."""
+
+    def __init__(self, path: Path) -> None:
+        self._f = open(path, "rb")
+        header = self._f.readline().decode("ascii").split()
+        if not header or header[0] != "YUV4MPEG2":
+            raise ValueError(f"{path} is not a YUV4MPEG2 file")
+        params = {p[0]: p[1:] for p in header[1:]}
+        if not params.get("C", "420").startswith("420"):
+            raise ValueError(f"{path}: only 4:2:0 Y4M is supported, got C{params['C']}")
+        self.width, self.height = int(params["W"]), int(params["H"])
+        self._data_start = self._f.tell()
+        self._frame_bytes = self.width * self.height * 3 // 2
+        self._current: Optional[np.ndarray] = None
+
+    def advance(self) -> None:
+        line = self._f.readline()
+        if not line:
+            self._f.seek(self._data_start)
+            line = self._f.readline()
+        if not line.startswith(b"FRAME"):
+            raise ValueError("Y4M stream is corrupt (missing FRAME marker)")
+        self._current = np.frombuffer(self._f.read(self._frame_bytes), dtype=np.uint8)
+
+    def frame(self) -> YuvFrame:
+        if self._current is None:
+            self.advance()
+        w, h = self.width, self.height
+        buf = self._current
+        y = buf[:w * h].reshape(h, w)
+        u = buf[w * h:w * h * 5 // 4].reshape(h // 2, w // 2)
+        v = buf[w * h * 5 // 4:].reshape(h // 2, w // 2)
+        return YuvFrame(y, u, v, time.time())
+
+    def close(self) -> None:
+        self._f.close()
+
+
+# ---------- Encoded frames ----------
+class FakeH264Encoder:
+    """
+    Annex-B access units with H.264 encoder-like sizes: GOPs of `iperiod` frames averaging
+    `bitrate`, with IDRs (plus SPS/PPS) `keyframe_weight` times larger than P frames.
+
+    Slice payloads start with the frame index as 8 hex digits so benchmarks can match what a
+    receiver got to what was sent; payload bytes are never zero, so no start-code emulation.
+    """
+
+    def __init__(self, bitrate: int, fps: float, iperiod: int, keyframe_weight: float = 4.0) -> None:
+        self._fps = fps
+        self._iperiod = max(iperiod, 1)
+        self._keyframe_weight = keyframe_weight
+        self._pool = b""
+        self.set_bitrate(bitrate)
+        self._index = 0
+        self._gop_start = 0
+        self._force_key = False
+
+    def set_bitrate(self, bitrate: int) -> None:
+        gop_bytes = bitrate / 8 * self._iperiod / self._fps
+        self.bitrate = bitrate
+        self.p_bytes = max(int(gop_bytes / (self._iperiod - 1 + self._keyframe_weight)), 16)
+        self.i_bytes = int(self.p_bytes * self._keyframe_weight)
+        if len(self._pool) < self.i_bytes * 2:
+            pool = bytearray(os.urandom(self.i_bytes * 2))
+            self._pool = bytes(b or 0xFF for b in pool)
+
+    def force_key_frame(self) -> None:
+        """The next frame is an IDR and starts a new GOP."""
+        self._force_key = True
+
+    def encode(self) -> Tuple[bytes, bool]:
+        i = self._index
+        self._index += 1
+        if self._force_key:
+            self._force_key = False
+            self._gop_start = i
+        keyframe = (i - self._gop_start) % self._iperiod == 0
+        size = self.i_bytes if keyframe else self.p_bytes
+        off = (i * 7919) % (len(self._pool) - size)
+        body = b"%08x" % (i & 0xFFFFFFFF) + self._pool[off:off + size]
+        if keyframe:
+            return b"".join((h264.START_CODE, SPS, h264.START_CODE, PPS,
+                             h264.START_CODE, b"\x65\x88", body)), True
+        return h264.START_CODE + b"\x41\x9a" + body, False
+
+    @staticmethod
+    def frame_index(frame: bytes) -> Optional[int]:
+        """Index stamped by `encode`, or None for access units from elsewhere."""
+        for nal in h264.iter_nal_units(frame):
+            if h264.nal_type(nal) in (h264.NAL_IDR, h264.NAL_SLICE):
+                try:
+                    return int(bytes(nal[2:10]), 16)
+                except ValueError:
+                    return None
+        return None
+
+
+class H264Replay:
+    """Loops over the access units of an Annex-B file."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._f: Optional[BinaryIO] = None
+        self._it: Optional[Iterator[Tuple[bytes, bool]]] = None
+
+    def encode(self) -> Tuple[bytes, bool]:
+        for _ in range(2):
+            if self._it is None:
+                self._f = open(self._path, "rb")
+                self._it = h264.iter_access_units(self._f)
+            au = next(self._it, None)
+            if au is not None:
+                return au
+            self.close()
+        raise ValueError(f"{self._path} contains no H.264 access units")
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+        self._f = self._it = None
+
+
+# ---------- Driver ----------
+class SyntheticCamera:
+    """
+    CameraDriver that drives `outputs` (picamera2-style Output objects) from a paced thread.
+    With `lq_outputs`, a second fake encoder (own bitrate and GOP) feeds them the same frames,
+    like a simulcast encoder on the lores stream; not available when replaying H.264.
+    `publisher`, `lq_publisher` and `recorder` name the outputs among those whose stats (and
+    on-demand mode) status() reports, under the same keys as Picamera2Driver.
+    """
+
+    def __init__(self, cfg: SyntheticConfig, outputs: List[Any], lq_outputs: Optional[List[Any]] = None,
+                 lq_bitrate: int = 500_000, lq_iperiod: int = 60, publisher: Optional[Any] = None,
+                 lq_publisher: Optional[Any] = None, recorder: Optional[Any] = None) -> None:
+        self._cfg = cfg
+        self._outputs = outputs
+        self._publisher = publisher
+        self._recorder = recorder
+        self._raw: Optional[Any] = None
+        path = Path(cfg.source)
+        if cfg.source == "pattern":
+            self._raw = PatternSource(cfg.width, cfg.height)
+        elif path.suffix == ".y4m":
+            self._raw = Y4mSource(path)
+        if self._raw is not None:
+            self._encoder: Any = FakeH264Encoder(cfg.bitrate, cfg.fps, cfg.iperiod, cfg.keyframe_weight)
+        else:
+            self._encoder = H264Replay(path)
+        self._lq_encoder: Optional[FakeH264Encoder] = None
+        self._lq_outputs: List[Any] = []
+        if lq_outputs is not None and self._raw is not None:
+            self._lq_encoder = FakeH264Encoder(lq_bitrate, cfg.fps, lq_iperiod, cfg.keyframe_weight)
+            self._lq_outputs = list(lq_outputs)
+        self._lq_publisher = lq_publisher if self._lq_encoder is not None else None
+        # Publishers ask for an IDR on (re)connect, as with the hardware encoder
+        for pub, encoder in ((self._publisher, self._encoder), (self._lq_publisher, self._lq_encoder)):
+            if pub is not None and isinstance(encoder, FakeH264Encoder):
+                pub.keyframe_requester = encoder.force_key_frame
+        self._grab_lock = threading.Lock()
+        self._advanced = threading.Condition(self._grab_lock)  # notified per raw frame, for bursts
+        self._raw_frames = 0
+        self._roi: Optional[Tuple[float, float, float, float]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._t0_us: Optional[int] = None
+        # (sequence number, monotonic emit time) of recent frames, for latency benchmarks; the
+        # sequence number is what FakeH264Encoder stamps into the frame
+        self.emitted: Deque[Tuple[int, float]] = deque(maxlen=100_000)
+        self._stats: Dict[str, int] = {"frames": 0, "keyframes": 0, "bytes": 0, "late_frames": 0}
+        self._lq_stats: Dict[str, int] = {"frames": 0, "keyframes": 0, "bytes": 0}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        for out in self._outputs + self._lq_outputs:
+            out.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="synthetic-camera", daemon=True)
+        self._thread.start()
+        LOG.info("Synthetic camera: %s at %dx%d %.1f fps", self._cfg.source,
+                 self._cfg.width, self._cfg.height, self._cfg.fps)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        for out in self._outputs + self._lq_outputs:
+            out.stop()
+
+    def time_base_us(self) -> Optional[int]:
+        """Monotonic time of timestamp zero, standing in for the sensor clock (for LatencyTracer)."""
+        return self._t0_us
+
+    def capture_still(self, destination: Path) -> None:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        grab = self.grab_frame()
+        if grab is None or not snapshots.JPEG_AVAILABLE:
+            destination.write_bytes(b"\xFF\xD8\xFF\xD9")
+            return
+        snapshots.write_atomic(destination, snapshots.encode_jpeg(grab[0], 85))
+
+    def grab_frame(self) -> Optional[snapshots.Grab]:
+        if self._raw is None:
+            return None
+        with self._grab_lock:
+            frame = self._raw.frame()
+            roi = self._roi
+        if roi is not None:
+            # Digital zoom like ScalerCrop: the region scaled back up to the output size
+            x, y, w, h = roi
+            region = snapshots.crop(frame, int(x * frame.width), int(y * frame.height),
+                                    int(w * frame.width), int(h * frame.height))
+            frame = snapshots.downscale(region, frame.width, frame.height)
+        return [frame]
+
+    def grab_burst(self, count: int) -> List[snapshots.Grab]:
+        """`count` consecutive frames, each grabbed as it is produced, like successive capture_requests."""
+        if self._raw is None:
+            return []
+        grabs: List[snapshots.Grab] = []
+        with self._advanced:
+            seen = self._raw_frames
+        while len(grabs) < count:
+            with self._advanced:
+                if not self._advanced.wait_for(lambda: self._raw_frames > seen, timeout=1.0):
+                    break  # stopped
+                seen = self._raw_frames
+            grabs.append(self.grab_frame())
+        return grabs
+
+    def set_bitrate(self, bitrate: int) -> None:
+        if not isinstance(self._encoder, FakeH264Encoder):
+            raise NotImplementedError("replayed H.264 has a fixed bitrate")
+        self._encoder.set_bitrate(bitrate)
+
+    def request_keyframe(self) -> None:
+        if not isinstance(self._encoder, FakeH264Encoder):
+            raise NotImplementedError("replayed H.264 has fixed keyframes")
+        self._encoder.force_key_frame()
+
+    def set_lores(self, enabled: bool) -> None:
+        raise NotImplementedError("the synthetic camera has no lores stream")
+
+    def set_roi(self, roi: Optional[Tuple[float, float, float, float]]) -> None:
+        """Zooms grabbed frames (stills, snapshots); the encoded stream keeps its bitrate, as at a fixed output size."""
+        if self._raw is None:
+            raise NotImplementedError("replayed H.264 cannot be cropped")
+        self._roi = roi
+
+    def set_publishing(self, mode: str, simulcast: bool = False) -> None:
+        """Switch the publisher among the outputs ("live", "keepalive", "off"), or the LQ one."""
+        publisher = self._lq_publisher if simulcast else self._publisher
+        if publisher is None:
+            raise NotImplementedError(f"no {'simulcast ' if simulcast else ''}publisher to switch")
+        publisher.set_mode(mode)
+
+    def status(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"driver": "synthetic", "source": self._cfg.source,
+                               "running": self._thread is not None, "roi": {"region": self._roi}, **self._stats}
+        if isinstance(self._encoder, FakeH264Encoder):
+            out["bitrate"] = self._encoder.bitrate
+        out["simulcast"] = {"active": self._lq_encoder is not None}
+        if self._lq_encoder is not None:
+            out["simulcast"].update(self._lq_stats, bitrate=self._lq_encoder.bitrate)
+            if self._lq_publisher is not None:
+                out["simulcast"]["publisher"] = self._lq_publisher.stats()
+        if self._publisher is not None:
+            out["publisher"] = self._publisher.stats()
+        if self._recorder is not None:
+            out["recorder"] = self._recorder.stats()
+        return out
+
+    def _run(self) -> None:
+        period = 1.0 / self._cfg.fps
+        t0 = time.monotonic()
+        self._t0_us = int(t0 * 1_000_000)
+        n = 0
+        try:
+            while not self._stop.is_set():
+                deadline = t0 + n * period
+                now = time.monotonic()
+                if now < deadline:
+                    self._stop.wait(deadline - now)
+                    continue
+                behind = int((now - deadline) / period)
+                if behind:
+                    # Like a sensor, a stalled pipeline loses frames rather than bunching them.
+                    self._stats["late_frames"] += behind
+                    n += behind
+                self._emit(n)
+                n += 1
+        except Exception:
+            LOG.exception("Synthetic camera stopped")
+        finally:
+            if isinstance(self._encoder, H264Replay):
+                self._encoder.close()
+
+    def _emit(self, n: int) -> None:
+        if self._raw is not None:
+            with self._advanced:
+                self._raw.advance()
+                self._raw_frames += 1
+                self._advanced.notify_all()
+        frame, keyframe = self._encoder.encode()
+        ts = int(n * 1_000_000 / self._cfg.fps)
+        self.emitted.append((self._stats["frames"], time.monotonic()))
+        for out in self._outputs:
+            out.outputframe(frame, keyframe, ts)
+        self._stats["frames"] += 1
+        self._stats["keyframes"] += keyframe
+        self._stats["bytes"] += len(frame)
+        if self._lq_encoder is not None:
+            frame, keyframe = self._lq_encoder.encode()
+            for out in self._lq_outputs:
+                out.outputframe(frame, keyframe, ts)
+            self._lq_stats["frames"] += 1
+            self._lq_stats["keyframes"] += keyframe
+            self._lq_stats["bytes"] += len(frame)
@@ -0,0 +1,62 @@
+"""
+sd_notify(3) without libsystemd: readiness, status and watchdog pings for Type=notify units.
+
+Every call is a no-op when the process was not started by systemd (NOTIFY_SOCKET unset).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+from typing import Optional
+
+LOG = logging.getLogger("PiSecureKit.systemd")
+
+
+class Notifier:
+
+    def __init__(self, address: Optional[str] = None, watchdog_usec: Optional[int] = None) -> None:
+        self._address = address
+        self.watchdog_interval_sec: Optional[float] = watchdog_usec / 2e6 if watchdog_usec else None
+
+    @classmethod
+    def from_env(cls) -> "Notifier":
+        watchdog = os.environ.get("WATCHDOG_USEC")
+        pid = os.environ.get("WATCHDOG_PID")
+        if pid and pid != str(os.getpid()):
+            watchdog = None  # meant for another process (e.g. our supervisor)
+        return cls(os.environ.get("NOTIFY_SOCKET"), int(watchdog) if watchdog else None)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._address)
+
+    def notify(self, state: str) -> bool:
+        if not self._address:
+            return False
+        addr = self._address
+        if addr.startswith("@"):
+            addr = "\0" + addr[1:]  # abstract namespace
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as sock:
+                sock.sendto(state.encode(), addr)
+            return True
+        except OSError as e:
+            LOG.warning("sd_notify(%s) failed: %s", state.split("\n")[0], e)
+            return False
+
+    def ready(self, status: str = "") -> bool:
+        return self.notify("READY=1" + (f"\nSTATUS={status}" if status else ""))
+
+    def status(self, status: str) -> bool:
+        return self.notify(f"STATUS={status}")
+
+    def stopping(self) -> bool:
+        return self.notify("STOPPING=1")
+
+    def watchdog(self) -> bool:
+        return self.notify("WATCHDOG=1")
+
+    def extend_timeout(self, sec: float) -> bool:
+        """Still starting: push the start timeout out by `sec` and count as a watchdog ping."""
+        return self.notify(f"EXTEND_TIMEOUT_USEC={int(sec * 1e6)}\nWATCHDOG=1")
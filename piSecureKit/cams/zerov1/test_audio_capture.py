@@ -0,0 +1,161 @@
+import shutil
+import tempfile
+import time
+import unittest
+import wave
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+import audio_capture
+from audio_capture import AudioCapture, AudioConfig, AudioRing, WavSource
+
+RATE = 8000
+
+
+def _write_wav(path, samples, width=2):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(width)
+        w.setframerate(RATE)
+        w.writeframes(samples.astype("<i2" if width == 2 else "<i4").tobytes())
+
+
+def _scene(loud_at, loud_sec, total_sec):
+    """Stereo: faint noise with a 1 kHz tone burst."""
+    n = int(total_sec * RATE)
+    samples = np.random.default_rng(1).integers(-30, 30, size=(n, 2)).astype(np.int32)
+    i, j = int(loud_at * RATE), int((loud_at + loud_sec) * RATE)
+    samples[i:j] += (8000 * np.sin(2 * np.pi * 1000 * np.arange(j - i) / RATE)).astype(np.int32)[:, None]
+    return samples
+
+
+class TestLevelsAndRing(unittest.TestCase):
+
+    def test_levels_in_dbfs(self):
+        sine = (32767 * np.sin(2 * np.pi * np.arange(4800) / 48)).astype(np.int16).reshape(-1, 2)
+        rms, peak = audio_capture.levels(sine)
+        self.assertAlmostEqual(rms, -3.01, places=1)
+        self.assertAlmostEqual(peak, 0.0, places=1)
+        self.assertEqual(audio_capture.levels(np.zeros((10, 2), np.int16)).rms_dbfs, audio_capture.SILENCE_DBFS)
+
+    def test_ring_keeps_the_latest_frames_by_absolute_position(self):
+        ring = AudioRing(10, 1)
+        for start in range(0, 24, 4):
+            ring.write(np.arange(start, start + 4, dtype=np.int16).reshape(-1, 1))
+        self.assertEqual((ring.start, ring.end), (14, 24))
+        self.assertEqual(ring.read(15, 24).ravel().tolist(), list(range(15, 24)))  # wraps around
+        with self.assertRaises(ValueError):
+            ring.read(13, 20)  # already overwritten
+        ring.write(np.arange(100, 125, dtype=np.int16).reshape(-1, 1))  # bigger than the ring
+        self.assertEqual(ring.read(39, 49).ravel().tolist(), list(range(115, 125)))
+
+    def test_32_bit_samples_keep_the_top_16_bits(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "s32.wav")
+            _write_wav(path, np.array([[1 << 16, -(1 << 30)]], dtype=np.int64), width=4)
+            block = next(WavSource(path).blocks(16))
+        self.assertEqual(block.tolist(), [[1, -(1 << 14)]])
+
+
+class TestAudioCapture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmp.name)
+        self.cfg = AudioConfig(directory=self.dir / "clips", block_sec=0.05, pre_roll_sec=1.0, post_roll_sec=1.0,
+                               max_clip_sec=10.0, codec="wav")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _run(self, samples, cfg=None, before=None):
+        path = self.dir / "in.wav"
+        _write_wav(path, samples)
+        capture = AudioCapture(cfg or self.cfg, WavSource(path))
+        if before:
+            before(capture)
+        capture.start()
+        capture.wait(timeout=30)
+        return capture
+
+    def test_loud_burst_becomes_one_clip_with_pre_roll(self):
+        samples = _scene(loud_at=3.0, loud_sec=0.5, total_sec=8.0)
+        capture = self._run(samples)
+        [event] = capture.events()
+        self.assertEqual(event.reason, "level")
+        # 1 s pre-roll + 0.5 s burst + 1 s of quiet, to block granularity
+        self.assertAlmostEqual(event.duration, 2.5, delta=0.1)
+        self.assertGreater(event.peak_dbfs, -13)
+        with wave.open(str(event.path), "rb") as w:
+            clip = np.frombuffer(w.readframes(w.getnframes()), "<i2").reshape(-1, 2)
+        start = 2 * RATE  # 3.0 s minus the pre-roll
+        np.testing.assert_array_equal(clip, samples[start:start + len(clip)].astype(np.int16))
+        stats = capture.stats()
+        self.assertEqual((stats["events"], stats["clips_written"], stats["frames"]), (1, 1, len(samples)))
+        self.assertEqual(stats["bytes_written"], event.path.stat().st_size)
+
+    def test_quiet_input_records_nothing(self):
+        capture = self._run(_scene(loud_at=0, loud_sec=0, total_sec=3.0))
+        self.assertEqual(capture.events(), [])
+        self.assertEqual(list(self.cfg.directory.iterdir()), [])
+
+    def test_manual_trigger_and_long_events_are_cut(self):
+        cfg = AudioConfig(directory=self.dir / "clips", pre_roll_sec=0.5, post_roll_sec=0.5, max_clip_sec=2.0,
+                          codec="wav")
+        capture = self._run(_scene(loud_at=3.0, loud_sec=3.0, total_sec=8.0), cfg,
+                            before=lambda c: (c.trigger(1.0), c.trigger(0.5, "srecord")))
+        events = capture.events()
+        # Two requests at once: one clip of the longer duration (plus post-roll), reason from the last
+        self.assertEqual(events[0].reason, "srecord")
+        self.assertAlmostEqual(events[0].duration, 1.5, delta=0.1)
+        # 3 s burst: cut at pre-roll + max_clip, then continued without pre-roll
+        self.assertEqual([e.reason for e in events[1:]], ["level", "level"])
+        self.assertAlmostEqual(events[1].duration, 2.5, delta=0.1)
+        self.assertAlmostEqual(events[1].start + events[1].duration, events[2].start, delta=0.01)
+        self.assertEqual(len(list(cfg.directory.iterdir())), 3)
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "needs ffmpeg")
+    def test_flac_clips(self):
+        cfg = AudioConfig(directory=self.dir / "clips", pre_roll_sec=1.0, post_roll_sec=1.0, codec="flac")
+        [event] = self._run(_scene(loud_at=2.0, loud_sec=0.5, total_sec=5.0), cfg).events()
+        self.assertEqual(event.path.suffix, ".flac")
+        self.assertLess(event.path.stat().st_size, event.duration * RATE * 4)
+
+    def test_live_source_is_restarted_with_backoff(self):
+        path = self.dir / "in.wav"
+        _write_wav(path, _scene(loud_at=0.5, loud_sec=0.3, total_sec=1.0))
+        runs = []
+
+        class Flaky(WavSource):
+            live = True  # like arecord: ending is a failure, not the end of the capture
+
+            def blocks(self, block_frames):
+                runs.append(time.monotonic())
+                if len(runs) in (1, 2):
+                    raise OSError("device busy")
+                if len(runs) > 3:
+                    return iter(())
+                return super().blocks(block_frames)
+
+        cfg = replace(self.cfg, restart_sec=0.05, restart_max_sec=0.2)
+        capture = AudioCapture(cfg, Flaky(path))
+        capture.start()
+        deadline = time.monotonic() + 10
+        while len(runs) < 6 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        capture.stop()
+        gaps = [b - a for a, b in zip(runs, runs[1:])]
+        self.assertGreaterEqual(gaps[1], 0.09)  # doubled after the second failure
+        self.assertLess(gaps[2], 0.09)  # reset once the source delivered blocks
+        self.assertLessEqual(max(gaps), 0.5)  # capped
+        stats = capture.stats()
+        self.assertGreaterEqual(stats["source_restarts"], 5)
+        self.assertEqual(stats["frames"], RATE)
+        [event] = capture.events()
+        self.assertTrue(event.path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import importlib.util
+import sys
+import time
+import unittest
+from pathlib import Path
+
+from bandwidth_client import BandwidthClient, BandwidthConfig, CongestionProbe
+from synthetic_camera import SyntheticCamera, SyntheticConfig
+
+HERE = Path(__file__).resolve().parent
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+allocator = _load("bandwidth_allocator", HERE.parents[1] / "hub" / "bandwidth_allocator.py")
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class _SimCamera:
+    """Simulated camera: wants `demand` bps, records the budgets it is given."""
+
+    def __init__(self, hub_url, name, priority, demand):
+        self.budgets = []
+        self.stats = {"outages": 0, "state": "live", "sink": {"frames_dropped": 0, "queue_bytes": 0}}
+        self.client = BandwidthClient(BandwidthConfig(hub_url, name, priority, interval_sec=0.05),
+                                      lambda: demand, self.budgets.append, lambda: self.stats)
+
+    @property
+    def budget(self):
+        return self.budgets[-1] if self.budgets else None
+
+
+class TestBandwidthFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.alloc = allocator.Allocator(allocator.AllocatorConfig(capacity_bps=10_000_000, headroom=1.0))
+        self.server = allocator.serve(self.alloc, "127.0.0.1", 0)
+        self.hub = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_simulated_fleet_shares_uplink_by_priority(self):
+        cams = [_SimCamera(self.hub, "front", 2, 8_000_000), _SimCamera(self.hub, "back", 1, 8_000_000),
+                _SimCamera(self.hub, "side", 1, 1_000_000)]
+        for cam in cams:
+            cam.client.start()
+        try:
+            front, back, side = cams
+            # 2:1 above the 300k minimums once all three have heartbeated
+            self.assertTrue(_wait(lambda: (front.budget, back.budget, side.budget) == (5_900_000, 3_100_000, 1_000_000)))
+            # Dropped frames on the back camera: its ceiling drops (then recovers beat by beat)
+            seen = len(back.budgets)
+            back.stats["sink"]["frames_dropped"] = 5
+            self.assertTrue(_wait(lambda: any(b < 3_100_000 for b in back.budgets[seen:])))
+            side.client.stop()
+            self.assertTrue(_wait(lambda: "side" not in self.alloc.allocations()))
+        finally:
+            for cam in cams:
+                cam.client.stop()
+
+    def test_hub_push_reaches_the_encoder(self):
+        main = _load("main_new_shutsdown", HERE / "main-new-shutsdown.py")
+        cfg = main.AppConfig(rtsp=main.RtspConfig(host="127.0.0.1", port=1), http_port=0,
+                             bandwidth=BandwidthConfig(self.hub, "cam", interval_sec=60))
+        camera = SyntheticCamera(SyntheticConfig(width=64, height=48), [])
+        service = main.StreamService(camera, cfg)
+        http = main.start_http(service, cfg)
+        client = main.start_bandwidth_client(service, cfg, http)
+        try:
+            self.assertTrue(_wait(lambda: camera.status()["bitrate"] == 4_000_000 and client.status()["budget"]))
+            self.alloc.set_capacity(1_500_000)  # pushed over POST /budget, no heartbeat needed
+            self.assertTrue(_wait(lambda: camera.status()["bitrate"] == 1_500_000))
+        finally:
+            client.stop()
+            http.stop()
+
+
+class TestCongestionProbe(unittest.TestCase):
+
+    def test_counts_only_increases(self):
+        stats = {"outages": 0, "sink": {"frames_dropped": 3, "queue_bytes": 0}}
+        probe = CongestionProbe(lambda: stats, queue_congested_sec=0.5)
+        self.assertFalse(probe.check(1_000_000))
+        stats["sink"] = {"frames_dropped": 0, "queue_bytes": 0}  # reconnected: fresh sink
+        self.assertFalse(probe.check(1_000_000))
+        stats["sink"] = {"frames_dropped": 0, "queue_bytes": 100_000}  # 0.8 s at 1 Mbps
+        self.assertTrue(probe.check(1_000_000))
+
+    def test_idle_publisher_is_not_congested(self):
+        stats = {"outages": 0, "state": "idle", "mode": "off", "sink": {}}
+        probe = CongestionProbe(lambda: stats)
+        self.assertTrue(probe.idle())
+        self.assertFalse(probe.check(1_000_000))
+        stats.update(state="outage", mode="keepalive")  # hub unreachable while nobody watches
+        self.assertFalse(probe.check(1_000_000))
+        stats.update(state="outage", mode="live")
+        self.assertTrue(probe.check(1_000_000))
+
+    def test_idle_camera_keeps_its_ceiling(self):
+        alloc = allocator.Allocator(allocator.AllocatorConfig(capacity_bps=10_000_000, headroom=1.0))
+        server = allocator.serve(alloc, "127.0.0.1", 0)
+        demand = [4_000_000]
+        stats = {"outages": 0, "state": "idle", "mode": "off", "sink": {}}
+        client = BandwidthClient(BandwidthConfig(f"http://127.0.0.1:{server.server_address[1]}", "cam"),
+                                 lambda: demand[0], lambda _b: None, lambda: stats)
+        try:
+            stats.update(state="live", mode="live")
+            self.assertEqual(client.heartbeat(), 4_000_000)
+            stats.update(state="idle", mode="off")
+            demand[0] = 100_000  # whatever the encoder reports while nothing streams
+            for _ in range(5):
+                self.assertEqual(client.heartbeat(), 4_000_000)
+            self.assertEqual(client.status()["congested"], 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import importlib.util
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import bench_encoder
+from bench_encoder import Clip, Setting
+
+HERE = Path(__file__).resolve().parent
+
+FFMPEG_STDERR = """\
+frame=   90 fps=0.0 q=-0.0 Lsize=N/A time=00:00:03.00 bitrate=N/A speed=18.2x
+[Parsed_ssim_4 @ 0x55d0] SSIM Y:0.962311 (14.240) U:0.981002 (17.212) V:0.979120 (16.802) All:0.968725 (15.048)
+[Parsed_psnr_5 @ 0x55d1] PSNR y:37.12 u:43.01 v:42.80 average:38.412931 min:35.20 max:41.77
+"""
+
+
+def _row(scene, bitrate, iperiod, ssim, actual, cpu=0.001, ok=True):
+    return {"scene": scene, "setting": Setting(bitrate, iperiod).label, "bitrate": bitrate, "iperiod": iperiod,
+            "quality": None, "ok": ok, "ssim": ssim, "psnr": 40.0, "actual_bitrate": actual,
+            "cpu_sec_per_frame": cpu}
+
+
+class TestEncoderGrid(unittest.TestCase):
+
+    def test_quality_presets_match_picamera2(self):
+        # Quality.LOW at the default 1640x1232@30 is what the driver has been streaming at
+        self.assertEqual(bench_encoder.quality_bitrate("low", 1640, 1232, 30), 3_897_530)
+        settings = bench_encoder.grid([1_000_000], ["medium"], [15, 30], 1920, 1080, 30)
+        self.assertEqual([s.label for s in settings],
+                         ["1.00M g15", "1.00M g30", "6.00M (medium) g15", "6.00M (medium) g30"])
+
+    def test_scores_parsed_from_ffmpeg(self):
+        self.assertEqual(bench_encoder.parse_scores(FFMPEG_STDERR), {"ssim": 0.968725, "psnr": 38.412931})
+        with self.assertRaises(ValueError):
+            bench_encoder.parse_scores("Conversion failed!")
+
+    def test_recommends_smallest_stream_over_target(self):
+        rows = [_row("day", 1_000_000, 30, 0.93, 1_000_000), _row("day", 2_000_000, 30, 0.96, 2_000_000),
+                _row("day", 2_000_000, 60, 0.97, 1_900_000), _row("day", 4_000_000, 30, 0.99, 4_000_000),
+                _row("night", 1_000_000, 30, 0.90, 1_000_000), _row("night", 2_000_000, 30, 0.92, 2_000_000),
+                _row("night", 2_000_000, 30, 0.0, 0, ok=False)]
+        summary = bench_encoder.summarize(rows)
+        self.assertEqual(bench_encoder.recommend(summary["day"], 0.95)["setting"], "2.00M g60")
+        # Nothing reaches the target at night: best quality wins
+        pick = bench_encoder.recommend(summary["night"], 0.95)
+        self.assertEqual((pick["setting"], pick["clips"]), ("2.00M g30", 1))
+        spec = importlib.util.spec_from_file_location("main_new_shutsdown", HERE / "main-new-shutsdown.py")
+        main = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = main
+        spec.loader.exec_module(main)
+        video = bench_encoder.video_config(main.VideoConfig(), pick)
+        self.assertEqual((video.bitrate, video.iperiod, video.quality), (2_000_000, 30, None))
+
+    def test_scene_is_the_clip_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("day/a.h264", "day/b.y4m", "night/c.h264", "night/notes.txt"):
+                Path(tmp, name).parent.mkdir(exist_ok=True)
+                Path(tmp, name).touch()
+            clips = bench_encoder.find_clips([Path(tmp, "day"), Path(tmp, "night")], 25.0)
+        self.assertEqual([(c.path.name, c.scene) for c in clips], [("a.h264", "day"), ("b.y4m", "day"),
+                                                                     ("c.h264", "night")])
+
+
+@unittest.skipUnless(shutil.which("ffmpeg"), "needs ffmpeg")
+class TestEncoderBenchmark(unittest.TestCase):
+
+    def test_grid_over_a_clip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            clip = Path(tmp, "scene", "pattern.y4m")
+            clip.parent.mkdir()
+            with clip.open("wb") as f:
+                f.write(b"YUV4MPEG2 W128 H96 F30:1 C420\n")
+                yy, xx = np.mgrid[:96, :128]
+                for i in range(30):
+                    f.write(b"FRAME\n" + ((xx + yy + 4 * i) & 0xFF).astype(np.uint8).tobytes()
+                            + bytes([128]) * (128 * 96 // 2))
+            settings = [Setting(100_000, 15), Setting(800_000, 15)]
+            rows = bench_encoder.run_grid([Clip(clip, "scene", 30.0)], settings, jobs=2)
+        self.assertTrue(all(r["ok"] and r["frames"] == 30 for r in rows), rows)
+        self.assertGreater(rows[1]["psnr"], rows[0]["psnr"])
+
+
+if __name__ == '__main__':
+    unittest.main()
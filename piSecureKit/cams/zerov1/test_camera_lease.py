@@ -0,0 +1,162 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+from pathlib import Path
+
+import camera_lease
+from camera_lease import CameraBusyError, CameraLease, LeaseConfig
+from systemd_notify import Notifier
+
+HERE = Path(__file__).resolve().parent
+
+_HOLDER = """
+import sys, time, signal
+sys.path.insert(0, {here!r})
+from camera_lease import CameraLease, LeaseConfig
+from pathlib import Path
+if {ignore_term}:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+CameraLease(0, LeaseConfig(lock_dir=Path({lock_dir!r}), reap=False)).acquire()
+print("held", flush=True)
+time.sleep(60)
+"""
+
+
+_SUPERVISOR = """
+import subprocess, sys, time
+sibling = subprocess.Popen(["sleep", "30"])
+worker = subprocess.Popen([sys.executable, "-c", {worker!r}.replace("SIBLING", str(sibling.pid))])
+worker.wait()
+print("sibling alive" if sibling.poll() is None else "sibling reaped", flush=True)
+sibling.kill()
+"""
+
+_WORKER = """
+import os, sys
+sys.path.insert(0, {here!r})
+import camera_lease
+from pathlib import Path
+# Device holders without a lease file: a sibling worker, the supervisor, a leftover of an earlier run
+camera_lease.device_holders = lambda: {{SIBLING, os.getppid(), {stale}}}
+camera_lease.CameraLease(0, camera_lease.LeaseConfig(lock_dir=Path({lock_dir!r}), grace_sec=0.3)).acquire()
+"""
+
+
+def _hold(lock_dir, ignore_term=False, **popen):
+    code = _HOLDER.format(here=str(HERE), lock_dir=str(lock_dir), ignore_term=ignore_term)
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True, **popen)
+    assert proc.stdout.readline().strip() == "held"
+    return proc
+
+
+class TestCameraLease(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.lock_dir = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_exclusive_and_released_on_exit(self):
+        cfg = LeaseConfig(lock_dir=self.lock_dir, wait_sec=0.3, reap=False)
+        with CameraLease(0, cfg) as lease:
+            self.assertEqual(lease.path.read_text().strip(), str(os.getpid()))
+            with CameraLease(1, cfg):
+                pass  # other cameras are independent
+        holder = _hold(self.lock_dir)
+        try:
+            with self.assertRaises(CameraBusyError):
+                CameraLease(0, cfg).acquire()
+        finally:
+            holder.kill()
+            holder.wait()
+        # The kernel drops the flock with the process; no waiting on a dead holder.
+        t0 = time.monotonic()
+        CameraLease(0, cfg).acquire().release()
+        self.assertLess(time.monotonic() - t0, 0.2)
+
+    @mock.patch.dict(os.environ, {"INVOCATION_ID": "test"})  # as if started by systemd
+    def test_reaps_lingering_holder_of_same_unit(self):
+        holder = _hold(self.lock_dir, ignore_term=True)  # same cgroup as this test process
+        try:
+            cfg = LeaseConfig(lock_dir=self.lock_dir, wait_sec=5, grace_sec=0.3)
+            t0 = time.monotonic()
+            lease = CameraLease(0, cfg).acquire()
+            self.assertLess(time.monotonic() - t0, 2)
+            self.assertIsNotNone(holder.wait(timeout=2))
+            lease.release()
+        finally:
+            if holder.poll() is None:
+                holder.kill()
+
+
+    def test_only_waits_outside_a_service(self):
+        holder = _hold(self.lock_dir)
+        session = "0::/user.slice/user-1000.slice/session-3.scope\n"
+        env = {k: v for k, v in os.environ.items() if k != "INVOCATION_ID"}
+        try:
+            with mock.patch.dict(os.environ, env, clear=True), mock.patch.object(camera_lease, "_cgroup",
+                                                                                 lambda pid: session):
+                self.assertFalse(camera_lease.in_service())
+                with self.assertRaises(CameraBusyError):
+                    CameraLease(0, LeaseConfig(lock_dir=self.lock_dir, wait_sec=0.5, grace_sec=0.1)).acquire()
+            self.assertIsNone(holder.poll())
+        finally:
+            holder.kill()
+            holder.wait()
+
+    def test_service_cgroup(self):
+        unit = "0::/system.slice/pisecurekit.service\n"
+        with mock.patch.object(camera_lease, "_cgroup", lambda pid: unit):
+            self.assertTrue(camera_lease.in_service())
+        hybrid = "1:name=systemd:/system.slice/pisecurekit.service\n0::/\n"
+        with mock.patch.object(camera_lease, "_cgroup", lambda pid: hybrid):
+            self.assertTrue(camera_lease.in_service())
+
+
+class TestSupervisedWorkers(unittest.TestCase):
+
+    def test_siblings_are_not_reaped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stale = subprocess.Popen(["sleep", "30"])  # not a child of the supervisor
+            try:
+                worker = _WORKER.format(here=str(HERE), lock_dir=tmp, stale=stale.pid)
+                out = subprocess.run([sys.executable, "-c", _SUPERVISOR.format(worker=worker)],
+                                     capture_output=True, text=True, timeout=20,
+                                     env={**os.environ, "INVOCATION_ID": "test"})
+                self.assertEqual(out.stdout.strip(), "sibling alive", out.stderr)
+                self.assertIsNotNone(stale.wait(timeout=2))
+            finally:
+                if stale.poll() is None:
+                    stale.kill()
+
+
+class TestNotifier(unittest.TestCase):
+
+    def test_ready_and_watchdog_datagrams(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "notify")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            server.bind(path)
+            try:
+                n = Notifier(path, watchdog_usec=20_000_000)
+                self.assertEqual(n.watchdog_interval_sec, 10)
+                self.assertTrue(n.ready("streaming"))
+                self.assertTrue(n.watchdog())
+                self.assertTrue(n.extend_timeout(30))
+                self.assertEqual(server.recv(256), b"READY=1\nSTATUS=streaming")
+                self.assertEqual(server.recv(256), b"WATCHDOG=1")
+                self.assertEqual(server.recv(256), b"EXTEND_TIMEOUT_USEC=30000000\nWATCHDOG=1")
+            finally:
+                server.close()
+        self.assertFalse(Notifier().ready())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import camera_supervisor
+from camera_supervisor import CameraSpec, CameraSupervisor
+
+
+def _worker(cfg, report):
+    """Reports its pid and affinity; 'crash' workers exit shortly after starting."""
+    for _ in range(20):
+        report({"pid": os.getpid(), "cpus": sorted(os.sched_getaffinity(0))},
+               '# TYPE frames counter\nframes{stage="x"} 1\n')
+        if cfg == "crash":
+            raise SystemExit(3)
+        time.sleep(0.1)
+
+
+def _wait(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestCameraSupervisor(unittest.TestCase):
+
+    def test_crashing_camera_restarts_without_disturbing_the_other(self):
+        sup = CameraSupervisor([CameraSpec("good", "ok", cpus=(0,)), CameraSpec("bad", "crash")],
+                               _worker, min_backoff_sec=0.1, max_backoff_sec=0.2)
+        sup.start()
+        try:
+            def tick():
+                sup.poll()
+                return sup.status()["bad"]["restarts"] >= 2 and sup.status()["good"]["status"]
+            self.assertTrue(_wait(tick))
+            status = sup.status()
+            self.assertEqual(status["good"]["restarts"], 0)
+            self.assertEqual(status["good"]["status"]["cpus"], [0])
+            self.assertEqual(status["bad"]["last_exit"], 3)
+            self.assertIn('frames{camera="good",stage="x"} 1', sup.metrics())
+            self.assertEqual(sup.metrics().count("# TYPE frames counter"), 1)
+        finally:
+            sup.stop()
+
+    def test_ini_sections(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "cameras.ini")
+            path.write_text("[supervisor]\nhub = 10.0.0.2\n\n[camera:front]\ncpus = 0-1,3\n\n[camera:back]\n")
+            settings, cameras = camera_supervisor.read_cameras_ini(path)
+        self.assertEqual(settings, {"hub": "10.0.0.2"})
+        self.assertEqual([n for n, _ in cameras], ["front", "back"])
+        self.assertEqual(camera_supervisor.parse_cpus(cameras[0][1]["cpus"]), (0, 1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+import importlib.util
+import json
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from dataclasses import replace
+from pathlib import Path
+
+import memory_budget
+import snapshots
+
+from encoded_output import EncodedOutput
+from resilient_publisher import OnDemandConfig, ReconnectConfig, ResilientPublisher
+from synthetic_camera import SyntheticCamera, SyntheticConfig
+
+HERE = Path(__file__).resolve().parent
+
+
+def _load_main():
+    spec = importlib.util.spec_from_file_location("main_new_shutsdown", HERE / "main-new-shutsdown.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class _Hub:
+    """Stands in for mediamtx: frames received per path."""
+
+    def __init__(self):
+        self.received = {}
+        self.lock = threading.Lock()
+
+
+class _HubSink(EncodedOutput):
+    def __init__(self, hub, path):
+        super().__init__()
+        self.hub, self.path = hub, path
+        self.error_callback = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        with self.hub.lock:
+            self.hub.received.setdefault(self.path, []).append((frame, keyframe))
+
+
+class _Frames:
+    def __init__(self):
+        self.keyframes = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        self.keyframes.append(keyframe)
+
+
+class TestControlApi(unittest.TestCase):
+
+    def setUp(self):
+        main = _load_main()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.frames = _Frames()
+        cfg = main.AppConfig(rtsp=main.RtspConfig(host="127.0.0.1"), http_port=0,
+                             preview_jpeg_path=Path(self._tmp.name, "preview.jpg"),
+                             stills_dir=Path(self._tmp.name, "stills"))
+        camera = SyntheticCamera(SyntheticConfig(width=64, height=48, fps=100, iperiod=1000), [self.frames])
+        self.service = main.StreamService(camera, cfg)
+        self.service.start()
+        self.server = main.start_http(self.service, cfg)
+
+    def tearDown(self):
+        self.server.stop()
+        self.service.stop()
+        self._tmp.cleanup()
+
+    def _call(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(f"http://127.0.0.1:{self.server.port}{path}", data=data, method=method)
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return json.load(resp)
+
+    def _error(self, method, path, body=None):
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            self._call(method, path, body)
+        return ctx.exception.code
+
+    def test_stop_and_start_keep_the_service_up(self):
+        self.assertEqual(self._call("POST", "/stop"), {"streaming": False})
+        status = self._call("GET", "/status")
+        self.assertTrue(status["running"])
+        self.assertFalse(status["streaming"])
+        self.assertFalse(status["camera"]["running"])
+        self.assertEqual(self._error("POST", "/snapshot"), 409)
+        self._call("POST", "/start")
+        self.assertTrue(self._call("GET", "/status")["camera"]["running"])
+        self.assertIn("full", self._call("POST", "/snapshot"))
+
+    def test_burst_keeps_streaming(self):
+        time.sleep(0.1)
+        before = self._call("GET", "/status")["camera"]["frames"]
+        result = self._call("POST", "/burst", {"count": 3})
+        self.assertEqual(len(result["paths"]), 3)
+        self.assertTrue(all(Path(p).parent == Path(self._tmp.name, "stills") for p in result["paths"]))
+        time.sleep(0.1)
+        status = self._call("GET", "/status")
+        self.assertTrue(status["camera"]["running"])
+        self.assertGreater(status["camera"]["frames"], before)
+        for bad in ({"count": 0}, {"count": 31}, {"count": "many"}):
+            self.assertEqual(self._error("POST", "/burst", bad), 400)
+        self._call("POST", "/stop")
+        self.assertEqual(self._error("POST", "/burst", {"count": 2}), 409)
+
+    def test_full_burst_backlog_is_refused_before_grabbing(self):
+        grabbed = []
+        self.service._camera.grab_burst = lambda count: grabbed.append(count) or []
+        bursts = snapshots.BurstSaver(Path(self._tmp.name, "stills"), max_pending=4, encode=lambda f, q: b"")
+        self.service._bursts, old = bursts, self.service._bursts
+        try:
+            bursts.reserve(3)  # a previous burst still being saved
+            self.assertEqual(self._error("POST", "/burst", {"count": 2}), 409)
+            self.assertEqual(grabbed, [])
+            bursts.release(3)
+            self._call("POST", "/burst", {"count": 2})  # nothing grabbed: stills, and the slots come back
+            self.assertEqual((grabbed, bursts.stats()["pending"]), ([2], 0))
+        finally:
+            self.service._bursts = old
+            bursts.close()
+
+    def test_burst_limit_follows_available_memory(self):
+        main = _load_main()
+        cfg = main.AppConfig(rtsp=main.RtspConfig(host="127.0.0.1"))  # 1640x1232: ~3MB per YUV copy
+        mem = memory_budget.MemorySnapshot(rss=0, rss_peak=0, cma_total=0, cma_free=0, mem_available=200 << 20)
+        self.assertEqual(main.burst_frame_limit(cfg, mem), 17)
+        self.assertEqual(main.burst_frame_limit(cfg, replace(mem, mem_available=0)), 30)
+        self.assertEqual(main.burst_frame_limit(cfg, replace(mem, mem_available=1 << 20)), 1)
+        roi = replace(cfg, video=main.VideoConfig(roi=(0.25, 0.25, 0.5, 0.5)))
+        self.assertEqual(main.burst_frame_limit(roi, mem), 30)
+
+    def test_always_on_camera_ignores_ended_leases(self):
+        reply = self._call("POST", "/publish", {"enabled": True, "lease_sec": 0.2, "holder": "hqstream"})
+        self.assertEqual(reply["paths"], {"hqstream": "live", "lqstream": "live"})
+        time.sleep(0.4)
+        status = self._call("GET", "/status")["publishing"]
+        self.assertEqual((status["paths"], status["on_demand"], status["holders"]),
+                         ({"hqstream": "live", "lqstream": "live"}, False, {}))
+
+    def test_bitrate_and_keyframe(self):
+        self.assertEqual(self._call("POST", "/bitrate", {"bitrate": 1_000_000}), {"bitrate": 1_000_000})
+        self.assertEqual(self._call("GET", "/status")["camera"]["bitrate"], 1_000_000)
+        for bad in ({"bitrate": 10}, {"bitrate": "fast"}, {}):
+            self.assertEqual(self._error("POST", "/bitrate", bad), 400)
+        time.sleep(0.1)
+        seen = len(self.frames.keyframes)
+        self._call("POST", "/keyframe")
+        time.sleep(0.1)
+        self.assertIn(True, self.frames.keyframes[seen:])
+
+    def test_snapshot_jpeg_etag_and_long_poll(self):
+        url = f"http://127.0.0.1:{self.server.port}/snapshot.jpg"
+        self.assertEqual(self._error("GET", "/snapshot.jpg"), 503)
+        self.assertEqual(self._error("GET", "/snapshot.jpg?size=huge"), 400)
+        self.service.store.put("full", 1, b"jpeg-1")
+        with urllib.request.urlopen(url, timeout=5) as resp:
+            etag = resp.headers["ETag"]
+            self.assertEqual((resp.read(), resp.headers["Content-Type"]), (b"jpeg-1", "image/jpeg"))
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(urllib.request.Request(url, headers={"If-None-Match": etag}), timeout=5)
+        self.assertEqual(ctx.exception.code, 304)
+        threading.Timer(0.1, self.service.store.put, ("full", 2, b"jpeg-2")).start()
+        req = urllib.request.Request(url + "?wait=5", headers={"If-None-Match": etag})
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            self.assertEqual(resp.read(), b"jpeg-2")
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_unsupported_control_is_a_conflict(self):
+        self.assertEqual(self._error("POST", "/lores", {"enabled": False}), 409)
+
+    def test_roi_moves_live_and_reports_usage(self):
+        time.sleep(0.2)
+        self.assertEqual(self._call("POST", "/roi", {"roi": [0.5, 0.25, 0.5, 0.5]}),
+                         {"roi": [0.5, 0.25, 0.5, 0.5]})
+        time.sleep(0.2)
+        status = self._call("GET", "/status")
+        self.assertTrue(status["camera"]["running"])  # no restart
+        self.assertEqual(status["camera"]["roi"]["region"], [0.5, 0.25, 0.5, 0.5])
+        change = status["roi"]["change"]
+        self.assertEqual((change["from"], change["to"]), (None, [0.5, 0.25, 0.5, 0.5]))
+        self.assertGreater(change["before"]["bitrate"], 0)
+        self.assertGreater(change["after"]["bitrate"], 0)
+        self.assertIn("cpu_percent", change["after"])
+        grab = self.service._camera.grab_frame()[0]
+        self.assertEqual((grab.width, grab.height), (64, 48))  # zoomed, not shrunk
+        for bad in ({"roi": [0.5, 0.5, 0.6, 0.1]}, {"roi": [0, 0, 1]}, {"roi": "a,b,c,d"}, {}):
+            self.assertEqual(self._error("POST", "/roi", bad), 400)
+        self.assertEqual(self._call("POST", "/roi", {"roi": None}), {"roi": None})
+
+
+class TestOnDemandPublishing(unittest.TestCase):
+
+    def setUp(self):
+        main = _load_main()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.hub = _Hub()
+        cfg = main.AppConfig(rtsp=main.RtspConfig(host="127.0.0.1", path="cam1"), http_port=0,
+                             simulcast=main.SimulcastConfig(path="cam1_lq"),
+                             preview_jpeg_path=Path(self._tmp.name, "preview.jpg"),
+                             on_demand=OnDemandConfig(idle="off", max_lease_sec=10))
+        self.publisher = ResilientPublisher(lambda path: _HubSink(self.hub, path), "cam1",
+                                            ReconnectConfig(settle_sec=0.1), cfg.on_demand)
+        self.lq_publisher = ResilientPublisher(lambda path: _HubSink(self.hub, path), "cam1_lq",
+                                               ReconnectConfig(settle_sec=0.1), cfg.on_demand)
+        camera = SyntheticCamera(SyntheticConfig(width=64, height=48, fps=100, iperiod=1000), [self.publisher],
+                                 lq_outputs=[self.lq_publisher], publisher=self.publisher,
+                                 lq_publisher=self.lq_publisher)
+        self.service = main.StreamService(camera, cfg)
+        self.service.start()
+        self.server = main.start_http(self.service, cfg)
+
+    def tearDown(self):
+        self.server.stop()
+        self.service.stop()
+        self._tmp.cleanup()
+
+    _call = TestControlApi._call
+    _error = TestControlApi._error
+
+    def test_lease_publishes_until_it_runs_out(self):
+        self.assertEqual(self._call("GET", "/status")["publishing"]["mode"], "off")
+        reply = self._call("POST", "/publish", {"enabled": True, "lease_sec": 0.6, "holder": "cam1"})
+        self.assertEqual(reply["mode"], "live")
+        # The publisher asks the encoder for a keyframe instead of waiting out the 10 s GOP
+        self.assertTrue(_wait_for(lambda: len(self.hub.received.get("cam1", [])) > 0, 1.0))
+        self.assertTrue(self.hub.received["cam1"][0][1])
+        time.sleep(0.3)
+        self.assertEqual(self._call("POST", "/publish", {"enabled": True, "lease_sec": 0.6, "holder": "cam1"})["mode"],
+                         "live")
+        time.sleep(0.4)
+        self.assertEqual(self.publisher.mode, "live")  # renewed in time
+        self.assertTrue(_wait_for(lambda: self.publisher.mode == "off", 1.0))
+        self.assertEqual(self._call("GET", "/status")["publishing"],
+                         {"mode": "off", "paths": {"cam1": "off", "cam1_lq": "off"}, "on_demand": True, "holders": {}})
+        for bad in ({"enabled": True, "lease_sec": 0}, {"enabled": True, "lease_sec": 60}, {"lease_sec": 1}):
+            self.assertEqual(self._error("POST", "/publish", bad), 400)
+
+    def test_holders_switch_only_their_path(self):
+        reply = self._call("POST", "/publish", {"enabled": True, "lease_sec": 5, "holder": "cam1_lq"})
+        self.assertEqual(reply["paths"], {"cam1": "off", "cam1_lq": "live"})
+        self.assertTrue(_wait_for(lambda: self.lq_publisher.stats()["state"] == "live", 2.0))
+        self.assertEqual(self.publisher.mode, "off")  # watching LQ does not put HQ on the air
+        self.assertNotIn("cam1", self.hub.received)
+        self._call("POST", "/publish", {"enabled": True, "lease_sec": 5, "holder": "cam1"})
+        self.assertTrue(_wait_for(lambda: self.publisher.stats()["state"] == "live", 2.0))
+        reply = self._call("POST", "/publish", {"enabled": False, "holder": "cam1_lq"})
+        self.assertEqual(reply["paths"], {"cam1": "live", "cam1_lq": "off"})
+        reply = self._call("POST", "/publish", {"enabled": False, "holder": "cam1"})
+        self.assertEqual((reply["mode"], reply["holders"]), ("off", {}))
+        self.assertEqual((self.publisher.stats()["mode_changes"], self.lq_publisher.stats()["mode_changes"]), (2, 2))
+
+    def test_lease_without_lease_sec_is_the_longest_allowed(self):
+        reply = self._call("POST", "/publish", {"enabled": True, "holder": "cam1"})
+        self.assertEqual(reply["mode"], "live")
+        self.assertTrue(9 < reply["holders"]["cam1"] <= 10)  # max_lease_sec, not until released
+
+
+def _wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestRoi(unittest.TestCase):
+
+    def setUp(self):
+        self.main = _load_main()
+
+    def test_roi_shrinks_what_is_encoded(self):
+        video = self.main.VideoConfig(roi=(0.25, 0.25, 0.5, 0.5))
+        encoded = self.main.roi_video(video)
+        self.assertEqual((encoded.width, encoded.height), (800, 616))
+        self.assertAlmostEqual(encoded.bitrate, 4_000_000 * 800 * 616 / (1640 * 1232), delta=1)
+        full_view = self.main.VideoConfig()
+        self.assertIs(self.main.roi_video(full_view), full_view)
+        self.assertEqual(self.main.parse_roi("0.1, 0.2, 0.3, 0.4"), (0.1, 0.2, 0.3, 0.4))
+        self.assertIsNone(self.main.parse_roi(""))
+
+    def test_scaler_crop_keeps_aspect_and_stays_on_sensor(self):
+        full = (0, 0, 3280, 2464)
+        self.assertEqual(self.main.scaler_crop(None, full, 3280 / 2464), full)
+        # A tall doorway at the right edge: widened to 4:3 about its centre, then pulled back on the sensor
+        x, y, w, h = self.main.scaler_crop((0.9, 0.0, 0.1, 1.0), full, 4 / 3)
+        self.assertEqual((w, h), (3280, 2460))
+        self.assertEqual(x + w, 3280)
+        x, y, w, h = self.main.scaler_crop((0.5, 0.5, 0.25, 0.25), (16, 8, 3280, 2464), 16 / 9)
+        self.assertAlmostEqual(w / h, 16 / 9, places=2)
+        self.assertAlmostEqual(x + w / 2, 16 + 3280 * 0.625, delta=1)
+        self.assertAlmostEqual(y + h / 2, 8 + 2464 * 0.625, delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
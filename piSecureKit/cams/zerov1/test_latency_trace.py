@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from latency_trace import Histogram, LatencyTracer, traced_outputs
+
+
+class _Slow:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        time.sleep(self.delay)
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles_are_bucket_bounds(self):
+        hist = Histogram()
+        for v in range(1, 101):
+            hist.record(v * 1000.0)  # 1..100 ms
+        summary = hist.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["p50_ms"], 50, delta=50 * 0.25)
+        self.assertAlmostEqual(summary["p99_ms"], 99, delta=99 * 0.25)
+        self.assertLessEqual(summary["p99_ms"], summary["max_ms"])
+        self.assertAlmostEqual(summary["mean_ms"], 50.5)
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_sampled_stages_measure_from_sensor_time(self):
+        tracer = LatencyTracer(sample_every=2)
+        base = int(time.monotonic() * 1e6)
+        tracer.time_base = lambda: base
+        chain = traced_outputs([_Slow(0.005)], tracer)
+        for i in range(10):
+            ts = int(time.monotonic() * 1e6) - base - 2000  # the frame left the sensor 2 ms ago
+            for out in chain:
+                out.outputframe(b"x", True, ts)
+        summary = tracer.summary()
+        self.assertEqual(summary["encoded"]["count"], 5)
+        self.assertGreaterEqual(summary["encoded"]["mean_ms"], 2)
+        self.assertGreaterEqual(summary["handed_off"]["mean_ms"] - summary["encoded"]["mean_ms"], 4)
+        text = tracer.prometheus()
+        self.assertIn('pisecurekit_frame_latency_seconds_count{stage="handed_off"} 5', text)
+        self.assertIn('stage="encoded",le="+Inf"} 5', text)
+
+    def test_nothing_recorded_before_time_base(self):
+        tracer = LatencyTracer(sample_every=1)
+        for out in traced_outputs([], tracer):
+            out.outputframe(b"x", True, 0)
+        self.assertEqual(tracer.summary(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import importlib.util
+import json
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+from dataclasses import replace
+from pathlib import Path
+
+import memory_budget
+from http_server import HttpServer, json_response
+from synthetic_camera import SyntheticConfig
+
+HERE = Path(__file__).resolve().parent
+
+
+def _load_main():
+    spec = importlib.util.spec_from_file_location("main_new_shutsdown", HERE / "main-new-shutsdown.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def test_snapshot_from_proc_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            meminfo = Path(tmp, "meminfo")
+            meminfo.write_text("MemTotal: 437000 kB\nMemAvailable: 200000 kB\n"
+                               "CmaTotal: 262144 kB\nCmaFree: 131072 kB\n")
+            status = Path(tmp, "status")
+            status.write_text("Name:\tpython3\nVmHWM:\t 40000 kB\nVmRSS:\t 30000 kB\n")
+            snap = memory_budget.snapshot(meminfo, status)
+        self.assertEqual(snap.cma_used, 131072 * 1024)
+        self.assertEqual(snap.rss, 30000 * 1024)
+        self.assertEqual(snap.as_dict()["rss_peak"], 40000 * 1024)
+        self.assertIn("cma used=", snap.describe())
+
+    def test_missing_proc_files_read_as_zero(self):
+        snap = memory_budget.snapshot(Path("/nonexistent/meminfo"), Path("/nonexistent/status"))
+        self.assertEqual(snap.cma_used, 0)
+
+    def test_ladder_estimates_shrink(self):
+        main = _load_main()
+        video = main.VideoConfig(lores_enabled=True)
+        estimates = [memory_budget.estimate_buffer_bytes(w, h, fmt, n, (640, 480) if lores else None)
+                     for w, h, fmt, n, lores in main.configuration_ladder(video)]
+        self.assertEqual(estimates[-1], 640 * 480 * 3 // 2 * 2)
+        self.assertEqual(estimates, sorted(estimates, reverse=True))
+
+    def test_roi_ladder_never_grows(self):
+        main = _load_main()
+        for roi, expected in (((0.25, 0.25, 0.5, 0.5), [(800, 616), (640, 480)]),
+                              ((0.4, 0.4, 0.2, 0.2), [(320, 246), (320, 246)])):
+            video = main.roi_video(main.VideoConfig(roi=roi))
+            ladder = main.configuration_ladder(video)
+            self.assertEqual([(w, h) for w, h, *_ in ladder], expected)
+            estimates = [memory_budget.estimate_buffer_bytes(w, h, fmt, n) for w, h, fmt, n, _ in ladder]
+            self.assertEqual(estimates, sorted(estimates, reverse=True))
+            self.assertLess(estimates[-1], estimates[0])
+
+
+def _cma(free_mb, total_mb=256):
+    return memory_budget.MemorySnapshot(rss=0, rss_peak=0, cma_total=total_mb << 20, cma_free=free_mb << 20,
+                                        mem_available=0)
+
+
+class TestSimulcastBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.main = _load_main()
+        self.cfg = self.main.AppConfig(rtsp=self.main.RtspConfig(host="127.0.0.1", port=1))
+
+    def test_lores_rungs_dropped_when_cma_is_short(self):
+        ladder = self.main.fitting_ladder(self.cfg, _cma(200))
+        self.assertEqual([a[3:] for a in ladder[:3]], [(3, True), (2, True), (3, False)])
+        need = self.main.attempt_cma_bytes(self.cfg, ladder[1])
+        tight = self.main.fitting_ladder(self.cfg, _cma(need // (1 << 20) + 25))  # default headroom 24MB
+        self.assertEqual(tight[0][3:], (2, True))
+        short = self.main.fitting_ladder(self.cfg, _cma(20))
+        self.assertFalse(any(a[4] for a in short))
+        self.assertEqual(len(short), len(ladder) - 2)  # main-only rungs are left to configure()
+        self.assertEqual(self.main.fitting_ladder(self.cfg, _cma(0, total_mb=0)), ladder)
+
+    def test_synthetic_simulcast_and_fallback(self):
+        cfg = replace(self.cfg, synthetic=SyntheticConfig(width=64, height=48, fps=50, iperiod=10),
+                      simulcast=self.main.SimulcastConfig(bitrate=200_000, iperiod=5))
+        camera = self.main.build_camera(cfg, mem=_cma(200))
+        camera.start()
+        time.sleep(0.5)
+        status = camera.status()
+        camera.stop()
+        lq = status["simulcast"]
+        self.assertTrue(lq["active"])
+        self.assertEqual(lq["frames"], status["frames"])
+        self.assertEqual(lq["keyframes"], -(-lq["frames"] // 5))  # independent GOP
+        self.assertLess(lq["bytes"], status["bytes"] / 5)
+        self.assertEqual(lq["publisher"]["state"], "outage")  # own publisher; no hub in tests
+        self.assertEqual(status["publisher"]["state"], "outage")  # keyed like Picamera2Driver's
+        self.assertNotIn("TraceTap", status)
+        fallback = self.main.build_camera(cfg, mem=_cma(20))
+        self.assertFalse(fallback.status()["simulcast"]["active"])
+
+
+class TestStatusEndpoint(unittest.TestCase):
+
+    def test_status_round_trip(self):
+        main = _load_main()
+        cfg = main.AppConfig(rtsp=main.RtspConfig(host="127.0.0.1"), http_port=0)
+        service = main.StreamService(main.NullCamera(), cfg)
+        server = main.start_http(service, cfg)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/status", timeout=5) as resp:
+                body = json.load(resp)
+            self.assertEqual(body["camera"]["driver"], "null")
+            self.assertIn("cma_used", body["memory"])
+        finally:
+            server.stop()
+
+    def test_unknown_route_and_method(self):
+        server = HttpServer("127.0.0.1", 0)
+
+        async def ok(_req):
+            return json_response({"ok": True})
+
+        server.route("GET", "/x", ok)
+        server.start()
+        try:
+            for method, path, code in (("GET", "/nope", 404), ("POST", "/x", 405)):
+                req = urllib.request.Request(f"http://127.0.0.1:{server.port}{path}", method=method)
+                with self.assertRaises(urllib.error.HTTPError) as ctx:
+                    urllib.request.urlopen(req, timeout=5)
+                self.assertEqual(ctx.exception.code, code)
+        finally:
+            server.stop()
+
+    def test_start_raises_when_port_is_taken(self):
+        first = HttpServer("127.0.0.1", 0).start()
+        try:
+            with self.assertRaises(OSError):
+                HttpServer("127.0.0.1", first.port).start()
+        finally:
+            first.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import socket
+import time
+import unittest
+
+from http_server import HttpServer
+from mjpeg_broadcast import MjpegBroadcaster, PartPool
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class _Viewer:
+    """Raw-socket multipart client, so a test can also be a viewer that never reads."""
+
+    def __init__(self, port, rcvbuf=None):
+        self.sock = socket.socket()
+        if rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.settimeout(5)
+        self.sock.connect(("127.0.0.1", port))
+        self.sock.sendall(b"GET /video_feed HTTP/1.1\r\nHost: cam\r\n\r\n")
+        self.buf = b""
+
+    def _read_until(self, marker):
+        while marker not in self.buf:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("closed")
+            self.buf += chunk
+        head, _, self.buf = self.buf.partition(marker)
+        return head
+
+    def status_line(self):
+        return self._read_until(b"\r\n\r\n").split(b"\r\n")[0]
+
+    def next_jpeg(self):
+        headers = self._read_until(b"\r\n\r\n").split(b"\r\n")
+        length = int(next(h for h in headers if h.lower().startswith(b"content-length")).split(b":")[1])
+        while len(self.buf) < length + 2:
+            self.buf += self.sock.recv(65536)
+        jpeg, self.buf = self.buf[:length], self.buf[length + 2:]
+        return jpeg
+
+    def close(self):
+        self.sock.close()
+
+
+class TestMjpegBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.broadcaster = MjpegBroadcaster(max_clients=60)
+        self.server = HttpServer("127.0.0.1", 0)
+        self.server.route("GET", "/video_feed", self.broadcaster.handle)
+        self.server.start()
+        self.viewers = []
+
+    def tearDown(self):
+        for v in self.viewers:
+            v.close()
+        self.server.stop()
+
+    def _connect(self, n, **kw):
+        viewers = [_Viewer(self.server.port, **kw) for _ in range(n)]
+        self.viewers += viewers
+        for v in viewers:
+            self.assertEqual(v.status_line(), b"HTTP/1.1 200 OK")
+        self.assertTrue(_wait(lambda: self.broadcaster.stats()["clients"] == len(self.viewers)))
+        return viewers
+
+    def test_every_viewer_gets_the_newest_frame(self):
+        viewers = self._connect(50)
+        self.broadcaster.publish(b"jpeg-1")
+        self.assertEqual({v.next_jpeg() for v in viewers}, {b"jpeg-1"})
+        for i in range(2, 7):
+            self.broadcaster.publish(b"jpeg-%d" % i)
+        for v in viewers:
+            while v.next_jpeg() != b"jpeg-6":
+                pass
+        stats = self.broadcaster.stats()
+        self.assertEqual((stats["frames"], stats["clients"]), (6, 50))
+        self.assertLessEqual(stats["parts_sent"], 6 * 50)
+
+    def test_slow_viewer_skips_frames_without_holding_others(self):
+        slow = self._connect(1, rcvbuf=4096)[0]  # never reads: its socket fills up
+        fast = self._connect(1)[0]
+        frame = bytes(200_000)
+        for i in range(30):
+            self.broadcaster.publish(b"%04d" % i + frame)
+            self.assertEqual(fast.next_jpeg()[:4], b"%04d" % i)
+        # Catching up, the slow viewer gets what was in flight and then the newest frame
+        received = 1
+        while slow.next_jpeg()[:4] != b"0029":
+            received += 1
+        self.assertLess(received, 8)  # socket buffers hold a few frames; the rest were skipped
+        self.assertGreater(self.broadcaster.stats()["frames_skipped"], 20)
+
+    def test_viewer_limit_and_disconnects(self):
+        self._connect(60)
+        extra = _Viewer(self.server.port)
+        self.assertEqual(extra.status_line(), b"HTTP/1.1 503 Service Unavailable")
+        extra.close()
+        for v in self.viewers[:10]:
+            v.close()
+        del self.viewers[:10]
+        # Parked viewers notice on a write: the first gets a reset, the next one fails
+        for _ in range(3):
+            self.broadcaster.publish(b"jpeg")
+            time.sleep(0.05)
+        self.assertTrue(_wait(lambda: self.broadcaster.stats()["clients"] == 50))
+
+    def test_twenty_viewers_reuse_a_few_buffers(self):
+        viewers = self._connect(20)
+        for i in range(30):
+            self.broadcaster.publish(b"%04d" % i + bytes(50_000))
+            for v in viewers:
+                self.assertEqual(v.next_jpeg()[:4], b"%04d" % i)
+        pool = self.broadcaster.stats()["pool"]
+        self.assertEqual((pool["parts"], pool["copies"], pool["bytes_copied"]), (30, 30, 30 * 50_004))
+        self.assertLessEqual(pool["allocations"], 4)  # not 30 x 20
+        self.assertEqual(pool["reuses"], 30 - pool["allocations"])
+
+
+class TestPartPool(unittest.TestCase):
+
+    def test_framing(self):
+        part = PartPool().build(b"\xff\xd8\xff\xd9")
+        self.assertEqual(bytes(part.data),
+                         b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 4\r\n\r\n\xff\xd8\xff\xd9\r\n")
+        self.assertEqual(bytes(part.jpeg), b"\xff\xd8\xff\xd9")
+
+    def test_buffers_reused_only_once_released(self):
+        pool = PartPool(max_buffers=2)
+        held = pool.build(b"a" * 1000)
+        pool.build(b"b" * 1000)  # released at once
+        third = pool.build(b"c" * 1000)
+        self.assertEqual(bytes(held.jpeg), b"a" * 1000)  # never overwritten while referenced
+        self.assertEqual(pool.stats()["allocations"], 2)
+        self.assertEqual(pool.stats()["reuses"], 1)
+        del held, third
+        pool.build(b"d" * 5000)  # bigger than any buffer: a free one grows
+        self.assertEqual(pool.stats()["buffers"], 2)
+        self.assertEqual(pool.stats()["allocations"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
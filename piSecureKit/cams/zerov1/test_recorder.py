@@ -0,0 +1,81 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from recorder import RecorderConfig, SegmentedRecorder
+
+
+def _frames(count, size=1000, gop=10, fps=30):
+    for i in range(count):
+        yield bytes([i % 256]) * size, i % gop == 0, int(i * 1_000_000 / fps)
+
+
+class TestSegmentedRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _cfg(self, **kw):
+        base = dict(directory=self.dir, segment_sec=1.0, write_block_bytes=4096,
+                    preallocate_bytes=64 * 1024, retain_bytes=None, retain_age_sec=None)
+        base.update(kw)
+        return RecorderConfig(**base)
+
+    def test_segments_rotate_on_keyframes_and_keep_every_byte(self):
+        rec = SegmentedRecorder(self._cfg())
+        rec.start()
+        frames = list(_frames(90))
+        for data, key, ts in frames:
+            rec.outputframe(data, key, ts)
+        rec.stop()
+
+        segments = sorted(self.dir.glob("cam_*.h264"))
+        self.assertEqual(len(segments), 3)
+        self.assertFalse(list(self.dir.glob("*.part")))
+        self.assertEqual(b"".join(p.read_bytes() for p in segments), b"".join(f[0] for f in frames))
+        stats = rec.stats()
+        self.assertEqual(stats["queue_frames"], 0)
+        self.assertEqual(stats["bytes_written"], 90 * 1000)
+
+    def test_retention_by_total_bytes_keeps_newest(self):
+        rec = SegmentedRecorder(self._cfg(retain_bytes=45_000))
+        rec.start()
+        for data, key, ts in _frames(150):
+            rec.outputframe(data, key, ts)
+        rec.stop()
+
+        segments = sorted(self.dir.glob("cam_*.h264"))
+        self.assertLessEqual(sum(p.stat().st_size for p in segments), 45_000)
+        self.assertGreaterEqual(rec.stats()["segments_deleted"], 1)
+
+    def test_retention_by_age(self):
+        old = self.dir / "cam_20000101-000000-000.h264"
+        old.write_bytes(b"x" * 10)
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+        rec = SegmentedRecorder(self._cfg(retain_age_sec=60))
+        rec.start()
+        for data, key, ts in _frames(40):
+            rec.outputframe(data, key, ts)
+        rec.stop()
+        self.assertFalse(old.exists())
+
+    def test_full_queue_drops_until_next_keyframe_instead_of_blocking(self):
+        rec = SegmentedRecorder(self._cfg(queue_max_bytes=5000))
+        rec.recording = True  # no writer thread, so the queue only fills
+        started = time.monotonic()
+        for data, key, ts in _frames(20):
+            rec.outputframe(data, key, ts)
+        self.assertLess(time.monotonic() - started, 0.5)
+        stats = rec.stats()
+        self.assertEqual(stats["queue_frames"], 5)
+        self.assertEqual(stats["dropped_frames"], 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import h264
+from encoded_output import EncodedOutput
+from resilient_publisher import KEEPALIVE, LIVE, OFF, OnDemandConfig, ReconnectConfig, ResilientPublisher, _MemoryBuffer
+from rtsp_test_server import RtspTestServer
+
+FAST = ReconnectConfig(initial_backoff_sec=0.05, max_backoff_sec=0.4, settle_sec=0.2,
+                       backfill_speed=50.0, buffer_max_bytes=1 << 20)
+
+
+class _Hub:
+    """Stands in for mediamtx: can be taken down and brought back."""
+
+    def __init__(self):
+        self.up = True
+        self.received = {}
+        self.connects = []
+        self.lock = threading.Lock()
+
+
+class _HubSink(EncodedOutput):
+    def __init__(self, hub, path):
+        super().__init__()
+        self.hub, self.path = hub, path
+        self.error_callback = None
+        self._broken = False
+
+    def start(self):
+        self.hub.connects.append(time.monotonic())
+        if not self.hub.up:
+            raise ConnectionRefusedError("hub down")
+        super().start()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if self._broken:
+            return
+        if not self.hub.up:
+            self._broken = True
+            self.error_callback(BrokenPipeError("hub went away"))
+            return
+        with self.hub.lock:
+            self.hub.received.setdefault(self.path, []).append((frame, keyframe))
+
+
+def _feed(pub, start, count, gop=10, fps=100):
+    for i in range(start, start + count):
+        pub.outputframe(i.to_bytes(4, "big"), i % gop == 0, i * 1_000_000 // fps)
+        time.sleep(1 / fps)
+
+
+def _wait(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestResilientPublisher(unittest.TestCase):
+
+    def test_outage_is_buffered_and_backfilled_after_reconnect(self):
+        hub = _Hub()
+        pub = ResilientPublisher(lambda path: _HubSink(hub, path), "hqstream", FAST)
+        pub.start()
+        try:
+            _feed(pub, 0, 40)
+            self.assertTrue(_wait(lambda: pub.stats()["state"] == "live"))
+            hub.up = False
+            _feed(pub, 40, 60)
+            self.assertGreater(pub.stats()["backlog_bytes"], 0)
+            hub.up = True
+            _feed(pub, 100, 60)
+            self.assertTrue(_wait(lambda: pub.stats()["backfills_done"] == 1))
+        finally:
+            pub.stop()
+
+        live = [int.from_bytes(f, "big") for f, _ in hub.received["hqstream"]]
+        backfill = [(int.from_bytes(f, "big"), k) for f, k in hub.received["hqstream_backfill"]]
+        self.assertTrue(backfill[0][1], "backfill must start on a keyframe")
+        self.assertEqual(backfill[0][0], 40)
+        # Every frame produced while the hub was down reached it through the backfill.
+        missing = set(range(40, 100)) - {n for n, _ in backfill}
+        self.assertFalse(missing)
+        self.assertGreater(max(live), 100)
+        self.assertEqual(pub.stats()["outages"], 1)
+
+    def test_reconnect_backs_off_exponentially(self):
+        hub = _Hub()
+        hub.up = False
+        pub = ResilientPublisher(lambda path: _HubSink(hub, path), "hqstream", FAST)
+        pub.start()
+        time.sleep(1.2)
+        pub.stop()
+        gaps = [b - a for a, b in zip(hub.connects, hub.connects[1:])]
+        self.assertGreaterEqual(len(gaps), 3)
+        self.assertLess(gaps[0], gaps[2])
+        self.assertLessEqual(max(gaps), FAST.max_backoff_sec + 0.1)
+
+    def test_on_demand_switches_paths_within_a_second(self):
+        hub = _Hub()
+        pub = ResilientPublisher(lambda path: _HubSink(hub, path), "hqstream", FAST,
+                                 OnDemandConfig(keepalive_interval_sec=0.2))
+        forced = threading.Event()
+        pub.keyframe_requester = forced.set
+        stop = threading.Event()
+
+        def encoder():  # 100 fps, a GOP of 10 s unless a keyframe is requested
+            i = 0
+            while not stop.is_set():
+                key = i % 1000 == 0 or forced.is_set()
+                forced.clear()
+                pub.outputframe(i.to_bytes(4, "big"), key, i * 10_000)
+                i += 1
+                time.sleep(0.01)
+
+        feeder = threading.Thread(target=encoder, daemon=True)
+        pub.start()
+        feeder.start()
+        try:
+            self.assertEqual(pub.mode, KEEPALIVE)
+            self.assertTrue(_wait(lambda: len(hub.received.get("hqstream_idle", [])) >= 3))
+            self.assertNotIn("hqstream", hub.received)
+            self.assertTrue(all(k for _, k in hub.received["hqstream_idle"]))
+            t = time.monotonic()
+            pub.set_mode(LIVE)
+            self.assertTrue(_wait(lambda: len(hub.received.get("hqstream", [])) > 0, timeout=1.0))
+            self.assertLess(time.monotonic() - t, 1.0)
+            self.assertTrue(_wait(lambda: pub.stats()["state"] == "live"))
+            self.assertTrue(hub.received["hqstream"][0][1], "live stream must start on a keyframe")
+            pub.set_mode(OFF)
+            self.assertEqual(pub.stats()["state"], "idle")  # not an outage
+            time.sleep(0.3)
+            received = {path: len(frames) for path, frames in hub.received.items()}
+            connects = len(hub.connects)
+            time.sleep(0.5)
+            self.assertEqual({path: len(frames) for path, frames in hub.received.items()}, received)
+            self.assertEqual(len(hub.connects), connects)
+        finally:
+            stop.set()
+            feeder.join()
+            pub.stop()
+        stats = pub.stats()
+        self.assertEqual((stats["mode"], stats["state"], stats["mode_changes"], stats["outages"]),
+                         (OFF, "idle", 2, 0))
+        self.assertEqual(stats["backfills_done"] + stats["backfills_pending"], 0)  # switching is not an outage
+        self.assertNotIn("hqstream_backfill", hub.received)
+        with self.assertRaises(ValueError):
+            pub.set_mode("sometimes")
+
+    def test_outage_backlog_survives_the_lease_running_out(self):
+        hub = _Hub()
+        pub = ResilientPublisher(lambda path: _HubSink(hub, path), "hqstream", FAST,
+                                 OnDemandConfig(keepalive_interval_sec=0.2))
+        pub.start()
+        try:
+            pub.set_mode(LIVE)
+            _feed(pub, 0, 40)
+            self.assertTrue(_wait(lambda: pub.stats()["state"] == "live"))
+            hub.up = False  # the hub dies, so nobody renews the lease
+            _feed(pub, 40, 60)
+            backlog = pub.stats()["backlog_bytes"]
+            self.assertGreater(backlog, 0)
+            pub.set_mode(KEEPALIVE)  # lease expiry
+            _feed(pub, 100, 20)
+            self.assertEqual(pub.stats()["backlog_bytes"], backlog)  # kept, and idle frames not added
+            hub.up = True
+            _feed(pub, 120, 60)
+            self.assertTrue(_wait(lambda: pub.stats()["backfills_done"] == 1))
+        finally:
+            pub.stop()
+        backfill = {int.from_bytes(f, "big") for f, _ in hub.received["hqstream_backfill"]}
+        self.assertFalse(set(range(40, 100)) - backfill)
+        self.assertFalse(backfill & set(range(100, 180)))
+        self.assertIn("hqstream_idle", hub.received)
+
+    def test_memory_buffer_is_bounded_and_starts_on_keyframe(self):
+        buf = _MemoryBuffer(max_bytes=1000)
+        for i in range(100):
+            buf.append(b"x" * 50, i % 5 == 0, i)
+        self.assertLessEqual(buf.nbytes, 1000)
+        frames = list(buf.take())
+        self.assertTrue(frames[0][1])
+        self.assertEqual(frames[-1][2], 99)
+
+
+def _ffmpeg_clip(path: Path, seconds: int = 4) -> None:
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=30:duration={seconds}",
+         "-c:v", "libx264", "-g", "15", "-bsf:v", "h264_mp4toannexb", "-f", "h264", str(path)],
+        check=True,
+    )
+
+
+class _FfmpegSink(EncodedOutput):
+    """What FfmpegOutput does, without needing picamera2 installed."""
+
+    def __init__(self, url):
+        super().__init__()
+        self.url, self.error_callback, self.proc = url, None, None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "quiet", "-use_wallclock_as_timestamps", "1", "-i", "-",
+             "-c:v", "copy", "-an", "-f", "rtsp", "-rtsp_transport", "tcp", self.url],
+            stdin=subprocess.PIPE)
+        super().start()
+
+    def stop(self):
+        super().stop()
+        if self.proc:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+            self.proc.kill()
+            self.proc.wait()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        try:
+            self.proc.stdin.write(frame)
+            self.proc.stdin.flush()
+        except OSError as e:
+            if self.error_callback:
+                self.error_callback(e)
+
+
+@unittest.skipUnless(shutil.which("ffmpeg"), "needs ffmpeg")
+class TestAgainstStandInReceiver(unittest.TestCase):
+
+    def test_hub_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            clip = Path(tmp) / "clip.h264"
+            _ffmpeg_clip(clip)
+            with clip.open("rb") as f:
+                frames = list(h264.iter_access_units(f))
+        server = RtspTestServer().start()
+        cfg = ReconnectConfig(initial_backoff_sec=0.2, max_backoff_sec=1.0, settle_sec=1.0)
+        pub = ResilientPublisher(lambda path: _FfmpegSink(server.url(path)), "hqstream", cfg)
+        pub.start()
+        try:
+            def play(chunk):
+                for au, key in chunk:
+                    pub.outputframe(au, key, None)
+                    time.sleep(1 / 30)
+            play(frames[:45])
+            self.assertTrue(server.wait_for("hqstream", 5))
+            server.stop()
+            play(frames[45:75])
+            server.start()
+            play(frames[75:] + frames)
+            self.assertTrue(_wait(lambda: pub.stats()["backfills_done"] == 1, timeout=15))
+            self.assertGreater(len(server.stream("hqstream_backfill").access_units), 0)
+        finally:
+            pub.stop()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
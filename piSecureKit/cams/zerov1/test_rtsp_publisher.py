@@ -0,0 +1,104 @@
+import os
+import socket
+import time
+import unittest
+
+import h264
+from resilient_publisher import ReconnectConfig, ResilientPublisher
+from rtsp_publisher import H264Packetizer, RtspClient, RtspOutput, build_sdp
+from rtsp_test_server import RtspTestServer, _Depacketizer
+
+SPS = bytes.fromhex("6742c01e8c8d40501e900f08846a")
+PPS = bytes.fromhex("68ce3c80")
+
+
+def _au(index, keyframe, slice_size=3000):
+    body = os.urandom(slice_size)
+    if keyframe:
+        return b"".join(h264.START_CODE + n for n in (SPS, PPS, b"\x65\x88" + body))
+    return h264.START_CODE + b"\x41\x9a" + body[:slice_size // 4]
+
+
+class TestPacketizer(unittest.TestCase):
+
+    def test_fu_a_round_trip(self):
+        pack = H264Packetizer(max_payload=500)
+        depack = _Depacketizer()
+        for i in range(10):
+            frame = _au(i, i % 5 == 0)
+            bufs = pack.packetize(frame, i * 33_333)
+            out = None
+            for j in range(0, len(bufs), 2):
+                packet = bytes(bufs[j]) + bytes(bufs[j + 1])
+                self.assertLessEqual(len(packet) - 4 - 12, 500)
+                out = depack.push(packet[4:]) or out
+            self.assertEqual(out[1], frame)
+            self.assertEqual(out[0], pack.rtp_timestamp(i * 33_333))
+
+    def test_sdp_carries_parameter_sets(self):
+        sdp = build_sdp("127.0.0.1", SPS, PPS)
+        self.assertIn("profile-level-id=42C01E", sdp)
+        self.assertIn("sprop-parameter-sets=", sdp)
+
+
+class TestRtspOutput(unittest.TestCase):
+
+    def test_publish_to_local_server(self):
+        frames = [_au(i, i % 10 == 0) for i in range(60)]
+        with RtspTestServer() as server:
+            out = RtspOutput(server.host, server.port, "hqstream", max_payload=1400)
+            out.start()
+            for i, f in enumerate(frames):
+                out.outputframe(f, i % 10 == 0, i * 33_333)
+            self.assertTrue(server.wait_for("hqstream", 60))
+            out.stop()
+            received = server.stream("hqstream")
+            self.assertIn("H264/90000", received.sdp)
+            self.assertEqual([au for _, au, _ in received.access_units], frames)
+            self.assertEqual(out.stats()["frames_sent"], 60)
+
+    def test_start_fails_fast_without_server(self):
+        server = RtspTestServer().start()
+        port = server.port
+        server.stop()
+        with self.assertRaises(OSError):
+            RtspOutput("127.0.0.1", port, "hqstream").start()
+
+    def test_reply_cut_short_is_an_error(self):
+        client = RtspClient("127.0.0.1", 0, "hqstream")
+        client._sock, server = socket.socketpair()
+        server.sendall(b"RTSP/1.0 200 OK\r\nCSeq: 1\r\nContent-Length: 100\r\n\r\nv=0")
+        server.close()
+        with self.assertRaises(ConnectionError):
+            client._read_response()
+        client._sock.close()
+
+    def test_survives_receiver_restart_through_resilient_publisher(self):
+        server = RtspTestServer().start()
+        cfg = ReconnectConfig(initial_backoff_sec=0.05, max_backoff_sec=0.2, settle_sec=0.2, backfill_speed=20.0)
+        pub = ResilientPublisher(lambda path: RtspOutput(server.host, server.port, path), "hqstream", cfg)
+        pub.start()
+
+        def play(start, count):
+            for i in range(start, start + count):
+                pub.outputframe(_au(i, i % 10 == 0, 800), i % 10 == 0, i * 33_333)
+                time.sleep(0.01)
+        try:
+            play(0, 50)
+            self.assertTrue(server.wait_for("hqstream", 20))
+            server.stop()
+            play(50, 50)
+            server.start()
+            play(100, 80)
+            deadline = time.monotonic() + 5
+            while pub.stats()["backfills_done"] < 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(pub.stats()["backfills_done"], 1)
+            self.assertGreaterEqual(len(server.stream("hqstream_backfill").access_units), 40)
+        finally:
+            pub.stop()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
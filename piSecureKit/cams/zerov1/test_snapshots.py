@@ -0,0 +1,177 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import snapshots
+from snapshots import BurstSaver, SnapshotConfig, SnapshotPipeline, SnapshotSize, SnapshotStore
+
+
+def _frame(width, height, value=0, stride=None, timestamp=0.0):
+    """A Picamera2-style YUV420 array: luma rows then chroma rows packed two per row."""
+    stride = stride or width
+    array = np.zeros((height * 3 // 2, stride), dtype=np.uint8)
+    array[:height, :width] = np.arange(width, dtype=np.uint8)[None, :] + value
+    chroma = array[height:].reshape(-1, stride // 2)
+    chroma[:height // 2, :width // 2] = 100
+    chroma[height // 2:, :width // 2] = 200
+    return snapshots.yuv420_planes(array, width, height, timestamp)
+
+
+def _fake_encode(frame, quality):
+    return f"{frame.width}x{frame.height}@{quality}:{frame.timestamp}".encode()
+
+
+class TestBurstSaver(unittest.TestCase):
+
+    def test_every_frame_saved_and_backlog_bounded(self):
+        gate = threading.Event()
+
+        def slow_encode(frame, quality):
+            gate.wait(5)
+            return _fake_encode(frame, quality)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            saver = BurstSaver(Path(tmp, "stills"), quality=90, workers=2, max_pending=5, encode=slow_encode)
+            saver.reserve(5)
+            saver.release(1)  # the grab came back one frame short
+            paths = saver.save([[_frame(64, 48, timestamp=float(i))] for i in range(4)], "b1")
+            self.assertEqual([p.name for p in paths], ["b1-00.jpg", "b1-01.jpg", "b1-02.jpg", "b1-03.jpg"])
+            with self.assertRaises(RuntimeError):
+                saver.reserve(2)  # would be 6 frames waiting: refused before anything is grabbed
+            saver.reserve(1)
+            saver.release(1)
+            with self.assertRaises(RuntimeError):
+                saver.save([[_frame(64, 48)]], "b3")  # no slot reserved
+            with self.assertRaises(RuntimeError):
+                saver.release(1)
+            gate.set()
+            self.assertTrue(saver.wait(5))
+            saver.close()
+            self.assertEqual([p.read_bytes() for p in paths], [b"64x48@90:%d.0" % i for i in range(4)])
+            stats = saver.stats()
+            self.assertEqual((stats["bursts"], stats["saved"], stats["rejected"], stats["pending"]), (1, 4, 1, 0))
+
+
+class TestDownscale(unittest.TestCase):
+
+    def test_planes_respect_stride(self):
+        f = _frame(64, 48, stride=128)
+        self.assertEqual(f.y.shape, (48, 64))
+        self.assertEqual((f.u.shape, int(f.u.mean()), int(f.v.mean())), ((24, 32), 100, 200))
+
+    def test_box_and_fractional_scaling(self):
+        f = _frame(64, 48)
+        half = snapshots.downscale(f, 32, 24)
+        self.assertEqual(half.y[0, :3].tolist(), [0, 2, 4])  # mean of (0, 1), (2, 3), ...
+        odd = snapshots.downscale(f, 20, 14)
+        self.assertEqual((odd.y.shape, odd.u.shape), ((14, 20), (7, 10)))
+        self.assertTrue((odd.v == 200).all())
+
+
+class TestSnapshotPipeline(unittest.TestCase):
+
+    def test_writes_every_size_from_best_source(self):
+        cfg = SnapshotConfig(sizes=(SnapshotSize("full"), SnapshotSize("medium", 320, 240, 80),
+                                    SnapshotSize("thumb", 160, 120, 70)), workers=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            pipe = SnapshotPipeline(cfg, Path(tmp, "preview.jpg"), encode=_fake_encode)
+            pipe.submit([_frame(1280, 720, timestamp=1.0), _frame(320, 240, timestamp=1.0)])
+            time.sleep(0.3)
+            pipe.close()
+            written = {n: p.read_bytes() for n, p in pipe.paths.items()}
+            self.assertEqual(written, {"full": b"1280x720@85:1.0", "medium": b"320x240@80:1.0",
+                                       "thumb": b"160x120@70:1.0"})
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()),
+                             ["preview-medium.jpg", "preview-thumb.jpg", "preview.jpg"])
+
+    def test_busy_workers_drop_stale_grabs(self):
+        gate = threading.Event()
+
+        def slow_encode(frame, quality):
+            gate.wait(5)
+            return _fake_encode(frame, quality)
+
+        cfg = SnapshotConfig(sizes=(SnapshotSize("full"),), workers=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            pipe = SnapshotPipeline(cfg, Path(tmp, "p.jpg"), encode=slow_encode)
+            for ts in range(5):
+                pipe.submit([_frame(64, 48, timestamp=float(ts))])
+                time.sleep(0.02)
+            gate.set()
+            time.sleep(0.3)
+            pipe.close()
+            stats = pipe.stats()
+            self.assertEqual((stats["submitted"], stats["encoded"], stats["dropped"]), (5, 2, 3))
+            self.assertEqual(pipe.paths["full"].read_bytes(), b"64x48@85:4.0")
+
+
+    def test_slow_destination_does_not_block_submit(self):
+        gate = threading.Event()
+        real_write = snapshots.write_atomic
+
+        def slow_write(path, data):
+            gate.wait(5)
+            real_write(path, data)
+
+        cfg = SnapshotConfig(sizes=(SnapshotSize("full"),), workers=1)
+        snapshots.write_atomic = slow_write
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                pipe = SnapshotPipeline(cfg, Path(tmp, "p.jpg"), encode=_fake_encode)
+                pipe.submit([_frame(64, 48, timestamp=1.0)])
+                time.sleep(0.1)  # the worker is now stuck writing
+                t0 = time.monotonic()
+                pipe.submit([_frame(64, 48, timestamp=2.0)])
+                self.assertEqual(pipe.stats()["pending"], 1)
+                self.assertLess(time.monotonic() - t0, 0.1)
+                gate.set()
+                time.sleep(0.3)
+                pipe.close()
+                self.assertEqual(pipe.paths["full"].read_bytes(), b"64x48@85:2.0")
+        finally:
+            snapshots.write_atomic = real_write
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def test_pipeline_publishes_to_store_without_files(self):
+        cfg = SnapshotConfig(sizes=(SnapshotSize("full"), SnapshotSize("thumb", 32, 24)), workers=1,
+                             write_files=False)
+        store = SnapshotStore()
+        with tempfile.TemporaryDirectory() as tmp:
+            pipe = SnapshotPipeline(cfg, Path(tmp, "p.jpg"), encode=_fake_encode, store=store)
+            pipe.submit([_frame(64, 48, timestamp=2.0)])
+            time.sleep(0.2)
+            pipe.close()
+            self.assertEqual(list(Path(tmp).iterdir()), [])
+        self.assertEqual(store.get("thumb").data, b"32x24@85:2.0")
+        self.assertEqual(store.get("full").seq, 1)
+        self.assertTrue(store.get("full").etag.endswith('-1"'))
+
+    def test_long_poll_wakes_on_newer_frame_only(self):
+        store = SnapshotStore()
+        store.put("full", 1, b"one")
+        first = store.get("full")
+        store.put("full", 0, b"stale")  # older seq from a slower worker is ignored
+        self.assertIs(store.get("full"), first)
+
+        async def poll():
+            self.assertIs(await store.wait_newer("full", set(), 1), first)  # unseen: immediate
+            self.assertIsNone(await store.wait_newer("full", {first.etag}, 0.05))
+            threading.Timer(0.05, store.put, ("full", 2, b"two")).start()
+            t0 = time.monotonic()
+            newer = await store.wait_newer("full", {first.etag}, 5)
+            return newer, time.monotonic() - t0
+
+        newer, waited = asyncio.run(poll())
+        self.assertEqual(newer.data, b"two")
+        self.assertLess(waited, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import bench_pipeline
+import h264
+from synthetic_camera import FakeH264Encoder, SyntheticCamera, SyntheticConfig, Y4mSource
+
+
+class _Collector:
+    """Minimal picamera2-style Output that keeps what it is given."""
+
+    def __init__(self):
+        self.frames = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        self.frames.append((frame, keyframe, timestamp))
+
+
+class TestFakeEncoder(unittest.TestCase):
+
+    def test_gop_matches_bitrate_and_parses(self):
+        enc = FakeH264Encoder(bitrate=2_000_000, fps=25, iperiod=25)
+        gop = [enc.encode() for _ in range(25)]
+        self.assertEqual([k for _, k in gop], [True] + [False] * 24)
+        self.assertAlmostEqual(sum(len(f) for f, _ in gop) * 8, 2_000_000, delta=20_000)
+        self.assertEqual([FakeH264Encoder.frame_index(f) for f, _ in gop], list(range(25)))
+        self.assertTrue(h264.is_keyframe(gop[0][0]))
+
+
+class TestSyntheticCamera(unittest.TestCase):
+
+    def test_paced_output_and_replay(self):
+        out = _Collector()
+        cam = SyntheticCamera(SyntheticConfig(width=64, height=48, fps=50, iperiod=10), [out])
+        cam.start()
+        time.sleep(0.5)
+        grab = cam.grab_frame()
+        cam.stop()
+        self.assertEqual(grab[0].y.shape, (48, 64))
+        self.assertGreaterEqual(len(out.frames), 20)
+        self.assertEqual(out.frames[10][2], 200_000)  # 10th frame at 50 fps
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "clip.h264")
+            path.write_bytes(b"".join(f for f, _, _ in out.frames[:20]))
+            replay = _Collector()
+            cam = SyntheticCamera(SyntheticConfig(source=str(path), fps=100), [replay])
+            cam.start()
+            time.sleep(0.3)
+            cam.stop()
+            self.assertIsNone(cam.grab_frame())
+            self.assertEqual([f for f, _, _ in replay.frames[20:25]], [f for f, _, _ in out.frames[:5]])
+
+    def test_burst_grabs_consecutive_frames_without_stalling_the_stream(self):
+        out = _Collector()
+        cam = SyntheticCamera(SyntheticConfig(width=64, height=48, fps=50), [out])
+        cam.start()
+        t0 = time.monotonic()
+        grabs = cam.grab_burst(10)
+        elapsed = time.monotonic() - t0
+        time.sleep(0.1)
+        cam.stop()
+        # The pattern's chroma steps by one per frame: ten distinct, consecutive frames
+        values = [int(g[0].u[0, 0]) for g in grabs]
+        self.assertEqual(values, list(range(values[0], values[0] + 10)))
+        self.assertLess(elapsed, 0.5)  # 10 frames at 50 fps, not a second per still
+        self.assertEqual(cam.status()["late_frames"], 0)
+
+    def test_y4m_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "clip.y4m")
+            frames = [np.full(8 * 4 * 3 // 2, i, dtype=np.uint8).tobytes() for i in range(3)]
+            path.write_bytes(b"YUV4MPEG2 W8 H4 F30:1 C420jpeg\n" + b"".join(b"FRAME\n" + f for f in frames))
+            src = Y4mSource(path)
+            seen = []
+            for _ in range(4):
+                src.advance()
+                seen.append(int(src.frame().y[0, 0]))
+            src.close()
+            self.assertEqual(seen, [0, 1, 2, 0])
+
+    def test_publish_benchmark_reports_latency(self):
+        cfg = SyntheticConfig(width=64, height=48, fps=30, bitrate=1_000_000)
+        result = bench_pipeline.bench_publish(cfg, 1.0, None)
+        self.assertEqual(result["received"], result["frames_sent"])
+        self.assertIn("p95", result["latency_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import struct
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import timelapse
+from timelapse import TimelapseConfig, TimelapseReader, TimelapseWriter
+
+
+def _jpeg(i, width=64, height=48):
+    """Smallest thing jpeg_size accepts: SOI, SOF0 with the dimensions, a payload, EOI."""
+    sof = struct.pack(">BBHBHHB", 0xFF, 0xC0, 11, 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + sof + f"frame{i:04d}".encode() + b"\xff\xd9"
+
+
+def _day(y, m, d, hour=12):
+    return datetime(y, m, d, hour).timestamp()
+
+
+def _write(directory, frames, **cfg):
+    """Offer frames one at a time, waiting for each so none are dropped."""
+    writer = TimelapseWriter(TimelapseConfig(directory=directory, **cfg))
+    for n, (ts, data) in enumerate(frames, 1):
+        writer.offer(data, ts)
+        deadline = time.monotonic() + 2
+        while writer.stats()["frames"] < n and time.monotonic() < deadline:
+            time.sleep(0.001)
+    writer.close()
+    return writer
+
+
+class TestTimelapse(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_append_seek_and_day_rollover(self):
+        t0 = _day(2024, 5, 1, 23)
+        frames = [(t0 + 600 * i, _jpeg(i)) for i in range(12)]  # 23:00 .. 00:50 next day
+        writer = _write(self.dir, frames, retain_days=None)
+        self.assertEqual(writer.stats()["frames"], 12)
+        reader = TimelapseReader(self.dir)
+        self.assertEqual(reader.days(), ["20240501", "20240502"])
+        self.assertEqual([reader.count(d) for d in reader.days()], [6, 6])
+        day, entry = reader.seek(t0 + 600 * 7 + 30)
+        self.assertEqual((day, reader.read(day, entry)), ("20240502", _jpeg(7)))
+        self.assertEqual(reader.read(*reader.seek(t0 - 3600)), _jpeg(0))  # before the first frame
+        self.assertEqual(reader.read(*reader.seek(t0 + 86400)), _jpeg(11))
+        kept = [ts for ts, _ in reader.frames(t0, t0 + 600 * 11, every_sec=1800)]
+        self.assertEqual(kept, [t0 + 600 * i for i in (0, 3, 6, 9)])
+
+    def test_torn_tail_is_repaired_on_reopen(self):
+        t0 = _day(2024, 5, 1)
+        _write(self.dir, [(t0 + i, _jpeg(i)) for i in range(3)])
+        with open(self.dir / "20240501.mjpeg", "ab") as f:
+            f.write(b"\xff\xd8partial")  # crash mid-frame, before its index record
+        with open(self.dir / "20240501.idx", "ab") as f:
+            f.write(b"\x01\x02\x03")  # and a torn record
+        _write(self.dir, [(t0 + 3, _jpeg(3))])
+        reader = TimelapseReader(self.dir)
+        self.assertEqual([reader.read("20240501", e) for e in reader.entries("20240501")],
+                         [_jpeg(i) for i in range(4)])
+
+    def test_retention_drops_old_days(self):
+        frames = [(_day(2024, 5, d), _jpeg(d)) for d in (1, 2, 10)]
+        writer = _write(self.dir, frames, retain_days=7)
+        self.assertEqual(TimelapseReader(self.dir).days(), ["20240510"])
+        self.assertEqual(writer.stats()["days_deleted"], 2)
+
+    def test_avi_copies_jpegs_unchanged(self):
+        frames = [_jpeg(i) + b"x" * (i % 2) for i in range(5)]  # odd sizes get padded
+        path = self.dir / "out.avi"
+        self.assertEqual(timelapse.write_avi(iter(frames), path, fps=25), [timelapse.AviPart(path, 5)])
+        data = path.read_bytes()
+        self.assertEqual((data[:4], data[8:12]), (b"RIFF", b"AVI "))
+        self.assertEqual(struct.unpack("<I", data[4:8])[0], len(data) - 8)
+        avih = data.index(b"avih") + 8
+        self.assertEqual(struct.unpack("<I", data[avih + 16:avih + 20])[0], 5)  # total frames
+        self.assertEqual(struct.unpack("<II", data[avih + 32:avih + 40]), (64, 48))
+        movi = data.index(b"movi")
+        self.assertEqual(struct.unpack("<I", data[movi - 4:movi])[0], data.index(b"idx1") - movi)
+        idx = data.index(b"idx1") + 8
+        for i, frame in enumerate(frames):
+            _, _, offset, size = struct.unpack("<4sIII", data[idx + 16 * i:idx + 16 * (i + 1)])
+            self.assertEqual(data[movi + offset + 8:movi + offset + 8 + size], frame)
+
+    def test_avi_is_split_before_the_size_limit(self):
+        frames = [_jpeg(i) + b"x" * 1000 for i in range(10)]
+        path = self.dir / "week.avi"
+        parts = timelapse.write_avi(iter(frames), path, max_bytes=4000)
+        self.assertEqual([p.path.name for p in parts], ["week.avi", "week-002.avi", "week-003.avi", "week-004.avi"])
+        self.assertEqual(sum(p.frames for p in parts), 10)
+        copied = []
+        for part in parts:
+            data = part.path.read_bytes()
+            self.assertLessEqual(len(data), 4000)
+            self.assertEqual(struct.unpack("<I", data[4:8])[0], len(data) - 8)
+            movi, idx = data.index(b"movi"), data.index(b"idx1") + 8
+            for i in range(part.frames):
+                _, _, offset, size = struct.unpack("<4sIII", data[idx + 16 * i:idx + 16 * (i + 1)])
+                copied.append(data[movi + offset + 8:movi + offset + 8 + size])
+        self.assertEqual(copied, frames)
+
+    def test_jpeg_size_rejects_garbage(self):
+        self.assertEqual(timelapse.jpeg_size(_jpeg(0, 1640, 1232)), (1640, 1232))
+        with self.assertRaises(ValueError):
+            timelapse.jpeg_size(b"\xff\xd8not a jpeg at all")
+
+
+if __name__ == '__main__':
+    unittest.main()
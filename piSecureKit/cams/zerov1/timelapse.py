@@ -0,0 +1,427 @@
+"""
+Time-lapse of the preview stills: one append-only MJPEG file per day plus a fixed-record index.
+
+Each day is `<dir>/<YYYYMMDD>.mjpeg` (the JPEGs back to back) and `<YYYYMMDD>.idx`, a 20-byte
+record per frame (capture time in µs, byte offset, length). Records are fixed size, so seeking to
+a time is a binary search over the index file; nothing is held in memory beyond one frame.
+A crash can at worst leave a frame without its record, which the next open truncates away.
+
+Compilations copy the stored JPEGs into an MJPEG AVI as they are, so a day or a week is put
+together without decoding or re-encoding a single frame (split into 1 GB parts):
+
+    python3 timelapse.py info /var/lib/pisecurekit/timelapse
+    python3 timelapse.py compile /var/lib/pisecurekit/timelapse --start 2024-05-01 --end 2024-05-08 \\
+        --every 60 --fps 30 -o week.avi
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+LOG = logging.getLogger("PiSecureKit.timelapse")
+
+_RECORD = struct.Struct("<qQI")  # timestamp_us, offset, length
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class TimelapseConfig:
+    directory: Path = Path("/var/lib/pisecurekit/timelapse")
+    interval_sec: float = 10.0         # one frame per this many seconds of wall time
+    size: str = "medium"               # snapshot size (SnapshotConfig.sizes name) to keep
+    retain_days: Optional[int] = 30    # day files older than this are deleted at rollover
+
+
+class IndexEntry(NamedTuple):
+    timestamp: float  # seconds since the epoch
+    offset: int
+    length: int
+
+
+def day_key(timestamp: float) -> str:
+    return time.strftime("%Y%m%d", time.localtime(timestamp))
+
+
+# ---------- Day file ----------
+class _Day:
+    """One day's MJPEG + index pair, opened for appending."""
+
+    def __init__(self, directory: Path, key: str) -> None:
+        self.key = key
+        self.data_path = directory / f"{key}.mjpeg"
+        self.index_path = directory / f"{key}.idx"
+        self._data = open(self.data_path, "ab")
+        self._index = open(self.index_path, "ab")
+        self.frames = self._repair()
+
+    def _repair(self) -> int:
+        """Drop a torn index tail, records past the data, and frame bytes no record points at."""
+        size = self._index.seek(0, os.SEEK_END)
+        data_size = self._data.seek(0, os.SEEK_END)
+        whole = size - size % _RECORD.size
+        end = 0
+        with open(self.index_path, "rb") as f:
+            while whole:
+                f.seek(whole - _RECORD.size)
+                _, offset, length = _RECORD.unpack(f.read(_RECORD.size))
+                if offset + length <= data_size:
+                    end = offset + length
+                    break
+                whole -= _RECORD.size
+        if whole != size:
+            self._index.truncate(whole)
+        if data_size != end:
+            LOG.warning("Time-lapse %s: dropping %d unindexed bytes", self.key, self._data.tell() - end)
+            self._data.truncate(end)
+            self._data.seek(end)
+        return whole // _RECORD.size
+
+    def append(self, data: bytes, timestamp: float) -> None:
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(data)
+        self._data.flush()
+        # The record goes last: an index entry always points at complete frame bytes
+        self._index.write(_RECORD.pack(int(timestamp * 1_000_000), offset, len(data)))
+        self._index.flush()
+        self.frames += 1
+
+    def close(self) -> None:
+        for f in (self._data, self._index):
+            os.fsync(f.fileno())
+            f.close()
+
+
+# ---------- Writer ----------
+class TimelapseWriter:
+    """
+    Appends offered frames on a background thread. `offer` never blocks: a frame offered while
+    the previous one is still being written replaces it (one slot), so a slow SD card costs frames,
+    not preview-loop time.
+    """
+
+    def __init__(self, cfg: TimelapseConfig) -> None:
+        self._cfg = cfg
+        cfg.directory.mkdir(parents=True, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending: Optional[Tuple[bytes, float]] = None
+        self._closed = False
+        self._day: Optional[_Day] = None
+        self._stats: Dict[str, int] = {"frames": 0, "bytes": 0, "dropped": 0, "days_deleted": 0}
+        self._thread = threading.Thread(target=self._run, name="timelapse", daemon=True)
+        self._thread.start()
+
+    def offer(self, data: bytes, timestamp: float) -> None:
+        with self._cond:
+            if self._pending is not None:
+                self._stats["dropped"] += 1
+            self._pending = (data, timestamp)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=10)
+        if self._day is not None:
+            self._day.close()
+            self._day = None
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            out: Dict[str, object] = dict(self._stats)
+        out["day"] = self._day.key if self._day is not None else None
+        return out
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                data, timestamp = self._pending
+                self._pending = None
+            try:
+                self._append(data, timestamp)
+            except OSError as e:
+                LOG.warning("Time-lapse append failed: %s", e)
+
+    def _append(self, data: bytes, timestamp: float) -> None:
+        key = day_key(timestamp)
+        if self._day is None or self._day.key != key:
+            if self._day is not None:
+                self._day.close()
+            self._day = _Day(self._cfg.directory, key)
+            self._enforce_retention(timestamp)
+        self._day.append(data, timestamp)
+        with self._cond:
+            self._stats["frames"] += 1
+            self._stats["bytes"] += len(data)
+
+    def _enforce_retention(self, now: float) -> None:
+        if self._cfg.retain_days is None:
+            return
+        cutoff = day_key(now - self._cfg.retain_days * 86400)
+        for key in TimelapseReader(self._cfg.directory).days():
+            if key < cutoff:
+                for suffix in (".mjpeg", ".idx"):
+                    (self._cfg.directory / f"{key}{suffix}").unlink(missing_ok=True)
+                with self._cond:
+                    self._stats["days_deleted"] += 1
+                LOG.info("Time-lapse: deleted %s (older than %d days)", key, self._cfg.retain_days)
+
+
+# ---------- Reader ----------
+class TimelapseReader:
+    """Random access by time over the day files; safe to use while a writer appends."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def days(self) -> List[str]:
+        return sorted(p.stem for p in self.directory.glob("*.idx") if p.stem.isdigit())
+
+    def count(self, day: str) -> int:
+        try:
+            return (self.directory / f"{day}.idx").stat().st_size // _RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def entry(self, day: str, i: int) -> IndexEntry:
+        with open(self.directory / f"{day}.idx", "rb") as f:
+            return self._entry(f, i)
+
+    def entries(self, day: str) -> Iterator[IndexEntry]:
+        with open(self.directory / f"{day}.idx", "rb") as f:
+            for i in range(self.count(day)):
+                yield self._entry(f, i)
+
+    def seek(self, timestamp: float) -> Optional[Tuple[str, IndexEntry]]:
+        """Last frame captured at or before `timestamp` (first of its day if none); None if no frames."""
+        days = [d for d in self.days() if self.count(d)]
+        if not days:
+            return None
+        key = day_key(timestamp)
+        earlier = [d for d in days if d <= key]
+        day = earlier[-1] if earlier else days[0]
+        with open(self.directory / f"{day}.idx", "rb") as f:
+            lo, hi = 0, self.count(day)
+            target = int(timestamp * 1_000_000)
+            while lo < hi:  # first record with timestamp > target
+                mid = (lo + hi) // 2
+                f.seek(mid * _RECORD.size)
+                if _RECORD.unpack(f.read(_RECORD.size))[0] <= target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return day, self._entry(f, max(lo - 1, 0))
+
+    def read(self, day: str, entry: IndexEntry) -> bytes:
+        with open(self.directory / f"{day}.mjpeg", "rb") as f:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+
+    def frames(self, start: float, end: float, every_sec: float = 0.0) -> Iterator[Tuple[float, bytes]]:
+        """(timestamp, jpeg) from `start` to `end`, at most one per `every_sec`; streams from disk."""
+        next_ts = start
+        for day in self.days():
+            if day < day_key(start) or day > day_key(end):
+                continue
+            with open(self.directory / f"{day}.idx", "rb") as idx, open(self.directory / f"{day}.mjpeg", "rb") as data:
+                for i in range(self.count(day)):
+                    entry = self._entry(idx, i)
+                    if entry.timestamp > end:
+                        break
+                    if entry.timestamp < next_ts:
+                        continue
+                    data.seek(entry.offset)
+                    yield entry.timestamp, data.read(entry.length)
+                    next_ts = entry.timestamp + every_sec if every_sec > 0 else entry.timestamp
+
+    @staticmethod
+    def _entry(f: BinaryIO, i: int) -> IndexEntry:
+        f.seek(i * _RECORD.size)
+        ts_us, offset, length = _RECORD.unpack(f.read(_RECORD.size))
+        return IndexEntry(ts_us / 1_000_000, offset, length)
+
+
+# ---------- MJPEG AVI ----------
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data: bytes) -> Tuple[int, int]:
+    """(width, height) from the JPEG's start-of-frame segment, without decoding."""
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            break
+        marker = data[i + 1]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    raise ValueError("not a JPEG (no start-of-frame segment)")
+
+
+# Plain RIFF sizes are uint32, and many players stop at 1 GB; longer compilations are split
+AVI_MAX_BYTES = 1 << 30
+_AVI_HARD_LIMIT = (1 << 32) - 1
+
+
+class AviPart(NamedTuple):
+    path: Path
+    frames: int
+
+
+def avi_part_path(path: Path, part: int) -> Path:
+    """`week.avi`, then `week-002.avi`, `week-003.avi`, ..."""
+    return path if part == 1 else path.with_name(f"{path.stem}-{part:03d}{path.suffix}")
+
+
+def write_avi(frames: Iterable[bytes], path: Path, fps: float = 30.0,
+              max_bytes: int = AVI_MAX_BYTES) -> List[AviPart]:
+    """
+    Stream JPEGs into MJPEG AVIs as-is. Sizes are patched in at the end, so only the idx1 table
+    (16 bytes per frame) is kept in memory. A file that would grow past `max_bytes` is closed and
+    the frames continue in the next part (see avi_part_path); each part plays on its own.
+    """
+    if not 0 < max_bytes <= _AVI_HARD_LIMIT:
+        raise ValueError(f"max_bytes must be within 1..{_AVI_HARD_LIMIT}")
+    parts: List[AviPart] = []
+    writer: Optional[_AviWriter] = None
+    try:
+        for data in frames:
+            if writer is not None and not writer.fits(len(data), max_bytes):
+                parts.append(AviPart(writer.path, writer.close()))
+                writer = None
+            if writer is None:
+                writer = _AviWriter(avi_part_path(path, len(parts) + 1), fps)
+            writer.add(data)
+        if writer is None:  # no frames: still leave a valid (empty) file
+            writer = _AviWriter(path, fps)
+        parts.append(AviPart(writer.path, writer.close()))
+        writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+    return parts
+
+
+class _AviWriter:
+    """One RIFF AVI file; the headers are rewritten with the real sizes on close()."""
+
+    def __init__(self, path: Path, fps: float) -> None:
+        self.path = path
+        self._fps = fps
+        self._index = bytearray()
+        self._count = 0
+        self._max_frame = 0
+        self._width = self._height = 0
+        self._f = open(path, "wb")
+        self._f.write(b"RIFF\0\0\0\0AVI ")
+        self._hdrl_at = self._f.tell()
+        self._f.write(_hdrl(0, 0, 0, fps, 0))
+        self._f.write(b"LIST\0\0\0\0movi")
+        self._movi_at = self._f.tell() - 4  # idx1 offsets are relative to the 'movi' fourcc
+
+    def fits(self, size: int, max_bytes: int) -> bool:
+        """Whether one more frame of `size` bytes, its index entry and idx1 stay within `max_bytes`."""
+        return self._f.tell() + 8 + size + (size & 1) + 8 + len(self._index) + 16 <= max_bytes
+
+    def add(self, data: bytes) -> None:
+        if not self._count:
+            self._width, self._height = jpeg_size(data)
+        f = self._f
+        self._index += struct.pack("<4sIII", b"00dc", 0x10, f.tell() - self._movi_at, len(data))
+        f.write(struct.pack("<4sI", b"00dc", len(data)))
+        f.write(data)
+        if len(data) & 1:
+            f.write(b"\0")
+        self._count += 1
+        self._max_frame = max(self._max_frame, len(data))
+
+    def close(self) -> int:
+        f = self._f
+        movi_end = f.tell()
+        f.write(struct.pack("<4sI", b"idx1", len(self._index)))
+        f.write(self._index)
+        end = f.tell()
+        f.seek(4)
+        f.write(struct.pack("<I", end - 8))
+        f.seek(self._movi_at - 4)
+        f.write(struct.pack("<I", movi_end - self._movi_at))
+        f.seek(self._hdrl_at)
+        f.write(_hdrl(self._width, self._height, self._count, self._fps, self._max_frame))
+        f.close()
+        return self._count
+
+    def abort(self) -> None:
+        self._f.close()
+
+
+def _hdrl(width: int, height: int, frames: int, fps: float, max_frame: int) -> bytes:
+    rate, scale = int(round(fps * 1000)), 1000
+    avih = struct.pack("<IIIIIIIIII16x", int(1_000_000 / fps), int(max_frame * fps), 0, 0x10,
+                       frames, 0, 1, max_frame, width, height)
+    strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, scale, rate, 0, frames,
+                       max_frame, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    strl = b"strl" + _chunk(b"strh", strh) + _chunk(b"strf", strf)
+    hdrl = b"hdrl" + _chunk(b"avih", avih) + _chunk(b"LIST", strl)
+    return _chunk(b"LIST", hdrl)
+
+
+def _chunk(fourcc: bytes, body: bytes) -> bytes:
+    return struct.pack("<4sI", fourcc, len(body)) + body + (b"\0" if len(body) & 1 else b"")
+
+
+# ---------- CLI ----------
+def _parse_day(text: str) -> float:
+    return datetime.strptime(text, "%Y-%m-%d").timestamp()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Inspect and compile PiSecureKit time-lapse recordings.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    info = sub.add_parser("info", help="frames and time span per day")
+    info.add_argument("directory", type=Path)
+    comp = sub.add_parser("compile", help="copy frames into an MJPEG AVI (no re-encoding)")
+    comp.add_argument("directory", type=Path)
+    comp.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    comp.add_argument("--end", help="day after the last one, YYYY-MM-DD (default: start + 1 day)")
+    comp.add_argument("--every", type=float, default=0.0, help="seconds between kept frames (0: all)")
+    comp.add_argument("--fps", type=float, default=30.0)
+    comp.add_argument("-o", "--output", type=Path, required=True)
+    comp.add_argument("--max-mb", type=float, default=AVI_MAX_BYTES / 1e6,
+                      help="split into NAME-002.avi, ... beyond this size (at most 4294)")
+    args = ap.parse_args()
+
+    reader = TimelapseReader(args.directory)
+    if args.cmd == "info":
+        for day in reader.days():
+            n = reader.count(day)
+            if n:
+                first, last = reader.entry(day, 0), reader.entry(day, n - 1)
+                print(f"{day}: {n} frames, {time.strftime('%H:%M:%S', time.localtime(first.timestamp))}"
+                      f"-{time.strftime('%H:%M:%S', time.localtime(last.timestamp))}, "
+                      f"{(last.offset + last.length) / 1e6:.1f} MB")
+        return
+    start = _parse_day(args.start)
+    end = _parse_day(args.end) if args.end else (datetime.fromtimestamp(start) + timedelta(days=1)).timestamp()
+    parts = write_avi((jpeg for _, jpeg in reader.frames(start, end - 1e-6, args.every)), args.output, args.fps,
+                      int(args.max_mb * 1e6))
+    for part in parts:
+        print(f"{part.path}: {part.frames} frames, {part.frames / args.fps:.1f} s at {args.fps:g} fps")
+
+
+if __name__ == "__main__":
+    main()
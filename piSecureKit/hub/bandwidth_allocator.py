@@ -0,0 +1,281 @@
+"""
+Hub-side bitrate allocation across the camera fleet.
+
+Cameras heartbeat their demand (priority, min/max bitrate, congestion) to the hub; the hub splits
+the uplink capacity by weighted water-filling and pushes each camera its budget (POST /budget on
+the camera's control API). Heartbeat replies carry the budget too, so a missed push heals itself.
+
+Congestion is handled AIMD-style per camera: a report cuts that camera's ceiling to 70% of what it
+was given, and every clean heartbeat raises it by a step until it is back at the camera's max.
+Cameras that stop heartbeating are dropped and their share goes back to the others.
+
+    python3 bandwidth_allocator.py --capacity-mbps 20 --port 8090
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LOG = logging.getLogger("PiSecureKit.hub.bandwidth")
+
+
+@dataclass(frozen=True)
+class AllocatorConfig:
+    capacity_bps: int = 20_000_000
+    headroom: float = 0.8            # share of capacity handed out; the rest absorbs Wi-Fi jitter
+    camera_ttl_sec: float = 15.0     # no heartbeat for this long: the camera left
+    congestion_backoff: float = 0.7  # ceiling multiplier on a congestion report
+    recovery_step: float = 0.05      # ceiling increase per clean heartbeat, as a share of max
+    push_threshold: float = 0.02     # only push budget changes larger than this (relative)
+    push_timeout_sec: float = 2.0
+
+
+@dataclass(frozen=True)
+class Demand:
+    name: str
+    priority: float = 1.0
+    min_bps: int = 300_000
+    max_bps: int = 4_000_000
+
+
+def allocate(capacity: int, demands: Sequence[Demand]) -> Dict[str, int]:
+    """
+    Weighted water-filling: everyone gets `min_bps`, the rest is shared in proportion to priority,
+    and whatever a camera cannot use above its `max_bps` is poured back to the others.
+    If the minimums alone do not fit, they are scaled down uniformly.
+    """
+    if not demands:
+        return {}
+    floor = sum(d.min_bps for d in demands)
+    if floor >= capacity:
+        scale = capacity / floor if floor else 0.0
+        return {d.name: int(d.min_bps * scale) for d in demands}
+    alloc = {d.name: float(d.min_bps) for d in demands}
+    remaining = float(capacity - floor)
+    active = [d for d in demands if d.max_bps > d.min_bps and d.priority > 0]
+    while remaining > 1 and active:
+        share = remaining / sum(d.priority for d in active)
+        capped = [d for d in active if alloc[d.name] + share * d.priority >= d.max_bps]
+        if not capped:
+            for d in active:
+                alloc[d.name] += share * d.priority
+            break
+        for d in capped:
+            remaining -= d.max_bps - alloc[d.name]
+            alloc[d.name] = float(d.max_bps)
+        active = [d for d in active if d not in capped]
+    return {name: int(bps) for name, bps in alloc.items()}
+
+
+@dataclass
+class _Camera:
+    demand: Demand
+    endpoint: Optional[str]  # camera control API base URL; None: heartbeat replies only
+    ceiling: float
+    last_seen: float
+    budget: int = 0
+    pushed: int = 0
+    congestion_reports: int = 0
+
+
+class Allocator:
+    """Fleet state plus the allocation; `push` delivers changed budgets (HTTP by default)."""
+
+    def __init__(self, cfg: AllocatorConfig = AllocatorConfig(),
+                 push: Optional[Callable[[str, int], None]] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._cfg = cfg
+        self._push = push or self._http_push
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._cameras: Dict[str, _Camera] = {}
+        self._capacity = cfg.capacity_bps
+
+    # -- fleet events --
+    def heartbeat(self, demand: Demand, endpoint: Optional[str] = None, congested: bool = False) -> int:
+        """Join or refresh a camera; returns its current budget."""
+        with self._lock:
+            cam = self._cameras.get(demand.name)
+            if cam is None:
+                LOG.info("Camera %s joined (priority %.1f, %d-%d bps)", demand.name, demand.priority,
+                         demand.min_bps, demand.max_bps)
+                cam = _Camera(demand, endpoint, float(demand.max_bps), self._clock())
+                self._cameras[demand.name] = cam
+            cam.demand, cam.endpoint, cam.last_seen = demand, endpoint or cam.endpoint, self._clock()
+            if congested:
+                cam.congestion_reports += 1
+                cam.ceiling = max(float(demand.min_bps), (cam.budget or demand.max_bps) * self._cfg.congestion_backoff)
+                LOG.info("Camera %s reports congestion; ceiling -> %d bps", demand.name, cam.ceiling)
+            else:
+                cam.ceiling = min(float(demand.max_bps), cam.ceiling + demand.max_bps * self._cfg.recovery_step)
+            pushes = self._reallocate()
+            budget = cam.budget
+            cam.pushed = budget  # the reply delivers it
+        self._deliver([p for p in pushes if p[0] != demand.name])
+        return budget
+
+    def leave(self, name: str) -> None:
+        with self._lock:
+            if self._cameras.pop(name, None) is None:
+                return
+            LOG.info("Camera %s left", name)
+            pushes = self._reallocate()
+        self._deliver(pushes)
+
+    def expire(self) -> List[str]:
+        """Drop cameras whose heartbeats stopped; returns their names."""
+        with self._lock:
+            cutoff = self._clock() - self._cfg.camera_ttl_sec
+            gone = [name for name, cam in self._cameras.items() if cam.last_seen < cutoff]
+            for name in gone:
+                LOG.info("Camera %s timed out", name)
+                del self._cameras[name]
+            pushes = self._reallocate() if gone else []
+        self._deliver(pushes)
+        return gone
+
+    def set_capacity(self, capacity_bps: int) -> None:
+        with self._lock:
+            self._capacity = capacity_bps
+            pushes = self._reallocate()
+        self._deliver(pushes)
+
+    # -- reporting --
+    def allocations(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: cam.budget for name, cam in self._cameras.items()}
+
+    def status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "capacity_bps": self._capacity,
+                "allocatable_bps": int(self._capacity * self._cfg.headroom),
+                "cameras": {name: {"budget": cam.budget, "ceiling": int(cam.ceiling),
+                                   "priority": cam.demand.priority, "min_bps": cam.demand.min_bps,
+                                   "max_bps": cam.demand.max_bps, "endpoint": cam.endpoint,
+                                   "congestion_reports": cam.congestion_reports}
+                            for name, cam in self._cameras.items()},
+            }
+
+    # -- internals --
+    def _reallocate(self) -> List[Tuple[str, str, int]]:
+        """Recompute budgets (lock held); returns (name, endpoint, budget) pushes that are due."""
+        demands = [Demand(c.demand.name, c.demand.priority, c.demand.min_bps, int(c.ceiling))
+                   for c in self._cameras.values()]
+        budgets = allocate(int(self._capacity * self._cfg.headroom), demands)
+        pushes = []
+        for name, budget in budgets.items():
+            cam = self._cameras[name]
+            cam.budget = budget
+            if cam.endpoint and abs(budget - cam.pushed) > cam.pushed * self._cfg.push_threshold:
+                cam.pushed = budget
+                pushes.append((name, cam.endpoint, budget))
+        return pushes
+
+    def _deliver(self, pushes: List[Tuple[str, str, int]]) -> None:
+        for name, endpoint, budget in pushes:
+            try:
+                self._push(endpoint, budget)
+            except Exception as e:
+                # The next heartbeat reply carries the budget anyway
+                LOG.warning("Pushing %d bps to %s (%s) failed: %s", budget, name, endpoint, e)
+
+    def _http_push(self, endpoint: str, budget: int) -> None:
+        req = urllib.request.Request(f"{endpoint.rstrip('/')}/budget", method="POST",
+                                     data=json.dumps({"bitrate": budget}).encode(),
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self._cfg.push_timeout_sec):
+            pass
+
+
+# ---------- HTTP API ----------
+def make_handler(allocator: Allocator):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == "/allocations":
+                self._reply(200, allocator.status())
+            else:
+                self._reply(404, {"error": f"no route for {self.path}"})
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if self.path == "/cameras/heartbeat":
+                    demand = Demand(str(body["name"]), float(body.get("priority", 1.0)),
+                                    int(body.get("min_bps", Demand.min_bps)), int(body.get("max_bps", Demand.max_bps)))
+                    endpoint = None
+                    if body.get("control_port"):
+                        endpoint = f"http://{self.client_address[0]}:{int(body['control_port'])}"
+                    budget = allocator.heartbeat(demand, endpoint, bool(body.get("congested", False)))
+                    self._reply(200, {"name": demand.name, "bitrate": budget})
+                elif self.path == "/cameras/leave":
+                    allocator.leave(str(body["name"]))
+                    self._reply(200, {"name": body["name"]})
+                elif self.path == "/capacity":
+                    allocator.set_capacity(int(body["capacity_bps"]))
+                    self._reply(200, allocator.status())
+                else:
+                    self._reply(404, {"error": f"no route for {self.path}"})
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+
+        def _reply(self, status: int, obj) -> None:
+            data = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            LOG.debug("%s " + fmt, self.client_address[0], *args)
+
+    return Handler
+
+
+def serve(allocator: Allocator, host: str = "0.0.0.0", port: int = 8090) -> ThreadingHTTPServer:
+    """Start the API and the expiry sweep on daemon threads; returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(allocator))
+    threading.Thread(target=server.serve_forever, name="bandwidth-http", daemon=True).start()
+
+    def sweep():
+        while True:
+            time.sleep(1.0)
+            allocator.expire()
+
+    threading.Thread(target=sweep, name="bandwidth-expiry", daemon=True).start()
+    LOG.info("Bandwidth allocator on %s:%d", host, server.server_address[1])
+    return server
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Split the hub uplink between cameras by priority.")
+    ap.add_argument("--capacity-mbps", type=float, default=AllocatorConfig.capacity_bps / 1e6,
+                    help="uplink capacity the cameras share (measured, not the AP's nominal rate)")
+    ap.add_argument("--headroom", type=float, default=AllocatorConfig.headroom)
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8090)
+    args = ap.parse_args()
+    allocator = Allocator(AllocatorConfig(capacity_bps=int(args.capacity_mbps * 1e6), headroom=args.headroom))
+    server = serve(allocator, args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,649 @@
+"""
+Fleet event timeline: motion, recording, pump on/off, ... from every camera and controller.
+
+Devices POST batches of events; they are appended to a write-ahead log and buffered, and every
+`chunk_rows` events (or `flush_sec`) the buffer is written out as immutable columnar chunks, one
+per UTC day partition (`<dir>/<YYYYMMDD>/<first µs>-<n>.chunk`):
+
+  - columns: timestamps (µs, delta-encoded), device and type codes (per-chunk dictionaries) and
+    values, each zlib-compressed separately, so a query only inflates what it reads;
+  - the header lists the chunk's time range, devices and types with their counts: the per-device
+    and per-type index that lets queries skip chunks without decompressing anything;
+  - rollups per (minute, device, type) and per (hour, device, type) with count/sum/min/max:
+    aggregations in buckets of whole minutes or hours read those instead of the rows for every
+    chunk inside the query range. A level is only kept when it is much smaller than the rows.
+
+Rows within a chunk are time-ordered, so range edges are a bisect. Old partitions are dropped whole.
+
+    python3 event_store.py serve --dir /var/lib/pisecurekit/events --port 8091
+    python3 event_store.py bench --events 1000000 --days 30
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import random
+import shutil
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+LOG = logging.getLogger("PiSecureKit.hub.events")
+
+_MAGIC = b"PSKEVT1\n"
+_HEADER_LEN = struct.Struct("<I")
+_DAY = 86400
+_AGGREGATES = ("count", "sum", "min", "max", "mean")
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class StoreConfig:
+    directory: Path = Path("/var/lib/pisecurekit/events")
+    chunk_rows: int = 16384         # buffered events written out as chunks at this many ...
+    flush_sec: float = 5.0          # ... or after this long
+    rollups: Tuple[int, ...] = (60, 3600)  # pre-aggregation periods; bucketed queries at multiples skip rows
+    rollup_min_ratio: int = 4       # keep a rollup level only if it has this many times fewer rows
+    compress_level: int = 6
+    retain_days: Optional[int] = 400
+
+
+class Event(NamedTuple):
+    ts: float       # seconds since the epoch
+    device: str
+    type: str
+    value: float = 0.0
+
+
+def parse_event(obj: dict, device: Optional[str] = None) -> Event:
+    """From the JSON ingest format: {"ts", "device", "type", "value"}; `device` fills in a batch's default."""
+    return Event(float(obj["ts"]), str(obj.get("device") or device or ""), str(obj["type"]),
+                 float(obj.get("value", 0.0)))
+
+
+# ---------- Column encoding ----------
+def _pack(typecode: str, values, level: int) -> bytes:
+    arr = array(typecode, values)
+    if sys.byteorder == "big":
+        arr.byteswap()  # chunks are little-endian on disk
+    return zlib.compress(arr.tobytes(), level)
+
+
+def _unpack(typecode: str, blob: bytes) -> array:
+    arr = array(typecode)
+    arr.frombytes(zlib.decompress(blob))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _delta(values: Sequence[int]) -> List[int]:
+    return [values[0]] + [b - a for a, b in zip(values, values[1:])] if values else []
+
+
+def _undelta(deltas: Sequence[int]) -> List[int]:
+    return list(accumulate(deltas))
+
+
+_COLUMNS = {"ts": "q", "device": "H", "type": "H", "value": "d"}
+# Fixed-size typecodes only ("l"/"L" are 4 bytes on 32-bit Pi OS and 8 on 64-bit)
+_ROLLUP_COLUMNS = {"period": "q", "device": "H", "type": "H", "count": "I", "sum": "d", "min": "d", "max": "d"}
+
+
+def _typecode(name: str) -> str:
+    return _COLUMNS[name] if name in _COLUMNS else _ROLLUP_COLUMNS[name.split("_", 1)[1]]
+
+
+class ChunkInfo(NamedTuple):
+    path: Path
+    min_ts: float
+    max_ts: float
+    count: int
+    devices: Tuple[str, ...]        # dictionary: code -> device
+    types: Tuple[str, ...]
+    device_counts: Tuple[int, ...]
+    type_counts: Tuple[int, ...]
+    rollups: Dict[int, int]         # period seconds -> first period (ts // seconds), for the levels kept
+    columns: Dict[str, Tuple[int, int]]  # name -> (offset, length) in the file; rollups as "r<sec>_<col>"
+
+    def read(self, f, name: str) -> array:
+        offset, length = self.columns[name]
+        f.seek(offset)
+        return _unpack(_typecode(name), f.read(length))
+
+
+def _rollup(events: List[Event], dcol: List[int], tcol: List[int], sec: int) -> Dict[Tuple[int, int, int], list]:
+    base = int(events[0].ts // sec)
+    rollups: Dict[Tuple[int, int, int], list] = {}
+    for e, d, t in zip(events, dcol, tcol):
+        key = (int(e.ts // sec) - base, d, t)
+        r = rollups.get(key)
+        if r is None:
+            rollups[key] = [1, e.value, e.value, e.value]
+        else:
+            r[0] += 1
+            r[1] += e.value
+            if e.value < r[2]:
+                r[2] = e.value
+            if e.value > r[3]:
+                r[3] = e.value
+    return rollups
+
+
+def write_chunk(path: Path, events: List[Event], rollups: Sequence[int] = (60, 3600), level: int = 6,
+                min_ratio: int = 4) -> ChunkInfo:
+    """`events` must be sorted by time. Written to a temporary name and renamed into place."""
+    devices = sorted({e.device for e in events})
+    types = sorted({e.type for e in events})
+    dcode = {d: i for i, d in enumerate(devices)}
+    tcode = {t: i for i, t in enumerate(types)}
+    dcol = [dcode[e.device] for e in events]
+    tcol = [tcode[e.type] for e in events]
+    blobs = {
+        "ts": _pack("q", _delta([round(e.ts * 1_000_000) for e in events]), level),
+        "device": _pack("H", dcol, level),
+        "type": _pack("H", tcol, level),
+        "value": _pack("d", [e.value for e in events], level),
+    }
+    bases = {}
+    for sec in rollups:
+        agg = _rollup(events, dcol, tcol, sec)
+        if len(agg) * min_ratio > len(events):
+            continue  # sparse at this period: the rows are as cheap to read
+        keys = sorted(agg)
+        bases[sec] = int(events[0].ts // sec)
+        blobs.update({
+            f"r{sec}_period": _pack("q", [k[0] for k in keys], level),
+            f"r{sec}_device": _pack("H", [k[1] for k in keys], level),
+            f"r{sec}_type": _pack("H", [k[2] for k in keys], level),
+            f"r{sec}_count": _pack("I", [agg[k][0] for k in keys], level),
+            f"r{sec}_sum": _pack("d", [agg[k][1] for k in keys], level),
+            f"r{sec}_min": _pack("d", [agg[k][2] for k in keys], level),
+            f"r{sec}_max": _pack("d", [agg[k][3] for k in keys], level),
+        })
+    device_counts, type_counts = [0] * len(devices), [0] * len(types)
+    for d in dcol:
+        device_counts[d] += 1
+    for t in tcol:
+        type_counts[t] += 1
+    header = {"count": len(events), "min_ts": events[0].ts, "max_ts": events[-1].ts, "devices": devices,
+              "types": types, "device_counts": device_counts, "type_counts": type_counts,
+              "rollups": bases, "lengths": {name: len(blob) for name, blob in blobs.items()}}
+    head = json.dumps(header, separators=(",", ":")).encode()
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_MAGIC + _HEADER_LEN.pack(len(head)) + head)
+        for blob in blobs.values():
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return read_chunk_info(path)
+
+
+def read_chunk_info(path: Path) -> ChunkInfo:
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not an event chunk")
+        (n,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+        h = json.loads(f.read(n))
+    offset, columns = len(_MAGIC) + _HEADER_LEN.size + n, {}
+    for name, length in h["lengths"].items():  # in file order
+        columns[name] = (offset, length)
+        offset += length
+    return ChunkInfo(path, h["min_ts"], h["max_ts"], h["count"], tuple(h["devices"]), tuple(h["types"]),
+                     tuple(h["device_counts"]), tuple(h["type_counts"]),
+                     {int(sec): base for sec, base in h["rollups"].items()}, columns)
+
+
+# ---------- Aggregation ----------
+class _Acc:
+    __slots__ = ("count", "sum", "min", "max")
+
+    def __init__(self) -> None:
+        self.count, self.sum, self.min, self.max = 0, 0.0, float("inf"), float("-inf")
+
+    def add(self, count: int, total: float, lo: float, hi: float) -> None:
+        self.count += count
+        self.sum += total
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+
+    def result(self, fn: str) -> float:
+        if fn == "count":
+            return self.count
+        if fn == "mean":
+            return self.sum / self.count if self.count else 0.0
+        return getattr(self, fn)
+
+
+# ---------- Store ----------
+class EventStore:
+    """Thread-safe: devices ingest on HTTP threads while queries read immutable chunks."""
+
+    def __init__(self, cfg: StoreConfig) -> None:
+        self._cfg = cfg
+        cfg.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer: List[Event] = []
+        self._buffer_since = time.monotonic()
+        self._chunks: List[ChunkInfo] = []
+        self._seq = 0
+        self._stats: Dict[str, float] = {"ingested": 0, "chunks_written": 0, "bytes_written": 0,
+                                         "partitions_dropped": 0}
+        for part in sorted(p for p in cfg.directory.iterdir() if p.is_dir()):
+            for path in sorted(part.glob("*.chunk")):
+                try:
+                    self._chunks.append(read_chunk_info(path))
+                except (OSError, ValueError, KeyError) as e:
+                    LOG.warning("Skipping unreadable chunk %s: %s", path, e)
+        self._chunks.sort(key=lambda c: c.min_ts)
+        self._wal_path = cfg.directory / "wal.jsonl"
+        self._buffer = self._replay_wal()
+        self._wal = open(self._wal_path, "a", encoding="utf-8")
+        LOG.info("Event store %s: %d chunks, %d events recovered from the log", cfg.directory,
+                 len(self._chunks), len(self._buffer))
+
+    # -- ingest --
+    def append(self, events: Iterable[Event]) -> int:
+        batch = list(events)
+        if not batch:
+            return 0
+        line = json.dumps([list(e) for e in batch], separators=(",", ":"))
+        with self._lock:
+            self._wal.write(line + "\n")
+            self._wal.flush()  # the page cache survives a crash of this process; chunks are fsynced
+            if not self._buffer:
+                self._buffer_since = time.monotonic()
+            self._buffer.extend(batch)
+            self._stats["ingested"] += len(batch)
+            full = len(self._buffer) >= self._cfg.chunk_rows
+        if full:
+            self.flush()
+        return len(batch)
+
+    def flush(self) -> int:
+        """
+        Write buffered events out as chunks (one per day partition); returns how many. If a chunk
+        cannot be written, its events and any after it go back to the front of the buffer and the
+        error is raised; the log still holds them.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+            events.sort(key=lambda e: e.ts)
+            written, done = [], 0
+            try:
+                for day, part in self._by_day(events):
+                    directory = self._cfg.directory / time.strftime("%Y%m%d", time.gmtime(day * _DAY))
+                    directory.mkdir(exist_ok=True)
+                    self._seq += 1
+                    path = directory / f"{round(part[0].ts * 1_000_000)}-{self._seq}.chunk"
+                    written.append(write_chunk(path, part, self._cfg.rollups, self._cfg.compress_level,
+                                               self._cfg.rollup_min_ratio))
+                    done += len(part)
+            except Exception:
+                with self._lock:
+                    self._buffer[:0] = events[done:]
+                    if written:
+                        self._chunks = sorted(self._chunks + written, key=lambda c: c.min_ts)
+                        self._stats["chunks_written"] += len(written)
+                        self._rewrite_wal(self._buffer)  # drop what did reach a chunk, or a restart duplicates it
+                raise
+            with self._lock:
+                self._chunks = sorted(self._chunks + written, key=lambda c: c.min_ts)
+                self._stats["chunks_written"] += len(written)
+                self._stats["bytes_written"] += sum(c.path.stat().st_size for c in written)
+                if not self._buffer:
+                    # Everything in the log is in chunks now (events appended meanwhile are re-logged)
+                    self._wal.truncate(0)
+                    self._wal.seek(0)
+                else:
+                    self._rewrite_wal(self._buffer)
+            self._enforce_retention()
+            return len(written)
+
+    def flush_due(self) -> bool:
+        with self._lock:
+            return bool(self._buffer) and time.monotonic() - self._buffer_since >= self._cfg.flush_sec
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._wal.close()
+
+    # -- queries --
+    def query(self, start: float, end: float, devices: Optional[Sequence[str]] = None,
+              types: Optional[Sequence[str]] = None, limit: Optional[int] = None) -> List[Event]:
+        """Events with start <= ts < end, in time order."""
+        out: List[Event] = []
+        for chunk, buffered in self._sources(start, end, devices, types):
+            if chunk is None:
+                out.extend(e for e in buffered if _match(e, start, end, devices, types))
+                continue
+            with open(chunk.path, "rb") as f:
+                ts = _undelta(chunk.read(f, "ts"))
+                lo, hi = bisect.bisect_left(ts, start * 1e6), bisect.bisect_left(ts, end * 1e6)
+                if lo == hi:
+                    continue
+                dcol, tcol, vcol = chunk.read(f, "device"), chunk.read(f, "type"), chunk.read(f, "value")
+            dmask = _codes(chunk.devices, devices)
+            tmask = _codes(chunk.types, types)
+            for i in range(lo, hi):
+                if (dmask is None or dcol[i] in dmask) and (tmask is None or tcol[i] in tmask):
+                    out.append(Event(ts[i] / 1e6, chunk.devices[dcol[i]], chunk.types[tcol[i]], vcol[i]))
+        out.sort(key=lambda e: e.ts)
+        return out[:limit] if limit is not None else out
+
+    def aggregate(self, start: float, end: float, bucket_sec: int, fn: str = "count",
+                  devices: Optional[Sequence[str]] = None, types: Optional[Sequence[str]] = None,
+                  group_by: Optional[str] = None) -> List[Dict[str, object]]:
+        """
+        `fn` of the values per time bucket (aligned to the epoch), optionally per device or type.
+        Chunks wholly inside the range are answered from their coarsest rollup that divides the
+        bucket; the rest (range edges, sparse chunks, the buffer) from rows.
+        """
+        if fn not in _AGGREGATES:
+            raise ValueError(f"fn must be one of {', '.join(_AGGREGATES)}")
+        if group_by not in (None, "device", "type"):
+            raise ValueError("group_by must be 'device' or 'type'")
+        if bucket_sec <= 0:
+            raise ValueError("bucket_sec must be positive")
+        accs: Dict[Tuple[float, str], _Acc] = {}
+
+        def acc(bucket: float, device: str, type_: str) -> _Acc:
+            key = (bucket, device if group_by == "device" else type_ if group_by == "type" else "")
+            a = accs.get(key)
+            if a is None:
+                a = accs[key] = _Acc()
+            return a
+
+        for chunk, buffered in self._sources(start, end, devices, types):
+            if chunk is not None and start <= chunk.min_ts and chunk.max_ts < end:
+                usable = [sec for sec in chunk.rollups if bucket_sec % sec == 0]
+                if usable:
+                    self._aggregate_rollups(chunk, max(usable), bucket_sec, devices, types, acc)
+                    continue
+            if chunk is not None:
+                self._aggregate_rows(chunk, start, end, bucket_sec, devices, types, acc)
+                continue
+            for e in buffered:
+                if _match(e, start, end, devices, types):
+                    acc(e.ts // bucket_sec * bucket_sec, e.device, e.type).add(1, e.value, e.value, e.value)
+        result = []
+        for (bucket, group), a in sorted(accs.items()):
+            row: Dict[str, object] = {"bucket": bucket, fn: a.result(fn)}
+            if group_by:
+                row[group_by] = group
+            result.append(row)
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            chunks = list(self._chunks)
+            out: Dict[str, object] = dict(self._stats)
+            out["buffered"] = len(self._buffer)
+        out["chunks"] = len(chunks)
+        out["events_stored"] = sum(c.count for c in chunks)
+        out["partitions"] = len({c.path.parent.name for c in chunks})
+        return out
+
+    # -- internals --
+    def _sources(self, start: float, end: float, devices, types):
+        """(chunk, None) for every chunk that may hold matches, then (None, buffered events)."""
+        with self._lock:
+            chunks = self._chunks
+            buffered = list(self._buffer)
+        wanted_d = set(devices) if devices else None
+        wanted_t = set(types) if types else None
+        for chunk in chunks:
+            if chunk.min_ts >= end:
+                break  # sorted by min_ts
+            if chunk.max_ts < start:
+                continue
+            if wanted_d is not None and wanted_d.isdisjoint(chunk.devices):
+                continue
+            if wanted_t is not None and wanted_t.isdisjoint(chunk.types):
+                continue
+            yield chunk, None
+        if buffered:
+            yield None, buffered
+
+    @staticmethod
+    def _aggregate_rows(chunk: ChunkInfo, start: float, end: float, bucket_sec: int, devices, types, acc) -> None:
+        with open(chunk.path, "rb") as f:
+            ts = _undelta(chunk.read(f, "ts"))
+            lo, hi = bisect.bisect_left(ts, start * 1e6), bisect.bisect_left(ts, end * 1e6)
+            if lo == hi:
+                return
+            dcol, tcol, vcol = chunk.read(f, "device"), chunk.read(f, "type"), chunk.read(f, "value")
+        dmask = _codes(chunk.devices, devices)
+        tmask = _codes(chunk.types, types)
+        bucket_us = bucket_sec * 1_000_000
+        last_key, last = None, None
+        for i in range(lo, hi):
+            d, t = dcol[i], tcol[i]
+            if (dmask is None or d in dmask) and (tmask is None or t in tmask):
+                key = (ts[i] // bucket_us, d, t)
+                if key != last_key:  # rows are time-ordered: consecutive rows mostly share a bucket
+                    last_key, last = key, acc(key[0] * bucket_sec, chunk.devices[d], chunk.types[t])
+                v = vcol[i]
+                last.add(1, v, v, v)
+
+    @staticmethod
+    def _aggregate_rollups(chunk: ChunkInfo, sec: int, bucket_sec: int, devices, types, acc) -> None:
+        with open(chunk.path, "rb") as f:
+            cols = [chunk.read(f, f"r{sec}_{name}") for name in _ROLLUP_COLUMNS]
+        dmask = _codes(chunk.devices, devices)
+        tmask = _codes(chunk.types, types)
+        base = chunk.rollups[sec]
+        for period, d, t, count, total, lo, hi in zip(*cols):
+            if (dmask is None or d in dmask) and (tmask is None or t in tmask):
+                ts = (base + period) * sec
+                acc(ts // bucket_sec * bucket_sec, chunk.devices[d], chunk.types[t]).add(count, total, lo, hi)
+
+    @staticmethod
+    def _by_day(events: List[Event]) -> Iterable[Tuple[int, List[Event]]]:
+        start = 0
+        while start < len(events):
+            day = int(events[start].ts // _DAY)
+            end = bisect.bisect_left(events, (day + 1) * _DAY, lo=start, key=lambda e: e.ts)
+            yield day, events[start:end]
+            start = end
+
+    def _replay_wal(self) -> List[Event]:
+        events: List[Event] = []
+        try:
+            with open(self._wal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        events.extend(Event(*e) for e in json.loads(line))
+                    except (ValueError, TypeError):
+                        break  # torn last line
+        except FileNotFoundError:
+            pass
+        return events
+
+    def _rewrite_wal(self, events: List[Event]) -> None:
+        self._wal.truncate(0)
+        self._wal.seek(0)
+        self._wal.write(json.dumps([list(e) for e in events], separators=(",", ":")) + "\n")
+        self._wal.flush()
+
+    def _enforce_retention(self) -> None:
+        if self._cfg.retain_days is None:
+            return
+        cutoff = time.strftime("%Y%m%d", time.gmtime(time.time() - self._cfg.retain_days * _DAY))
+        with self._lock:
+            old = {c.path.parent for c in self._chunks if c.path.parent.name < cutoff}
+            self._chunks = [c for c in self._chunks if c.path.parent not in old]
+            self._stats["partitions_dropped"] += len(old)
+        for directory in old:
+            shutil.rmtree(directory, ignore_errors=True)
+            LOG.info("Events: dropped partition %s (older than %d days)", directory.name, self._cfg.retain_days)
+
+
+def _codes(dictionary: Sequence[str], wanted: Optional[Sequence[str]]) -> Optional[set]:
+    if not wanted:
+        return None
+    return {i for i, name in enumerate(dictionary) if name in wanted}
+
+
+def _match(e: Event, start: float, end: float, devices, types) -> bool:
+    return start <= e.ts < end and (not devices or e.device in devices) and (not types or e.type in types)
+
+
+# ---------- HTTP API ----------
+def make_handler(store: EventStore):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            q = urllib.parse.parse_qs(url.query)
+            try:
+                if url.path == "/stats":
+                    self._reply(200, store.stats())
+                    return
+                start, end = float(q["start"][0]), float(q.get("end", [time.time()])[0])
+                devices, types = _csv(q.get("device")), _csv(q.get("type"))
+                if url.path == "/events":
+                    limit = int(q.get("limit", [10_000])[0])
+                    events = store.query(start, end, devices, types, limit)
+                    self._reply(200, {"events": [e._asdict() for e in events]})
+                elif url.path == "/aggregate":
+                    rows = store.aggregate(start, end, int(q.get("bucket", [3600])[0]), q.get("fn", ["count"])[0],
+                                           devices, types, q.get("group", [None])[0])
+                    self._reply(200, {"buckets": rows})
+                else:
+                    self._reply(404, {"error": f"no route for {url.path}"})
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if self.path != "/events":
+                    self._reply(404, {"error": f"no route for {self.path}"})
+                    return
+                # {"device": "cam1", "events": [{"ts": ..., "type": "motion", "value": 0.4}, ...]}
+                batch = [parse_event(e, body.get("device")) for e in body["events"]]
+                self._reply(200, {"accepted": store.append(batch)})
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+
+        def _reply(self, status: int, obj) -> None:
+            data = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            LOG.debug("%s " + fmt, self.client_address[0], *args)
+
+    return Handler
+
+
+def _csv(values: Optional[List[str]]) -> Optional[List[str]]:
+    return [v for value in values for v in value.split(",") if v] if values else None
+
+
+def serve(store: EventStore, host: str = "0.0.0.0", port: int = 8091) -> ThreadingHTTPServer:
+    """Start the API and the periodic flush on daemon threads; returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    threading.Thread(target=server.serve_forever, name="events-http", daemon=True).start()
+
+    def flusher():
+        while True:
+            time.sleep(1.0)
+            if store.flush_due():
+                try:
+                    store.flush()
+                except OSError as e:
+                    LOG.warning("Event flush failed: %s", e)
+
+    threading.Thread(target=flusher, name="events-flush", daemon=True).start()
+    LOG.info("Event store API on %s:%d", host, server.server_address[1])
+    return server
+
+
+def bench(directory: Path, n: int, days: int, devices: int) -> Dict[str, float]:
+    """Ingest `n` synthetic events spread over `days`, then time typical month-scale queries."""
+    store = EventStore(StoreConfig(directory=directory, retain_days=None))
+    end = time.time() // _DAY * _DAY
+    start = end - days * _DAY
+    rng = random.Random(1)
+    types = ["motion", "recording", "pump_on", "pump_off", "moisture"]
+    names = [f"dev{i:02d}" for i in range(devices)]
+    step = (end - start) / n
+    t0 = time.perf_counter()
+    for i in range(0, n, 1000):
+        store.append(Event(start + (i + j) * step, rng.choice(names), rng.choice(types), rng.random())
+                     for j in range(min(1000, n - i)))
+    store.flush()
+    ingest = time.perf_counter() - t0
+    timings = {}
+    for name, fn in (("hourly_counts_all", lambda: store.aggregate(start, end, 3600)),
+                     ("daily_mean_per_device", lambda: store.aggregate(start, end, _DAY, "mean", group_by="device")),
+                     ("one_device_one_type_rows", lambda: store.query(start, end, ["dev03"], ["pump_on"])),
+                     ("last_hour_rows", lambda: store.query(end - 3600, end))):
+        t = time.perf_counter()
+        fn()
+        timings[name + "_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    stats = store.stats()
+    store.close()
+    return {"events": n, "ingest_per_sec": round(n / ingest), "bytes_per_event": round(stats["bytes_written"] / n, 2),
+            "chunks": stats["chunks"], **timings}
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Fleet event timeline store.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    srv = sub.add_parser("serve")
+    srv.add_argument("--dir", type=Path, default=StoreConfig.directory)
+    srv.add_argument("--host", default="0.0.0.0")
+    srv.add_argument("--port", type=int, default=8091)
+    srv.add_argument("--retain-days", type=int, default=StoreConfig.retain_days)
+    bch = sub.add_parser("bench", help="ingest synthetic events into a temporary store and time queries")
+    bch.add_argument("--events", type=int, default=1_000_000)
+    bch.add_argument("--days", type=int, default=30)
+    bch.add_argument("--devices", type=int, default=20)
+    args = ap.parse_args()
+
+    if args.cmd == "bench":
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(bench(Path(tmp), args.events, args.days, args.devices), indent=2))
+        return
+    store = EventStore(StoreConfig(directory=args.dir, retain_days=args.retain_days))
+    server = serve(store, args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+On-demand camera paths for mediamtx.
+
+By default every camera publishes around the clock to the `all: source: publisher` path. Cameras
+started with PISECUREKIT_ON_DEMAND (see cams/zerov1) only publish while the hub asks them to;
+this writes the per-camera paths that do the asking into config/mediamtx.yml:
+
+    <name>:        runOnDemand: publish_lease.sh <control url> <lease>
+                   mediamtx starts the hook when the first reader (WebRTC, HLS, an export) wants
+                   the path; it POSTs /publish to the camera and renews the lease every lease/3 s,
+                   and is stopped `close_after` after the last reader left, which ends the lease.
+    <name>_lq:     the same for the simulcast stream, if the camera has one; never recorded, as
+                   it duplicates <name>.
+    <name>_idle:   where the camera sends its keepalive (one keyframe every few seconds) while
+                   nobody watches; the thumbnail grid reads this one (see thumbnails.py).
+
+The block sits between marker comments under `paths:` and is replaced on every run, so removing
+a camera is re-running without it. Leave a camera out entirely to keep it always-on.
+
+    python3 on_demand_config.py --camera hqstream=http://192.168.6.50:8080,lqstream \\
+                                --camera garage=http://192.168.6.51:8080,garage_lq
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence
+
+LOG = logging.getLogger("PiSecureKit.hub.on_demand")
+
+BEGIN = "# BEGIN on-demand paths (generated by on_demand_config.py; edits are overwritten)"
+END = "# END on-demand paths"
+_NAME = re.compile(r"^[A-Za-z0-9_.~-]+(/[A-Za-z0-9_.~-]+)*$")  # what mediamtx accepts as a path name
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class HookConfig:
+    hook: str = "/scripts/publish_lease.sh"  # inside the mediamtx container (docker-compose.yml)
+    lease_sec: int = 30                # camera falls back to idle this long after the hub goes quiet
+    start_timeout_sec: int = 5         # readers give up if the camera is not live by then
+    close_after_sec: int = 10          # camera keeps publishing this long after the last reader
+    idle_suffix: str = "_idle"         # camera's OnDemandConfig.keepalive_suffix
+    record_idle: bool = False          # record the keepalive: a keyframe timeline of quiet hours
+
+
+class Camera(NamedTuple):
+    name: str                  # mediamtx path of the HQ stream
+    control_url: str           # camera HTTP API, e.g. http://192.168.6.50:8080
+    lq_path: Optional[str] = None
+
+
+def parse_camera(spec: str) -> Camera:
+    """NAME=URL[,LQ_PATH]"""
+    name, sep, rest = spec.partition("=")
+    url, _, lq = rest.partition(",")
+    if not sep or not url.startswith(("http://", "https://")):
+        raise ValueError(f"expected NAME=http://HOST:PORT[,LQ_PATH], got {spec!r}")
+    for path in (name, lq):
+        if path and not _NAME.match(path):
+            raise ValueError(f"invalid path name {path!r}")
+    return Camera(name, url.rstrip("/"), lq or None)
+
+
+# ---------- Rendering ----------
+def render_paths(cameras: Sequence[Camera], cfg: HookConfig = HookConfig(), indent: str = "  ") -> str:
+    """The marker-delimited block of path entries, indented for the `paths:` mapping."""
+    if cfg.lease_sec < 3:
+        raise ValueError("lease_sec must be at least 3 (renewed every lease/3 s)")
+    lines = [BEGIN]
+    for cam in cameras:
+        for path in (cam.name, cam.lq_path):
+            if path is None:
+                continue
+            lines += [f"{path}:",
+                      "  source: publisher",
+                      f"  runOnDemand: {cfg.hook} {cam.control_url} {cfg.lease_sec}",
+                      "  runOnDemandRestart: yes",
+                      f"  runOnDemandStartTimeout: {cfg.start_timeout_sec}s",
+                      f"  runOnDemandCloseAfter: {cfg.close_after_sec}s"]
+            if path == cam.lq_path:
+                lines.append("  record: no")
+        lines += [f"{cam.name}{cfg.idle_suffix}:",
+                  "  source: publisher",
+                  f"  record: {'yes' if cfg.record_idle else 'no'}"]
+    lines.append(END)
+    return "".join(f"{indent}{line}\n" for line in lines)
+
+
+def apply(config_text: str, block: str) -> str:
+    """`config_text` with the generated block replaced, or inserted as the first entry of `paths:`."""
+    lines = config_text.splitlines(keepends=True)
+    starts = [i for i, line in enumerate(lines) if line.strip() == BEGIN]
+    ends = [i for i, line in enumerate(lines) if line.strip() == END]
+    if starts and ends and starts[0] < ends[0]:
+        return "".join(lines[:starts[0]]) + block + "".join(lines[ends[0] + 1:])
+    if starts or ends:
+        raise ValueError("unbalanced on-demand markers in the config")
+    for i, line in enumerate(lines):
+        if line.rstrip() == "paths:":
+            # Before the catch-all `all:` entry, which would otherwise match first
+            return "".join(lines[:i + 1]) + block + "\n" + "".join(lines[i + 1:])
+    raise ValueError("no top-level `paths:` section in the config")
+
+
+def update_config(path: Path, cameras: Sequence[Camera], cfg: HookConfig = HookConfig()) -> bool:
+    """Rewrite `path` atomically if the block changed; True if it did."""
+    old = path.read_text()
+    new = apply(old, render_paths(cameras, cfg))
+    if new == old:
+        return False
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(new)
+    os.replace(tmp, path)
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Write per-camera on-demand paths into mediamtx.yml.")
+    ap.add_argument("--camera", action="append", default=[], type=parse_camera, metavar="NAME=URL[,LQ_PATH]",
+                    help="on-demand camera: mediamtx path, camera HTTP API, optional simulcast path")
+    ap.add_argument("--config", type=Path, default=Path(__file__).resolve().parent / "config" / "mediamtx.yml")
+    ap.add_argument("--lease", type=int, default=HookConfig.lease_sec, help="seconds")
+    ap.add_argument("--close-after", type=int, default=HookConfig.close_after_sec, help="seconds")
+    ap.add_argument("--record-idle", action="store_true", help="also record the keepalive streams")
+    ap.add_argument("--print", action="store_true", help="print the block instead of writing the config")
+    args = ap.parse_args(argv)
+
+    cfg = HookConfig(lease_sec=args.lease, close_after_sec=args.close_after, record_idle=args.record_idle)
+    if args.print:
+        print(render_paths(args.camera, cfg), end="")
+        return 0
+    changed = update_config(args.config, args.camera, cfg)
+    LOG.info("%s: %s (%d on-demand camera(s)); mediamtx reloads it on change", args.config,
+             "updated" if changed else "unchanged", len(args.camera))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,301 @@
+"""
+Compaction and tiered retention for the recordings tree (see recordings_index.py).
+
+mediamtx closes a segment every `recordSegmentDuration`, so a camera leaves thousands of small
+files a day. In the background, and never faster than `io_bytes_per_sec`, this job:
+
+  1. merges the segments of each closed hour into one file: MPEG-TS segments of one continuous
+     recording are concatenated at packet boundaries, which is a lossless remux (nothing is demuxed
+     or re-encoded). The hourly file takes the first segment's name, so it is found the same way;
+     a PTS jump (the camera restarted) starts a new file;
+  2. thins footage older than `full_rate_sec` to keyframes only: PAT/PMT plus the PES of every
+     keyframe the index knows about, everything else is dropped (~1 frame per GOP is left);
+  3. deletes footage older than `keep_sec`, then the oldest footage while over `quota_bytes`.
+
+Keyframe offsets are carried over into the index instead of re-parsing the new files. Files are
+written next to the originals as `.part` and renamed into place before the index is updated, so an
+interrupted pass leaves either the old files or a file the indexer reads correctly.
+
+    ionice -c3 nice -n 19 python3 recordings_compactor.py --root ./recordings --quota-gb 200
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import recordings_index
+from recordings_index import IndexConfig, RecordingsIndex, Segment, TS_PACKET
+
+LOG = logging.getLogger("PiSecureKit.hub.compactor")
+
+_PTS_HZ = 90_000
+_PTS_WRAP = 1 << 33
+_HOUR = 3600
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class RetentionConfig:
+    compact_after_sec: float = 2 * 3600      # an hour is merged once it ended this long ago
+    full_rate_sec: float = 2 * 86400         # older footage is thinned to keyframes
+    keep_sec: float = 30 * 86400             # older footage is deleted
+    quota_bytes: Optional[int] = None        # and the oldest beyond this total
+    io_bytes_per_sec: int = 20 << 20         # read + write budget; live ingest keeps the rest
+    max_pts_jump_sec: float = 2.0            # PTS vs file time mismatch that breaks an hourly file
+    poll_sec: float = 300.0
+
+
+# ---------- I/O budget ----------
+class Throttle:
+    """Sleeps the caller to keep its I/O under `bytes_per_sec`; at most ~0.1 s of burst."""
+
+    def __init__(self, bytes_per_sec: int) -> None:
+        self.rate = float(bytes_per_sec)
+        self._debt = 0.0     # seconds of I/O done ahead of the budget
+        self._last = time.monotonic()
+        self.slept = 0.0
+
+    def __call__(self, nbytes: int) -> None:
+        now = time.monotonic()
+        self._debt = max(0.0, self._debt - (now - self._last)) + nbytes / self.rate
+        self._last = now
+        if self._debt > 0.1:
+            time.sleep(self._debt)
+            self.slept += self._debt
+            self._debt = 0.0
+            self._last = time.monotonic()
+
+
+def _copy(src_fd: int, out, offset: int, length: int, throttle: Throttle, block: int = 1 << 20) -> None:
+    while length > 0:
+        n = min(block, length)
+        recordings_index._copy_range(src_fd, out, offset, n)
+        throttle(2 * n)
+        offset += n
+        length -= n
+
+
+def keyframe_units(path: Path, offsets: Sequence[int], video_pid: int, throttle: Throttle) -> Iterator[bytes]:
+    """The video packets of the access unit starting at each offset, up to the next PES start."""
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        for offset in offsets:
+            unit, pos, done = bytearray(), offset, False
+            while not done:
+                data = os.pread(fd, 256 * TS_PACKET, pos)
+                if len(data) < TS_PACKET:
+                    break
+                throttle(len(data))
+                for i in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+                    pid = ((data[i + 1] & 0x1F) << 8) | data[i + 2]
+                    if pid != video_pid:
+                        continue
+                    if data[i + 1] & 0x40 and (unit or pos + i != offset):
+                        done = True  # the next frame
+                        break
+                    unit += data[i:i + TS_PACKET]
+                pos += len(data) - len(data) % TS_PACKET
+            yield bytes(unit)
+
+
+# ---------- Compactor ----------
+class Compactor:
+
+    def __init__(self, index: RecordingsIndex, root: Path, cfg: RetentionConfig) -> None:
+        self._index = index
+        self._root = root
+        self._cfg = cfg
+        self._throttle = Throttle(cfg.io_bytes_per_sec)
+        self._stats: Dict[str, float] = {"passes": 0, "segments_merged": 0, "hourly_files": 0, "thinned": 0,
+                                         "deleted_age": 0, "deleted_quota": 0, "dropped_empty": 0,
+                                         "covered_dropped": 0, "bytes_freed": 0, "throttled_sec": 0.0, "last_pass_sec": 0.0}
+        for part in root.rglob("*.ts.part"):  # from an interrupted pass
+            part.unlink(missing_ok=True)
+
+    def run_once(self, now: Optional[float] = None) -> Dict[str, float]:
+        now = time.time() if now is None else now
+        t0 = time.monotonic()
+        self._index.scan()
+        self._drop_covered()
+        self._expire(now)
+        self._compact(now)
+        self._thin(now)
+        self._stats["passes"] += 1
+        self._stats["throttled_sec"] = round(self._throttle.slept, 2)
+        self._stats["last_pass_sec"] = round(time.monotonic() - t0, 2)
+        return dict(self._stats)
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                stats = self.run_once()
+                LOG.info("Compaction pass: %s", stats)
+            except OSError as e:
+                LOG.warning("Compaction pass failed: %s", e)
+            stop.wait(self._cfg.poll_sec)
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self._stats)
+
+    # -- steps --
+    def _drop_covered(self) -> None:
+        """Segments inside an earlier one of the same camera: left over when a merge was interrupted."""
+        last: Dict[str, Segment] = {}
+        covered = []
+        for seg in self._index.segments():
+            prev = last.get(seg.camera)
+            if prev is not None and prev.start <= seg.start and seg.end <= prev.end and prev.size > seg.size:
+                covered.append(seg)
+                continue
+            last[seg.camera] = seg
+        self._delete(covered, "covered_dropped")
+
+    def _expire(self, now: float) -> None:
+        self._delete(self._index.segments(end_before=now - self._cfg.keep_sec), "deleted_age")
+        if self._cfg.quota_bytes is None:
+            return
+        segments = self._index.segments()
+        excess = sum(s.size for s in segments) - self._cfg.quota_bytes
+        victims = []
+        for seg in segments:  # oldest first, all cameras
+            if excess <= 0:
+                break
+            victims.append(seg)
+            excess -= seg.size
+        self._delete(victims, "deleted_quota")
+
+    def _compact(self, now: float) -> None:
+        closed_before = (now - self._cfg.compact_after_sec) // _HOUR * _HOUR
+        by_camera: Dict[str, List[Segment]] = {}
+        for seg in self._index.segments(end_before=closed_before):
+            if seg.tier == "full" and seg.first_pts is not None and seg.start < closed_before:
+                by_camera.setdefault(seg.camera, []).append(seg)
+        for segments in by_camera.values():
+            for run in self._runs(segments):
+                if len(run) > 1:
+                    self._merge(run)
+
+    def _runs(self, segments: List[Segment]) -> Iterator[List[Segment]]:
+        """Consecutive segments of one clock hour and one continuous recording."""
+        run: List[Segment] = []
+        for seg in segments:
+            if run and (seg.start // _HOUR != run[0].start // _HOUR or not self._continuous(run[-1], seg)):
+                yield run
+                run = []
+            run.append(seg)
+        if run:
+            yield run
+
+    def _continuous(self, a: Segment, b: Segment) -> bool:
+        if (a.pmt_pid, a.video_pid, a.stream_type) != (b.pmt_pid, b.video_pid, b.stream_type):
+            return False
+        pts_sec = ((b.first_pts - a.first_pts) % _PTS_WRAP) / _PTS_HZ
+        return abs(pts_sec - (b.start - a.start)) <= self._cfg.max_pts_jump_sec
+
+    def _merge(self, run: List[Segment]) -> None:
+        first, last = run[0], run[-1]
+        part = first.path.with_name(first.path.name + ".part")
+        keyframes: List[Tuple[float, int]] = []
+        size = 0
+        with open(part, "wb") as out:
+            for seg in run:
+                # The index has each segment's keyframes against its own start; the merged file's
+                # times come from PTS relative to the first segment, which is the same given continuity
+                keyframes += [(t, size + offset) for t, offset in self._index.keyframes(seg.id)]
+                with open(seg.path, "rb") as src:
+                    _copy(src.fileno(), out, 0, seg.size, self._throttle)
+                size += seg.size
+            out.flush()
+            os.fsync(out.fileno())
+        mtime = part.stat().st_mtime
+        os.replace(part, first.path)
+        merged = first._replace(end=last.end, size=size, last_pts=last.last_pts)
+        self._index.replace(run, merged, keyframes, mtime)
+        for seg in run[1:]:
+            seg.path.unlink(missing_ok=True)
+        self._stats["segments_merged"] += len(run)
+        self._stats["hourly_files"] += 1
+        LOG.info("Merged %d segments of %s into %s (%d bytes)", len(run), first.camera, first.path.name, size)
+
+    def _thin(self, now: float) -> None:
+        for seg in self._index.segments(end_before=now - self._cfg.full_rate_sec):
+            if seg.tier != "full" or seg.video_pid is None:
+                continue
+            keyframes = self._index.keyframes(seg.id)
+            if not keyframes:
+                self._delete([seg], "dropped_empty")  # nothing decodable
+                continue
+            part = seg.path.with_name(seg.path.name + ".part")
+            new_keyframes = []
+            with open(part, "wb") as out:
+                out.write(recordings_index.ts_headers(seg.path))
+                units = keyframe_units(seg.path, [offset for _, offset in keyframes], seg.video_pid, self._throttle)
+                for (t, _), unit in zip(keyframes, units):
+                    new_keyframes.append((t, out.tell()))
+                    out.write(unit)
+                    self._throttle(len(unit))
+                out.flush()
+                os.fsync(out.fileno())
+                size = out.tell()
+            mtime = part.stat().st_mtime
+            os.replace(part, seg.path)
+            last_t = keyframes[-1][0]
+            thinned = seg._replace(end=last_t, size=size, tier="keyframes",
+                                   last_pts=(seg.first_pts + round((last_t - seg.start) * _PTS_HZ)) % _PTS_WRAP)
+            self._index.replace([seg], thinned, new_keyframes, mtime)
+            self._stats["thinned"] += 1
+            self._stats["bytes_freed"] += seg.size - size
+
+    def _delete(self, segments: Sequence[Segment], counter: str) -> None:
+        if not segments:
+            return
+        for seg in segments:
+            try:
+                seg.path.unlink()
+            except FileNotFoundError:
+                pass
+            self._stats["bytes_freed"] += seg.size
+        self._index.remove(seg.path for seg in segments)
+        self._stats[counter] += len(segments)
+        LOG.info("Removed %d segments (%s)", len(segments), counter)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Merge, thin and expire mediamtx recordings.")
+    ap.add_argument("--root", type=Path, default=IndexConfig.root)
+    ap.add_argument("--db", type=Path, help="index file (default: <root>/index.sqlite)")
+    ap.add_argument("--full-days", type=float, default=RetentionConfig.full_rate_sec / 86400,
+                    help="keep footage at full frame rate this long")
+    ap.add_argument("--keep-days", type=float, default=RetentionConfig.keep_sec / 86400)
+    ap.add_argument("--quota-gb", type=float, help="total size the recordings may use")
+    ap.add_argument("--io-mbps", type=float, default=RetentionConfig.io_bytes_per_sec / (1 << 20),
+                    help="read + write budget in MiB/s")
+    ap.add_argument("--once", action="store_true", help="one pass, then exit")
+    args = ap.parse_args()
+
+    index = RecordingsIndex(IndexConfig(root=args.root, db_path=args.db or args.root / "index.sqlite"))
+    cfg = RetentionConfig(full_rate_sec=args.full_days * 86400, keep_sec=args.keep_days * 86400,
+                          quota_bytes=int(args.quota_gb * (1 << 30)) if args.quota_gb else None,
+                          io_bytes_per_sec=int(args.io_mbps * (1 << 20)))
+    compactor = Compactor(index, args.root, cfg)
+    try:
+        if args.once:
+            print(compactor.run_once())
+        else:
+            compactor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
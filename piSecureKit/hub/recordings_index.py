@@ -0,0 +1,499 @@
+"""
+Index of the MPEG-TS segments mediamtx records under ./recordings, for seeking and exports.
+
+mediamtx writes `<root>/<camera path>/<YYYY-MM-DD_HH-MM-SS-ffffff>.ts` (see config/mediamtx.yml).
+The indexer polls the tree and only ever reads bytes it has not seen: a growing segment is resumed
+from where the last pass stopped, so the cost is proportional to what the cameras wrote since.
+For every segment it stores the camera, the wall-clock time range and the byte offset and time of
+each keyframe in SQLite; "camera X between 14:02 and 14:05" is then two indexed lookups per
+segment. Exports copy the byte ranges between keyframes (plus the PAT/PMT) into one .ts file,
+without demuxing or re-encoding anything.
+
+    python3 recordings_index.py watch --root ./recordings --db ./recordings/index.sqlite
+    python3 recordings_index.py query cam1 "2024-05-01 14:02" "2024-05-01 14:05"
+    python3 recordings_index.py export cam1 "2024-05-01 14:02" "2024-05-01 14:05" -o porch.ts
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+LOG = logging.getLogger("PiSecureKit.hub.recordings")
+
+TS_PACKET = 188
+_SYNC = 0x47
+_PTS_HZ = 90_000
+_PTS_WRAP = 1 << 33
+# PMT stream types: H.264, H.265
+_H264, _H265 = 0x1B, 0x24
+# mediamtx recordPath time format, as the file stem
+NAME_FORMAT = "%Y-%m-%d_%H-%M-%S-%f"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    start REAL NOT NULL,            -- wall time of the first PTS
+    end REAL NOT NULL,              -- wall time of the last PTS seen so far
+    scanned INTEGER NOT NULL,       -- bytes parsed (whole packets); exports stop here
+    mtime REAL NOT NULL,
+    pmt_pid INTEGER,
+    video_pid INTEGER,
+    stream_type INTEGER,
+    first_pts INTEGER,
+    last_pts INTEGER,
+    tier TEXT NOT NULL DEFAULT 'full'   -- 'full' as recorded, or 'keyframes' (see recordings_compactor.py)
+);
+CREATE INDEX IF NOT EXISTS segments_camera_start ON segments (camera, start);
+CREATE TABLE IF NOT EXISTS keyframes (
+    segment INTEGER NOT NULL REFERENCES segments (id) ON DELETE CASCADE,
+    time REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (segment, time)
+) WITHOUT ROWID;
+"""
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class IndexConfig:
+    root: Path = Path("recordings")
+    db_path: Path = Path("recordings/index.sqlite")
+    poll_sec: float = 2.0
+    read_block_bytes: int = 4 << 20     # appended bytes are parsed in chunks of this size
+    max_segment_sec: float = 3600.0     # upper bound on a segment's length (mediamtx recordSegmentDuration)
+
+
+class Segment(NamedTuple):
+    id: int
+    camera: str
+    path: Path
+    start: float
+    end: float
+    size: int           # bytes indexed (whole packets)
+    tier: str
+    pmt_pid: Optional[int]
+    video_pid: Optional[int]
+    stream_type: Optional[int]
+    first_pts: Optional[int]
+    last_pts: Optional[int]
+
+
+_SEGMENT_COLUMNS = "id, camera, path, start, end, scanned, tier, pmt_pid, video_pid, stream_type, first_pts, last_pts"
+
+
+class Span(NamedTuple):
+    path: Path
+    start_offset: int   # a keyframe (or the segment start)
+    end_offset: int     # the first keyframe after the range (or what is indexed so far)
+    start: float        # wall time at start_offset
+    end: float          # wall time at end_offset
+
+
+# ---------- MPEG-TS parsing ----------
+@dataclass
+class _TsState:
+    """What a scan needs to resume mid-file; persisted in the segments row."""
+    pmt_pid: Optional[int] = None
+    video_pid: Optional[int] = None
+    stream_type: Optional[int] = None
+    first_pts: Optional[int] = None
+    last_pts: Optional[int] = None
+
+
+def _payload(packet: memoryview) -> memoryview:
+    if packet[3] & 0x20:  # adaptation field
+        return packet[5 + packet[4]:]
+    return packet[4:]
+
+
+def _psi_section(payload: memoryview) -> memoryview:
+    """Section body (after the pointer field and the 8-byte header), up to the CRC."""
+    section = payload[1 + payload[0]:]
+    length = ((section[1] & 0x0F) << 8) | section[2]
+    return section[8:3 + length - 4]
+
+
+def _pes_pts(payload: memoryview) -> Optional[int]:
+    if len(payload) < 14 or payload[0] != 0 or payload[1] != 0 or payload[2] != 1 or not payload[7] & 0x80:
+        return None
+    p = payload[9:14]
+    return (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+
+
+def _starts_keyframe(packet: memoryview, payload: memoryview, stream_type: Optional[int]) -> bool:
+    """Random-access indicator, or an IDR/IRAP (or parameter set) NAL in the first PES packet."""
+    if packet[3] & 0x20 and packet[4] and packet[5] & 0x40:
+        return True
+    data = bytes(payload[9 + payload[8]:]) if len(payload) > 9 else b""
+    i = data.find(b"\x00\x00\x01")
+    while 0 <= i < len(data) - 3:
+        header = data[i + 3]
+        if stream_type == _H265:
+            if 16 <= (header >> 1) & 0x3F <= 21 or (header >> 1) & 0x3F == 32:
+                return True
+        elif header & 0x1F in (5, 7):
+            return True
+        i = data.find(b"\x00\x00\x01", i + 3)
+    return False
+
+
+def parse_ts(data: bytes, base: int, state: _TsState) -> List[Tuple[int, int]]:
+    """
+    Walk whole packets of `data` (file offset `base`), updating `state`; returns the (offset, pts)
+    of each keyframe PES. Only packets that start a payload are looked at beyond the header.
+    """
+    keyframes = []
+    view = memoryview(data)
+    for i in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+        if data[i] != _SYNC:
+            raise ValueError(f"lost TS sync at byte {base + i}")
+        if not data[i + 1] & 0x40:  # payload_unit_start_indicator
+            continue
+        pid = ((data[i + 1] & 0x1F) << 8) | data[i + 2]
+        packet = view[i:i + TS_PACKET]
+        if pid == 0 and state.pmt_pid is None:
+            section = _psi_section(_payload(packet))
+            for j in range(0, len(section) - 3, 4):
+                if (section[j] << 8) | section[j + 1]:  # program 0 is the NIT
+                    state.pmt_pid = ((section[j + 2] & 0x1F) << 8) | section[j + 3]
+                    break
+        elif pid == state.pmt_pid and state.video_pid is None:
+            section = _psi_section(_payload(packet))
+            j = 4 + (((section[2] & 0x0F) << 8) | section[3])
+            while j + 5 <= len(section):
+                stream_type, es_pid = section[j], ((section[j + 1] & 0x1F) << 8) | section[j + 2]
+                if stream_type in (_H264, _H265):
+                    state.video_pid, state.stream_type = es_pid, stream_type
+                    break
+                j += 5 + (((section[j + 3] & 0x0F) << 8) | section[j + 4])
+        elif pid == state.video_pid:
+            payload = _payload(packet)
+            pts = _pes_pts(payload)
+            if pts is None:
+                continue
+            if state.first_pts is None:
+                state.first_pts = pts
+            state.last_pts = pts
+            if _starts_keyframe(packet, payload, state.stream_type):
+                keyframes.append((base + i, pts))
+    return keyframes
+
+
+def segment_start(path: Path) -> Optional[float]:
+    try:
+        return datetime.strptime(path.stem, NAME_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+def ts_headers(path: Path) -> bytes:
+    """The first PAT and PMT packets of a segment, which an export puts in front of its ranges."""
+    state = _TsState()
+    out = {}
+    with open(path, "rb") as f:
+        data = f.read(TS_PACKET * 64)
+    for i in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+        packet = memoryview(data)[i:i + TS_PACKET]
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid == 0 and 0 not in out:
+            out[0] = bytes(packet)
+            parse_ts(bytes(packet), 0, state)
+        elif pid == state.pmt_pid and pid not in out:
+            out[pid] = bytes(packet)
+        if len(out) == 2:
+            break
+    return b"".join(out.values())
+
+
+# ---------- Index ----------
+class RecordingsIndex:
+    """
+    SQLite index over one recordings tree. `scan` is incremental and safe to call in a loop
+    (`watch`); queries may run on other threads, each with its own connection.
+    """
+
+    def __init__(self, cfg: IndexConfig) -> None:
+        self._cfg = cfg
+        cfg.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(_SCHEMA)
+        if "tier" not in {row[1] for row in db.execute("PRAGMA table_info(segments)")}:
+            db.execute("ALTER TABLE segments ADD COLUMN tier TEXT NOT NULL DEFAULT 'full'")
+        # (size, mtime) as last scanned, so unchanged files cost a stat and no query
+        self._seen: Dict[str, Tuple[int, float]] = {
+            path: (scanned, mtime) for path, scanned, mtime in db.execute("SELECT path, scanned, mtime FROM segments")}
+        self._stats: Dict[str, float] = {"scans": 0, "segments": len(self._seen), "bytes_parsed": 0,
+                                         "keyframes": 0, "errors": 0, "last_scan_ms": 0.0}
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self._cfg.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")  # queries never wait for the indexer
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+        return db
+
+    # -- indexing --
+    def scan(self) -> Dict[str, float]:
+        """One pass over the tree: parse what was appended, add new segments, drop deleted ones."""
+        t0 = time.perf_counter()
+        db = self._db()
+        present = set()
+        with db:  # one transaction per pass
+            for path, st in self._walk():
+                key = str(path)
+                present.add(key)
+                scanned, mtime = self._seen.get(key, (-1, 0.0))
+                if st.st_size - max(scanned, 0) < TS_PACKET and st.st_mtime == mtime:
+                    continue
+                # Changed or new: the row may have been written by another process (the compactor)
+                row = db.execute("SELECT scanned, mtime FROM segments WHERE path = ?", (key,)).fetchone()
+                scanned, mtime = row if row is not None else (-1, 0.0)
+                if st.st_size < scanned:  # rewritten in place: start over
+                    db.execute("DELETE FROM segments WHERE path = ?", (key,))
+                    scanned = -1
+                elif row is not None and st.st_size - scanned < TS_PACKET and st.st_mtime == mtime:
+                    self._seen[key] = (scanned, mtime)
+                    continue
+                try:
+                    self._index_file(db, path, st, scanned)
+                except (OSError, ValueError, IndexError) as e:
+                    self._stats["errors"] += 1
+                    LOG.warning("Indexing %s failed: %s", path, e)
+            gone = [key for key in self._seen if key not in present]
+            for key in gone:
+                db.execute("DELETE FROM segments WHERE path = ?", (key,))
+                del self._seen[key]
+        self._stats["scans"] += 1
+        self._stats["segments"] = len(self._seen)
+        self._stats["last_scan_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return dict(self._stats)
+
+    def watch(self, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.scan()
+            stop.wait(self._cfg.poll_sec)
+
+    def _walk(self) -> Iterable[Tuple[Path, os.stat_result]]:
+        stack = [self._cfg.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.endswith(".ts"):
+                    yield Path(entry.path), entry.stat()
+
+    def _index_file(self, db: sqlite3.Connection, path: Path, st: os.stat_result, scanned: int) -> None:
+        key = str(path)
+        row = db.execute("SELECT id, start, pmt_pid, video_pid, stream_type, first_pts, last_pts FROM segments "
+                         "WHERE path = ?", (key,)).fetchone() if scanned >= 0 else None
+        if row is None:
+            start = segment_start(path)
+            if start is None:
+                start = st.st_mtime  # not a mediamtx name: best effort
+            camera = path.parent.relative_to(self._cfg.root).as_posix()
+            seg_id = db.execute("INSERT INTO segments (camera, path, start, end, scanned, mtime) "
+                                "VALUES (?, ?, ?, ?, 0, 0)", (camera, key, start, start)).lastrowid
+            state, scanned = _TsState(), 0
+        else:
+            seg_id, start = row[0], row[1]
+            state = _TsState(*row[2:])
+        keyframes: List[Tuple[float, int]] = []
+        with open(path, "rb") as f:
+            f.seek(scanned)
+            while True:
+                data = f.read(self._cfg.read_block_bytes)
+                whole = len(data) - len(data) % TS_PACKET
+                if not whole:
+                    break
+                for offset, pts in parse_ts(data[:whole], scanned, state):
+                    keyframes.append((start + ((pts - state.first_pts) % _PTS_WRAP) / _PTS_HZ, offset))
+                scanned += whole
+                self._stats["bytes_parsed"] += whole
+                if whole < len(data):
+                    break  # a packet still being written
+        end = start if state.last_pts is None else start + ((state.last_pts - state.first_pts) % _PTS_WRAP) / _PTS_HZ
+        db.executemany("INSERT OR REPLACE INTO keyframes (segment, time, offset) VALUES (?, ?, ?)",
+                       [(seg_id, t, offset) for t, offset in keyframes])
+        db.execute("UPDATE segments SET end = ?, scanned = ?, mtime = ?, pmt_pid = ?, video_pid = ?, stream_type = ?, "
+                   "first_pts = ?, last_pts = ? WHERE id = ?",
+                   (end, scanned, st.st_mtime, state.pmt_pid, state.video_pid, state.stream_type,
+                    state.first_pts, state.last_pts, seg_id))
+        self._seen[key] = (scanned, st.st_mtime)
+        self._stats["keyframes"] += len(keyframes)
+
+    # -- queries --
+    def cameras(self) -> List[str]:
+        return [c for (c,) in self._db().execute("SELECT DISTINCT camera FROM segments ORDER BY camera")]
+
+    def find(self, camera: str, start: float, end: float) -> List[Span]:
+        """Byte ranges covering [start, end] of `camera`, cut at keyframes, in time order."""
+        db = self._db()
+        rows = db.execute("SELECT id, path, start, end, scanned FROM segments WHERE camera = ? AND start >= ? "
+                          "AND start < ? AND end >= ? ORDER BY start",
+                          (camera, start - self._cfg.max_segment_sec, end, start)).fetchall()
+        spans = []
+        for seg_id, path, seg_start, seg_end, scanned in rows:
+            first = db.execute("SELECT time, offset FROM keyframes WHERE segment = ? AND time <= ? "
+                               "ORDER BY time DESC LIMIT 1", (seg_id, max(start, seg_start))).fetchone()
+            if first is None:
+                first = db.execute("SELECT time, offset FROM keyframes WHERE segment = ? ORDER BY time LIMIT 1",
+                                   (seg_id,)).fetchone()
+            if first is None or first[0] > end:
+                continue  # nothing decodable inside the range
+            after = db.execute("SELECT time, offset FROM keyframes WHERE segment = ? AND time > ? "
+                               "ORDER BY time LIMIT 1", (seg_id, end)).fetchone()
+            last_time, last_offset = after if after is not None else (seg_end, scanned)
+            spans.append(Span(Path(path), first[1], last_offset, first[0], last_time))
+        return spans
+
+    def segments(self, camera: Optional[str] = None, end_before: Optional[float] = None) -> List[Segment]:
+        """Indexed segments, oldest first."""
+        sql, args = f"SELECT {_SEGMENT_COLUMNS} FROM segments WHERE 1", []
+        if camera is not None:
+            sql += " AND camera = ?"
+            args.append(camera)
+        if end_before is not None:
+            sql += " AND end < ?"
+            args.append(end_before)
+        return [Segment(r[0], r[1], Path(r[2]), *r[3:]) for r in self._db().execute(sql + " ORDER BY start, camera", args)]
+
+    def keyframes(self, segment_id: int) -> List[Tuple[float, int]]:
+        """(time, offset) of every keyframe of a segment, in order."""
+        return self._db().execute("SELECT time, offset FROM keyframes WHERE segment = ? ORDER BY time",
+                                  (segment_id,)).fetchall()
+
+    # -- maintenance (rewrites done by another component) --
+    def replace(self, old: Iterable[Segment], new: Segment, keyframes: Iterable[Tuple[float, int]],
+                mtime: float) -> None:
+        """In one transaction: drop the `old` rows and index `new` (a file written by the caller)."""
+        db = self._db()
+        with db:
+            for seg in old:
+                db.execute("DELETE FROM segments WHERE id = ?", (seg.id,))
+                self._seen.pop(str(seg.path), None)
+            db.execute("DELETE FROM segments WHERE path = ?", (str(new.path),))
+            seg_id = db.execute(
+                "INSERT INTO segments (camera, path, start, end, scanned, mtime, tier, pmt_pid, video_pid, stream_type, "
+                "first_pts, last_pts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (new.camera, str(new.path), new.start, new.end, new.size, mtime, *new[6:])).lastrowid
+            db.executemany("INSERT OR REPLACE INTO keyframes (segment, time, offset) VALUES (?, ?, ?)",
+                           [(seg_id, t, offset) for t, offset in keyframes])
+        self._seen[str(new.path)] = (new.size, mtime)
+        self._stats["segments"] = len(self._seen)
+
+    def remove(self, paths: Iterable[Path]) -> None:
+        db = self._db()
+        with db:
+            for path in paths:
+                db.execute("DELETE FROM segments WHERE path = ?", (str(path),))
+                self._seen.pop(str(path), None)
+        self._stats["segments"] = len(self._seen)
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self._stats)
+
+    def close(self) -> None:
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+# ---------- Export ----------
+def export(spans: List[Span], destination: Path) -> int:
+    """Concatenate the spans, PAT/PMT first, into one .ts file (atomically); returns its size."""
+    if not spans:
+        raise ValueError("no recordings in that time range")
+    part = destination.with_name(destination.name + ".part")
+    with open(part, "wb") as out:
+        out.write(ts_headers(spans[0].path))
+        for span in spans:
+            with open(span.path, "rb") as src:
+                _copy_range(src.fileno(), out, span.start_offset, span.end_offset - span.start_offset)
+    os.replace(part, destination)
+    return destination.stat().st_size
+
+
+def _copy_range(src_fd: int, out, offset: int, length: int) -> None:
+    out.flush()
+    dst_fd = out.fileno()
+    while length > 0:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, length, offset)  # in-kernel, or a reflink on CoW filesystems
+        except (AttributeError, OSError):
+            n = os.write(dst_fd, os.pread(src_fd, min(length, 1 << 20), offset))
+        if n <= 0:
+            raise OSError(f"short read at {offset}")
+        offset += n
+        length -= n
+
+
+def _parse_time(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Index mediamtx recordings for seeking and exports.")
+    ap.add_argument("--root", type=Path, default=IndexConfig.root)
+    ap.add_argument("--db", type=Path, help="index file (default: <root>/index.sqlite)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("watch", help="keep the index up to date")
+    sub.add_parser("scan", help="one incremental pass, then exit")
+    for name in ("query", "export"):
+        p = sub.add_parser(name)
+        p.add_argument("camera")
+        p.add_argument("start", help="epoch seconds or ISO time")
+        p.add_argument("end", help="epoch seconds or ISO time")
+        if name == "export":
+            p.add_argument("-o", "--output", type=Path, required=True)
+    args = ap.parse_args()
+
+    index = RecordingsIndex(IndexConfig(root=args.root, db_path=args.db or args.root / "index.sqlite"))
+    if args.cmd == "watch":
+        try:
+            index.watch()
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.cmd == "scan":
+        print(json.dumps(index.scan(), indent=2))
+        return
+    t0 = time.perf_counter()
+    spans = index.find(args.camera, _parse_time(args.start), _parse_time(args.end))
+    elapsed = (time.perf_counter() - t0) * 1000
+    if args.cmd == "query":
+        for s in spans:
+            print(f"{s.path}  bytes {s.start_offset}-{s.end_offset}  "
+                  f"{datetime.fromtimestamp(s.start):%H:%M:%S.%f}-{datetime.fromtimestamp(s.end):%H:%M:%S.%f}")
+        print(f"{len(spans)} span(s) in {elapsed:.1f} ms")
+        return
+    size = export(spans, args.output)
+    print(f"{args.output}: {size / 1e6:.1f} MB from {len(spans)} segment(s)")
+
+
+if __name__ == "__main__":
+    main()
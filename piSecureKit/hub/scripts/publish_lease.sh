@@ -0,0 +1,30 @@
+#!/bin/sh
+# mediamtx runOnDemand hook written by on_demand_config.py: keeps one camera publishing while the
+# path has readers. Runs in the mediamtx container (busybox sh + wget).
+#
+#   publish_lease.sh <camera control url> <lease seconds>
+#
+# The lease is renewed every lease/3 s; mediamtx stops the hook runOnDemandCloseAfter after the
+# last reader left, and the release below lets the camera go idle right away. If the hub dies
+# instead, the camera goes idle on its own once the lease runs out.
+url="$1/publish"
+lease="${2:-30}"
+holder="${MTX_PATH:-hub}"
+
+post() {
+    wget -q -O /dev/null -T 5 --header "Content-Type: application/json" --post-data "$1" "$url" \
+        || echo "publish_lease: POST $url ($1) failed" >&2
+}
+
+release() {
+    post "{\"enabled\":false,\"holder\":\"$holder\"}"
+    exit 0
+}
+trap release INT TERM
+
+while true; do
+    post "{\"enabled\":true,\"lease_sec\":$lease,\"holder\":\"$holder\"}"
+    # Backgrounded so the trap runs as soon as mediamtx signals, not after the sleep
+    sleep $((lease / 3)) &
+    wait $!
+done
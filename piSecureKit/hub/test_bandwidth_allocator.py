@@ -0,0 +1,67 @@
+import unittest
+
+from bandwidth_allocator import Allocator, AllocatorConfig, Demand, allocate
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAllocate(unittest.TestCase):
+
+    def test_weighted_water_filling(self):
+        demands = [Demand("a", 1, 500_000, 4_000_000), Demand("b", 3, 500_000, 4_000_000),
+                   Demand("c", 1, 500_000, 1_000_000)]
+        budgets = allocate(6_000_000, demands)
+        self.assertEqual(budgets["c"], 1_000_000)  # capped; its surplus goes to a and b
+        self.assertAlmostEqual(budgets["b"] - 500_000, 3 * (budgets["a"] - 500_000), delta=3)
+        self.assertAlmostEqual(sum(budgets.values()), 6_000_000, delta=3)
+
+    def test_everyone_capped_and_minimums_scaled(self):
+        demands = [Demand("a", 1, 500_000, 1_000_000), Demand("b", 1, 500_000, 2_000_000)]
+        self.assertEqual(allocate(10_000_000, demands), {"a": 1_000_000, "b": 2_000_000})
+        self.assertEqual(allocate(500_000, demands), {"a": 250_000, "b": 250_000})
+        self.assertEqual(allocate(1_000_000, []), {})
+
+
+class TestAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.pushes = []
+        cfg = AllocatorConfig(capacity_bps=10_000_000, headroom=0.8, camera_ttl_sec=10)
+        self.alloc = Allocator(cfg, push=lambda endpoint, bps: self.pushes.append((endpoint, bps)), clock=self.clock)
+
+    def test_join_leave_and_expiry_rebalance(self):
+        self.assertEqual(self.alloc.heartbeat(Demand("a", 1, 500_000, 8_000_000), "http://a"), 8_000_000)
+        self.assertEqual(self.pushes, [])  # the reply carried it
+        self.alloc.heartbeat(Demand("b", 1, 500_000, 8_000_000), "http://b")
+        self.assertEqual(self.alloc.allocations(), {"a": 4_000_000, "b": 4_000_000})
+        self.assertEqual(self.pushes, [("http://a", 4_000_000)])
+        self.alloc.leave("b")
+        self.assertEqual(self.pushes[-1], ("http://a", 8_000_000))
+        self.alloc.heartbeat(Demand("b", 1, 500_000, 8_000_000), "http://b")
+        self.clock.now = 8
+        self.alloc.heartbeat(Demand("a", 1, 500_000, 8_000_000), "http://a")
+        self.clock.now = 12
+        self.assertEqual(self.alloc.expire(), ["b"])
+        self.assertEqual(self.alloc.allocations(), {"a": 8_000_000})
+
+    def test_congestion_backs_off_then_recovers(self):
+        for name in ("a", "b"):
+            self.alloc.heartbeat(Demand(name, 1, 500_000, 4_000_000), None)
+        self.assertEqual(self.alloc.allocations()["a"], 4_000_000)
+        self.alloc.heartbeat(Demand("a", 1, 500_000, 4_000_000), None, congested=True)
+        self.assertEqual(self.alloc.allocations()["a"], 2_800_000)
+        for _ in range(6):
+            self.alloc.heartbeat(Demand("a", 1, 500_000, 4_000_000), None)
+        self.assertEqual(self.alloc.allocations()["a"], 4_000_000)
+        self.assertEqual(self.alloc.status()["cameras"]["a"]["congestion_reports"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import json
+import random
+import tempfile
+import time
+import unittest
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import event_store
+from event_store import Event, EventStore, StoreConfig
+
+T0 = datetime(2024, 5, 1, tzinfo=timezone.utc).timestamp()
+DEVICES = [f"cam{i}" for i in range(6)] + ["irrigation1", "irrigation2"]
+TYPES = ["motion", "recording", "pump_on", "pump_off"]
+
+
+def _events(n, days, seed=1):
+    rng = random.Random(seed)
+    return [Event(T0 + rng.random() * days * 86400, rng.choice(DEVICES), rng.choice(TYPES), round(rng.random(), 3))
+            for _ in range(n)]
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cfg = StoreConfig(directory=Path(self._tmp.name, "events"), chunk_rows=5000, retain_days=None)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _store(self, events, cfg=None):
+        store = EventStore(cfg or self.cfg)
+        for i in range(0, len(events), 500):
+            store.append(events[i:i + 500])
+        store.flush()
+        return store
+
+    def test_chunks_are_partitioned_by_day_and_compressed(self):
+        events = _events(20_000, days=3)
+        store = self._store(events)
+        days = sorted(p.name for p in self.cfg.directory.iterdir() if p.is_dir())
+        self.assertEqual(days, ["20240501", "20240502", "20240503"])
+        stats = store.stats()
+        self.assertEqual((stats["events_stored"], stats["buffered"], stats["ingested"]), (20_000, 0, 20_000))
+        # Raw columns would be 8 + 2 + 2 + 8 bytes per event, plus the rollups
+        self.assertLess(stats["bytes_written"] / 20_000, 20)
+        for chunk in store._chunks:
+            self.assertEqual(chunk.path.parent.name, time.strftime("%Y%m%d", time.gmtime(chunk.min_ts)))
+            self.assertEqual(time.gmtime(chunk.min_ts).tm_yday, time.gmtime(chunk.max_ts).tm_yday)
+        store.close()
+
+    def test_range_queries_match_a_scan(self):
+        events = _events(20_000, days=3)
+        store = self._store(events[:15_000])
+        store.append(events[15_000:])  # still buffered: queries see them too
+        start, end = T0 + 30_000, T0 + 150_000
+        got = store.query(start, end, devices=["cam2", "irrigation1"], types=["pump_on"])
+        expected = sorted((e for e in events if start <= e.ts < end and e.device in ("cam2", "irrigation1")
+                           and e.type == "pump_on"), key=lambda e: e.ts)
+        self.assertEqual(len(got), len(expected))
+        for g, e in zip(got, expected):
+            self.assertAlmostEqual(g.ts, e.ts, places=5)
+            self.assertEqual((g.device, g.type, g.value), (e.device, e.type, e.value))
+        self.assertEqual(len(store.query(start, end, limit=10)), 10)
+        self.assertEqual(store.query(T0 - 1000, T0), [])
+        store.close()
+
+    def test_aggregates_from_rollups_and_rows_agree_with_brute_force(self):
+        events = _events(20_000, days=3)
+        store = self._store(events)
+        start, end = T0 + 7_777, T0 + 3 * 86400  # ragged start: edge chunks are read row by row
+        for bucket, fn, group in ((3600, "count", None), (86400, "mean", "device"), (600, "max", "type"),
+                                  (90, "sum", None)):  # 90 s is not whole minutes: rows only
+            sel = [e for e in events if start <= e.ts < end and e.type != "motion"]
+            groups = defaultdict(list)
+            for e in sel:
+                groups[(e.ts // bucket * bucket, getattr(e, group) if group else "")].append(e.value)
+            reduce = {"count": len, "mean": lambda v: sum(v) / len(v), "max": max, "sum": sum}[fn]
+            got = store.aggregate(start, end, bucket, fn, types=["recording", "pump_on", "pump_off"], group_by=group)
+            self.assertEqual(len(got), len(groups))
+            for row in got:
+                self.assertAlmostEqual(row[fn], reduce(groups[(row["bucket"], row.get(group, ""))]), places=6)
+        with self.assertRaises(ValueError):
+            store.aggregate(start, end, 60, "median")
+        store.close()
+
+    def test_pruning_skips_chunks_without_the_device(self):
+        events = _events(10_000, days=2) + [Event(T0 + 100_000 + i, "gate", "open", 1.0) for i in range(50)]
+        store = self._store(events, StoreConfig(directory=self.cfg.directory, chunk_rows=100_000, retain_days=None))
+        chunks = store._chunks
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([c for c, _ in store._sources(T0, T0 + 2 * 86400, ["gate"], None)], [chunks[1]])
+        self.assertEqual(len(store.query(T0, T0 + 2 * 86400, devices=["gate"])), 50)
+        store.close()
+
+    def test_unflushed_events_survive_a_restart(self):
+        events = _events(3_000, days=1)
+        store = EventStore(self.cfg)
+        store.append(events[:2_000])
+        store.flush()
+        store.append(events[2_000:])
+        store._wal.close()  # crash: no flush
+        with open(self.cfg.directory / "wal.jsonl", "a") as f:
+            f.write('[[1714521600.0,"cam1","mot')  # torn write
+        reopened = EventStore(self.cfg)
+        self.assertEqual(reopened.stats()["buffered"], 1_000)
+        self.assertEqual(len(reopened.query(T0, T0 + 86400)), 3_000)
+        reopened.close()
+        self.assertEqual((self.cfg.directory / "wal.jsonl").stat().st_size, 0)
+        self.assertEqual(EventStore(self.cfg).stats()["events_stored"], 3_000)
+
+    def test_failed_flush_keeps_the_events(self):
+        events = _events(3_000, days=2)
+        store = EventStore(self.cfg)
+        store.append(events)
+        write_chunk, calls = event_store.write_chunk, []
+
+        def full_disk(path, part, *args):
+            calls.append(len(part))
+            if len(calls) > 1:
+                raise OSError(28, "No space left on device")
+            return write_chunk(path, part, *args)
+
+        event_store.write_chunk = full_disk
+        try:
+            with self.assertRaises(OSError):
+                store.flush()  # day one reaches a chunk, day two does not
+        finally:
+            event_store.write_chunk = write_chunk
+        self.assertEqual(store.stats()["buffered"], 3_000 - calls[0])
+        self.assertEqual(len(store.query(T0, T0 + 2 * 86400)), 3_000)
+        store._wal.close()  # crash before the next flush
+        reopened = EventStore(self.cfg)
+        self.assertEqual(reopened.stats()["buffered"], 3_000 - calls[0])
+        reopened.close()
+        self.assertEqual(EventStore(self.cfg).stats()["events_stored"], 3_000)
+
+    def test_old_partitions_are_dropped(self):
+        now = time.time()
+        cfg = StoreConfig(directory=self.cfg.directory, retain_days=7)
+        store = EventStore(cfg)
+        store.append([Event(now - 10 * 86400, "cam1", "motion"), Event(now, "cam1", "motion")])
+        store.flush()
+        self.assertEqual(store.stats()["partitions"], 1)
+        self.assertEqual(len(list(cfg.directory.glob("*/*.chunk"))), 1)
+        store.close()
+
+    def test_http_ingest_and_query(self):
+        store = EventStore(self.cfg)
+        server = event_store.serve(store, "127.0.0.1", 0)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            body = {"device": "cam1", "events": [{"ts": T0 + i, "type": "motion", "value": i} for i in range(10)]}
+            req = urllib.request.Request(base + "/events", json.dumps(body).encode(), method="POST")
+            self.assertEqual(json.load(urllib.request.urlopen(req, timeout=5)), {"accepted": 10})
+            got = json.load(urllib.request.urlopen(f"{base}/events?start={T0 + 5}&end={T0 + 100}&device=cam1",
+                                                   timeout=5))
+            self.assertEqual([e["value"] for e in got["events"]], [5, 6, 7, 8, 9])
+            agg = json.load(urllib.request.urlopen(f"{base}/aggregate?start={T0}&end={T0 + 60}&bucket=60&fn=sum",
+                                                   timeout=5))
+            self.assertEqual(agg["buckets"], [{"bucket": T0, "sum": 45.0}])
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(f"{base}/aggregate?start={T0}&fn=median", timeout=5)
+            self.assertEqual(ctx.exception.code, 400)
+        finally:
+            server.shutdown()
+            store.close()
+
+    def test_month_of_events_queries_in_under_a_second(self):
+        store = EventStore(StoreConfig(directory=self.cfg.directory, retain_days=None))
+        events = _events(300_000, days=30)
+        t = time.perf_counter()
+        for i in range(0, len(events), 1000):
+            store.append(events[i:i + 1000])
+        store.flush()
+        self.assertGreater(len(events) / (time.perf_counter() - t), 5_000)
+        t = time.perf_counter()
+        hourly = store.aggregate(T0, T0 + 30 * 86400, 3600, "count", group_by="device")
+        self.assertLess(time.perf_counter() - t, 1.0)
+        self.assertEqual(sum(row["count"] for row in hourly), len(events))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
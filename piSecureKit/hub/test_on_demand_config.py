@@ -0,0 +1,115 @@
+import http.server
+import json
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import on_demand_config
+from on_demand_config import Camera, HookConfig, apply, parse_camera, render_paths, update_config
+
+HERE = Path(__file__).resolve().parent
+CONFIG = """\
+rtsp: yes
+
+pathDefaults:
+  record: yes
+
+paths:
+  smptebars:
+      record: no
+
+  all:
+    source: publisher
+"""
+
+
+class TestOnDemandConfig(unittest.TestCase):
+
+    def test_camera_specs(self):
+        self.assertEqual(parse_camera("hqstream=http://10.0.0.5:8080/,lqstream"),
+                         Camera("hqstream", "http://10.0.0.5:8080", "lqstream"))
+        self.assertEqual(parse_camera("garage/cam2=http://cam2:8080").lq_path, None)
+        for bad in ("hqstream", "hqstream=10.0.0.5:8080", "bad name=http://x", "cam=http://x,lq:1"):
+            with self.assertRaises(ValueError):
+                parse_camera(bad)
+
+    def test_block_goes_before_the_catch_all_and_is_replaced_in_place(self):
+        cams = [Camera("cam1", "http://10.0.0.5:8080", "cam1_lq"), Camera("cam2", "http://10.0.0.6:8080")]
+        text = apply(CONFIG, render_paths(cams))
+        paths = text[text.index("\npaths:"):]
+        self.assertLess(paths.index("  cam1:\n"), paths.index("  smptebars:"))
+        self.assertIn("    runOnDemand: /scripts/publish_lease.sh http://10.0.0.6:8080 30\n", paths)
+        self.assertEqual(paths.count("runOnDemand:"), 3)  # cam1, cam1_lq, cam2
+        self.assertIn("  cam2_idle:\n    source: publisher\n    record: no\n", paths)
+        lq = paths[paths.index("  cam1_lq:\n"):paths.index("  cam1_idle:")]
+        self.assertIn("    record: no\n", lq)
+        self.assertNotIn("record", paths[paths.index("  cam1:\n"):paths.index("  cam1_lq:")])
+        self.assertEqual(apply(text, render_paths(cams)), text)
+        fewer = apply(text, render_paths(cams[:1], HookConfig(lease_sec=12)))
+        self.assertNotIn("cam2", fewer)
+        self.assertIn("http://10.0.0.5:8080 12\n", fewer)
+        self.assertEqual(apply(fewer, render_paths([])).count("runOnDemand"), 0)
+        with self.assertRaises(ValueError):
+            apply("rtsp: yes\n", render_paths(cams))
+        with self.assertRaises(ValueError):
+            render_paths(cams, HookConfig(lease_sec=2))
+
+    def test_shipped_config_records_only_camera_paths(self):
+        text = (HERE / "config" / "mediamtx.yml").read_text()
+        [pattern] = re.findall(r'^  "~(.+)":\n    source: publisher\n    record: no$', text, re.M)
+        for path in ("lqstream", "cam1_lq", "hqstream_backfill", "garage/cam2_backfill"):
+            self.assertTrue(re.match(pattern, path), path)
+        for path in ("hqstream", "cam1", "backfill", "cam_lqx"):
+            self.assertFalse(re.match(pattern, path), path)
+        self.assertLess(text.index(pattern), text.index("\n  all:"))  # before the catch-all
+
+    def test_config_file_is_rewritten_only_on_change(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "mediamtx.yml")
+            path.write_text(CONFIG)
+            self.assertEqual(on_demand_config.main(["--config", str(path), "--camera", "cam1=http://cam1:8080"]), 0)
+            self.assertIn("cam1_idle:", path.read_text())
+            self.assertFalse(update_config(path, [Camera("cam1", "http://cam1:8080")]))
+            self.assertEqual([p.name for p in Path(tmp).iterdir()], ["mediamtx.yml"])
+
+    @unittest.skipUnless(shutil.which("wget"), "needs wget")
+    def test_hook_renews_the_lease_and_releases_it(self):
+        posts = []
+
+        class Camera(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                posts.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Camera)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        hook = subprocess.Popen(["sh", str(HERE / "scripts" / "publish_lease.sh"), url, "3"],
+                                env={"MTX_PATH": "cam1", "PATH": "/usr/bin:/bin"})
+        try:
+            deadline = time.monotonic() + 5
+            while len(posts) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            hook.send_signal(signal.SIGINT)  # what mediamtx sends once the path is unused
+            self.assertEqual(hook.wait(5), 0)
+        finally:
+            hook.kill()
+            server.shutdown()
+        self.assertEqual(posts[:2], [{"enabled": True, "lease_sec": 3, "holder": "cam1"}] * 2)
+        self.assertEqual(posts[-1], {"enabled": False, "holder": "cam1"})
+
+
+if __name__ == '__main__':
+    unittest.main()
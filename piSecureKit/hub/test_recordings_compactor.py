@@ -0,0 +1,143 @@
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import recordings_index
+from recordings_compactor import Compactor, RetentionConfig, Throttle
+from recordings_index import IndexConfig, RecordingsIndex
+from test_recordings_index import VIDEO_PID, _segment
+
+T0 = datetime(2024, 5, 1, 13, 58, 0).timestamp()
+FPS, GOP = 2, 4   # a keyframe every 2 s
+PACKET = recordings_index.TS_PACKET
+
+
+class TestCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name, "recordings")
+        self.icfg = IndexConfig(root=self.root, db_path=Path(self._tmp.name, "index.sqlite"))
+        self.index = RecordingsIndex(self.icfg)
+
+    def tearDown(self):
+        self.index.close()
+        self._tmp.cleanup()
+
+    def _record(self, camera, start, minutes, first_pts=900_000):
+        """One-minute segments of a continuous recording, as mediamtx writes them."""
+        paths = []
+        for i in range(minutes):
+            t = start + 60 * i
+            path = self.root / camera / (datetime.fromtimestamp(t).strftime(recordings_index.NAME_FORMAT) + ".ts")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(_segment(60 * FPS, fps=FPS, gop=GOP, first_pts=first_pts + i * 60 * 90_000))
+            paths.append(path)
+        return paths
+
+    def _compactor(self, **kw):
+        kw.setdefault("io_bytes_per_sec", 1 << 30)
+        return Compactor(self.index, self.root, RetentionConfig(**kw))
+
+    def test_closed_hours_are_merged_losslessly(self):
+        paths = self._record("cam1", T0, 70)  # 13:58 .. 15:07
+        original = b"".join(p.read_bytes() for p in paths)
+        self.index.scan()
+        before = self.index.find("cam1", T0 + 90, T0 + 3750)
+        # At 17:30 the 13:00 and 14:00 hours are closed (two hours ago), 15:00 is not yet
+        stats = self._compactor().run_once(now=T0 + 3 * 3600 + 32 * 60)
+        self.assertEqual((stats["hourly_files"], stats["segments_merged"]), (2, 62))
+        files = sorted((self.root / "cam1").iterdir())
+        self.assertEqual([f.name for f in files[:2]], [paths[0].name, paths[2].name])
+        self.assertEqual(len(files), 2 + 8)
+        self.assertEqual(b"".join(f.read_bytes() for f in files), original)
+        after = self.index.find("cam1", T0 + 90, T0 + 3750)
+        self.assertEqual([s.path.name for s in after], [paths[0].name, paths[2].name, paths[62].name])
+        self.assertEqual((after[0].start, after[-1].end), (before[0].start, before[-1].end))
+        # The carried-over keyframes are what the indexer finds in the merged file
+        merged = [s for s in self.index.segments("cam1") if s.path == files[1]][0]
+        fresh = RecordingsIndex(IndexConfig(root=self.root, db_path=Path(self._tmp.name, "fresh.sqlite")))
+        fresh.scan()
+        [rescanned] = [s for s in fresh.segments("cam1") if s.path == files[1]]
+        self.assertEqual([(round(t, 3), o) for t, o in self.index.keyframes(merged.id)],
+                         [(round(t, 3), o) for t, o in fresh.keyframes(rescanned.id)])
+        self.assertAlmostEqual(merged.end, rescanned.end, places=3)
+        fresh.close()
+
+    def test_a_restarted_recording_starts_a_new_file(self):
+        self._record("cam1", T0 + 120, 5)
+        self._record("cam1", T0 + 420, 5, first_pts=123)  # camera restarted: PTS from scratch
+        self.index.scan()
+        stats = self._compactor().run_once(now=T0 + 5 * 3600)
+        self.assertEqual((stats["hourly_files"], stats["segments_merged"]), (2, 10))
+        self.assertEqual(len(list((self.root / "cam1").iterdir())), 2)
+
+    def test_old_footage_is_thinned_to_keyframes(self):
+        [path] = self._record("cam1", T0, 1)
+        self.index.scan()
+        [seg] = self.index.segments()
+        stats = self._compactor(full_rate_sec=86400).run_once(now=T0 + 2 * 86400)
+        self.assertEqual(stats["thinned"], 1)
+        [thin] = self.index.segments()
+        self.assertEqual(thin.tier, "keyframes")
+        # PAT + PMT, then one 3-packet PES per keyframe (every GOP-th frame)
+        self.assertEqual(path.stat().st_size, (2 + 3 * 60 * FPS // GOP) * PACKET)
+        self.assertEqual(stats["bytes_freed"], seg.size - thin.size)
+        state = recordings_index._TsState()
+        keyframes = recordings_index.parse_ts(path.read_bytes(), 0, state)
+        self.assertEqual([o for o, _ in keyframes], [o for _, o in self.index.keyframes(thin.id)])
+        self.assertEqual(state.video_pid, VIDEO_PID)
+        self.assertEqual(self._compactor(full_rate_sec=86400).run_once(now=T0 + 3 * 86400)["thinned"], 0)
+        [span] = self.index.find("cam1", T0 + 10, T0 + 20)
+        self.assertEqual((span.start, span.end), (T0 + 10, T0 + 22))
+
+    def test_retention_by_age_then_quota(self):
+        self._record("cam1", T0, 3)
+        self._record("cam2", T0 + 60, 3)
+        self.index.scan()
+        size = self.index.segments()[0].size
+        stats = self._compactor(compact_after_sec=1e9, keep_sec=86400, quota_bytes=3 * size).run_once(
+            now=T0 + 86400 + 100)
+        # 13:58 of cam1 is older than a day; then the oldest go until 3 segments are left
+        self.assertEqual((stats["deleted_age"], stats["deleted_quota"]), (1, 2))
+        left = [(s.camera, s.start) for s in self.index.segments()]
+        self.assertEqual(left, [("cam1", T0 + 120), ("cam2", T0 + 120), ("cam2", T0 + 180)])
+        self.assertEqual(len(list(self.root.rglob("*.ts"))), 3)
+
+    def test_indexer_in_another_process_follows_the_rewrite(self):
+        self._record("cam1", T0 + 120, 10)
+        other = RecordingsIndex(self.icfg)
+        other.scan()
+        self._compactor().run_once(now=T0 + 5 * 3600)
+        stats = other.scan()
+        self.assertEqual((stats["segments"], stats["errors"]), (1, 0))
+        self.assertEqual(stats["bytes_parsed"], 10 * len(_segment(60 * FPS, fps=FPS, gop=GOP)))  # nothing reread
+        [seg] = other.segments()
+        self.assertEqual(len(other.keyframes(seg.id)), 10 * 60 * FPS // GOP)
+        other.close()
+
+    def test_interrupted_merge_is_cleaned_up(self):
+        paths = self._record("cam1", T0 + 120, 3)
+        self.index.scan()
+        # Renamed into place, but the index update and the deletes never happened
+        with open(paths[0], "ab") as f:
+            f.write(paths[1].read_bytes() + paths[2].read_bytes())
+        (paths[0].parent / (paths[0].name + ".part")).write_bytes(b"junk")
+        stats = self._compactor().run_once(now=T0 + 5 * 3600)
+        self.assertEqual((stats["covered_dropped"], stats["hourly_files"]), (2, 0))
+        self.assertEqual(sorted(self.root.rglob("*")), [paths[0].parent, paths[0]])
+        [seg] = self.index.segments()
+        self.assertEqual(len(self.index.keyframes(seg.id)), 3 * 60 * FPS // GOP)
+
+    def test_throttle_holds_the_rate(self):
+        throttle = Throttle(4 << 20)
+        t = time.monotonic()
+        for _ in range(8):
+            throttle(256 << 10)
+        self.assertGreater(time.monotonic() - t, 0.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
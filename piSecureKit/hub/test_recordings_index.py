@@ -0,0 +1,131 @@
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import recordings_index
+from recordings_index import IndexConfig, RecordingsIndex
+
+T0 = datetime(2024, 5, 1, 14, 0, 0).timestamp()
+VIDEO_PID, PMT_PID = 0x100, 0x1000
+
+
+def _packet(pid, payload, pusi=False, rai=False):
+    header = bytes([0x47, (0x40 if pusi else 0) | pid >> 8, pid & 0xFF])
+    if rai or len(payload) < 184:
+        stuffing = 184 - len(payload) - 2
+        af = bytes([0x40 if rai else 0]) + b"\xff" * stuffing if stuffing >= 0 else b""
+        return header + b"\x30" + bytes([len(af)]) + af + payload
+    return header + b"\x10" + payload
+
+
+def _section(table_id, body):
+    length = 5 + len(body) + 4
+    return b"\x00" + bytes([table_id, 0xB0 | length >> 8, length & 0xFF, 0, 1, 0xC1, 0, 0]) + body + b"\0\0\0\0"
+
+
+def _pts(pts):
+    return bytes([0x21 | (pts >> 29) & 0x0E, (pts >> 22) & 0xFF, (pts >> 14) & 0xFE | 1, (pts >> 7) & 0xFF,
+                  (pts << 1) & 0xFE | 1])
+
+
+def _segment(frames, fps=10, gop=10, rai=True, first_pts=900_000):
+    """A mediamtx-like TS: PAT, PMT, then one 3-packet PES per frame, IDR every `gop` frames."""
+    out = [_packet(0, _section(0, b"\x00\x01" + bytes([0xE0 | PMT_PID >> 8, PMT_PID & 0xFF])), pusi=True),
+           _packet(PMT_PID, _section(2, b"\xE1\x00\xF0\x00\x1B" + bytes([0xE0 | VIDEO_PID >> 8, VIDEO_PID & 0xFF])
+                                     + b"\xF0\x00"), pusi=True)]
+    for n in range(frames):
+        key = n % gop == 0
+        es = b"\x00\x00\x00\x01" + (b"\x65" if key else b"\x41") + bytes([n & 0xFF]) * 20
+        pes = b"\x00\x00\x01\xE0\x00\x00\x80\x80\x05" + _pts(first_pts + n * 90_000 // fps) + es
+        out.append(_packet(VIDEO_PID, pes, pusi=True, rai=rai and key))
+        out += [_packet(VIDEO_PID, bytes([n & 0xFF]) * 184) for _ in range(2)]
+    return b"".join(out)
+
+
+class TestRecordingsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name, "recordings")
+        self.cfg = IndexConfig(root=self.root, db_path=Path(self._tmp.name, "index.sqlite"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, camera, start, data):
+        path = self.root / camera / (datetime.fromtimestamp(start).strftime(recordings_index.NAME_FORMAT) + ".ts")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return path
+
+    def test_range_resolves_to_keyframe_byte_ranges(self):
+        first = self._write("cam1", T0, _segment(600))             # 14:00:00 - 14:00:59.9
+        second = self._write("cam1", T0 + 60, _segment(600, rai=False))  # keyframes found from the NAL type
+        self._write("garage/cam2", T0, _segment(600))
+        index = RecordingsIndex(self.cfg)
+        stats = index.scan()
+        self.assertEqual((stats["segments"], stats["keyframes"], stats["errors"]), (3, 180, 0))
+        self.assertEqual(index.cameras(), ["cam1", "garage/cam2"])
+
+        spans = index.find("cam1", T0 + 55.5, T0 + 62.5)
+        self.assertEqual([s.path for s in spans], [first, second])
+        packet = recordings_index.TS_PACKET
+        # Frame n is at 2 + 3n packets; keyframes every 10 frames (1 s)
+        self.assertEqual((spans[0].start_offset, spans[0].start), ((2 + 3 * 550) * packet, T0 + 55))
+        self.assertEqual((spans[0].end_offset, spans[0].end), (len(first.read_bytes()), T0 + 59.9))
+        self.assertEqual((spans[1].start_offset, spans[1].end_offset), (2 * packet, (2 + 3 * 30) * packet))
+        self.assertEqual(spans[1].end, T0 + 63)
+        self.assertEqual(index.find("cam1", T0 - 100, T0 - 50), [])
+
+    def test_growing_segments_are_read_once(self):
+        data = _segment(300)
+        path = self._write("cam1", T0, data[:100_000])  # mid-packet, as while mediamtx writes
+        index = RecordingsIndex(self.cfg)
+        index.scan()
+        with open(path, "ab") as f:
+            f.write(data[100_000:])
+        stats = index.scan()
+        self.assertEqual((stats["bytes_parsed"], stats["keyframes"]), (len(data), 30))
+        self.assertEqual(index.scan()["bytes_parsed"], len(data))  # nothing new: nothing read
+        [span] = index.find("cam1", T0, T0 + 100)
+        self.assertEqual(span.end, T0 + 29.9)
+        # A fresh process resumes from the stored state
+        self.assertEqual(RecordingsIndex(self.cfg).scan()["bytes_parsed"], 0)
+        path.unlink()
+        self.assertEqual(index.scan()["segments"], 0)
+        self.assertEqual(index.find("cam1", T0, T0 + 100), [])
+
+    def test_export_is_a_byte_range_copy(self):
+        first = self._write("cam1", T0, _segment(600)).read_bytes()
+        second = self._write("cam1", T0 + 60, _segment(600)).read_bytes()
+        index = RecordingsIndex(self.cfg)
+        index.scan()
+        spans = index.find("cam1", T0 + 58.2, T0 + 60.5)
+        out = Path(self._tmp.name, "clip.ts")
+        size = recordings_index.export(spans, out)
+        packet = recordings_index.TS_PACKET
+        expected = first[:2 * packet] + first[spans[0].start_offset:] + second[2 * packet:(2 + 3 * 10) * packet]
+        self.assertEqual((size, out.read_bytes()), (len(expected), expected))
+        # The export is itself a valid recording
+        state = recordings_index._TsState()
+        keyframes = recordings_index.parse_ts(expected, 0, state)
+        self.assertEqual((keyframes[0][0], len(keyframes), state.video_pid), (2 * packet, 3, VIDEO_PID))
+
+    def test_time_range_query_is_fast_with_many_segments(self):
+        segment = _segment(20, fps=10)
+        for cam in range(4):
+            for i in range(250):
+                self._write(f"cam{cam}", T0 + 2 * i, segment)
+        index = RecordingsIndex(self.cfg)
+        self.assertEqual(index.scan()["segments"], 1000)
+        t = time.perf_counter()
+        for i in range(100):
+            spans = index.find("cam2", T0 + 301, T0 + 305)
+        self.assertLess((time.perf_counter() - t) / 100, 0.01)
+        self.assertEqual(len(spans), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import http.server
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import thumbnails
+from thumbnails import JpegSplitter, ThumbConfig, ThumbnailService
+
+
+def _jpeg(i):
+    return b"\xff\xd8\xff\xe0" + f"keyframe{i:03d}".encode() + b"\xff\x00\xff\xd9"
+
+
+def _fake_decoder(count, then_sleep=0.0):
+    """A command factory: a process that prints `count` JPEGs in odd-sized writes."""
+    data = b"garbage" + b"".join(_jpeg(i) for i in range(count))
+    script = ("import sys, time\n"
+              f"data = {data!r}\n"
+              "for i in range(0, len(data), 7):\n"
+              "    sys.stdout.buffer.write(data[i:i + 7]); sys.stdout.buffer.flush()\n"
+              f"time.sleep({then_sleep})\n")
+    return lambda cfg, url: [sys.executable, "-c", script]
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestJpegSplitter(unittest.TestCase):
+
+    def test_images_survive_any_read_size(self):
+        stream = b"\x00junk\xff" + b"".join(_jpeg(i) for i in range(5))
+        for size in (1, 2, 3, 7, 64, len(stream)):
+            splitter, out = JpegSplitter(), []
+            for i in range(0, len(stream), size):
+                out += splitter.feed(stream[i:i + size])
+            self.assertEqual(out, [_jpeg(i) for i in range(5)], size)
+
+    def test_unterminated_image_is_dropped_at_the_limit(self):
+        splitter = JpegSplitter(max_bytes=100)
+        self.assertEqual(splitter.feed(b"\xff\xd8" + b"x" * 200), [])
+        self.assertEqual(splitter.feed(_jpeg(1)), [_jpeg(1)])
+
+
+class TestThumbnailService(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = ThumbConfig(restart_sec=0.05, restart_max_sec=0.1, stale_sec=30.0)
+
+    def test_subscribers_follow_the_path_list_and_keep_the_latest_keyframe(self):
+        service = ThumbnailService(self.cfg, _fake_decoder(3, then_sleep=30))
+        try:
+            service.sync(["cam1", "garage/cam2", "smptebars"])
+            self.assertTrue(_wait_for(lambda: all(c["seq"] == 3 for c in service.cameras())))
+            self.assertEqual([c["path"] for c in service.cameras()], ["cam1", "garage/cam2"])
+            self.assertEqual(service.cache.get("cam1").jpeg, _jpeg(2))
+            stats = service.stats()
+            self.assertEqual((stats["subscribed"], stats["paths"]["cam1"]["keyframes"]), (2, 3))
+            service.sync(["cam1"])
+            # The last thumbnail of a camera that went away is still shown, marked by its age
+            self.assertEqual(service.stats()["subscribed"], 1)
+            self.assertEqual(len(service.cameras()), 2)
+        finally:
+            service.stop()
+
+    def test_decoder_is_restarted_when_the_stream_ends(self):
+        service = ThumbnailService(self.cfg, _fake_decoder(2))
+        try:
+            service.sync(["cam1"])
+            self.assertTrue(_wait_for(lambda: service.stats()["paths"]["cam1"]["restarts"] >= 2))
+            self.assertGreaterEqual(service.cache.get("cam1").seq, 4)
+        finally:
+            service.stop()
+
+    def test_http_grid_and_thumbnails(self):
+        service = ThumbnailService(self.cfg, _fake_decoder(1, then_sleep=30))
+        server = thumbnails.serve(service, "127.0.0.1", 0)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            service.sync(["garage/cam2"])
+            self.assertTrue(_wait_for(lambda: service.cache.get("garage/cam2") is not None))
+            page = urllib.request.urlopen(base + "/", timeout=5).read().decode()
+            self.assertIn('data-src="thumb/garage/cam2.jpg"', page)
+            r = urllib.request.urlopen(base + "/thumb/garage/cam2.jpg", timeout=5)
+            self.assertEqual((r.read(), r.headers["Content-Type"], r.headers["ETag"]), (_jpeg(0), "image/jpeg", '"1"'))
+            req = urllib.request.Request(base + "/thumb/garage/cam2.jpg", headers={"If-None-Match": '"1"'})
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(req, timeout=5)
+            self.assertEqual(ctx.exception.code, 304)
+            cams = json.load(urllib.request.urlopen(base + "/cameras.json", timeout=5))
+            self.assertEqual([(c["path"], c["seq"], c["stale"]) for c in cams], [("garage/cam2", 1, False)])
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(base + "/thumb/cam9.jpg", timeout=5)
+            self.assertEqual(ctx.exception.code, 404)
+        finally:
+            server.shutdown()
+            service.stop()
+
+    def test_on_demand_paths_are_not_subscribed(self):
+        replies = {"/v3/paths/list": {"items": [{"name": "cam1", "ready": True}, {"name": "cam1_idle", "ready": True},
+                                                {"name": "cam2", "ready": False}]},
+                   "/v3/config/paths/list": {"items": [{"name": "cam1", "runOnDemand": "publish_lease.sh"},
+                                                       {"name": "cam1_idle", "runOnDemand": ""}]}}
+
+        class Api(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(replies[self.path.split("?")[0]]).encode()
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        api = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Api)
+        threading.Thread(target=api.serve_forever, daemon=True).start()
+        try:
+            self.assertEqual(thumbnails.list_paths(f"http://127.0.0.1:{api.server_address[1]}"), ["cam1_idle"])
+        finally:
+            api.shutdown()
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "needs ffmpeg")
+    def test_only_keyframes_are_decoded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            clip = Path(tmp, "clip.ts")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=25",
+                            "-frames:v", "100", "-c:v", "libx264", "-g", "25", "-keyint_min", "25",
+                            "-sc_threshold", "0", str(clip)], check=True)
+            splitter = JpegSplitter()
+            out = subprocess.run(thumbnails.ffmpeg_command(self.cfg, str(clip)), capture_output=True, check=True)
+            jpegs = splitter.feed(out.stdout)
+        self.assertEqual(len(jpegs), 4)  # 100 frames, GOP 25
+        self.assertLess(max(len(j) for j in jpegs), 100_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
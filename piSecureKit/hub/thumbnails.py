@@ -0,0 +1,400 @@
+"""
+Camera overview thumbnails from keyframes only.
+
+Opening every `hqstream` in the dashboard decodes N full streams in the browser. Instead the hub
+subscribes once to each ready mediamtx path with ffmpeg told to decode keyframes only
+(`-skip_frame nokey`: the other frames are demuxed and dropped before the decoder), scales them
+down and pipes them out as JPEGs. The latest one per camera is kept in memory and served as-is:
+
+    GET /                      grid page (refreshes the tiles whose keyframe changed)
+    GET /thumb/<path>.jpg      latest thumbnail (ETag; 304 when unchanged; 404 before the first one)
+    GET /cameras.json          [{"path", "seq", "age_sec", "stale"}, ...]
+    GET /stats
+
+Decode cost follows the keyframe rate (one per GOP, e.g. every 1-2 s) rather than the frame rate.
+
+    python3 thumbnails.py --api http://127.0.0.1:9997 --rtsp rtsp://127.0.0.1:8554 --port 8092
+"""
+from __future__ import annotations
+
+import argparse
+import html
+import json
+import logging
+import subprocess
+import threading
+import time
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+LOG = logging.getLogger("PiSecureKit.hub.thumbnails")
+
+SOI, EOI = b"\xff\xd8", b"\xff\xd9"
+
+
+# ---------- Configuration ----------
+@dataclass(frozen=True)
+class ThumbConfig:
+    api_url: str = "http://127.0.0.1:9997"    # mediamtx control API
+    rtsp_url: str = "rtsp://127.0.0.1:8554"
+    width: int = 320
+    quality: int = 6               # ffmpeg -q:v, 2 (best) .. 31
+    discover_sec: float = 10.0     # how often the path list is refreshed
+    stale_sec: float = 30.0        # no keyframe for this long: the tile shows the camera as offline
+    restart_sec: float = 2.0       # first retry after ffmpeg exits; doubles up to restart_max_sec
+    restart_max_sec: float = 30.0
+    exclude: Sequence[str] = ("smptebars",)
+
+
+def ffmpeg_command(cfg: ThumbConfig, url: str) -> List[str]:
+    """Keyframes of `url`'s first video stream as scaled JPEGs on stdout."""
+    cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if url.startswith("rtsp://"):
+        cmd += ["-rtsp_transport", "tcp"]
+    return cmd + ["-skip_frame", "nokey", "-i", url, "-map", "0:v:0", "-an",
+                  "-vf", f"scale={cfg.width}:-2", "-fps_mode", "passthrough",
+                  "-c:v", "mjpeg", "-q:v", str(cfg.quality), "-f", "image2pipe", "pipe:1"]
+
+
+# ---------- JPEG stream ----------
+class JpegSplitter:
+    """Cuts a concatenated JPEG stream (ffmpeg image2pipe) into images, whatever the read sizes."""
+
+    def __init__(self, max_bytes: int = 4 << 20) -> None:
+        self._buf = bytearray()
+        self._scan = 0
+        self._max = max_bytes
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buf += data
+        out = []
+        while True:
+            start = self._buf.find(SOI)
+            if start < 0:
+                del self._buf[:max(0, len(self._buf) - 1)]  # keep a trailing 0xFF
+                self._scan = 0
+                return out
+            if start:
+                del self._buf[:start]
+                self._scan = 0
+            # Inside entropy-coded data 0xFF is always stuffed, so EOI only appears at the end
+            end = self._buf.find(EOI, max(2, self._scan))
+            if end < 0:
+                self._scan = max(2, len(self._buf) - 1)
+                if len(self._buf) > self._max:
+                    LOG.warning("Dropping %d bytes without a JPEG end marker", len(self._buf))
+                    self._buf.clear()
+                    self._scan = 0
+                return out
+            out.append(bytes(self._buf[:end + 2]))
+            del self._buf[:end + 2]
+            self._scan = 0
+
+
+# ---------- Cache ----------
+class Thumbnail(NamedTuple):
+    jpeg: bytes
+    time: float     # wall clock of the keyframe's arrival
+    seq: int        # per camera, increases with every keyframe
+
+
+class ThumbnailCache:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thumbs: Dict[str, Thumbnail] = {}
+
+    def put(self, path: str, jpeg: bytes) -> Thumbnail:
+        with self._lock:
+            prev = self._thumbs.get(path)
+            thumb = Thumbnail(jpeg, time.time(), prev.seq + 1 if prev else 1)
+            self._thumbs[path] = thumb
+            return thumb
+
+    def get(self, path: str) -> Optional[Thumbnail]:
+        with self._lock:
+            return self._thumbs.get(path)
+
+    def snapshot(self) -> Dict[str, Thumbnail]:
+        with self._lock:
+            return dict(self._thumbs)
+
+
+# ---------- Per-path subscriber ----------
+class Subscriber:
+    """One ffmpeg per path, restarted with backoff when the stream drops."""
+
+    def __init__(self, path: str, cfg: ThumbConfig, cache: ThumbnailCache,
+                 command: Callable[[ThumbConfig, str], List[str]] = ffmpeg_command) -> None:
+        self.path = path
+        self._cfg = cfg
+        self._cache = cache
+        self._command = command
+        self._stop = threading.Event()
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._stats = {"keyframes": 0, "bytes_in": 0, "restarts": 0}
+        self._thread = threading.Thread(target=self._run, name=f"thumb-{path}", daemon=True)
+
+    def start(self) -> "Subscriber":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        with self._lock:
+            proc = self._proc
+        if proc and proc.poll() is None:
+            proc.terminate()
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self) -> None:
+        url = f"{self._cfg.rtsp_url.rstrip('/')}/{self.path}"
+        backoff = self._cfg.restart_sec
+        while not self._stop.is_set():
+            got = self._pump(url)
+            if self._stop.is_set():
+                break
+            backoff = self._cfg.restart_sec if got else min(backoff * 2, self._cfg.restart_max_sec)
+            with self._lock:
+                self._stats["restarts"] += 1
+            LOG.info("Thumbnails: %s ended after %d keyframes, retrying in %.0fs", self.path, got, backoff)
+            self._stop.wait(backoff)
+
+    def _pump(self, url: str) -> int:
+        try:
+            proc = subprocess.Popen(self._command(self._cfg, url), stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            LOG.warning("Thumbnails: cannot start decoder for %s: %s", self.path, e)
+            return 0
+        with self._lock:
+            self._proc = proc
+        if self._stop.is_set():  # stopped while starting
+            proc.terminate()
+        splitter, got = JpegSplitter(), 0
+        try:
+            while True:
+                data = proc.stdout.read1(65536)
+                if not data:
+                    break
+                jpegs = splitter.feed(data)
+                for jpeg in jpegs:
+                    self._cache.put(self.path, jpeg)
+                got += len(jpegs)
+                with self._lock:
+                    self._stats["bytes_in"] += len(data)
+                    self._stats["keyframes"] += len(jpegs)
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+            try:
+                proc.wait(2)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            proc.stdout.close()
+            with self._lock:
+                self._proc = None
+        return got
+
+
+# ---------- Service ----------
+def list_paths(api_url: str, timeout: float = 3.0) -> List[str]:
+    """
+    Names of the mediamtx paths that currently have a publisher, minus on-demand ones: a
+    subscriber there would count as a viewer and keep the camera publishing (on_demand_config.py).
+    Those cameras show up through their `<path>_idle` keepalive, which carries keyframes only.
+    """
+    base = api_url.rstrip("/")
+    with urllib.request.urlopen(f"{base}/v3/paths/list?itemsPerPage=1000", timeout=timeout) as r:
+        items = json.load(r).get("items") or []
+    with urllib.request.urlopen(f"{base}/v3/config/paths/list?itemsPerPage=1000", timeout=timeout) as r:
+        on_demand = {conf["name"] for conf in json.load(r).get("items") or [] if conf.get("runOnDemand")}
+    return sorted(item["name"] for item in items if item.get("ready") and item["name"] not in on_demand)
+
+
+class ThumbnailService:
+
+    def __init__(self, cfg: ThumbConfig, command: Callable[[ThumbConfig, str], List[str]] = ffmpeg_command) -> None:
+        self.cfg = cfg
+        self.cache = ThumbnailCache()
+        self._command = command
+        self._subs: Dict[str, Subscriber] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def sync(self, paths: Sequence[str]) -> None:
+        """Subscribe to `paths` (minus excluded ones) and drop subscriptions to the others."""
+        wanted = {p for p in paths if p not in self.cfg.exclude}
+        with self._lock:
+            gone = [self._subs.pop(p) for p in list(self._subs) if p not in wanted]
+            for path in sorted(wanted - self._subs.keys()):
+                LOG.info("Thumbnails: subscribing to %s", path)
+                self._subs[path] = Subscriber(path, self.cfg, self.cache, self._command).start()
+        for sub in gone:
+            LOG.info("Thumbnails: %s no longer published", sub.path)
+            sub.stop()
+
+    def start(self) -> "ThumbnailService":
+        threading.Thread(target=self._discover, name="thumb-discover", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.sync([])
+
+    def cameras(self) -> List[Dict[str, object]]:
+        """Subscribed paths and any that still have a cached thumbnail from earlier."""
+        thumbs = self.cache.snapshot()
+        with self._lock:
+            names = sorted(set(self._subs) | set(thumbs))
+        now = time.time()
+        out = []
+        for name in names:
+            thumb = thumbs.get(name)
+            age = round(now - thumb.time, 1) if thumb else None
+            out.append({"path": name, "seq": thumb.seq if thumb else 0, "age_sec": age,
+                        "stale": age is None or age > self.cfg.stale_sec})
+        return out
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            subs = dict(self._subs)
+        return {"subscribed": len(subs), "cached": len(self.cache.snapshot()),
+                "paths": {name: sub.stats() for name, sub in subs.items()}}
+
+    def _discover(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sync(list_paths(self.cfg.api_url))
+            except (OSError, ValueError) as e:
+                LOG.warning("Thumbnails: mediamtx API unavailable: %s", e)
+            self._stop.wait(self.cfg.discover_sec)
+
+
+# ---------- HTTP ----------
+GRID_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Cameras</title><style>
+body {{ margin: 0; background: #111; color: #ddd; font: 13px sans-serif; }}
+main {{ display: grid; grid-template-columns: repeat(auto-fill, minmax({width}px, 1fr)); gap: 4px; padding: 4px; }}
+figure {{ margin: 0; position: relative; }}
+img {{ width: 100%; display: block; background: #222; aspect-ratio: 16 / 9; object-fit: cover; }}
+figcaption {{ position: absolute; left: 4px; bottom: 4px; background: #000a; padding: 1px 4px; }}
+.stale img {{ opacity: .35; }}
+</style></head><body><main>{tiles}</main><script>
+const tiles = new Map([...document.querySelectorAll('figure')].map(f => [f.dataset.path, f]));
+async function refresh() {{
+  try {{
+    for (const cam of await (await fetch('cameras.json')).json()) {{
+      const fig = tiles.get(cam.path);
+      if (!fig) {{ location.reload(); return; }}
+      fig.classList.toggle('stale', cam.stale);
+      if (cam.seq && fig.dataset.seq != cam.seq) {{
+        fig.dataset.seq = cam.seq;
+        fig.querySelector('img').src = fig.dataset.src + '?v=' + cam.seq;
+      }}
+    }}
+  }} catch (e) {{}}
+  setTimeout(refresh, 1000);
+}}
+refresh();
+</script></body></html>
+"""
+
+
+def grid_page(service: ThumbnailService) -> bytes:
+    tiles = []
+    for cam in service.cameras():
+        src = "thumb/" + urllib.parse.quote(cam["path"]) + ".jpg"
+        name = html.escape(cam["path"])
+        tiles.append(f'<figure data-path="{name}" data-src="{src}" data-seq="{cam["seq"]}"'
+                     f'{" class=stale" if cam["stale"] else ""}><img src="{src}?v={cam["seq"]}" alt="{name}">'
+                     f'<figcaption>{name}</figcaption></figure>')
+    return GRID_PAGE.format(width=service.cfg.width, tiles="".join(tiles)).encode()
+
+
+def make_handler(service: ThumbnailService):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path == "/":
+                self._reply(200, grid_page(service), "text/html; charset=utf-8")
+            elif url.path == "/cameras.json":
+                self._reply(200, json.dumps(service.cameras()).encode(), "application/json")
+            elif url.path == "/stats":
+                self._reply(200, json.dumps(service.stats()).encode(), "application/json")
+            elif url.path.startswith("/thumb/") and url.path.endswith(".jpg"):
+                self._thumb(urllib.parse.unquote(url.path[len("/thumb/"):-len(".jpg")]))
+            else:
+                self._reply(404, b"not found", "text/plain")
+
+        def _thumb(self, path: str) -> None:
+            thumb = service.cache.get(path)
+            if thumb is None:
+                self._reply(404, b"no keyframe yet", "text/plain")
+                return
+            etag = f'"{thumb.seq}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self._reply(200, thumb.jpeg, "image/jpeg", {"ETag": etag, "Cache-Control": "no-cache"})
+
+        def _reply(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            LOG.debug("%s " + fmt, self.client_address[0], *args)
+
+    return Handler
+
+
+def serve(service: ThumbnailService, host: str = "0.0.0.0", port: int = 8092) -> ThreadingHTTPServer:
+    """Start the HTTP API on a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, name="thumb-http", daemon=True).start()
+    LOG.info("Thumbnail grid on %s:%d", host, server.server_address[1])
+    return server
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ap = argparse.ArgumentParser(description="Keyframe-only camera thumbnails from mediamtx.")
+    ap.add_argument("--api", default=ThumbConfig.api_url, help="mediamtx control API")
+    ap.add_argument("--rtsp", default=ThumbConfig.rtsp_url)
+    ap.add_argument("--width", type=int, default=ThumbConfig.width)
+    ap.add_argument("--exclude", nargs="*", default=list(ThumbConfig.exclude))
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8092)
+    args = ap.parse_args()
+    service = ThumbnailService(ThumbConfig(api_url=args.api, rtsp_url=args.rtsp, width=args.width,
+                                           exclude=tuple(args.exclude))).start()
+    server = serve(service, args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
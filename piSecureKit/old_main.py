@@ -6,18 +6,25 @@ PiSecureKit - Raspberry Pi Camera Security System
 # Standard library imports
 import io
 import os
-import time
 import logging
-import subprocess
+import shutil
 import threading
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from threading import Condition
 
 # Third-party imports
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, redirect, request
 from flask_restful import Resource, Api
 
+# Live view is served by the asyncio MJPEG broadcaster that ships with the camera service
+from cams.zerov1.audio_capture import AudioCapture, AudioConfig, ArecordSource
+from cams.zerov1.http_server import HttpServer, json_response
+from cams.zerov1.mjpeg_broadcast import MjpegBroadcaster, PartPool
+from cams.zerov1.snapshots import write_atomic
+
 # Camera-specific imports
 try:
     import picamera2
@@ -35,11 +42,15 @@ CONFIG = {
     'DEBUG': False,
     'HOST': '0.0.0.0',
     'PORT': 5000,
+    'STREAM_PORT': 5001,  # MJPEG live view (/video_feed); one event loop for all viewers
     'VIDEO_SIZE': (800, 600),
     'ENCODER_BITRATE': 10000000,  # 10 Mbps
+    'BURST_MAX': 30,  # stills per /snap.html?count=N request
     'PICTURE_DIR': '/hoome/allzero22/Webserver/webcam/static/pictures/',
     'VIDEO_DIR': '/hooome/allzero22/Webserver/webcam/static/video/',
-    'SOUND_DIR': '/hoooome/allzero22/Webserver/webcam/static/sound/'
+    'SOUND_DIR': '/hoooome/allzero22/Webserver/webcam/static/sound/',
+    'AUDIO_DEVICE': 'dmic_sv',
+    'AUDIO_TRIGGER_DBFS': -30.0,  # sound events are recorded on their own, with 5 s of pre-roll
 }
 stream_name = "fd"  # change to your deviceId
 rtsp_url = f"rtsp://pi5.local:8554/{stream_name}"
@@ -53,23 +64,34 @@ logger = logging.getLogger(__name__)
 
 # ========================= Streaming Output Class =========================
 class StreamingOutput(io.BufferedIOBase):
-    """Buffer for camera output streaming"""
+    """Buffer for camera output streaming; every frame also goes to the MJPEG broadcaster"""
 
-    def __init__(self):
+    def __init__(self, broadcaster=None):
         self.frame = None
         self.condition = Condition()
+        self.broadcaster = broadcaster
+        # Multipart part built once per frame in a reused buffer; viewers send memoryviews of it
+        self.parts = PartPool()
 
     def write(self, buf):
-        """Write a new frame to the buffer"""
+        """Copy the frame into a pooled part, so nothing keeps a reference to the encoder's buffer"""
+        part = self.parts.build(buf)
         with self.condition:
-            self.frame = buf
+            self.frame = part.jpeg
             self.condition.notify_all()
+        if self.broadcaster is not None:
+            self.broadcaster.publish_part(part)
+        return len(buf)
+
+    def stats(self):
+        """Allocation and copy counts of the part pool"""
+        return self.parts.stats()
 
 # ========================= Camera Handler Class =========================
 class Camera:
     """Camera handler for video streaming and image capture"""
 
-    def __init__(self):
+    def __init__(self, broadcaster=None):
         """Initialize camera with default configuration"""
         if not CAMERA_AVAILABLE:
             logger.error("Camera modules not available. Cannot initialize camera.")
@@ -81,11 +103,12 @@ class Camera:
             self.camera.configure(self.camera.create_video_configuration(
                 main={"size": CONFIG['VIDEO_SIZE']}
             ))
-            self.still_config = self.camera.create_still_configuration()
+            # Stills are frames of the running stream, saved off the request thread
+            self.savers = ThreadPoolExecutor(max_workers=2, thread_name_prefix="still-save")
 
             # Setup encoder and output for streaming
             self.encoder = MJPEGEncoder(CONFIG['ENCODER_BITRATE'])
-            self.streamOut = StreamingOutput()
+            self.streamOut = StreamingOutput(broadcaster)
             self.streamOut2 = FileOutput(self.streamOut)
             self.encoder.output = [self.streamOut2]
 
@@ -118,32 +141,36 @@ class Camera:
             logger.error(f"Error getting frame: {e}")
             return None
 
-    def video_snap(self):
-        """Take a still photo"""
+    def video_snap(self, count=1):
+        """Take `count` consecutive stills from the running MJPEG stream (no mode switch)"""
         if not self.camera:
             logger.error("Camera not initialized.")
             return False
 
         try:
             timestamp = datetime.now().isoformat("_", "seconds")
-            logger.info(f"Taking photo at {timestamp}")
-
-            filename = os.path.join(CONFIG['PICTURE_DIR'], f"snap_{timestamp}.jpg")
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-            self.still_config = self.camera.create_still_configuration()
-            time.sleep(1)  # Allow camera to adjust
-
-            job = self.camera.switch_mode_and_capture_file(
-                self.still_config, filename, wait=False
-            )
-            self.camera.wait(job)
-            logger.info(f"Photo saved to {filename}")
+            logger.info(f"Taking {count} photo(s) at {timestamp}")
+            os.makedirs(CONFIG['PICTURE_DIR'], exist_ok=True)
+
+            for i in range(count):
+                # The encoder's JPEG is already a still: copy it out and keep the next frame coming
+                frame = bytes(self.get_frame())
+                suffix = f"_{i:02d}" if count > 1 else ""
+                filename = os.path.join(CONFIG['PICTURE_DIR'], f"snap_{timestamp}{suffix}.jpg")
+                self.savers.submit(self._save_still, filename, frame)
             return True
         except Exception as e:
             logger.error(f"Error taking photo: {e}")
             return False
 
+    def _save_still(self, filename, frame):
+        """Write one still on a saver thread"""
+        try:
+            write_atomic(Path(filename), frame)
+            logger.info(f"Photo saved to {filename}")
+        except OSError as e:
+            logger.error(f"Error saving photo {filename}: {e}")
+
     def start_recording(self, basename):
         """Start video recording"""
         if not self.camera:
@@ -179,22 +206,37 @@ class Camera:
         """Clean up camera resources"""
         if self.camera:
             try:
+                self.savers.shutdown(wait=True)
                 self.camera.stop_encoder()
                 self.camera.stop()
                 logger.info("Camera resources released")
             except Exception as e:
                 logger.error(f"Error during camera cleanup: {e}")
 
-# ========================= Frame Generator =========================
-def gen_frames(camera):
-    """Generate a sequence of frames for video streaming"""
-    while True:
-        frame = camera.get_frame()
-        if frame:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n')
-        else:
-            time.sleep(0.1)  # Avoid busy wait if camera not working
+# ========================= Live View =========================
+def start_stream_server(broadcaster):
+    """Serve /video_feed from the broadcaster: viewers are coroutines, not Flask threads"""
+    server = HttpServer(CONFIG['HOST'], CONFIG['STREAM_PORT'])
+    server.route('GET', '/video_feed', broadcaster.handle)
+
+    async def stats(_req):
+        out = broadcaster.stats()
+        if camera and camera.camera:
+            out['output'] = camera.streamOut.stats()
+        if audio:
+            out['audio'] = audio.stats()
+        return json_response(out)
+
+    server.route('GET', '/stats', stats)
+    return server.start()
+
+
+def stream_url():
+    """The broadcaster's /video_feed on the host the browser used to reach Flask"""
+    host = request.host
+    if not host.endswith(']'):  # drop Flask's port, but leave a bare IPv6 literal alone
+        host = host.rsplit(':', 1)[0]
+    return f"http://{host}:{CONFIG['STREAM_PORT']}/video_feed"
 
 # ========================= Helper Functions =========================
 def show_time():
@@ -204,36 +246,48 @@ def show_time():
     logger.debug(f"Timestamp created: {formatted_time}")
     return formatted_time
 
-def record_audio(duration=30):
-    """Record audio for the specified duration"""
+def start_audio():
+    """Capture continuously from the microphone; clips are cut from the ring buffer"""
+    if not shutil.which('arecord'):
+        logger.warning("arecord not found. Audio recording will be disabled.")
+        return None
+    cfg = AudioConfig(directory=Path(CONFIG['SOUND_DIR']), device=CONFIG['AUDIO_DEVICE'],
+                      trigger_dbfs=CONFIG['AUDIO_TRIGGER_DBFS'])
+    capture = AudioCapture(cfg, ArecordSource(cfg.device, cfg.rate, cfg.channels))
     try:
-        timestamp = datetime.now().isoformat("_", "seconds")
-        os.makedirs(CONFIG['SOUND_DIR'], exist_ok=True)
-
-        command = (
-            f'arecord -D dmic_sv -d {duration} -r 48000 -f S32_LE '
-            f'{CONFIG["SOUND_DIR"]}birdcam_$(date "+%b-%d-%y-%I:%M:%S-%p").wav -c 2'
-        )
-        subprocess.Popen(command, shell=True)
-        logger.info(f"Started audio recording at {timestamp}")
-        return True
-    except Exception as e:
-        logger.error(f"Error recording audio: {e}")
+        capture.start()
+    except OSError as e:  # e.g. SOUND_DIR not writable; everything else works without audio
+        logger.error(f"Audio capture disabled: {e}")
+        return None
+    return capture
+
+def record_audio(duration=30):
+    """Record audio for the specified duration (joins a clip already being recorded)"""
+    if not audio:
+        logger.error("Audio capture not available")
         return False
+    audio.trigger(duration, reason="srecord")
+    logger.info(f"Audio recording requested for {duration}s")
+    return True
 
 # ========================= Flask App Setup =========================
 app = Flask(__name__, template_folder='template', static_url_path='/static')
 api = Api(app)
 
-# Initialize camera
-camera = Camera() if CAMERA_AVAILABLE else None
+# Live view, camera and audio are started by main(), so importing this module opens nothing
+broadcaster = None
+stream_server = None
+camera = None
+audio = None
 
-# Register cleanup handler
-@atexit.register
 def cleanup_resources():
     """Clean up resources when application exits"""
     if camera:
         camera.cleanup()
+    if audio:
+        audio.stop()
+    if stream_server:
+        stream_server.stop()
     logger.info("Application shutting down, resources released")
 
 # ========================= Flask Routes =========================
@@ -274,21 +328,19 @@ def srecord():
 
 @app.route('/snap.html')
 def snap():
-    """Take a photo"""
-    logger.info("Photo capture requested")
+    """Take a photo, or a burst of consecutive frames with ?count=N"""
+    count = max(1, min(request.args.get('count', 1, type=int), CONFIG['BURST_MAX']))
+    logger.info(f"Photo capture requested ({count})")
     if camera:
-        camera.video_snap()
+        camera.video_snap(count)
     return render_template('snap.html')
 
 @app.route('/video_feed')
 def video_feed():
-    """Video streaming route"""
+    """Video streaming route (moved to the broadcaster; <img src> follows the redirect)"""
     if not camera:
         return "Camera not available", 500
-    return Response(
-        gen_frames(camera),
-        mimetype='multipart/x-mixed-replace; boundary=frame'
-    )\
+    return redirect(stream_url(), code=302)
 
 @app.route('/stream')
 def video_stream():
@@ -325,19 +377,26 @@ class VideoFeed(Resource):
         """API endpoint for video feed"""
         if not camera:
             return "Camera not available", 500
-        return Response(
-            gen_frames(camera),
-            mimetype='multipart/x-mixed-replace; boundary=frame'
-        )
+        return redirect(stream_url(), code=302)
 
 api.add_resource(VideoFeed, '/cam')
 
 # ========================= Main =========================
-if __name__ == '__main__':
+def main():
+    global broadcaster, stream_server, camera, audio
+    broadcaster = MjpegBroadcaster()
+    stream_server = start_stream_server(broadcaster)
+    camera = Camera(broadcaster) if CAMERA_AVAILABLE else None
+    audio = start_audio()
+    atexit.register(cleanup_resources)
+
     logger.info(f"Starting server on {CONFIG['HOST']}:{CONFIG['PORT']}")
     app.run(
         host=CONFIG['HOST'],
         port=CONFIG['PORT'],
         debug=CONFIG['DEBUG'],
         threaded=True
-    )
\ No newline at end of file
+    )
+
+if __name__ == '__main__':
+    main()